@@ -1,10 +1,23 @@
 import json
 import os
+import time
 from typing import Dict, Any, List
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import requests
 
+from normalization import normalize_warehouse
+import metrics
+
+REQUESTS = metrics.counter('orders_requests_total', 'Запросы к функции заявок', ('method', 'status'))
+REQUEST_DURATION = metrics.histogram('orders_request_duration_seconds', 'Время обработки запроса', ('method',))
+TELEGRAM_DURATION = metrics.histogram(
+    'orders_telegram_api_duration_seconds', 'Время запросов к Telegram Bot API', ('method',))
+TELEGRAM_REQUESTS = metrics.counter(
+    'orders_telegram_api_requests_total', 'Запросы к Telegram Bot API по методу и HTTP-статусу', ('method', 'status'))
+TELEGRAM_RATE_LIMITED = metrics.counter(
+    'orders_telegram_api_rate_limited_total', 'Ответы 429 Too Many Requests от Telegram', ('method',))
+
 def get_db_connection():
     dsn = os.environ.get('DATABASE_URL')
     return psycopg2.connect(dsn)
@@ -55,8 +68,10 @@ def send_telegram_notification(order_type: str, order_id: int, data: Dict[str, A
     
     # Отправляем уведомление всем админам
     for admin in admins:
+        status = 'error'
+        started = time.perf_counter()
         try:
-            requests.post(
+            response = requests.post(
                 f"https://api.telegram.org/bot{bot_token}/sendMessage",
                 json={
                     'chat_id': admin['chat_id'],
@@ -64,12 +79,36 @@ def send_telegram_notification(order_type: str, order_id: int, data: Dict[str, A
                     'parse_mode': 'HTML'
                 }
             )
+            status = str(response.status_code)
+            if response.status_code == 429:
+                TELEGRAM_RATE_LIMITED.inc(method='sendMessage')
         except:
             pass
+        TELEGRAM_DURATION.observe(time.perf_counter() - started, method='sendMessage')
+        TELEGRAM_REQUESTS.inc(method='sendMessage', status=status)
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
+    query_params = event.get('queryStringParameters') or {}
     
+    if method == 'GET' and query_params.get('action') == 'metrics':
+        if not metrics.is_authorized(query_params):
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Forbidden'}),
+                'isBase64Encoded': False
+            }
+        return metrics.metrics_response()
+    
+    started = time.perf_counter()
+    response = handle_request(event, method)
+    REQUESTS.inc(method=method, status=str(response['statusCode']))
+    REQUEST_DURATION.observe(time.perf_counter() - started, method=method)
+    metrics.maybe_push('orders')
+    return response
+
+def handle_request(event: Dict[str, Any], method: str) -> Dict[str, Any]:
     headers = {
         'Content-Type': 'application/json',
         'Access-Control-Allow-Origin': '*',
@@ -169,8 +208,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     INSERT INTO sender_orders (
                         loading_address, warehouse, loading_date, loading_time,
                         pallet_quantity, box_quantity, sender_name, phone, label_size,
-                        cargo_type, cargo_quantity
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        cargo_type, cargo_quantity, warehouse_normalized
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                     RETURNING id, created_at
                 """, (
                     body.get('loadingAddress') or body.get('pickupAddress'),
@@ -183,7 +222,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     body.get('phone'),
                     body.get('labelSize', '120x75'),
                     'pallet',
-                    0
+                    0,
+                    normalize_warehouse(body.get('warehouse') or '')
                 ))
                 
                 result = cursor.fetchone()
@@ -209,8 +249,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     INSERT INTO carrier_orders (
                         car_brand, car_model, license_plate, pallet_capacity,
                         box_capacity, warehouse, driver_name, phone,
-                        capacity_type, capacity_quantity
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        capacity_type, capacity_quantity, warehouse_normalized
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                     RETURNING id, created_at
                 """, (
                     body.get('carBrand'),
@@ -222,7 +262,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     body.get('driverName'),
                     body.get('phone'),
                     'pallet',
-                    0
+                    0,
+                    normalize_warehouse(body.get('warehouse') or '')
                 ))
                 
                 result = cursor.fetchone()
@@ -0,0 +1,237 @@
+"""
+Метрики функции в формате Prometheus (text exposition 0.0.4)
+Счётчики, гистограммы и gauge живут в памяти экземпляра функции и отдаются по GET ?action=metrics.
+Если задан METRICS_PUSH_URL, значения не чаще раза в METRICS_PUSH_INTERVAL секунд отправляются
+в коллектор (Pushgateway или локальную заглушку) — короткоживущие экземпляры иначе не успеть опросить.
+Модуль одинаковый во всех функциях: при изменении скопировать в каждую папку
+(совпадение копий проверяет tools/check_shared_modules.py).
+"""
+
+import os
+import hmac
+import time
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple, Callable, Sequence
+import requests
+
+METRICS_PUSH_URL = os.environ.get('METRICS_PUSH_URL', '')
+# Как часто отправлять метрики в коллектор (секунды)
+METRICS_PUSH_INTERVAL = 15
+# GET ?action=metrics требует token=<METRICS_TOKEN>; без секрета эндпоинт закрыт
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Границы корзин по умолчанию (секунды): от быстрых запросов к БД до медленных вебхуков
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+INSTANCE_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Базовая метрика с набором меток"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Any]] = None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        # callback вызывается при выгрузке: число или dict {кортеж значений меток: число}
+        self.callback = callback
+        self.values: Dict[LabelKey, Any] = {}
+        # Значения меняют потоки воркера long polling, выгрузка читает копию
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"Metric '{self.name}' expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def _current_values(self) -> Dict[LabelKey, Any]:
+        if self.callback is None:
+            with self.lock:
+                return dict(self.values)
+        try:
+            value = self.callback()
+        except Exception as e:
+            print(f"[ERROR] metric {self.name}: {str(e)}")
+            return {}
+        if isinstance(value, dict):
+            return {tuple(str(v) for v in (k if isinstance(k, tuple) else (k,))): v for k, v in value.items()}
+        return {(): value}
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{self._labels(key)} {_format_value(value)}"
+            for key, value in sorted(self._current_values().items())
+        ]
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(Metric):
+    """Монотонный счётчик (имя заканчивается на _total)"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение (глубина очереди, доля попаданий в кэш)"""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """Распределение длительностей по корзинам"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            snapshot = {key: dict(state, buckets=list(state['buckets'])) for key, state in self.values.items()}
+        for key, state in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['buckets']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._labels(key, [('le', '+Inf')])} {state['count']}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{self._labels(key)} {state['count']}")
+        return lines
+
+
+_registry: Dict[str, Metric] = {}
+_last_push = 0.0
+
+
+def _register(metric: Metric) -> Metric:
+    existing = _registry.get(metric.name)
+    if existing is not None:
+        if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+            raise ValueError(f"Metric '{metric.name}' already registered with another type or labels")
+        return existing
+    _registry[metric.name] = metric
+    return metric
+
+
+def counter(name: str, help_text: str, labelnames: Sequence[str] = (),
+            callback: Optional[Callable[[], Any]] = None) -> Counter:
+    return _register(Counter(name, help_text, labelnames, callback))
+
+
+def gauge(name: str, help_text: str, labelnames: Sequence[str] = (),
+          callback: Optional[Callable[[], Any]] = None) -> Gauge:
+    return _register(Gauge(name, help_text, labelnames, callback))
+
+
+def histogram(name: str, help_text: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help_text, labelnames, buckets))
+
+
+def render() -> str:
+    """Все метрики экземпляра в текстовом формате Prometheus"""
+    lines: List[str] = []
+    for name in sorted(_registry):
+        lines.extend(_registry[name].render())
+    return '\n'.join(lines) + '\n'
+
+
+def is_authorized(query_params: Dict[str, Any]) -> bool:
+    """Метрики отдаются только с токеном из секретов"""
+    token = query_params.get('token', '')
+    return bool(METRICS_TOKEN) and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode())
+
+
+def metrics_response() -> Dict[str, Any]:
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': CONTENT_TYPE},
+        'isBase64Encoded': False,
+        'body': render()
+    }
+
+
+def push(job: str) -> bool:
+    """Отправить метрики в коллектор (протокол Pushgateway: группа job/instance)"""
+    global _last_push
+    if not METRICS_PUSH_URL:
+        return False
+    _last_push = time.time()
+    url = f"{METRICS_PUSH_URL.rstrip('/')}/metrics/job/{job}/instance/{INSTANCE_ID}"
+    try:
+        response = requests.post(url, data=render().encode('utf-8'),
+                                 headers={'Content-Type': CONTENT_TYPE}, timeout=2)
+        return response.status_code < 300
+    except Exception as e:
+        print(f"[ERROR] metrics push: {str(e)}")
+        return False
+
+
+def maybe_push(job: str) -> bool:
+    """push(), если с прошлой отправки прошло METRICS_PUSH_INTERVAL секунд"""
+    if not METRICS_PUSH_URL or time.time() - _last_push < METRICS_PUSH_INTERVAL:
+        return False
+    return push(job)
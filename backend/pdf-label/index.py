@@ -6,7 +6,9 @@
 
 import json
 import os
-from typing import Dict, Any
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
 from reportlab.lib.pagesizes import mm
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm as MM
@@ -22,6 +24,14 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 import requests as http_client
 
+import metrics
+
+LABEL_SIZES = ('120x75', '58x40')
+
+REQUESTS = metrics.counter('pdf_label_requests_total', 'Запросы к функции этикеток по HTTP-статусу', ('status',))
+RENDER_DURATION = metrics.histogram(
+    'pdf_label_render_seconds', 'Время генерации PDF-этикетки', ('label_size', 'order_type'))
+
 def get_bot_username() -> str:
     """Получает username бота через Telegram Bot API"""
     try:
@@ -42,7 +52,25 @@ BOT_USERNAME = get_bot_username()
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
+    query_params = event.get('queryStringParameters') or {}
+    
+    if method == 'GET' and query_params.get('action') == 'metrics':
+        if not metrics.is_authorized(query_params):
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Forbidden'}),
+                'isBase64Encoded': False
+            }
+        return metrics.metrics_response()
     
+    response = handle_request(event, method)
+    REQUESTS.inc(status=str(response['statusCode']))
+    metrics.maybe_push('pdf-label')
+    return response
+
+
+def handle_request(event: Dict[str, Any], method: str) -> Dict[str, Any]:
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
@@ -102,7 +130,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            pdf_bytes = generate_label_pdf(order, order_type, label_size)
+            with RENDER_DURATION.time(label_size=label_size if label_size in LABEL_SIZES else 'other',
+                                      order_type=order_type if order_type == 'sender' else 'carrier'):
+                pdf_bytes = generate_label_pdf(order, order_type, label_size)
             pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
             
             return {
@@ -211,7 +241,22 @@ def format_order_text(order: Dict[str, Any], order_type: str) -> str:
         return '\n'.join(lines)
 
 
-def generate_label_pdf(order: Dict[str, Any], order_type: str, label_size: str) -> bytes:
+@contextmanager
+def _phase(timings: Optional[Dict[str, float]], name: str):
+    """Добавить время блока к timings[name] (для бенчмарка этикеток)"""
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
+
+def generate_label_pdf(order: Dict[str, Any], order_type: str, label_size: str,
+                       timings: Optional[Dict[str, float]] = None) -> bytes:
+    """PDF этикетки. timings, если передан, получает время по фазам: font, qr, text, save"""
     buffer = io.BytesIO()
     
     if label_size == '120x75':
@@ -231,62 +276,66 @@ def generate_label_pdf(order: Dict[str, Any], order_type: str, label_size: str)
     
     c = canvas.Canvas(buffer, pagesize=(width, height))
     
-    font_path = download_font()
-    pdfmetrics.registerFont(TTFont('DejaVu', font_path))
-    c.setFont("DejaVu", font_size_title)
+    with _phase(timings, 'font'):
+        font_path = download_font()
+        pdfmetrics.registerFont(TTFont('DejaVu', font_path))
+        c.setFont("DejaVu", font_size_title)
     
     y_position = height - 7*MM
     x_margin = 3*MM
     
     # QR-код слева, название бота справа на одном уровне
-    try:
-        qr_url = f"https://t.me/{BOT_USERNAME}"
-        qr_code = QrCodeWidget(qr_url)
-        bounds = qr_code.getBounds()
-        qr_width = bounds[2] - bounds[0]
-        qr_height = bounds[3] - bounds[1]
-        qr_drawing = Drawing(qr_size, qr_size, transform=[qr_size/qr_width, 0, 0, qr_size/qr_height, 0, 0])
-        qr_drawing.add(qr_code)
-        renderPDF.draw(qr_drawing, c, x_margin, y_position - qr_size + 3*MM)
-    except:
-        pass
+    with _phase(timings, 'qr'):
+        try:
+            qr_url = f"https://t.me/{BOT_USERNAME}"
+            qr_code = QrCodeWidget(qr_url)
+            bounds = qr_code.getBounds()
+            qr_width = bounds[2] - bounds[0]
+            qr_height = bounds[3] - bounds[1]
+            qr_drawing = Drawing(qr_size, qr_size, transform=[qr_size/qr_width, 0, 0, qr_size/qr_height, 0, 0])
+            qr_drawing.add(qr_code)
+            renderPDF.draw(qr_drawing, c, x_margin, y_position - qr_size + 3*MM)
+        except:
+            pass
     
-    # Название бота справа на одном уровне с QR-кодом
-    bot_link = f"t.me/{BOT_USERNAME}"
-    bot_text_x = x_margin + qr_size + 3*MM
-    bot_text_y = y_position - (qr_size / 2)
-    c.drawString(bot_text_x, bot_text_y, bot_link)
+    with _phase(timings, 'text'):
+        # Название бота справа на одном уровне с QR-кодом
+        bot_link = f"t.me/{BOT_USERNAME}"
+        bot_text_x = x_margin + qr_size + 3*MM
+        bot_text_y = y_position - (qr_size / 2)
+        c.drawString(bot_text_x, bot_text_y, bot_link)
     
-    y_position -= qr_size + 0.5*MM
+        y_position -= qr_size + 0.5*MM
     
-    # Рисуем линию-разделитель
-    c.setStrokeColor(colors.black)
-    c.setLineWidth(0.5)
-    c.line(x_margin, y_position, width - x_margin, y_position)
+        # Рисуем линию-разделитель
+        c.setStrokeColor(colors.black)
+        c.setLineWidth(0.5)
+        c.line(x_margin, y_position, width - x_margin, y_position)
     
-    y_position -= 5*MM
+        y_position -= 5*MM
     
-    # Выводим текст заявки
-    c.setFont("DejaVu", font_size_normal)
+        # Выводим текст заявки
+        c.setFont("DejaVu", font_size_normal)
     
-    order_text = format_order_text(order, order_type)
+        order_text = format_order_text(order, order_type)
     
-    for line in order_text.split('\n'):
-        if y_position < 5*MM:
-            break
+        for line in order_text.split('\n'):
+            if y_position < 5*MM:
+                break
         
-        # Обрезаем слишком длинные строки
-        max_chars = 50 if label_size == '120x75' else 28
-        if len(line) > max_chars:
-            line = line[:max_chars-3] + '...'
+            # Обрезаем слишком длинные строки
+            max_chars = 50 if label_size == '120x75' else 28
+            if len(line) > max_chars:
+                line = line[:max_chars-3] + '...'
         
-        c.drawString(x_margin, y_position, line)
-        y_position -= line_height
+            c.drawString(x_margin, y_position, line)
+            y_position -= line_height
     
     # Убираем нижнюю надпись (больше не выводим t.me/{BOT_USERNAME})
     
-    c.save()
-    pdf_bytes = buffer.getvalue()
-    buffer.close()
+    with _phase(timings, 'save'):
+        c.save()
+        pdf_bytes = buffer.getvalue()
+        buffer.close()
     
     return pdf_bytes
\ No newline at end of file
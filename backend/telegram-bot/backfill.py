@@ -0,0 +1,193 @@
+"""
+Фоновый пересчёт warehouse_normalized / loading_city_normalized
+и ключа склада в подписках (warehouse_filter_normalized)
+Заявки читаются по возрастанию id серверным курсором, нормализуются пачкой
+и записываются одним UPDATE ... FROM (VALUES ...) на пачку.
+Прогресс хранится в normalization_backfill_state, поэтому запуск можно прерывать и продолжать;
+при смене NORMALIZATION_VERSION пересчёт начинается с начала.
+"""
+
+import time
+import threading
+from typing import Dict, Any, Tuple
+from psycopg2.extras import execute_values
+
+import db
+import subscriptions
+from normalization import NORMALIZATION_VERSION, normalize_warehouse_batch, normalize_city_batch
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+ORDER_TABLES = {
+    'sender': 'sender_orders',
+    'carrier': 'carrier_orders',
+}
+
+BACKFILL_BATCH_SIZE = 1000
+# Ограничение по времени одного запуска (функция должна уложиться в таймаут)
+BACKFILL_TIME_BUDGET = 20.0
+# Как часто перепроверять, закончен ли пересчёт (секунды)
+BACKFILL_STATUS_TTL = 60
+
+_status = {'done': False, 'checked_at': 0.0}
+_status_lock = threading.Lock()
+
+
+def _load_state(conn, order_type: str) -> int:
+    """Вернуть id, с которого продолжать; при смене версии правил — сбросить прогресс"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE {SCHEMA}.normalization_backfill_state
+            SET rules_version = %s, last_order_id = 0, updated_rows = 0, finished_at = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE order_type = %s AND rules_version <> %s
+        """, (NORMALIZATION_VERSION, order_type, NORMALIZATION_VERSION))
+        cur.execute(f"""
+            SELECT last_order_id, finished_at FROM {SCHEMA}.normalization_backfill_state
+            WHERE order_type = %s
+        """, (order_type,))
+        row = cur.fetchone()
+    conn.commit()
+    if not row:
+        return -1
+    last_order_id, finished_at = row
+    return -1 if finished_at else last_order_id
+
+
+def backfill_order_type(order_type: str, deadline: float) -> Dict[str, Any]:
+    """Пересчитать одну таблицу заявок до конца или до истечения deadline"""
+    table = f"{SCHEMA}.{ORDER_TABLES[order_type]}"
+    write_conn = db.open_connection()
+    read_conn = db.open_connection()
+    result = {'scanned': 0, 'updated': 0, 'done': False}
+    try:
+        last_order_id = _load_state(write_conn, order_type)
+        if last_order_id < 0:
+            result['done'] = True
+            return result
+
+        read_conn.set_session(readonly=True)
+        with read_conn.cursor(name=f'backfill_{order_type}') as reader:
+            reader.itersize = BACKFILL_BATCH_SIZE
+            reader.execute(f"""
+                SELECT id, warehouse, loading_city, warehouse_normalized, loading_city_normalized
+                FROM {table}
+                WHERE id > %s
+                ORDER BY id
+            """, (last_order_id,))
+
+            while True:
+                rows = reader.fetchmany(BACKFILL_BATCH_SIZE)
+                if not rows:
+                    result['done'] = True
+                    break
+
+                warehouses = normalize_warehouse_batch([r[1] or '' for r in rows])
+                cities = normalize_city_batch([r[2] or '' for r in rows])
+                # Исходные значения едут вместе с ключами: если заявку отредактировали после чтения,
+                # строка не обновится и ключ, посчитанный при редактировании, останется
+                changed = [
+                    (r[0], r[1], r[2], wh, city)
+                    for r, wh, city in zip(rows, warehouses, cities)
+                    if r[3] != wh or r[4] != city
+                ]
+                last_order_id = rows[-1][0]
+
+                with write_conn.cursor() as cur:
+                    if changed:
+                        execute_values(cur, f"""
+                            UPDATE {table} AS o
+                            SET warehouse_normalized = v.warehouse_normalized,
+                                loading_city_normalized = v.loading_city_normalized
+                            FROM (VALUES %s) AS v(id, warehouse, loading_city,
+                                                  warehouse_normalized, loading_city_normalized)
+                            WHERE o.id = v.id
+                            AND o.warehouse IS NOT DISTINCT FROM v.warehouse
+                            AND o.loading_city IS NOT DISTINCT FROM v.loading_city
+                        """, changed, page_size=BACKFILL_BATCH_SIZE)
+                    cur.execute(f"""
+                        UPDATE {SCHEMA}.normalization_backfill_state
+                        SET last_order_id = %s, updated_rows = updated_rows + %s, updated_at = CURRENT_TIMESTAMP
+                        WHERE order_type = %s
+                    """, (last_order_id, len(changed), order_type))
+                write_conn.commit()
+
+                result['scanned'] += len(rows)
+                result['updated'] += len(changed)
+
+                if time.time() >= deadline:
+                    break
+
+        if result['done']:
+            with write_conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE {SCHEMA}.normalization_backfill_state
+                    SET finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                    WHERE order_type = %s
+                """, (order_type,))
+            write_conn.commit()
+        return result
+    finally:
+        read_conn.close()
+        write_conn.close()
+
+
+def normalized_columns_ready() -> bool:
+    """Пересчёт для текущей NORMALIZATION_VERSION закончен во всех таблицах заявок.
+    Готовность запоминается до конца жизни процесса: версия правил — константа кода"""
+    if _status['done']:
+        return True
+    with _status_lock:
+        if not _status['done'] and time.monotonic() - _status['checked_at'] >= BACKFILL_STATUS_TTL:
+            row = db.execute('normalization_backfill_done', (NORMALIZATION_VERSION,), fetch='one')
+            _status['done'] = bool(row and row[0])
+            _status['checked_at'] = time.monotonic()
+    return _status['done']
+
+
+def match_statement(name: str, warehouse_norm: str, warehouse: str) -> Tuple[str, Tuple[str, ...]]:
+    """Запрос подбора и параметры склада: до конца пересчёта — с запасным сравнением склада как есть"""
+    if normalized_columns_ready():
+        return name, (warehouse_norm,)
+    return f"{name}_fallback", (warehouse_norm, warehouse)
+
+
+def backfill_subscriptions() -> Dict[str, Any]:
+    """Пересчитать ключи склада у подписок (таблица небольшая — целиком за один проход)"""
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT id, warehouse_filter, warehouse_filter_normalized
+                FROM {SCHEMA}.user_subscriptions
+                WHERE warehouse_filter IS NOT NULL
+            """)
+            rows = cur.fetchall()
+            warehouses = normalize_warehouse_batch([r[1] for r in rows])
+            changed = [(r[0], wh) for r, wh in zip(rows, warehouses) if r[2] != wh]
+            if changed:
+                execute_values(cur, f"""
+                    UPDATE {SCHEMA}.user_subscriptions AS s
+                    SET warehouse_filter_normalized = v.warehouse_filter_normalized
+                    FROM (VALUES %s) AS v(id, warehouse_filter_normalized)
+                    WHERE s.id = v.id
+                """, changed, page_size=BACKFILL_BATCH_SIZE)
+        conn.commit()
+    finally:
+        conn.close()
+    if changed:
+        subscriptions.invalidate()
+    return {'scanned': len(rows), 'updated': len(changed), 'done': True}
+
+
+def run_backfill() -> Dict[str, Any]:
+    """Продолжить пересчёт для всех типов заявок в пределах BACKFILL_TIME_BUDGET"""
+    deadline = time.time() + BACKFILL_TIME_BUDGET
+    summary = {'rules_version': NORMALIZATION_VERSION}
+    for order_type in ORDER_TABLES:
+        if time.time() >= deadline:
+            summary[order_type] = {'scanned': 0, 'updated': 0, 'done': False}
+            continue
+        summary[order_type] = backfill_order_type(order_type, deadline)
+    summary['subscriptions'] = backfill_subscriptions()
+    return summary
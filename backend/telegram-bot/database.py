@@ -11,48 +11,13 @@ from psycopg2.extras import RealDictCursor
 from datetime import datetime, timedelta
 
 from constants import MAX_ORDERS_PER_DAY
-
-def normalize_warehouse(warehouse: str) -> str:
-    """Нормализует название склада для fuzzy matching"""
-    if not warehouse:
-        return ''
-    
-    normalized = warehouse.lower().strip()
-    normalized = ' '.join(normalized.split())
-    
-    replacements = {
-        'коледино': 'каледино',
-        'электросталь': 'електросталь',
-        'подольск': 'падольск',
-        'щелково': 'щолково',
-        'чехов': 'чихов',
-        'е': 'е',
-        'ё': 'е'
-    }
-    
-    for wrong, correct in replacements.items():
-        normalized = normalized.replace(wrong, correct)
-    
-    normalized = ''.join(c for c in normalized if c.isalnum() or c.isspace())
-    
-    return normalized
+import security_log
+from normalization import normalize_warehouse
+from permissions import get_admin_permissions
 
 def log_security_event(chat_id: int, event_type: str, details: str, severity: str = 'medium'):
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO t_p52349012_telegram_bot_creatio.security_logs 
-                (chat_id, event_type, details, severity)
-                VALUES (%s, %s, %s, %s)
-                """,
-                (chat_id, event_type, details, severity)
-            )
-            conn.commit()
-        conn.close()
-    except:
-        pass
+    """Событие попадает в буфер security_log и записывается пачкой"""
+    security_log.log_event(chat_id, event_type, details, severity)
 
 def auto_block_user(chat_id: int, reason: str):
     try:
@@ -132,50 +97,6 @@ def get_user_orders_today(chat_id: int) -> int:
     finally:
         conn.close()
 
-def get_admin_permissions(chat_id: int) -> Optional[Dict[str, bool]]:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT ba.role, ap.*
-                FROM t_p52349012_telegram_bot_creatio.bot_admins ba
-                LEFT JOIN t_p52349012_telegram_bot_creatio.admin_permissions ap ON ba.id = ap.admin_id
-                WHERE ba.chat_id = %s AND ba.is_active = true
-            """, (chat_id,))
-            result = cur.fetchone()
-            
-            if not result:
-                return None
-            
-            role = result.get('role', 'viewer')
-            
-            if role == 'owner':
-                return {
-                    'role': 'owner',
-                    'can_view_stats': True,
-                    'can_view_orders': True,
-                    'can_remove_orders': True,
-                    'can_manage_users': True,
-                    'can_block_users': True,
-                    'can_manage_admins': True,
-                    'can_view_security_logs': True
-                }
-            
-            return {
-                'role': role,
-                'can_view_stats': result.get('can_view_stats', True),
-                'can_view_orders': result.get('can_view_orders', True),
-                'can_remove_orders': result.get('can_remove_orders', False),
-                'can_manage_users': result.get('can_manage_users', False),
-                'can_block_users': result.get('can_block_users', False),
-                'can_manage_admins': result.get('can_manage_admins', False),
-                'can_view_security_logs': result.get('can_view_security_logs', False)
-            }
-    except:
-        return None
-    finally:
-        conn.close()
-
 def is_admin(chat_id: int) -> bool:
     return get_admin_permissions(chat_id) is not None
 
@@ -184,11 +105,11 @@ def check_suspicious_activity(chat_id: int) -> bool:
     try:
         with conn.cursor() as cur:
             cur.execute("""
-                SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.security_logs
+                SELECT COALESCE(SUM(event_count), 0) FROM t_p52349012_telegram_bot_creatio.security_logs
                 WHERE chat_id = %s AND created_at > NOW() - INTERVAL '1 hour'
             """, (chat_id,))
             
-            events_last_hour = cur.fetchone()[0]
+            events_last_hour = cur.fetchone()[0] + security_log.pending_count(chat_id)
             
             if events_last_hour > 50:
                 return True
@@ -215,21 +136,9 @@ def check_suspicious_activity(chat_id: int) -> bool:
     finally:
         conn.close()
 
-def save_warehouse_mapping(normalized_name: str, original_name: str):
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO t_p52349012_telegram_bot_creatio.warehouse_mappings 
-                (normalized_name, original_name)
-                VALUES (%s, %s)
-                ON CONFLICT (normalized_name, original_name) DO UPDATE 
-                SET usage_count = t_p52349012_telegram_bot_creatio.warehouse_mappings.usage_count + 1
-            """, (normalized_name, original_name))
-            conn.commit()
-        conn.close()
-    except:
-        pass
+def save_warehouse_mapping(normalized_name: str, original_name: str, marketplace: str = ''):
+    from warehouses import record_warehouse_usage
+    record_warehouse_usage(marketplace, original_name)
 
 def save_sender_order(chat_id: int, order_data: Dict[str, Any]) -> int:
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
@@ -261,9 +170,9 @@ def save_sender_order(chat_id: int, order_data: Dict[str, Any]) -> int:
             normalized_to = normalize_warehouse(order_data.get('to_warehouse', ''))
             
             if normalized_from:
-                save_warehouse_mapping(normalized_from, order_data.get('from_warehouse'))
+                save_warehouse_mapping(normalized_from, order_data.get('from_warehouse'), order_data.get('marketplace') or '')
             if normalized_to:
-                save_warehouse_mapping(normalized_to, order_data.get('to_warehouse'))
+                save_warehouse_mapping(normalized_to, order_data.get('to_warehouse'), order_data.get('marketplace') or '')
             
             return order_id
     except Exception as e:
@@ -300,9 +209,9 @@ def save_carrier_order(chat_id: int, order_data: Dict[str, Any]) -> int:
             normalized_to = normalize_warehouse(order_data.get('to_warehouse', ''))
             
             if normalized_from:
-                save_warehouse_mapping(normalized_from, order_data.get('from_warehouse'))
+                save_warehouse_mapping(normalized_from, order_data.get('from_warehouse'), order_data.get('marketplace') or '')
             if normalized_to:
-                save_warehouse_mapping(normalized_to, order_data.get('to_warehouse'))
+                save_warehouse_mapping(normalized_to, order_data.get('to_warehouse'), order_data.get('marketplace') or '')
             
             return order_id
     except Exception as e:
@@ -479,41 +388,11 @@ def get_template_by_id(template_id: int) -> Optional[Dict[str, Any]]:
     finally:
         conn.close()
 
-def get_matching_warehouses(search_term: str, limit: int = 5) -> List[str]:
-    normalized_search = normalize_warehouse(search_term)
-    
-    if not normalized_search:
-        return []
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT original_name, usage_count
-                FROM t_p52349012_telegram_bot_creatio.warehouse_mappings
-                WHERE normalized_name LIKE %s
-                ORDER BY usage_count DESC, original_name
-                LIMIT %s
-            """, (f'%{normalized_search}%', limit))
-            
-            return [row[0] for row in cur.fetchall()]
-    except:
-        return []
-    finally:
-        conn.close()
+def get_matching_warehouses(search_term: str, limit: int = 5, marketplace: Optional[str] = None) -> List[str]:
+    from warehouses import suggest_warehouses
+    return suggest_warehouses(marketplace, search_term, limit)
 
 def update_user_info(chat_id: int, username: str, first_name: str, last_name: str):
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO t_p52349012_telegram_bot_creatio.users 
-                (chat_id, username, first_name, last_name, last_seen)
-                VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
-                ON CONFLICT (chat_id) DO UPDATE 
-                SET username = %s, first_name = %s, last_name = %s, last_seen = CURRENT_TIMESTAMP
-            """, (chat_id, username, first_name, last_name, username, first_name, last_name))
-            conn.commit()
-        conn.close()
-    except:
-        pass
\ No newline at end of file
+    """Обновляет профиль и last_seen в реестре bot_users (не чаще раза в USER_TOUCH_INTERVAL)"""
+    from users import touch_user
+    touch_user(chat_id, username, first_name, last_name)
\ No newline at end of file
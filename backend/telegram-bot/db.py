@@ -0,0 +1,375 @@
+"""
+Соединение с БД и реестр горячих запросов
+Соединение одно на поток (в функции — одно на процесс) и переиспользуется между вызовами,
+пока живёт экземпляр.
+Запросы из реестра описаны один раз с параметрами %s и выполняются как подготовленные
+(PREPARE/EXECUTE), поэтому Postgres не разбирает и не планирует их заново на каждый вызов.
+Если пулер соединений не поддерживает подготовленные запросы (pgbouncer в режиме transaction),
+реестр переключается на обычное выполнение того же параметризованного SQL.
+"""
+
+import os
+import re
+import time
+import threading
+from typing import Dict, Any, List, Sequence
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import tracing
+import metrics
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# auto — подготавливать запросы, пока это работает; off — всегда выполнять обычный SQL
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', 'auto')
+
+# Коды ошибок, которыми пулер выдаёт потерю подготовленного запроса между соединениями
+PREPARED_UNSUPPORTED_CODES = ('26000', '42P05')
+
+_PLACEHOLDER_RE = re.compile(r'%s')
+
+QUERY_DURATION = metrics.histogram(
+    'bot_db_query_duration_seconds', 'Время запросов реестра', ('statement',))
+QUERY_ERRORS = metrics.counter(
+    'bot_db_query_errors_total', 'Ошибки запросов реестра', ('statement',))
+CONNECTIONS_OPENED = metrics.counter(
+    'bot_db_connections_opened_total', 'Открытые соединения вне реестра')
+
+
+class Statement:
+    """Запрос реестра со счётчиками времени выполнения"""
+
+    def __init__(self, name: str, sql: str, idempotent: bool = True):
+        self.name = name
+        self.sql = sql
+        # False — повтор после обрыва соединения может выполнить запрос дважды (INSERT без ключа)
+        self.idempotent = idempotent
+        self.param_count = len(_PLACEHOLDER_RE.findall(sql))
+        counter = iter(range(1, self.param_count + 1))
+        self.prepare_sql = f"PREPARE {name} AS " + _PLACEHOLDER_RE.sub(lambda m: f"${next(counter)}", sql)
+        if self.param_count:
+            self.execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * self.param_count)})"
+        else:
+            self.execute_sql = f"EXECUTE {name}"
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+STATEMENTS: Dict[str, Statement] = {}
+
+# conn и prepared (имена подготовленных в этом соединении запросов) — свои у каждого потока
+_local = threading.local()
+_prepared_enabled = DB_PREPARED_STATEMENTS != 'off'
+
+
+def register_statement(name: str, sql: str, idempotent: bool = True) -> Statement:
+    """Описать запрос один раз при импорте модуля"""
+    if name in STATEMENTS:
+        raise ValueError(f"Duplicate statement '{name}'")
+    statement = Statement(name, sql, idempotent)
+    STATEMENTS[name] = statement
+    return statement
+
+
+def _prepared() -> set:
+    if not hasattr(_local, 'prepared'):
+        _local.prepared = set()
+    return _local.prepared
+
+
+def get_connection():
+    """Общее соединение потока (autocommit); пересоздаётся, если было закрыто"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or conn.closed:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn.autocommit = True
+        _local.conn = conn
+        _prepared().clear()
+    return conn
+
+
+def open_connection():
+    """Отдельное соединение для запросов вне реестра (транзакции); открытие пишется в трассу"""
+    CONNECTIONS_OPENED.inc()
+    with tracing.span('db_connect', 'connect'):
+        return psycopg2.connect(os.environ['DATABASE_URL'])
+
+
+def reset_connection() -> None:
+    """Закрыть общее соединение потока (после сетевой ошибки)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and not conn.closed:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    _local.conn = None
+    _prepared().clear()
+
+
+def _run(statement: Statement, params: Sequence[Any], fetch: str, dict_rows: bool, sent: list):
+    """sent пополняется перед отправкой самого запроса (PREPARE запрос ещё не выполняет)"""
+    global _prepared_enabled
+    conn = get_connection()
+    prepared = _prepared()
+    with conn.cursor(cursor_factory=RealDictCursor if dict_rows else None) as cur:
+        if _prepared_enabled:
+            try:
+                if statement.name not in prepared:
+                    cur.execute(statement.prepare_sql)
+                    prepared.add(statement.name)
+                sent.append(statement.name)
+                cur.execute(statement.execute_sql, params)
+            except psycopg2.Error as e:
+                if e.pgcode not in PREPARED_UNSUPPORTED_CODES:
+                    raise
+                print(f"[ERROR] prepared statements unavailable, falling back to plain SQL: {str(e)}")
+                _prepared_enabled = False
+                prepared.clear()
+                cur.execute(statement.sql, params)
+        else:
+            sent.append(statement.name)
+            cur.execute(statement.sql, params)
+
+        if fetch == 'one':
+            return cur.fetchone()
+        if fetch == 'all':
+            return cur.fetchall()
+        if fetch == 'rowcount':
+            return cur.rowcount
+        return None
+
+
+def execute(name: str, params: Sequence[Any] = (), fetch: str = 'none', dict_rows: bool = False):
+    """Выполнить запрос реестра. fetch: 'one' | 'all' | 'rowcount' | 'none'"""
+    statement = STATEMENTS[name]
+    started = time.perf_counter()
+    try:
+        with tracing.span('db', name):
+            sent: list = []
+            try:
+                return _run(statement, params, fetch, dict_rows, sent)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # Соединение могло закрыться, пока экземпляр простаивал — одна повторная попытка.
+                # Неидемпотентный запрос повторяется, только если до сервера он не отправлялся:
+                # иначе он мог выполниться до обрыва, и повтор создал бы дубль
+                reset_connection()
+                if sent and not statement.idempotent:
+                    raise
+                return _run(statement, params, fetch, dict_rows, [])
+    except Exception:
+        statement.errors += 1
+        QUERY_ERRORS.inc(statement=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        statement.calls += 1
+        statement.total_time += elapsed
+        statement.max_time = max(statement.max_time, elapsed)
+        QUERY_DURATION.observe(elapsed, statement=name)
+
+
+def statement_stats() -> List[Dict[str, Any]]:
+    """Задержки по запросам реестра (для диагностики)"""
+    return [
+        {
+            'name': s.name,
+            'calls': s.calls,
+            'errors': s.errors,
+            'total_ms': round(s.total_time * 1000, 2),
+            'avg_ms': round(s.total_time * 1000 / s.calls, 2) if s.calls else 0,
+            'max_ms': round(s.max_time * 1000, 2),
+            'prepared': s.name in _prepared(),
+        }
+        for s in sorted(STATEMENTS.values(), key=lambda s: s.total_time, reverse=True)
+        if s.calls
+    ]
+
+
+# --- Горячие запросы бота
+
+register_statement('is_user_blocked', f"""
+    SELECT 1 FROM {SCHEMA}.blocked_users WHERE chat_id = %s
+""")
+
+register_statement('user_daily_limit', f"""
+    SELECT daily_order_limit FROM {SCHEMA}.user_limits WHERE chat_id = %s
+""")
+
+register_statement('user_orders_today', f"""
+    SELECT
+        (SELECT COUNT(*) FROM {SCHEMA}.sender_orders
+         WHERE chat_id = %s AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + 1)
+      + (SELECT COUNT(*) FROM {SCHEMA}.carrier_orders
+         WHERE chat_id = %s AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + 1)
+""")
+
+register_statement('upsert_sender_defaults', f"""
+    INSERT INTO {SCHEMA}.user_defaults
+    (chat_id, last_marketplace, last_warehouse, last_phone,
+     last_sender_name, last_loading_city, last_loading_address,
+     last_order_type, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, 'sender', CURRENT_TIMESTAMP)
+    ON CONFLICT (chat_id) DO UPDATE SET
+        last_marketplace = EXCLUDED.last_marketplace,
+        last_warehouse = EXCLUDED.last_warehouse,
+        last_phone = EXCLUDED.last_phone,
+        last_sender_name = EXCLUDED.last_sender_name,
+        last_loading_city = EXCLUDED.last_loading_city,
+        last_loading_address = EXCLUDED.last_loading_address,
+        last_order_type = 'sender',
+        updated_at = CURRENT_TIMESTAMP
+""")
+
+register_statement('upsert_carrier_defaults', f"""
+    INSERT INTO {SCHEMA}.user_defaults
+    (chat_id, last_marketplace, last_warehouse, last_phone,
+     last_driver_name, last_car_model, last_license_plate,
+     last_loading_city_carrier, last_hydroboard,
+     last_order_type, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'carrier', CURRENT_TIMESTAMP)
+    ON CONFLICT (chat_id) DO UPDATE SET
+        last_marketplace = EXCLUDED.last_marketplace,
+        last_warehouse = EXCLUDED.last_warehouse,
+        last_phone = EXCLUDED.last_phone,
+        last_driver_name = EXCLUDED.last_driver_name,
+        last_car_model = EXCLUDED.last_car_model,
+        last_license_plate = EXCLUDED.last_license_plate,
+        last_loading_city_carrier = EXCLUDED.last_loading_city_carrier,
+        last_hydroboard = EXCLUDED.last_hydroboard,
+        last_order_type = 'carrier',
+        updated_at = CURRENT_TIMESTAMP
+""")
+
+register_statement('insert_sender_order', f"""
+    INSERT INTO {SCHEMA}.sender_orders
+    (loading_address, warehouse, cargo_type, sender_name, phone, loading_date, loading_time, delivery_date,
+     pallet_quantity, box_quantity, label_size, marketplace, chat_id, rate,
+     warehouse_normalized, loading_city, loading_city_normalized)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, '120x75', %s, %s, %s, %s, %s, %s)
+    RETURNING id
+""", idempotent=False)
+
+register_statement('update_sender_order', f"""
+    UPDATE {SCHEMA}.sender_orders
+    SET loading_address = %s, warehouse = %s, cargo_type = %s, sender_name = %s, phone = %s,
+        loading_date = %s, loading_time = %s, delivery_date = %s,
+        pallet_quantity = %s, box_quantity = %s, marketplace = %s, rate = %s,
+        warehouse_normalized = %s, loading_city = %s, loading_city_normalized = %s
+    WHERE id = %s AND chat_id = %s
+    RETURNING id
+""")
+
+register_statement('insert_carrier_order', f"""
+    INSERT INTO {SCHEMA}.carrier_orders
+    (car_brand, license_plate, capacity_type, driver_name, phone, warehouse, car_model,
+     pallet_capacity, box_capacity, marketplace, loading_date, arrival_date, hydroboard, chat_id,
+     warehouse_normalized, loading_city, loading_city_normalized)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING id
+""", idempotent=False)
+
+register_statement('update_carrier_order', f"""
+    UPDATE {SCHEMA}.carrier_orders
+    SET car_brand = %s, license_plate = %s, capacity_type = %s, driver_name = %s, phone = %s,
+        warehouse = %s, car_model = %s, pallet_capacity = %s, box_capacity = %s, marketplace = %s,
+        loading_date = %s, arrival_date = %s, hydroboard = %s,
+        warehouse_normalized = %s, loading_city = %s, loading_city_normalized = %s
+    WHERE id = %s AND chat_id = %s
+    RETURNING id
+""")
+
+register_statement('match_carriers_for_sender', f"""
+    SELECT id, phone, driver_name, car_brand, car_model,
+           pallet_capacity, box_capacity, loading_date, arrival_date, hydroboard, warehouse, chat_id, loading_city
+    FROM {SCHEMA}.carrier_orders
+    WHERE arrival_date = %s
+    AND warehouse_normalized = %s
+    AND marketplace = %s
+    AND (loading_city_normalized = %s OR loading_city = 'Любой город')
+    AND (
+        (pallet_capacity >= %s) OR
+        (pallet_capacity = 0 AND box_capacity >= %s)
+    )
+    ORDER BY id DESC
+    LIMIT 5
+""")
+
+register_statement('match_senders_any_city', f"""
+    SELECT id, phone, sender_name, loading_address, loading_city,
+           pallet_quantity, box_quantity, loading_date, loading_time, delivery_date, rate, warehouse, chat_id
+    FROM {SCHEMA}.sender_orders
+    WHERE delivery_date = %s
+    AND warehouse_normalized = %s
+    AND marketplace = %s
+    AND (
+        (%s >= pallet_quantity) OR
+        (%s = 0 AND %s >= box_quantity)
+    )
+    ORDER BY id DESC
+    LIMIT 5
+""")
+
+register_statement('match_senders_for_carrier', f"""
+    SELECT id, phone, sender_name, loading_address, loading_city,
+           pallet_quantity, box_quantity, loading_date, loading_time, delivery_date, rate, warehouse, chat_id
+    FROM {SCHEMA}.sender_orders
+    WHERE delivery_date = %s
+    AND warehouse_normalized = %s
+    AND marketplace = %s
+    AND loading_city_normalized = %s
+    AND (
+        (%s >= pallet_quantity) OR
+        (%s = 0 AND %s >= box_quantity)
+    )
+    ORDER BY id DESC
+    LIMIT 5
+""")
+
+# Пока бэкфилл не пересчитал warehouse_normalized для текущей версии правил, у старых заявок
+# ключ пустой или устаревший — подбор дополнительно сравнивает склад как есть (см. backfill.py)
+for _name in ('match_carriers_for_sender', 'match_senders_any_city', 'match_senders_for_carrier'):
+    register_statement(f"{_name}_fallback", STATEMENTS[_name].sql.replace(
+        'AND warehouse_normalized = %s', 'AND (warehouse_normalized = %s OR warehouse = %s)'))
+
+register_statement('normalization_backfill_done', f"""
+    SELECT COUNT(*) = 0 FROM {SCHEMA}.normalization_backfill_state
+    WHERE rules_version <> %s OR finished_at IS NULL
+""")
+
+# GCRA (rate_limit.py): EXCLUDED.tat - interval — текущее время БД; строка обновляется,
+# только если запрос разрешён. Параметры: key, interval x5, tolerance
+register_statement('rate_limit_hit', f"""
+    INSERT INTO {SCHEMA}.rate_limits AS r (key, tat)
+    VALUES (%s, EXTRACT(EPOCH FROM clock_timestamp())::double precision + %s)
+    ON CONFLICT (key) DO UPDATE
+    SET tat = GREATEST(r.tat, EXCLUDED.tat - %s) + %s
+    WHERE GREATEST(r.tat, EXCLUDED.tat - %s) - (EXCLUDED.tat - %s) <= %s
+    RETURNING tat
+""", idempotent=False)
+
+# Занять обновление: новая строка или отметка processing старше таймаута (параметры: update_id, секунды)
+register_statement('claim_update', f"""
+    INSERT INTO {SCHEMA}.processed_updates AS p (update_id, status, claimed_at)
+    VALUES (%s, 'processing', CURRENT_TIMESTAMP)
+    ON CONFLICT (update_id) DO UPDATE SET claimed_at = EXCLUDED.claimed_at
+    WHERE p.status = 'processing' AND p.claimed_at < EXCLUDED.claimed_at - make_interval(secs => %s)
+    RETURNING update_id
+""", idempotent=False)
+
+register_statement('complete_update', f"""
+    UPDATE {SCHEMA}.processed_updates SET status = 'done' WHERE update_id = %s
+""")
+
+register_statement('release_update', f"""
+    DELETE FROM {SCHEMA}.processed_updates WHERE update_id = %s
+""")
+
+register_statement('load_subscriptions', f"""
+    SELECT id, chat_id, user_type, subscription_type, warehouse_filter,
+           warehouse_filter_normalized, marketplace_normalized, digest_minutes
+    FROM {SCHEMA}.user_subscriptions
+""")
@@ -0,0 +1,127 @@
+"""
+Защита от повторной обработки обновлений Telegram
+Если вебхук отвечает долго (генерация этикетки, рассылка), Telegram присылает то же обновление ещё раз.
+update_id отмечается до обработки: сначала в кольцевом буфере процесса (повтор отсекается без БД),
+затем в таблице processed_updates, общей для всех экземпляров функции.
+Отметка ставится в состоянии processing и переводится в done после обработки. Если обработка упала
+с исключением, отметка снимается; если экземпляр не дожил до конца (таймаут, нехватка памяти),
+отметку processing старше UPDATE_DEDUP_CLAIM_TIMEOUT занимает следующая доставка.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import db
+import metrics
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# off — не проверять, memory — только в пределах процесса, postgres — для всех экземпляров
+UPDATE_DEDUP = os.environ.get('UPDATE_DEDUP', 'postgres')
+# Сколько последних update_id помнить в памяти процесса
+UPDATE_DEDUP_RING_SIZE = 4096
+# Сколько часов хранить строки processed_updates (Telegram повторяет доставку не дольше суток)
+UPDATE_DEDUP_RETENTION_HOURS = 48
+# Через сколько секунд незавершённая обработка считается потерянной (больше таймаута функции)
+UPDATE_DEDUP_CLAIM_TIMEOUT = int(os.environ.get('UPDATE_DEDUP_CLAIM_TIMEOUT', '120'))
+
+DUPLICATES = metrics.counter(
+    'bot_duplicate_updates_total', 'Повторно доставленные обновления по месту обнаружения', ('source',))
+
+
+class RecentUpdates:
+    """Кольцевой буфер последних update_id: при переполнении забываются самые старые"""
+
+    def __init__(self, size: int = UPDATE_DEDUP_RING_SIZE, claim_timeout: float = UPDATE_DEDUP_CLAIM_TIMEOUT):
+        self.size = size
+        self.claim_timeout = claim_timeout
+        # update_id -> время взятия в обработку (monotonic) или None, если обработка завершена
+        self.ids: 'OrderedDict[int, Optional[float]]' = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, update_id: int) -> bool:
+        """True — update_id новый (или его обработка зависла) и запомнен, False — уже был"""
+        with self.lock:
+            now = time.monotonic()
+            if update_id in self.ids:
+                claimed_at = self.ids[update_id]
+                if claimed_at is None or now - claimed_at < self.claim_timeout:
+                    return False
+            self.ids[update_id] = now
+            self.ids.move_to_end(update_id)
+            if len(self.ids) > self.size:
+                self.ids.popitem(last=False)
+            return True
+
+    def complete(self, update_id: int) -> None:
+        with self.lock:
+            if update_id in self.ids:
+                self.ids[update_id] = None
+
+    def discard(self, update_id: int) -> None:
+        with self.lock:
+            self.ids.pop(update_id, None)
+
+
+_recent = RecentUpdates()
+
+
+def claim(update_id: Optional[int]) -> bool:
+    """Отметить обновление перед обработкой. False — оно уже обработано или обрабатывается"""
+    if UPDATE_DEDUP == 'off' or update_id is None:
+        return True
+    if not _recent.add(update_id):
+        DUPLICATES.inc(source='memory')
+        return False
+    if UPDATE_DEDUP != 'postgres':
+        return True
+    try:
+        claimed = db.execute('claim_update', (update_id, UPDATE_DEDUP_CLAIM_TIMEOUT), fetch='one') is not None
+    except Exception as e:
+        # Без БД лучше обработать возможный повтор, чем потерять обновление
+        print(f"[ERROR] dedup.claim: {str(e)}")
+        return True
+    if not claimed:
+        DUPLICATES.inc(source='db')
+    return claimed
+
+
+def complete(update_id: Optional[int]) -> None:
+    """Отметить обновление обработанным: повторная доставка больше не займёт его"""
+    if UPDATE_DEDUP == 'off' or update_id is None:
+        return
+    _recent.complete(update_id)
+    if UPDATE_DEDUP != 'postgres':
+        return
+    try:
+        db.execute('complete_update', (update_id,))
+    except Exception as e:
+        print(f"[ERROR] dedup.complete: {str(e)}")
+
+
+def release(update_id: Optional[int]) -> None:
+    """Снять отметку после ошибки обработки, чтобы повторная доставка не была отброшена"""
+    if UPDATE_DEDUP == 'off' or update_id is None:
+        return
+    _recent.discard(update_id)
+    if UPDATE_DEDUP != 'postgres':
+        return
+    try:
+        db.execute('release_update', (update_id,))
+    except Exception as e:
+        print(f"[ERROR] dedup.release: {str(e)}")
+
+
+def purge_processed_updates(conn) -> int:
+    """Удалить старые отметки из processed_updates (вызывается из maintenance)"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            DELETE FROM {SCHEMA}.processed_updates
+            WHERE processed_at < CURRENT_TIMESTAMP - make_interval(hours => %s)
+        """, (UPDATE_DEDUP_RETENTION_HOURS,))
+        deleted = cur.rowcount
+    conn.commit()
+    return deleted
@@ -0,0 +1,213 @@
+"""
+Сводки уведомлений для подписчиков
+Подписчик в режиме сводки (digest_minutes > 0) получает не сообщение на каждую новую заявку,
+а одну строку в subscription_digest_items. Плановый сброс (GET ?action=digest или воркер
+long polling) отправляет накопленное одним сообщением, когда самой старой строке исполнилось
+digest_minutes минут. Сброс берёт строки в аренду (claimed_by, claimed_at), поэтому параллельные
+сбросы не отправят одну сводку дважды. Строки удаляются только после отправки; если отправка
+не удалась, аренда снимается и сводка уйдёт при следующем сбросе. Аренда сброса, который
+не дожил до конца, истекает через DIGEST_CLAIM_LEASE секунд.
+"""
+
+import os
+import html
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple, Callable
+from psycopg2.extras import execute_values
+
+import db
+import fanout
+import metrics
+import subscriptions
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# Интервал режима «периодически» (минуты)
+DIGEST_INTERVAL_MINUTES = int(os.environ.get('DIGEST_INTERVAL_MINUTES', '30'))
+DIGEST_DAILY_MINUTES = 1440
+# Режимы, которые предлагаются подписчику: минуты -> подпись кнопки
+DIGEST_MODES = OrderedDict([
+    (0, '⚡ Сразу'),
+    (DIGEST_INTERVAL_MINUTES, f'🕒 Раз в {DIGEST_INTERVAL_MINUTES} минут'),
+    (DIGEST_DAILY_MINUTES, '📅 Раз в день'),
+])
+# Сколько заявок перечислять в одной сводке (сообщение Telegram — до 4096 символов)
+DIGEST_MAX_ITEMS = 25
+DIGEST_MAX_CHARS = 3800
+# Через сколько секунд строки незавершённого сброса снова доступны (больше таймаута функции)
+DIGEST_CLAIM_LEASE = int(os.environ.get('DIGEST_CLAIM_LEASE', '300'))
+
+ENQUEUED = metrics.counter('bot_digest_items_enqueued_total', 'Заявки, отложенные в сводки подписчиков')
+SENT = metrics.counter('bot_digest_messages_sent_total', 'Отправленные сводки')
+RETRIED = metrics.counter('bot_digest_messages_retried_total', 'Сводки, возвращённые в очередь после ошибки отправки')
+
+ENQUEUE_QUERY = f"""
+    INSERT INTO {SCHEMA}.subscription_digest_items (chat_id, order_type, order_id, summary)
+    VALUES %s
+    ON CONFLICT (chat_id, order_type, order_id) DO UPDATE SET summary = EXCLUDED.summary
+"""
+
+# Строка свободна: не взята сбросом или аренда истекла
+AVAILABLE_CONDITION = "(i.claimed_at IS NULL OR i.claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %(lease)s))"
+
+# Чаты, у которых самая старая свободная строка ждёт дольше интервала подписки;
+# их свободные строки берутся в аренду целиком
+CLAIM_DUE_QUERY = f"""
+    WITH due AS (
+        SELECT i.chat_id
+        FROM {SCHEMA}.subscription_digest_items i
+        JOIN (
+            SELECT chat_id, MIN(digest_minutes) AS digest_minutes
+            FROM {SCHEMA}.user_subscriptions
+            GROUP BY chat_id
+        ) s ON s.chat_id = i.chat_id
+        WHERE {AVAILABLE_CONDITION}
+        GROUP BY i.chat_id, s.digest_minutes
+        HAVING MIN(i.created_at) <= CURRENT_TIMESTAMP - make_interval(mins => s.digest_minutes)
+        LIMIT %(max_chats)s
+    )
+    UPDATE {SCHEMA}.subscription_digest_items i
+    SET claimed_by = %(claim_id)s, claimed_at = CURRENT_TIMESTAMP
+    FROM due
+    WHERE i.chat_id = due.chat_id AND {AVAILABLE_CONDITION}
+    RETURNING i.chat_id, i.order_type, i.order_id, i.summary, i.created_at
+"""
+
+DELETE_CLAIMED_QUERY = f"""
+    DELETE FROM {SCHEMA}.subscription_digest_items
+    WHERE claimed_by = %s AND chat_id = ANY(%s)
+"""
+
+RELEASE_CLAIMED_QUERY = f"""
+    UPDATE {SCHEMA}.subscription_digest_items
+    SET claimed_by = NULL, claimed_at = NULL
+    WHERE claimed_by = %s AND chat_id = ANY(%s)
+"""
+
+
+def mode_label(minutes: int) -> str:
+    if minutes <= 0:
+        return 'сразу'
+    if minutes >= DIGEST_DAILY_MINUTES:
+        return 'раз в день'
+    return f'раз в {minutes} минут'
+
+
+def build_summary(order_id: int, order_type: str, data: Dict[str, Any]) -> str:
+    """Одна строка сводки о заявке"""
+    warehouse = html.escape(str(data.get('warehouse') or '-'))
+    marketplace = html.escape(str(data.get('marketplace') or '-'))
+    city = html.escape(str(data.get('loading_city') or '-'))
+    if order_type == 'sender':
+        return (
+            f"📦 <b>#{order_id}</b> {marketplace}, {warehouse} — {data.get('delivery_date') or '-'}, "
+            f"из {city}: {data.get('pallet_quantity', 0)} пал. / {data.get('box_quantity', 0)} кор., "
+            f"{data.get('rate', '-')} руб."
+        )
+    return (
+        f"🚚 <b>#{order_id}</b> {marketplace}, {warehouse} — {data.get('arrival_date') or '-'}, "
+        f"из {city}: до {data.get('pallet_capacity', 0)} пал. / {data.get('box_capacity', 0)} кор."
+    )
+
+
+def build_digest_message(summaries: List[str]) -> str:
+    """Сводка из строк заявок; лишнее сокращается до «и ещё N»"""
+    header = f"🗞 <b>Новые заявки по вашей подписке: {len(summaries)}</b>\n\n"
+    lines = []
+    length = len(header)
+    for summary in summaries[:DIGEST_MAX_ITEMS]:
+        if length + len(summary) + 1 > DIGEST_MAX_CHARS:
+            break
+        lines.append(summary)
+        length += len(summary) + 1
+    rest = len(summaries) - len(lines)
+    footer = f"\n\n…и ещё {rest}" if rest else ''
+    return header + '\n'.join(lines) + footer + "\n\nЧастота уведомлений: /digest"
+
+
+def enqueue(order_id: int, order_type: str, data: Dict[str, Any], chat_ids: List[int]) -> int:
+    """Отложить заявку в сводки подписчиков"""
+    if not chat_ids:
+        return 0
+    summary = build_summary(order_id, order_type, data)
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, ENQUEUE_QUERY, [(chat_id, order_type, order_id, summary) for chat_id in chat_ids])
+        conn.commit()
+    finally:
+        conn.close()
+    ENQUEUED.inc(len(chat_ids))
+    return len(chat_ids)
+
+
+def set_mode(chat_id: int, minutes: int) -> int:
+    """Режим доставки для всех подписок пользователя; возвращает число подписок"""
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"UPDATE {SCHEMA}.user_subscriptions SET digest_minutes = %s WHERE chat_id = %s",
+                (minutes, chat_id)
+            )
+            updated = cur.rowcount
+            if minutes == 0:
+                # Переход на «сразу»: накопленное уйдёт при ближайшем сбросе
+                cur.execute(
+                    f"UPDATE {SCHEMA}.subscription_digest_items SET created_at = to_timestamp(0) WHERE chat_id = %s",
+                    (chat_id,)
+                )
+        conn.commit()
+        # Режим доставки хранится в карте подписок — перечитать её
+        subscriptions.invalidate()
+        return updated
+    finally:
+        conn.close()
+
+
+def claim_due(claim_id: str, max_chats: int = 500) -> List[Tuple[int, List[str]]]:
+    """Взять в аренду строки чатов, которым пора отправить сводку: [(chat_id, [строки по времени])]"""
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(CLAIM_DUE_QUERY, {'claim_id': claim_id, 'max_chats': max_chats, 'lease': DIGEST_CLAIM_LEASE})
+            rows = cur.fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+
+    by_chat: Dict[int, List[Tuple[Any, str]]] = {}
+    for chat_id, _order_type, _order_id, summary, created_at in rows:
+        by_chat.setdefault(chat_id, []).append((created_at, summary))
+    return [(chat_id, [s for _, s in sorted(items, key=lambda item: item[0])]) for chat_id, items in by_chat.items()]
+
+
+def finish_claim(claim_id: str, done_chat_ids: List[int], failed_chat_ids: List[int]) -> None:
+    """Удалить отправленные строки аренды и вернуть в очередь строки чатов, отправка которым не удалась"""
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            if done_chat_ids:
+                cur.execute(DELETE_CLAIMED_QUERY, (claim_id, done_chat_ids))
+            if failed_chat_ids:
+                cur.execute(RELEASE_CLAIMED_QUERY, (claim_id, failed_chat_ids))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def flush_due(send: Callable[[int, str], Any]) -> Dict[str, int]:
+    """Отправить созревшие сводки (вызывается по расписанию)"""
+    claim_id = uuid.uuid4().hex
+    due = claim_due(claim_id)
+    messages = [(chat_id, build_digest_message(summaries)) for chat_id, summaries in due]
+    outcomes = fanout.send_each(send, messages, 'digest')
+    # Отказ Telegram (чат заблокировал бота) повторять бесполезно — такие строки тоже удаляются
+    done = [chat_id for (chat_id, _), outcome in zip(messages, outcomes) if outcome != fanout.FAILED]
+    failed = [chat_id for (chat_id, _), outcome in zip(messages, outcomes) if outcome == fanout.FAILED]
+    finish_claim(claim_id, done, failed)
+    sent = sum(1 for outcome in outcomes if outcome == fanout.SENT)
+    SENT.inc(sent)
+    RETRIED.inc(len(failed))
+    return {'chats': len(due), 'items': sum(len(s) for _, s in due), 'sent': sent, 'failed': len(failed)}
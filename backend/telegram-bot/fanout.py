@@ -0,0 +1,91 @@
+"""
+Параллельное выполнение независимого ввода-вывода внутри одного обновления
+После сохранения заявки запрос этикетки, уведомление админов, рассылка подписчикам и подбор
+совпадений не зависят друг от друга и выполняются одновременно в пуле потоков процесса.
+Рассылка одного сообщения многим получателям тоже идёт параллельно.
+Потоки пула держат свои соединения с БД (см. db.py), отрезки пишутся в трассу обновления.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import tracing
+
+# Потоков на независимые задачи обновления; 1 — выполнять по очереди, как раньше
+FANOUT_THREADS = int(os.environ.get('FANOUT_THREADS', '4'))
+# Потоков на рассылку сообщений (Telegram допускает ~30 сообщений в секунду на бота)
+FANOUT_SEND_THREADS = int(os.environ.get('FANOUT_SEND_THREADS', '8'))
+
+Task = Tuple[str, Callable[[], Any]]
+
+# Итоги отправки сообщения (send_each)
+SENT = 'sent'
+REJECTED = 'rejected'
+FAILED = 'failed'
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(name: str, size: int) -> ThreadPoolExecutor:
+    # Задачи и рассылка в разных пулах: задача, ожидающая свою рассылку, не занимает её потоки
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f'fanout-{name}')
+        return pool
+
+
+def _call(name: str, fn: Callable[[], Any], trace: Optional[tracing.Trace]) -> Any:
+    with tracing.attach(trace):
+        try:
+            return fn()
+        except Exception as e:
+            print(f"[ERROR] {name}: {str(e)}")
+            return None
+
+
+def _run(pool_name: str, size: int, tasks: Sequence[Task]) -> List[Any]:
+    trace = tracing.current_trace()
+    if size <= 1 or len(tasks) <= 1:
+        return [_call(name, fn, trace) for name, fn in tasks]
+    pool = _pool(pool_name, size)
+    futures = [pool.submit(_call, name, fn, trace) for name, fn in tasks]
+    return [future.result() for future in futures]
+
+
+def run_all(tasks: Sequence[Task]) -> List[Any]:
+    """Выполнить задачи (имя, функция) одновременно и дождаться всех.
+    Ошибка одной задачи пишется в лог и не мешает остальным; её результат — None"""
+    return _run('tasks', FANOUT_THREADS, tasks)
+
+
+def _outcome(result: Any) -> str:
+    """Итог send() по ответу Bot API (Response или разобранный JSON); None — send ответ не возвращает"""
+    if isinstance(result, dict):
+        code = 200 if result.get('ok', True) else result.get('error_code', 500)
+    else:
+        code = getattr(result, 'status_code', 200)
+    if code < 400:
+        return SENT
+    if code == 429 or code >= 500:
+        return FAILED
+    return REJECTED
+
+
+def send_each(send: Callable[[int, str], Any], messages: Sequence[Tuple[int, str]], what: str) -> List[str]:
+    """send(chat_id, text) для каждого получателя одновременно; итог по каждому сообщению:
+    SENT, REJECTED (чат заблокировал бота, неверный запрос — повтор бесполезен) или FAILED
+    (сеть, 429, 5xx — сообщение стоит отправить позже)"""
+    results = _run('send', FANOUT_SEND_THREADS, [
+        (f"{what} -> {chat_id}", lambda chat_id=chat_id, text=text: _outcome(send(chat_id, text)))
+        for chat_id, text in messages
+    ])
+    return [r or FAILED for r in results]
+
+
+def send_all(send: Callable[[int, str], Any], messages: Sequence[Tuple[int, str]], what: str) -> int:
+    """send_each(); возвращает число доставленных сообщений"""
+    return sum(1 for r in send_each(send, messages, what) if r == SENT)
@@ -5,6 +5,9 @@
 from database import *
 from messaging import *
 from utils import *
+from stats import get_admin_stats
+from users import get_bot_user, get_top_users
+import security_log
 import json
 import os
 from typing import Dict, Any, Optional
@@ -878,42 +881,22 @@ def handle_admin_panel(chat_id: int):
 
 def handle_admin_stats(chat_id: int):
     """Статистика для админа"""
-    import psycopg2
-    
     perms = get_admin_permissions(chat_id)
     
     if not perms or not perms.get('can_view_stats'):
         send_message(chat_id, "❌ Недостаточно прав")
         return
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.sender_orders")
-            sender_orders = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.carrier_orders")
-            carrier_orders = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(DISTINCT chat_id) FROM t_p52349012_telegram_bot_creatio.sender_orders")
-            sender_users = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(DISTINCT chat_id) FROM t_p52349012_telegram_bot_creatio.carrier_orders")
-            carrier_users = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.blocked_users")
-            blocked_users = cur.fetchone()[0]
-    finally:
-        conn.close()
+    stats = get_admin_stats()
     
     message = f"""
 📊 <b>Статистика бота</b>
 
-📦 <b>Заявки отправителей:</b> {sender_orders}
-🚚 <b>Заявки перевозчиков:</b> {carrier_orders}
-👥 <b>Отправителей:</b> {sender_users}
-👥 <b>Перевозчиков:</b> {carrier_users}
-🚫 <b>Заблокировано:</b> {blocked_users}
+📦 <b>Заявки отправителей:</b> {stats['sender_count']}
+🚚 <b>Заявки перевозчиков:</b> {stats['carrier_count']}
+👥 <b>Отправителей:</b> {stats['sender_users']}
+👥 <b>Перевозчиков:</b> {stats['carrier_users']}
+🚫 <b>Заблокировано:</b> {stats['blocked_count']}
 """
     
     send_message(
@@ -1014,33 +997,13 @@ def handle_admin_remove_order(chat_id: int, order_type: str, order_id: int, mess
 
 def handle_admin_users(chat_id: int):
     """Список пользователей"""
-    import psycopg2
-    from psycopg2.extras import RealDictCursor
-    
     perms = get_admin_permissions(chat_id)
     
     if not perms or not perms.get('can_manage_users'):
         send_message(chat_id, "❌ Недостаточно прав")
         return
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT DISTINCT chat_id, COUNT(*) as order_count
-                FROM (
-                    SELECT chat_id FROM t_p52349012_telegram_bot_creatio.sender_orders
-                    UNION ALL
-                    SELECT chat_id FROM t_p52349012_telegram_bot_creatio.carrier_orders
-                ) AS combined
-                GROUP BY chat_id
-                ORDER BY order_count DESC
-                LIMIT 30
-            """)
-            
-            users = cur.fetchall()
-    finally:
-        conn.close()
+    users = get_top_users(30)
     
     message = "👥 <b>Активные пользователи:</b>\n\n"
     buttons = []
@@ -1049,7 +1012,8 @@ def handle_admin_users(chat_id: int):
         user_chat_id = user['chat_id']
         order_count = user['order_count']
         
-        message += f"👤 {user_chat_id} | Заявок: {order_count}\n"
+        username = f" @{user['username']}" if user.get('username') else ''
+        message += f"👤 {user_chat_id}{username} | Заявок: {order_count}\n"
         buttons.append([
             {'text': f'👤 {user_chat_id}', 'callback_data': f'admin_user_{user_chat_id}'}
         ])
@@ -1065,41 +1029,24 @@ def handle_admin_users(chat_id: int):
 
 def handle_admin_user_detail(chat_id: int, user_chat_id: int):
     """Детали пользователя"""
-    import psycopg2
-    from psycopg2.extras import RealDictCursor
-    
     perms = get_admin_permissions(chat_id)
     
     if not perms or not perms.get('can_manage_users'):
         send_message(chat_id, "❌ Недостаточно прав")
         return
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.sender_orders
-                WHERE chat_id = %s
-            """, (user_chat_id,))
-            sender_orders = cur.fetchone()['count']
-            
-            cur.execute("""
-                SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.carrier_orders
-                WHERE chat_id = %s
-            """, (user_chat_id,))
-            carrier_orders = cur.fetchone()['count']
-            
-            cur.execute("""
-                SELECT * FROM t_p52349012_telegram_bot_creatio.blocked_users
-                WHERE chat_id = %s
-            """, (user_chat_id,))
-            is_blocked = cur.fetchone() is not None
-    finally:
-        conn.close()
+    user = get_bot_user(user_chat_id) or {}
+    sender_orders = user.get('sender_orders_count', 0)
+    carrier_orders = user.get('carrier_orders_count', 0)
+    is_blocked = bool(user.get('is_blocked'))
+    username = f"@{user['username']}" if user.get('username') else '—'
+    last_seen = user['last_seen'].strftime('%d.%m.%Y %H:%M') if user.get('last_seen') else '—'
     
     message = f"""
 👤 <b>Пользователь {user_chat_id}</b>
 
+🔗 <b>Username:</b> {username}
+🕒 <b>Последняя активность:</b> {last_seen}
 📦 <b>Заявок отправителя:</b> {sender_orders}
 🚚 <b>Заявок перевозчика:</b> {carrier_orders}
 🚫 <b>Заблокирован:</b> {'Да' if is_blocked else 'Нет'}
@@ -1213,11 +1160,13 @@ def handle_admin_security_logs(chat_id: int):
         send_message(chat_id, "❌ Недостаточно прав")
         return
     
+    security_log.flush()
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
                 SELECT * FROM t_p52349012_telegram_bot_creatio.security_logs
+                WHERE created_at > NOW() - INTERVAL '30 days'
                 ORDER BY created_at DESC
                 LIMIT 50
             """)
@@ -1233,7 +1182,8 @@ def handle_admin_security_logs(chat_id: int):
     message = "🔒 <b>Логи безопасности:</b>\n\n"
     
     for log in logs[:20]:
-        message += f"⚠️ {log['severity']} | {log['event_type']}\n"
+        repeats = f" ×{log['event_count']}" if log.get('event_count', 1) > 1 else ''
+        message += f"⚠️ {log['severity']} | {log['event_type']}{repeats}\n"
         message += f"👤 User: {log['chat_id']}\n"
         message += f"📋 {log['details']}\n\n"
     
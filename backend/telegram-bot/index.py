@@ -7,17 +7,37 @@
 
 import json
 import os
-from typing import Dict, Any, Optional, List
-import psycopg2
+from typing import Dict, Any, Optional, List, Tuple
 from psycopg2.extras import RealDictCursor
-import requests
 from datetime import datetime, timedelta
 import time
-from collections import defaultdict
 import ipaddress
 import re
 import html
 
+from stats import get_admin_stats, get_weekly_stats
+from users import touch_user_from_update, get_bot_user
+import security_log
+import maintenance
+import backfill
+from normalization import normalize_warehouse, normalize_city
+from warehouses import get_popular_warehouses, is_known_warehouse, suggest_warehouses, record_warehouse_usage
+from router import Router
+from rate_limit import create_limiter
+from permissions import get_admin_permissions, invalidate_admin_permissions
+import permissions
+from user_cache import user_cache, is_miss
+import db
+import dedup
+import digest
+import fanout
+import subscriptions
+import sent_notifications
+import order_pages
+import tracing
+import telegram_client
+import metrics
+
 MARKETPLACES = ['Wildberries', 'OZON', 'Яндекс.Маркет', 'AliExpress', 'Другой']
 MAX_ORDERS_PER_DAY = 10
 MAX_TEXT_LENGTH = 500
@@ -26,7 +46,36 @@ SESSION_TIMEOUT = 6 * 60 * 60
 
 user_states: Dict[int, Dict[str, Any]] = {}
 admin_sessions: Dict[int, int] = {}
-request_counts: Dict[int, list] = defaultdict(list)
+message_limiter = create_limiter('messages', MAX_REQUESTS_PER_MINUTE, 60)
+
+# Таблицы маршрутов: обработчики регистрируются декораторами рядом со своим кодом
+callback_router = Router('callback')
+admin_router = Router('admin')
+command_router = Router('command')
+step_router = Router('step')
+
+UPDATES = metrics.counter('bot_updates_total', 'Обновления Telegram по типу', ('type',))
+UPDATE_DURATION = metrics.histogram('bot_update_duration_seconds', 'Время обработки вебхука', ('type',))
+RATE_LIMITED = metrics.counter('bot_rate_limited_total', 'Сообщения, отклонённые ограничителем частоты')
+metrics.gauge('bot_security_log_queue_depth', 'События безопасности в буфере, ещё не записанные в БД',
+              callback=security_log.buffered_count)
+metrics.counter('bot_cache_requests_total', 'Обращения к кэшам процесса', ('cache', 'result'),
+                callback=lambda: {
+                    ('user_data', 'hit'): user_cache.hits,
+                    ('user_data', 'miss'): user_cache.misses,
+                    ('admin_permissions', 'hit'): permissions.cache_stats()['hits'],
+                    ('admin_permissions', 'miss'): permissions.cache_stats()['misses'],
+                })
+metrics.gauge('bot_cache_hit_ratio', 'Доля попаданий в кэши процесса', ('cache',),
+              callback=lambda: {
+                  'user_data': _hit_ratio(user_cache.hits, user_cache.misses),
+                  'admin_permissions': _hit_ratio(permissions.cache_stats()['hits'], permissions.cache_stats()['misses']),
+              })
+metrics.gauge('bot_cache_entries', 'Записей в кэшах процесса', ('cache',),
+              callback=lambda: {
+                  'user_data': len(user_cache.entries),
+                  'admin_permissions': permissions.cache_stats()['entries'],
+              })
 
 BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 BASE_URL = f"https://api.telegram.org/bot{BOT_TOKEN}"
@@ -37,15 +86,15 @@ PDF_FUNCTION_URL = 'https://functions.poehali.dev/a68807d2-57ae-4e99-b9e2-44b1dc
 def is_telegram_request(ip: str) -> bool:
     return True
 
+def _hit_ratio(hits: int, misses: int) -> float:
+    total = hits + misses
+    return hits / total if total else 0.0
+
 def is_rate_limited(chat_id: int) -> bool:
-    now = time.time()
-    requests_list = request_counts[chat_id]
-    requests_list = [req for req in requests_list if now - req < 60]
-    request_counts[chat_id] = requests_list
-    if len(requests_list) >= MAX_REQUESTS_PER_MINUTE:
-        return True
-    requests_list.append(now)
-    return False
+    limited = message_limiter.is_limited(chat_id)
+    if limited:
+        RATE_LIMITED.inc()
+    return limited
 
 def validate_text_length(text: str, max_length: int = MAX_TEXT_LENGTH) -> bool:
     return len(text) <= max_length
@@ -63,65 +112,12 @@ def check_admin_session(chat_id: int) -> bool:
 def create_admin_session(chat_id: int):
     admin_sessions[chat_id] = int(time.time())
 
-def normalize_warehouse(warehouse: str) -> str:
-    if not warehouse:
-        return ''
-    normalized = warehouse.lower().strip()
-    normalized = ' '.join(normalized.split())
-    replacements = {'коледино': 'каледино', 'электросталь': 'електросталь', 'подольск': 'падольск', 'щелково': 'щолково', 'чехов': 'чихов', 'е': 'е', 'ё': 'е'}
-    for wrong, correct in replacements.items():
-        normalized = normalized.replace(wrong, correct)
-    normalized = ''.join(c for c in normalized if c.isalnum() or c.isspace())
-    return normalized
-
-def normalize_city(city: str) -> str:
-    if not city:
-        return ''
-    normalized = city.lower().strip()
-    normalized = normalized.replace('г.', '').replace('город', '').strip()
-    normalized = ' '.join(normalized.split())
-    replacements = {
-        'москва': 'москва',
-        'санкт-петербург': 'санктпетербург',
-        'санкт петербург': 'санктпетербург',
-        'спб': 'санктпетербург',
-        'питер': 'санктпетербург',
-        'петербург': 'санктпетербург',
-        'нижний новгород': 'нижнийновгород',
-        'н новгород': 'нижнийновгород',
-        'екатеринбург': 'екатеринбург',
-        'самара': 'самара',
-        'казань': 'казань',
-        'ростов-на-дону': 'ростовнадону',
-        'ростов': 'ростовнадону',
-        'е': 'е',
-        'ё': 'е'
-    }
-    for wrong, correct in replacements.items():
-        if normalized == wrong or normalized.startswith(wrong + ' '):
-            normalized = correct
-            break
-    normalized = ''.join(c for c in normalized if c.isalnum())
-    return normalized
-
 def log_security_event(chat_id: int, event_type: str, details: str, severity: str = 'medium'):
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        with conn.cursor() as cur:
-            event_type_escaped = event_type.replace("'", "''")
-            details_escaped = details.replace("'", "''")
-            severity_escaped = severity.replace("'", "''")
-            query = f"INSERT INTO t_p52349012_telegram_bot_creatio.security_logs (chat_id, event_type, details, severity) VALUES ({chat_id}, '{event_type_escaped}', '{details_escaped}', '{severity_escaped}')"
-            cur.execute(query)
-            conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"[ERROR] log_security_event: {str(e)}")
-        pass
+    security_log.log_event(chat_id, event_type, details, severity)
 
 def auto_block_user(chat_id: int, reason: str):
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = db.open_connection()
         with conn.cursor() as cur:
             reason_escaped = reason.replace("'", "''")
             query1 = f"INSERT INTO t_p52349012_telegram_bot_creatio.auto_blocked_users (chat_id, reason) VALUES ({chat_id}, '{reason_escaped}') ON CONFLICT (chat_id) DO UPDATE SET reason = '{reason_escaped}', blocked_at = CURRENT_TIMESTAMP"
@@ -136,21 +132,14 @@ def auto_block_user(chat_id: int, reason: str):
         pass
 
 def is_user_blocked(chat_id: int) -> bool:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
     try:
-        with conn.cursor() as cur:
-            query = f"SELECT chat_id FROM t_p52349012_telegram_bot_creatio.blocked_users WHERE chat_id = {chat_id}"
-            cur.execute(query)
-            result = cur.fetchone() is not None
-        return result
+        return db.execute('is_user_blocked', (chat_id,), fetch='one') is not None
     except Exception as e:
         print(f"[ERROR] is_user_blocked: {str(e)}")
         return False
-    finally:
-        conn.close()
 
 def get_blocked_users() -> List[str]:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
             cur.execute("SELECT chat_id FROM t_p52349012_telegram_bot_creatio.blocked_users")
@@ -161,68 +150,30 @@ def get_blocked_users() -> List[str]:
         conn.close()
 
 def get_user_daily_limit(chat_id: int) -> int:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
     try:
-        with conn.cursor() as cur:
-            query = f"SELECT daily_order_limit FROM t_p52349012_telegram_bot_creatio.user_limits WHERE chat_id = {chat_id}"
-            cur.execute(query)
-            result = cur.fetchone()
-            return result[0] if result else MAX_ORDERS_PER_DAY
+        result = db.execute('user_daily_limit', (chat_id,), fetch='one')
+        return result[0] if result else MAX_ORDERS_PER_DAY
     except Exception as e:
         print(f"[ERROR] get_user_daily_limit: {str(e)}")
         return MAX_ORDERS_PER_DAY
-    finally:
-        conn.close()
 
 def get_user_orders_today(chat_id: int) -> int:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
     try:
-        with conn.cursor() as cur:
-            query = f"SELECT COUNT(*) FROM (SELECT id FROM t_p52349012_telegram_bot_creatio.sender_orders WHERE chat_id = {chat_id} AND created_at::date = CURRENT_DATE UNION ALL SELECT id FROM t_p52349012_telegram_bot_creatio.carrier_orders WHERE chat_id = {chat_id} AND created_at::date = CURRENT_DATE) AS combined"
-            cur.execute(query)
-            return cur.fetchone()[0]
+        return db.execute('user_orders_today', (chat_id, chat_id), fetch='one')[0]
     except Exception as e:
         print(f"[ERROR] get_user_orders_today: {str(e)}")
         return 0
-    finally:
-        conn.close()
-
-def get_admin_permissions(chat_id: int) -> Optional[Dict[str, bool]]:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT ba.role, ap.* 
-                FROM t_p52349012_telegram_bot_creatio.bot_admins ba 
-                LEFT JOIN t_p52349012_telegram_bot_creatio.admin_permissions ap 
-                ON ba.id = ap.admin_id 
-                WHERE ba.chat_id = %s AND ba.is_active = true
-            """, (chat_id,))
-            result = cur.fetchone()
-            if not result:
-                print(f"[DEBUG] get_admin_permissions: No admin found for chat_id={chat_id}")
-                return None
-            role = result.get('role', 'viewer')
-            print(f"[DEBUG] get_admin_permissions: Found admin chat_id={chat_id}, role={role}")
-            if role == 'owner':
-                return {'role': 'owner', 'can_view_stats': True, 'can_view_orders': True, 'can_remove_orders': True, 'can_manage_users': True, 'can_block_users': True, 'can_manage_admins': True, 'can_view_security_logs': True}
-            return {'role': role, 'can_view_stats': result.get('can_view_stats', True), 'can_view_orders': result.get('can_view_orders', True), 'can_remove_orders': result.get('can_remove_orders', False), 'can_manage_users': result.get('can_manage_users', False), 'can_block_users': result.get('can_block_users', False), 'can_manage_admins': result.get('can_manage_admins', False), 'can_view_security_logs': result.get('can_view_security_logs', False)}
-    except Exception as e:
-        print(f"[ERROR] get_admin_permissions: {str(e)}")
-        return None
-    finally:
-        conn.close()
 
 def is_admin(chat_id: int) -> bool:
     return get_admin_permissions(chat_id) is not None
 
 def check_suspicious_activity(chat_id: int) -> bool:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
-            query1 = f"SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.security_logs WHERE chat_id = {chat_id} AND created_at > NOW() - INTERVAL '1 hour'"
+            query1 = f"SELECT COALESCE(SUM(event_count), 0) FROM t_p52349012_telegram_bot_creatio.security_logs WHERE chat_id = {chat_id} AND created_at > NOW() - INTERVAL '1 hour'"
             cur.execute(query1)
-            events_last_hour = cur.fetchone()[0]
+            events_last_hour = cur.fetchone()[0] + security_log.pending_count(chat_id)
             if events_last_hour > 50:
                 return True
             query2 = f"SELECT COUNT(*) FROM (SELECT id FROM t_p52349012_telegram_bot_creatio.sender_orders WHERE chat_id = {chat_id} AND created_at::date = CURRENT_DATE UNION ALL SELECT id FROM t_p52349012_telegram_bot_creatio.carrier_orders WHERE chat_id = {chat_id} AND created_at::date = CURRENT_DATE) AS combined"
@@ -239,12 +190,18 @@ def check_suspicious_activity(chat_id: int) -> bool:
         conn.close()
 
 def get_user_templates(chat_id: int) -> List[Dict[str, Any]]:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    """Шаблоны пользователя (из кэша, если уже читались). Результат не изменять"""
+    cached = user_cache.get('templates', chat_id)
+    if not is_miss(cached):
+        return cached
+    conn = db.open_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             query = f"SELECT id, template_name, order_type, template_data, created_at FROM t_p52349012_telegram_bot_creatio.order_templates WHERE chat_id = {chat_id} ORDER BY created_at DESC"
             cur.execute(query)
-            return [dict(row) for row in cur.fetchall()]
+            templates = [dict(row) for row in cur.fetchall()]
+            user_cache.put('templates', chat_id, templates)
+            return templates
     except Exception as e:
         print(f"[ERROR] get_user_templates: {str(e)}")
         return []
@@ -252,15 +209,24 @@ def get_user_templates(chat_id: int) -> List[Dict[str, Any]]:
         conn.close()
 
 def save_template(chat_id: int, template_name: str, order_type: str, data: Dict[str, Any]) -> bool:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
             template_name_escaped = template_name.replace("'", "''")
             order_type_escaped = order_type.replace("'", "''")
             data_json = json.dumps(data).replace("'", "''")
-            query = f"INSERT INTO t_p52349012_telegram_bot_creatio.order_templates (chat_id, template_name, order_type, template_data) VALUES ({chat_id}, '{template_name_escaped}', '{order_type_escaped}', '{data_json}') ON CONFLICT (chat_id, template_name) DO UPDATE SET order_type = EXCLUDED.order_type, template_data = EXCLUDED.template_data"
+            query = f"INSERT INTO t_p52349012_telegram_bot_creatio.order_templates (chat_id, template_name, order_type, template_data) VALUES ({chat_id}, '{template_name_escaped}', '{order_type_escaped}', '{data_json}') ON CONFLICT (chat_id, template_name) DO UPDATE SET order_type = EXCLUDED.order_type, template_data = EXCLUDED.template_data RETURNING id, template_name, order_type, template_data, created_at"
             cur.execute(query)
+            saved = cur.fetchone()
             conn.commit()
+            
+            cached = user_cache.get('templates', chat_id)
+            if not is_miss(cached):
+                saved = {'id': saved[0], 'template_name': saved[1], 'order_type': saved[2], 'template_data': saved[3], 'created_at': saved[4]}
+                templates = [t for t in cached if t['id'] != saved['id']]
+                position = next((i for i, t in enumerate(cached) if t['id'] == saved['id']), 0)
+                templates.insert(position, saved)
+                user_cache.put('templates', chat_id, templates)
             return True
     except Exception as e:
         print(f"[ERROR] save_template failed: {str(e)}")
@@ -270,7 +236,7 @@ def save_template(chat_id: int, template_name: str, order_type: str, data: Dict[
         conn.close()
 
 def delete_template(chat_id: int, template_id: int) -> bool:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
             query = f"DELETE FROM t_p52349012_telegram_bot_creatio.order_templates WHERE id = {template_id} AND chat_id = {chat_id}"
@@ -285,7 +251,10 @@ def delete_template(chat_id: int, template_id: int) -> bool:
         conn.close()
 
 def get_template_by_id(template_id: int, chat_id: int) -> Optional[Dict[str, Any]]:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cached = user_cache.get('templates', chat_id)
+    if not is_miss(cached):
+        return next((dict(t) for t in cached if t['id'] == template_id), None)
+    conn = db.open_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             query = f"SELECT id, template_name, order_type, template_data, created_at FROM t_p52349012_telegram_bot_creatio.order_templates WHERE id = {template_id} AND chat_id = {chat_id}"
@@ -300,13 +269,18 @@ def get_template_by_id(template_id: int, chat_id: int) -> Optional[Dict[str, Any
 
 def get_user_defaults(chat_id: int) -> Optional[Dict[str, Any]]:
     """Получить последние значения пользователя для умных дефолтов"""
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cached = user_cache.get('defaults', chat_id)
+    if not is_miss(cached):
+        return cached
+    conn = db.open_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             query = f"SELECT * FROM t_p52349012_telegram_bot_creatio.user_defaults WHERE chat_id = {chat_id}"
             cur.execute(query)
             result = cur.fetchone()
-            return dict(result) if result else None
+            defaults = dict(result) if result else None
+            user_cache.put('defaults', chat_id, defaults)
+            return defaults
     except Exception as e:
         print(f"[ERROR] get_user_defaults failed: {str(e)}")
         return None
@@ -315,75 +289,46 @@ def get_user_defaults(chat_id: int) -> Optional[Dict[str, Any]]:
 
 def save_user_defaults(chat_id: int, data: Dict[str, Any], order_type: str):
     """Сохранить последние значения пользователя для умных дефолтов"""
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
     try:
-        with conn.cursor() as cur:
-            # Подготавливаем данные для вставки
-            marketplace = data.get('marketplace', '').replace("'", "''")
-            warehouse = data.get('warehouse', '').replace("'", "''")
-            phone = data.get('phone', '').replace("'", "''")
-            
+        if order_type == 'sender':
+            db.execute('upsert_sender_defaults', (
+                chat_id, data.get('marketplace', ''), data.get('warehouse', ''), data.get('phone', ''),
+                data.get('sender_name', ''), data.get('loading_city', ''), data.get('loading_address', '')
+            ))
+        else:  # carrier
+            db.execute('upsert_carrier_defaults', (
+                chat_id, data.get('marketplace', ''), data.get('warehouse', ''), data.get('phone', ''),
+                data.get('driver_name', ''), data.get('car_model', ''), data.get('license_plate', ''),
+                data.get('loading_city', ''), data.get('hydroboard', '')
+            ))
+        print(f"[DEBUG] Saved user defaults for chat_id={chat_id}, order_type={order_type}")
+        
+        cached = user_cache.get('defaults', chat_id)
+        if not is_miss(cached):
+            defaults = dict(cached or {'chat_id': chat_id})
+            defaults.update({
+                'last_marketplace': data.get('marketplace', ''),
+                'last_warehouse': data.get('warehouse', ''),
+                'last_phone': data.get('phone', ''),
+                'last_order_type': order_type,
+            })
             if order_type == 'sender':
-                sender_name = data.get('sender_name', '').replace("'", "''")
-                loading_city = data.get('loading_city', '').replace("'", "''")
-                loading_address = data.get('loading_address', '').replace("'", "''")
-                
-                query = f"""
-                    INSERT INTO t_p52349012_telegram_bot_creatio.user_defaults 
-                    (chat_id, last_marketplace, last_warehouse, last_phone, 
-                     last_sender_name, last_loading_city, last_loading_address, 
-                     last_order_type, updated_at)
-                    VALUES ({chat_id}, '{marketplace}', '{warehouse}', '{phone}', 
-                            '{sender_name}', '{loading_city}', '{loading_address}', 
-                            'sender', CURRENT_TIMESTAMP)
-                    ON CONFLICT (chat_id) DO UPDATE SET
-                        last_marketplace = EXCLUDED.last_marketplace,
-                        last_warehouse = EXCLUDED.last_warehouse,
-                        last_phone = EXCLUDED.last_phone,
-                        last_sender_name = EXCLUDED.last_sender_name,
-                        last_loading_city = EXCLUDED.last_loading_city,
-                        last_loading_address = EXCLUDED.last_loading_address,
-                        last_order_type = 'sender',
-                        updated_at = CURRENT_TIMESTAMP
-                """
-            else:  # carrier
-                driver_name = data.get('driver_name', '').replace("'", "''")
-                car_model = data.get('car_model', '').replace("'", "''")
-                license_plate = data.get('license_plate', '').replace("'", "''")
-                loading_city_carrier = data.get('loading_city', '').replace("'", "''")
-                hydroboard = data.get('hydroboard', '').replace("'", "''")
-                
-                query = f"""
-                    INSERT INTO t_p52349012_telegram_bot_creatio.user_defaults 
-                    (chat_id, last_marketplace, last_warehouse, last_phone, 
-                     last_driver_name, last_car_model, last_license_plate, 
-                     last_loading_city_carrier, last_hydroboard, 
-                     last_order_type, updated_at)
-                    VALUES ({chat_id}, '{marketplace}', '{warehouse}', '{phone}', 
-                            '{driver_name}', '{car_model}', '{license_plate}', 
-                            '{loading_city_carrier}', '{hydroboard}', 
-                            'carrier', CURRENT_TIMESTAMP)
-                    ON CONFLICT (chat_id) DO UPDATE SET
-                        last_marketplace = EXCLUDED.last_marketplace,
-                        last_warehouse = EXCLUDED.last_warehouse,
-                        last_phone = EXCLUDED.last_phone,
-                        last_driver_name = EXCLUDED.last_driver_name,
-                        last_car_model = EXCLUDED.last_car_model,
-                        last_license_plate = EXCLUDED.last_license_plate,
-                        last_loading_city_carrier = EXCLUDED.last_loading_city_carrier,
-                        last_hydroboard = EXCLUDED.last_hydroboard,
-                        last_order_type = 'carrier',
-                        updated_at = CURRENT_TIMESTAMP
-                """
-            
-            cur.execute(query)
-            conn.commit()
-            print(f"[DEBUG] Saved user defaults for chat_id={chat_id}, order_type={order_type}")
+                defaults.update({
+                    'last_sender_name': data.get('sender_name', ''),
+                    'last_loading_city': data.get('loading_city', ''),
+                    'last_loading_address': data.get('loading_address', ''),
+                })
+            else:
+                defaults.update({
+                    'last_driver_name': data.get('driver_name', ''),
+                    'last_car_model': data.get('car_model', ''),
+                    'last_license_plate': data.get('license_plate', ''),
+                    'last_loading_city_carrier': data.get('loading_city', ''),
+                    'last_hydroboard': data.get('hydroboard', ''),
+                })
+            user_cache.put('defaults', chat_id, defaults)
     except Exception as e:
         print(f"[ERROR] save_user_defaults failed: {str(e)}")
-        conn.rollback()
-    finally:
-        conn.close()
 
 def send_message(chat_id: int, text: str, reply_markup: Optional[Dict] = None):
     """Отправить сообщение через Telegram Bot API"""
@@ -397,7 +342,7 @@ def send_message(chat_id: int, text: str, reply_markup: Optional[Dict] = None):
         data['reply_markup'] = json.dumps(reply_markup)
     
     try:
-        response = requests.post(url, json=data, timeout=10)
+        response = telegram_client.post(url, json=data, timeout=10)
         return response.json()
     except Exception as e:
         print(f"[ERROR] send_message failed: {str(e)}")
@@ -417,7 +362,7 @@ def edit_message(chat_id: int, message_id: int, text: str, reply_markup: Optiona
         data['reply_markup'] = json.dumps(reply_markup)
     
     try:
-        response = requests.post(url, json=data, timeout=10)
+        response = telegram_client.post(url, json=data, timeout=10)
         return response.json()
     except Exception as e:
         print(f"[ERROR] edit_message failed: {str(e)}")
@@ -433,7 +378,7 @@ def delete_message(chat_id: int, message_id: int):
     }
     
     try:
-        response = requests.post(url, json=data, timeout=10)
+        response = telegram_client.post(url, json=data, timeout=10)
         return response.json()
     except Exception as e:
         print(f"[ERROR] delete_message failed: {str(e)}")
@@ -451,7 +396,7 @@ def answer_callback_query(callback_query_id: str, text: Optional[str] = None, sh
         data['text'] = text
     
     try:
-        response = requests.post(url, json=data, timeout=10)
+        response = telegram_client.post(url, json=data, timeout=10)
         return response.json()
     except Exception as e:
         print(f"[ERROR] answer_callback_query failed: {str(e)}")
@@ -468,7 +413,7 @@ def send_document(chat_id: int, document_bytes: bytes, filename: str, caption: s
         'parse_mode': 'HTML'
     }
     try:
-        requests.post(url, data=data, files=files, timeout=10)
+        telegram_client.post(url, data=data, files=files, timeout=10)
     except Exception as e:
         print(f"[ERROR] send_document failed: {str(e)}")
 
@@ -478,7 +423,7 @@ def send_label_to_user(chat_id: int, order_id: int, order_type: str, label_size:
     try:
         import base64
         
-        response = requests.post(
+        response = telegram_client.post(
             PDF_FUNCTION_URL,
             json={
                 'order_id': order_id,
@@ -577,7 +522,7 @@ def notify_admin_about_block(chat_id: int, reason: str):
 
 def load_template(template_id: int, chat_id: int) -> Optional[Dict[str, Any]]:
     """Загрузить шаблон по ID"""
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
@@ -596,7 +541,7 @@ def load_template(template_id: int, chat_id: int) -> Optional[Dict[str, Any]]:
 
 def delete_template(chat_id: int, template_id: int) -> bool:
     """Удалить шаблон по ID"""
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
@@ -604,6 +549,10 @@ def delete_template(chat_id: int, template_id: int) -> bool:
                 (template_id, chat_id)
             )
             conn.commit()
+            
+            cached = user_cache.get('templates', chat_id)
+            if not is_miss(cached):
+                user_cache.put('templates', chat_id, [t for t in cached if t['id'] != template_id])
             return cur.rowcount > 0
     except Exception as e:
         print(f"[ERROR] delete_template failed: {str(e)}")
@@ -614,14 +563,18 @@ def delete_template(chat_id: int, template_id: int) -> bool:
 
 def delete_user_data(chat_id: int):
     """Удалить все персональные данные пользователя (GDPR)"""
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM t_p52349012_telegram_bot_creatio.sender_orders WHERE chat_id = %s", (chat_id,))
             cur.execute("DELETE FROM t_p52349012_telegram_bot_creatio.carrier_orders WHERE chat_id = %s", (chat_id,))
             cur.execute("DELETE FROM t_p52349012_telegram_bot_creatio.order_templates WHERE chat_id = %s", (chat_id,))
             cur.execute("DELETE FROM t_p52349012_telegram_bot_creatio.user_subscriptions WHERE chat_id = %s", (chat_id,))
+            cur.execute("DELETE FROM t_p52349012_telegram_bot_creatio.subscription_digest_items WHERE chat_id = %s", (chat_id,))
+            cur.execute("DELETE FROM t_p52349012_telegram_bot_creatio.sent_notifications WHERE chat_id = %s", (chat_id,))
             conn.commit()
+            user_cache.invalidate(chat_id)
+            subscriptions.invalidate()
             log_security_event(chat_id, 'data_deletion', 'Пользователь удалил свои персональные данные', 'medium')
     except Exception as e:
         print(f"[ERROR] delete_user_data failed: {str(e)}")
@@ -699,7 +652,8 @@ def send_message(chat_id: int, text: str, reply_markup: Optional[Dict] = None):
     if reply_markup:
         payload['reply_markup'] = json.dumps(reply_markup)
     
-    requests.post(f"{BASE_URL}/sendMessage", json=payload, timeout=10)
+    # Ответ нужен рассылкам: по коду fanout отличает временную ошибку от отказа Telegram
+    return telegram_client.post(f"{BASE_URL}/sendMessage", json=payload, timeout=10)
 
 
 def send_photo(chat_id: int, photo_url: str, caption: str = ''):
@@ -709,7 +663,7 @@ def send_photo(chat_id: int, photo_url: str, caption: str = ''):
         'caption': caption,
         'parse_mode': 'HTML'
     }
-    requests.post(f"{BASE_URL}/sendPhoto", json=payload, timeout=10)
+    telegram_client.post(f"{BASE_URL}/sendPhoto", json=payload, timeout=10)
 
 
 def send_document(chat_id: int, file_bytes: bytes, filename: str, caption: str = ''):
@@ -719,12 +673,12 @@ def send_document(chat_id: int, file_bytes: bytes, filename: str, caption: str =
         'caption': caption,
         'parse_mode': 'HTML'
     }
-    requests.post(f"{BASE_URL}/sendDocument", files=files, data=data, timeout=10)
+    telegram_client.post(f"{BASE_URL}/sendDocument", files=files, data=data, timeout=10)
 
 
 def send_label_to_user(chat_id: int, order_id: int, order_type: str, label_size: str):
     try:
-        response = requests.post(
+        response = telegram_client.post(
             PDF_FUNCTION_URL,
             json={'order_id': order_id, 'order_type': order_type, 'label_size': label_size},
             headers={'Content-Type': 'application/json'},
@@ -762,7 +716,7 @@ def edit_message(chat_id: int, message_id: int, text: str, reply_markup: Optiona
     if reply_markup:
         payload['reply_markup'] = json.dumps(reply_markup)
     
-    requests.post(f"{BASE_URL}/editMessageText", json=payload, timeout=10)
+    telegram_client.post(f"{BASE_URL}/editMessageText", json=payload, timeout=10)
 
 
 def delete_message(chat_id: int, message_id: int):
@@ -770,7 +724,7 @@ def delete_message(chat_id: int, message_id: int):
         'chat_id': chat_id,
         'message_id': message_id
     }
-    requests.post(f"{BASE_URL}/deleteMessage", json=payload, timeout=10)
+    telegram_client.post(f"{BASE_URL}/deleteMessage", json=payload, timeout=10)
 
 
 def process_callback(chat_id: int, callback_data: str, message_id: int):
@@ -780,6 +734,7 @@ def process_callback(chat_id: int, callback_data: str, message_id: int):
     # Пропускаем проверку сессии для админских команд
     is_admin_action = (
         callback_data.startswith('admin_') or 
+        callback_data.startswith('digest_mode_') or
         callback_data in ['show_terms', 'show_privacy']
     )
     
@@ -805,379 +760,452 @@ def process_callback(chat_id: int, callback_data: str, message_id: int):
         state['last_activity'] = time.time()
         data = state.get('data', {})
     
-    if callback_data.startswith('set_role_'):
-        role = callback_data.replace('set_role_', '')
-        target_admin_id = state.get('target_admin_id')
-        
-        if not target_admin_id:
-            send_message(chat_id, "❌ Ошибка: ID пользователя не найден")
-            return
-        
-        role_permissions = {
-            'admin': {
-                'can_view_stats': True,
-                'can_view_orders': True,
-                'can_remove_orders': True,
-                'can_manage_users': True,
-                'can_block_users': True,
-                'can_manage_admins': False,
-                'can_view_security_logs': True
-            },
-            'moderator': {
-                'can_view_stats': True,
-                'can_view_orders': True,
-                'can_remove_orders': True,
-                'can_manage_users': False,
-                'can_block_users': True,
-                'can_manage_admins': False,
-                'can_view_security_logs': False
-            },
-            'viewer': {
-                'can_view_stats': True,
-                'can_view_orders': True,
-                'can_remove_orders': False,
-                'can_manage_users': False,
-                'can_block_users': False,
-                'can_manage_admins': False,
-                'can_view_security_logs': False
-            }
-        }
-        
-        perms = role_permissions.get(role, role_permissions['viewer'])
-        
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO t_p52349012_telegram_bot_creatio.bot_admins (chat_id, username, role, is_active) VALUES (%s, %s, %s, true) RETURNING id",
-                    (target_admin_id, f"user_{target_admin_id}", role)
-                )
-                admin_id = cur.fetchone()[0]
-                
-                cur.execute(
-                    """
-                    INSERT INTO t_p52349012_telegram_bot_creatio.admin_permissions 
-                    (admin_id, can_view_stats, can_view_orders, can_remove_orders, can_manage_users, can_block_users, can_manage_admins, can_view_security_logs, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                    """,
-                    (admin_id, perms['can_view_stats'], perms['can_view_orders'], perms['can_remove_orders'], perms['can_manage_users'], perms['can_block_users'], perms['can_manage_admins'], perms['can_view_security_logs'])
-                )
-                
-                conn.commit()
-                
-                role_names = {'admin': '⚡️ Администратор', 'moderator': '🛡 Модератор', 'viewer': '👁 Наблюдатель'}
-                send_message(
-                    chat_id,
-                    f"✅ <b>Администратор добавлен!</b>\n\n"
-                    f"Chat ID: <code>{target_admin_id}</code>\n"
-                    f"Роль: {role_names.get(role, role)}\n\n"
-                    f"Пользователь может использовать команду /admin для входа в админ-панель."
-                )
-                
-                log_security_event(chat_id, 'admin_added', f'Добавлен новый админ {target_admin_id} с ролью {role}', 'high')
-        finally:
-            conn.close()
-        
-        if 'target_admin_id' in state:
-            del state['target_admin_id']
-        if 'step' in state:
-            del state['step']
-        
-        return
-    
-    elif callback_data == 'cancel_add_admin':
-        if 'target_admin_id' in state:
-            del state['target_admin_id']
-        if 'step' in state:
-            del state['step']
-        send_message(chat_id, "❌ Добавление администратора отменено")
-        return
+    callback_router.dispatch(callback_data, chat_id, message_id, state, data)
+
+
+@callback_router.route('set_role_{role}')
+def callback_set_role(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any], role: str):
+    target_admin_id = state.get('target_admin_id')
     
-    elif callback_data == 'cancel_create':
-        if chat_id in user_states:
-            del user_states[chat_id]
-        send_message(
-            chat_id,
-            "❌ Создание заявки отменено. Введите /start для начала",
-            {'remove_keyboard': True}
-        )
+    if not target_admin_id:
+        send_message(chat_id, "❌ Ошибка: ID пользователя не найден")
         return
     
-    elif callback_data.startswith('view_template_'):
-        template_id = int(callback_data.replace('view_template_', ''))
-        template = get_template_by_id(template_id, chat_id)
-        
-        if not template:
-            send_message(chat_id, "❌ Шаблон не найден")
-            return
-        
-        template_data = json.loads(template['template_data']) if isinstance(template['template_data'], str) else template['template_data']
-        template_type = template['template_type']
-        template_name = template['template_name']
-        
-        preview_text = f"📋 <b>Шаблон: {template_name}</b>\n\n"
-        preview_text += f"📦 <b>Тип:</b> {'Отправитель' if template_type == 'sender' else 'Перевозчик'}\n\n"
-        
-        if template_type == 'sender':
-            preview_text += f"🏪 <b>Маркетплейс:</b> {template_data.get('marketplace', 'Не указан')}\n"
-            preview_text += f"📍 <b>Склад:</b> {template_data.get('warehouse', 'Не указан')}\n"
-            preview_text += f"📦 <b>Паллеты:</b> {template_data.get('pallet_quantity', 0)}\n"
-            preview_text += f"📦 <b>Коробки:</b> {template_data.get('box_quantity', 0)}\n"
-        else:
-            preview_text += f"🏪 <b>Маркетплейс:</b> {template_data.get('marketplace', 'Не указан')}\n"
-            preview_text += f"📍 <b>Склад:</b> {template_data.get('warehouse', 'Не указан')}\n"
-            preview_text += f"🚗 <b>Авто:</b> {template_data.get('car_brand', '')} {template_data.get('car_model', '')}\n"
-            preview_text += f"📦 <b>Вместимость паллет:</b> {template_data.get('pallet_capacity', 0)}\n"
-        
-        keyboard = {
-            'inline_keyboard': [
-                [{'text': '✅ Использовать', 'callback_data': f'use_template_{template_id}'}],
-                [{'text': '🗑 Удалить', 'callback_data': f'delete_template_{template_id}'}],
-                [{'text': '⬅️ Назад к шаблонам', 'callback_data': 'back_to_templates'}]
-            ]
+    role_permissions = {
+        'admin': {
+            'can_view_stats': True,
+            'can_view_orders': True,
+            'can_remove_orders': True,
+            'can_manage_users': True,
+            'can_block_users': True,
+            'can_manage_admins': False,
+            'can_view_security_logs': True
+        },
+        'moderator': {
+            'can_view_stats': True,
+            'can_view_orders': True,
+            'can_remove_orders': True,
+            'can_manage_users': False,
+            'can_block_users': True,
+            'can_manage_admins': False,
+            'can_view_security_logs': False
+        },
+        'viewer': {
+            'can_view_stats': True,
+            'can_view_orders': True,
+            'can_remove_orders': False,
+            'can_manage_users': False,
+            'can_block_users': False,
+            'can_manage_admins': False,
+            'can_view_security_logs': False
         }
-        
-        edit_message(chat_id, message_id, preview_text, keyboard)
-        return
-    
-    elif callback_data == 'back_to_templates':
-        show_templates_management(chat_id)
-        return
-    
-    elif callback_data.startswith('use_template_'):
-        template_id = int(callback_data.replace('use_template_', ''))
-        template = get_template_by_id(template_id, chat_id)
-        
-        if not template:
-            send_message(chat_id, "❌ Шаблон не найден")
-            return
-        
-        template_data = json.loads(template['template_data']) if isinstance(template['template_data'], str) else template['template_data']
-        template_type = template['template_type']
-        
-        data['type'] = template_type
-        for key, value in template_data.items():
-            data[key] = value
-        
-        state['step'] = 'show_preview'
-        show_preview(chat_id, data)
-        return
+    }
     
-    elif callback_data.startswith('delete_template_'):
-        template_id = int(callback_data.replace('delete_template_', ''))
-        if delete_template(chat_id, template_id):
-            delete_message(chat_id, message_id)
-        else:
-            send_message(chat_id, "❌ Ошибка удаления шаблона")
-        return
+    perms = role_permissions.get(role, role_permissions['viewer'])
     
-    if callback_data.startswith('edit_'):
-        field = callback_data.replace('edit_', '')
-        state['editing_field'] = field
-        
-        field_names = {
-            'marketplace': 'маркетплейс',
-            'warehouse': 'склад назначения',
-            'loading_city': 'город погрузки',
-            'loading_address': 'адрес погрузки',
-            'loading_date': 'дату погрузки (ДД.ММ.ГГГГ)',
-            'loading_time': 'время погрузки',
-            'delivery_date': 'дату поставки на склад (ДД.ММ.ГГГГ)',
-            'pallet_quantity': 'количество паллет',
-            'box_quantity': 'количество коробок',
-            'sender_name': 'ФИО отправителя',
-            'phone': 'номер телефона',
-            'car_brand': 'марку автомобиля',
-            'car_model': 'модель автомобиля',
-            'license_plate': 'гос. номер',
-            'pallet_capacity': 'вместимость паллет',
-            'box_capacity': 'вместимость коробок',
-            'driver_name': 'ФИО водителя',
-            'arrival_date': 'дату прибытия на склад (ДД.ММ.ГГГГ)',
-            'rate': 'ставку в рублях',
-            'hydroboard': 'гидроборт'
-        }
-        
-        if field == 'hydroboard':
-            send_message(
-                chat_id,
-                "🚚 <b>Гидроборт</b>",
-                {
-                    'keyboard': [
-                        [{'text': 'Есть'}],
-                        [{'text': 'Нету'}]
-                    ],
-                    'resize_keyboard': True,
-                    'one_time_keyboard': True
-                }
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO t_p52349012_telegram_bot_creatio.bot_admins (chat_id, username, role, is_active) VALUES (%s, %s, %s, true) RETURNING id",
+                (target_admin_id, f"user_{target_admin_id}", role)
             )
-        elif field in ['loading_date', 'arrival_date', 'delivery_date']:
-            today = datetime.now()
-            tomorrow = today + timedelta(days=1)
-            send_message(
-                chat_id,
-                f"✏️ Введите новое значение для <b>{field_names.get(field, field)}</b>:\n\nВыберите из вариантов или введите дату вручную\nФормат: ДД.ММ.ГГГГ",
-                {
-                    'keyboard': [
-                        [{'text': f'🔴 Сегодня ({today.strftime("%d.%m.%Y")})'}],
-                        [{'text': f'🟢 Завтра ({tomorrow.strftime("%d.%m.%Y")})'}]
-                    ],
-                    'resize_keyboard': True,
-                    'one_time_keyboard': True
-                }
+            admin_id = cur.fetchone()[0]
+            
+            cur.execute(
+                """
+                INSERT INTO t_p52349012_telegram_bot_creatio.admin_permissions 
+                (admin_id, can_view_stats, can_view_orders, can_remove_orders, can_manage_users, can_block_users, can_manage_admins, can_view_security_logs, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                """,
+                (admin_id, perms['can_view_stats'], perms['can_view_orders'], perms['can_remove_orders'], perms['can_manage_users'], perms['can_block_users'], perms['can_manage_admins'], perms['can_view_security_logs'])
             )
-        else:
+            
+            conn.commit()
+            invalidate_admin_permissions(target_admin_id)
+            
+            role_names = {'admin': '⚡️ Администратор', 'moderator': '🛡 Модератор', 'viewer': '👁 Наблюдатель'}
             send_message(
                 chat_id,
-                f"✏️ Введите новое значение для <b>{field_names.get(field, field)}</b>:"
+                f"✅ <b>Администратор добавлен!</b>\n\n"
+                f"Chat ID: <code>{target_admin_id}</code>\n"
+                f"Роль: {role_names.get(role, role)}\n\n"
+                f"Пользователь может использовать команду /admin для входа в админ-панель."
             )
+            
+            log_security_event(chat_id, 'admin_added', f'Добавлен новый админ {target_admin_id} с ролью {role}', 'high')
+    finally:
+        conn.close()
     
-    elif callback_data == 'save_as_template':
-        state['step'] = 'enter_template_name'
-        send_message(
-            chat_id,
-            "💾 <b>Сохранение шаблона</b>\n\n"
-            "Введите название для шаблона (от 3 до 50 символов):\n\n"
-            "Например: 'Мой маршрут' или 'Доставка в Москву'",
-            {'remove_keyboard': True}
-        )
-        return
+    if 'target_admin_id' in state:
+        del state['target_admin_id']
+    if 'step' in state:
+        del state['step']
+
+
+@callback_router.route('cancel_add_admin')
+def callback_cancel_add_admin(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any]):
+    if 'target_admin_id' in state:
+        del state['target_admin_id']
+    if 'step' in state:
+        del state['step']
+    send_message(chat_id, "❌ Добавление администратора отменено")
+
+
+@callback_router.route('cancel_create')
+def callback_cancel_create(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any]):
+    if chat_id in user_states:
+        del user_states[chat_id]
+    send_message(
+        chat_id,
+        "❌ Создание заявки отменено. Введите /start для начала",
+        {'remove_keyboard': True}
+    )
+
+
+@callback_router.route('view_template_{template_id:int}')
+def callback_view_template(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any], template_id: int):
+    template = get_template_by_id(template_id, chat_id)
     
-    elif callback_data == 'confirm_create':
-        print(f"[DEBUG] confirm_create pressed by chat_id={chat_id}, type={data.get('type')}")
-        if data.get('type') == 'sender':
-            print("[DEBUG] Calling save_sender_order...")
-            save_sender_order(chat_id, data)
-        else:
-            print("[DEBUG] Calling save_carrier_order...")
-            save_carrier_order(chat_id, data)
-    
-    elif callback_data.startswith('edit_order_'):
-        parts = callback_data.replace('edit_order_', '').split('_')
-        order_type = parts[0]
-        order_id = int(parts[1])
-        load_order_for_edit(chat_id, order_id, order_type)
+    if not template:
+        send_message(chat_id, "❌ Шаблон не найден")
         return
     
-    elif callback_data.startswith('delete_order_'):
-        parts = callback_data.replace('delete_order_', '').split('_')
-        order_type = parts[0]
-        order_id = int(parts[1])
-        delete_user_order(chat_id, order_id, order_type, message_id)
+    template_data = json.loads(template['template_data']) if isinstance(template['template_data'], str) else template['template_data']
+    template_type = template['template_type']
+    template_name = template['template_name']
+    
+    preview_text = f"📋 <b>Шаблон: {template_name}</b>\n\n"
+    preview_text += f"📦 <b>Тип:</b> {'Отправитель' if template_type == 'sender' else 'Перевозчик'}\n\n"
+    
+    if template_type == 'sender':
+        preview_text += f"🏪 <b>Маркетплейс:</b> {template_data.get('marketplace', 'Не указан')}\n"
+        preview_text += f"📍 <b>Склад:</b> {template_data.get('warehouse', 'Не указан')}\n"
+        preview_text += f"📦 <b>Паллеты:</b> {template_data.get('pallet_quantity', 0)}\n"
+        preview_text += f"📦 <b>Коробки:</b> {template_data.get('box_quantity', 0)}\n"
+    else:
+        preview_text += f"🏪 <b>Маркетплейс:</b> {template_data.get('marketplace', 'Не указан')}\n"
+        preview_text += f"📍 <b>Склад:</b> {template_data.get('warehouse', 'Не указан')}\n"
+        preview_text += f"🚗 <b>Авто:</b> {template_data.get('car_brand', '')} {template_data.get('car_model', '')}\n"
+        preview_text += f"📦 <b>Вместимость паллет:</b> {template_data.get('pallet_capacity', 0)}\n"
+    
+    keyboard = {
+        'inline_keyboard': [
+            [{'text': '✅ Использовать', 'callback_data': f'use_template_{template_id}'}],
+            [{'text': '🗑 Удалить', 'callback_data': f'delete_template_{template_id}'}],
+            [{'text': '⬅️ Назад к шаблонам', 'callback_data': 'back_to_templates'}]
+        ]
+    }
+    
+    edit_message(chat_id, message_id, preview_text, keyboard)
+
+
+@callback_router.route('back_to_templates')
+def callback_back_to_templates(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any]):
+    show_templates_management(chat_id)
+
+
+@callback_router.route('use_template_{template_id:int}')
+def callback_use_template(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any], template_id: int):
+    template = get_template_by_id(template_id, chat_id)
+    
+    if not template:
+        send_message(chat_id, "❌ Шаблон не найден")
         return
     
-    elif callback_data.startswith('admin_'):
-        print(f"[DEBUG] Admin callback received: {callback_data} from chat_id={chat_id}")
-        perms = get_admin_permissions(chat_id)
-        print(f"[DEBUG] Admin permissions: {perms}")
-        if not perms:
-            print(f"[DEBUG] No permissions found, sending error message")
-            send_message(chat_id, "❌ У вас нет прав администратора")
-            return
-        
-        if callback_data == 'admin_exit':
-            if chat_id in admin_sessions:
-                del admin_sessions[chat_id]
-            send_message(
-                chat_id,
-                "👋 Вы вышли из админ-панели. Введите /start для возврата к основному меню.",
-                {'remove_keyboard': True}
-            )
-            return
-        
-        admin_sessions[chat_id] = int(time.time())
-        
-        if callback_data == 'admin_stats':
-            show_admin_stats(chat_id)
-        elif callback_data == 'admin_weekly':
-            show_weekly_stats(chat_id)
-        elif callback_data == 'admin_delete':
-            show_all_orders_for_admin(chat_id)
-        elif callback_data == 'admin_cleanup':
-            cleanup_old_orders(chat_id)
-        elif callback_data == 'admin_security_logs':
-            show_security_logs(chat_id)
-        elif callback_data == 'admin_blocked_users':
-            show_blocked_users(chat_id)
-        elif callback_data == 'admin_set_limit':
-            state['admin_action'] = 'set_limit'
-            send_message(chat_id, "📝 Введите Chat ID пользователя и новый лимит через пробел\n\nНапример: 123456789 50")
-        elif callback_data.startswith('admin_del_s_') or callback_data.startswith('admin_del_c_'):
-            try:
-                print(f"[DEBUG] Delete button clicked: {callback_data}")
-                parts = callback_data.split('_')
-                order_type = parts[2]
-                order_id = int(parts[3])
-                user_chat_id = int(parts[4])
-                print(f"[DEBUG] Parsed: order_type={order_type}, order_id={order_id}, user_chat_id={user_chat_id}")
-                confirm_delete_order(chat_id, order_id, order_type, user_chat_id)
-                print(f"[DEBUG] confirm_delete_order completed successfully")
-            except Exception as e:
-                print(f"[ERROR] Failed to process delete button: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                send_message(chat_id, f"❌ Ошибка при удалении: {str(e)}")
-        elif callback_data.startswith('admin_del_one_'):
-            try:
-                print(f"[DEBUG] Confirm delete button clicked: {callback_data}")
-                parts = callback_data.split('_')
-                order_type = parts[3]
-                order_id = int(parts[4])
-                print(f"[DEBUG] Parsed: order_type={order_type}, order_id={order_id}")
-                delete_order_admin(chat_id, order_id, order_type)
-                print(f"[DEBUG] delete_order_admin completed, showing orders list")
-                show_all_orders_for_admin(chat_id)
-                print(f"[DEBUG] show_all_orders_for_admin completed")
-            except Exception as e:
-                print(f"[ERROR] Failed to confirm delete: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                send_message(chat_id, f"❌ Ошибка при удалении: {str(e)}")
-        elif callback_data.startswith('admin_del_all_'):
-            user_chat_id = int(callback_data.split('_')[3])
-            delete_all_user_orders(chat_id, user_chat_id)
-        elif callback_data == 'admin_filter_sender':
-            show_all_orders_for_admin(chat_id, 'sender')
-        elif callback_data == 'admin_filter_carrier':
-            show_all_orders_for_admin(chat_id, 'carrier')
-        elif callback_data == 'admin_filter_all':
-            show_all_orders_for_admin(chat_id, 'all')
-        elif callback_data == 'admin_search_chatid':
-            state = user_states.get(chat_id, {})
-            state['admin_action'] = 'search_chatid'
-            user_states[chat_id] = state
-            send_message(chat_id, "🔍 Введите Chat ID пользователя для поиска его заявок:")
-        elif callback_data == 'admin_exit_to_main':
-            show_admin_panel(chat_id, perms)
-    
-    elif callback_data.startswith('delete_order_'):
-        order_id = int(callback_data.replace('delete_order_', ''))
-        delete_user_order(chat_id, order_id)
-    
-    elif callback_data == 'my_orders':
-        show_my_orders(chat_id)
+    template_data = json.loads(template['template_data']) if isinstance(template['template_data'], str) else template['template_data']
+    template_type = template['template_type']
     
-    elif callback_data == 'cancel_create':
-        if chat_id in user_states:
-            del user_states[chat_id]
+    data['type'] = template_type
+    for key, value in template_data.items():
+        data[key] = value
+    
+    state['step'] = 'show_preview'
+    show_preview(chat_id, data)
+
+
+@callback_router.route('delete_template_{template_id:int}')
+def callback_delete_template(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any], template_id: int):
+    if delete_template(chat_id, template_id):
+        delete_message(chat_id, message_id)
+    else:
+        send_message(chat_id, "❌ Ошибка удаления шаблона")
+
+
+@callback_router.route('edit_{field:rest}')
+def callback_edit_field(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any], field: str):
+    state['editing_field'] = field
+    
+    field_names = {
+        'marketplace': 'маркетплейс',
+        'warehouse': 'склад назначения',
+        'loading_city': 'город погрузки',
+        'loading_address': 'адрес погрузки',
+        'loading_date': 'дату погрузки (ДД.ММ.ГГГГ)',
+        'loading_time': 'время погрузки',
+        'delivery_date': 'дату поставки на склад (ДД.ММ.ГГГГ)',
+        'pallet_quantity': 'количество паллет',
+        'box_quantity': 'количество коробок',
+        'sender_name': 'ФИО отправителя',
+        'phone': 'номер телефона',
+        'car_brand': 'марку автомобиля',
+        'car_model': 'модель автомобиля',
+        'license_plate': 'гос. номер',
+        'pallet_capacity': 'вместимость паллет',
+        'box_capacity': 'вместимость коробок',
+        'driver_name': 'ФИО водителя',
+        'arrival_date': 'дату прибытия на склад (ДД.ММ.ГГГГ)',
+        'rate': 'ставку в рублях',
+        'hydroboard': 'гидроборт'
+    }
+    
+    if field == 'hydroboard':
+        send_message(
+            chat_id,
+            "🚚 <b>Гидроборт</b>",
+            {
+                'keyboard': [
+                    [{'text': 'Есть'}],
+                    [{'text': 'Нету'}]
+                ],
+                'resize_keyboard': True,
+                'one_time_keyboard': True
+            }
+        )
+    elif field in ['loading_date', 'arrival_date', 'delivery_date']:
+        today = datetime.now()
+        tomorrow = today + timedelta(days=1)
+        send_message(
+            chat_id,
+            f"✏️ Введите новое значение для <b>{field_names.get(field, field)}</b>:\n\nВыберите из вариантов или введите дату вручную\nФормат: ДД.ММ.ГГГГ",
+            {
+                'keyboard': [
+                    [{'text': f'🔴 Сегодня ({today.strftime("%d.%m.%Y")})'}],
+                    [{'text': f'🟢 Завтра ({tomorrow.strftime("%d.%m.%Y")})'}]
+                ],
+                'resize_keyboard': True,
+                'one_time_keyboard': True
+            }
+        )
+    else:
         send_message(
             chat_id,
-            "❌ Заявка отменена. Введите /start для начала работы"
+            f"✏️ Введите новое значение для <b>{field_names.get(field, field)}</b>:"
         )
 
 
-def go_back_step(chat_id: int, state: Dict[str, Any], data: Dict[str, Any]):
-    """Возврат на предыдущий шаг"""
-    current_step = state.get('step')
-    user_type = data.get('type')
+@callback_router.route('save_as_template')
+def callback_save_as_template(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any]):
+    state['step'] = 'enter_template_name'
+    send_message(
+        chat_id,
+        "💾 <b>Сохранение шаблона</b>\n\n"
+        "Введите название для шаблона (от 3 до 50 символов):\n\n"
+        "Например: 'Мой маршрут' или 'Доставка в Москву'",
+        {'remove_keyboard': True}
+    )
+
+
+@callback_router.route('confirm_create')
+def callback_confirm_create(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any]):
+    print(f"[DEBUG] confirm_create pressed by chat_id={chat_id}, type={data.get('type')}")
+    if data.get('type') == 'sender':
+        print("[DEBUG] Calling save_sender_order...")
+        save_sender_order(chat_id, data)
+    else:
+        print("[DEBUG] Calling save_carrier_order...")
+        save_carrier_order(chat_id, data)
+
+
+@callback_router.route('edit_order_{order_type}_{order_id:int}')
+def callback_edit_order(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any], order_type: str, order_id: int):
+    load_order_for_edit(chat_id, order_id, order_type)
+
+
+@callback_router.route('delete_order_{order_type}_{order_id:int}')
+def callback_delete_order(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any], order_type: str, order_id: int):
+    delete_user_order(chat_id, order_id, order_type, message_id)
+
+
+@callback_router.route('my_orders')
+def callback_my_orders(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any]):
+    show_my_orders(chat_id)
+
+
+@callback_router.route('my_orders_{order_type}_{direction}_{anchor:int}')
+def callback_my_orders_page(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any], order_type: str, direction: str, anchor: int):
+    if order_type in order_pages.ORDER_TYPES:
+        show_my_orders(chat_id, order_type, direction, anchor, message_id)
+
+
+@callback_router.route('show_terms')
+def callback_show_terms(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any]):
+    send_message(chat_id, TERMS_TEXT)
+
+
+@callback_router.route('show_privacy')
+def callback_show_privacy(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any]):
+    send_message(chat_id, PRIVACY_TEXT)
+
+
+@callback_router.route('digest_mode_{minutes:int}')
+def callback_digest_mode(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any], minutes: int):
+    if minutes not in digest.DIGEST_MODES:
+        return
+    if digest.set_mode(chat_id, minutes):
+        edit_message(chat_id, message_id, f"✅ Уведомления о новых заявках: <b>{digest.mode_label(minutes)}</b>")
+    else:
+        edit_message(chat_id, message_id, "У вас нет подписок на уведомления о заявках")
+
+
+@callback_router.route('admin_{action:rest}')
+def callback_admin(chat_id: int, message_id: int, state: Dict[str, Any], data: Dict[str, Any], action: str):
+    callback_data = f"admin_{action}"
+    print(f"[DEBUG] Admin callback received: {callback_data} from chat_id={chat_id}")
+    perms = get_admin_permissions(chat_id)
+    print(f"[DEBUG] Admin permissions: {perms}")
+    if not perms:
+        print(f"[DEBUG] No permissions found, sending error message")
+        send_message(chat_id, "❌ У вас нет прав администратора")
+        return
     
-    # Маппинг шагов для отправителей
-    sender_back_steps = {
-        'choose_marketplace': ('choose_service', show_main_menu),
-        'sender_warehouse': ('choose_marketplace', lambda cid: send_marketplace_keyboard(cid, 'sender')),
-        'sender_loading_city': ('sender_warehouse', lambda cid: send_message(cid, "📍 <b>Укажите склад назначения</b>\n\nНапример: Электросталь", {
-            'keyboard': [[{'text': '⬅️ Назад'}]], 'resize_keyboard': True, 'one_time_keyboard': False
-        })),
+    if callback_data != 'admin_exit':
+        admin_sessions[chat_id] = int(time.time())
+    admin_router.dispatch(callback_data, chat_id, message_id, state, perms)
+
+
+@admin_router.route('admin_exit')
+def admin_exit(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    if chat_id in admin_sessions:
+        del admin_sessions[chat_id]
+    send_message(
+        chat_id,
+        "👋 Вы вышли из админ-панели. Введите /start для возврата к основному меню.",
+        {'remove_keyboard': True}
+    )
+
+
+@admin_router.route('admin_stats')
+def admin_stats(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    show_admin_stats(chat_id)
+
+
+@admin_router.route('admin_weekly')
+def admin_weekly(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    show_weekly_stats(chat_id)
+
+
+@admin_router.route('admin_delete')
+def admin_delete(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    show_all_orders_for_admin(chat_id, message_id=message_id)
+
+
+@admin_router.route('admin_cleanup')
+def admin_cleanup(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    cleanup_old_orders(chat_id)
+
+
+@admin_router.route('admin_security_logs')
+def admin_security_logs(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    show_security_logs(chat_id)
+
+
+@admin_router.route('admin_blocked_users')
+def admin_blocked_users(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    show_blocked_users(chat_id)
+
+
+@admin_router.route('admin_set_limit')
+def admin_set_limit(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    state['admin_action'] = 'set_limit'
+    send_message(chat_id, "📝 Введите Chat ID пользователя и новый лимит через пробел\n\nНапример: 123456789 50")
+
+
+@admin_router.route('admin_filter_sender')
+def admin_filter_sender(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    show_all_orders_for_admin(chat_id, 'sender', message_id=message_id)
+
+
+@admin_router.route('admin_filter_carrier')
+def admin_filter_carrier(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    show_all_orders_for_admin(chat_id, 'carrier', message_id=message_id)
+
+
+@admin_router.route('admin_filter_all')
+def admin_filter_all(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    show_all_orders_for_admin(chat_id, 'all', message_id=message_id)
+
+
+@admin_router.route('admin_orders_{order_type}_{direction}_{anchor:int}')
+def admin_orders_page(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any], order_type: str, direction: str, anchor: int):
+    if order_type in order_pages.ORDER_TYPES:
+        show_all_orders_for_admin(chat_id, order_type, direction, anchor, message_id)
+
+
+@admin_router.route('admin_user_orders_{user_chat_id:int}_{order_type}_{direction}_{anchor:int}')
+def admin_user_orders_page(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any], user_chat_id: int, order_type: str, direction: str, anchor: int):
+    if order_type in order_pages.ORDER_TYPES:
+        search_orders_by_chatid(chat_id, user_chat_id, order_type, direction, anchor, message_id)
+
+
+@admin_router.route('admin_search_chatid')
+def admin_search_chatid(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    state['admin_action'] = 'search_chatid'
+    send_message(chat_id, "🔍 Введите Chat ID пользователя для поиска его заявок:")
+
+
+@admin_router.route('admin_exit_to_main')
+def admin_exit_to_main(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any]):
+    show_admin_panel(chat_id, perms)
+
+
+@admin_router.route('admin_del_{order_type}_{order_id:int}_{user_chat_id:int}')
+def admin_confirm_delete(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any], order_type: str, order_id: int, user_chat_id: int):
+    try:
+        print(f"[DEBUG] Delete button clicked: admin_del_{order_type}_{order_id}_{user_chat_id}")
+        print(f"[DEBUG] Parsed: order_type={order_type}, order_id={order_id}, user_chat_id={user_chat_id}")
+        confirm_delete_order(chat_id, order_id, order_type, user_chat_id, message_id)
+        print(f"[DEBUG] confirm_delete_order completed successfully")
+    except Exception as e:
+        print(f"[ERROR] Failed to process delete button: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        send_message(chat_id, f"❌ Ошибка при удалении: {str(e)}")
+
+
+@admin_router.route('admin_del_one_{order_type}_{order_id:int}')
+def admin_delete_one(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any], order_type: str, order_id: int):
+    try:
+        print(f"[DEBUG] Confirm delete button clicked: admin_del_one_{order_type}_{order_id}")
+        print(f"[DEBUG] Parsed: order_type={order_type}, order_id={order_id}")
+        delete_order_admin(chat_id, order_id, order_type)
+        print(f"[DEBUG] delete_order_admin completed, showing orders list")
+        show_all_orders_for_admin(chat_id, 'sender' if order_type == 's' else 'carrier', message_id=message_id)
+        print(f"[DEBUG] show_all_orders_for_admin completed")
+    except Exception as e:
+        print(f"[ERROR] Failed to confirm delete: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        send_message(chat_id, f"❌ Ошибка при удалении: {str(e)}")
+
+
+@admin_router.route('admin_del_all_{user_chat_id:int}')
+def admin_delete_all(chat_id: int, message_id: int, state: Dict[str, Any], perms: Dict[str, Any], user_chat_id: int):
+    delete_all_user_orders(chat_id, user_chat_id)
+
+
+def go_back_step(chat_id: int, state: Dict[str, Any], data: Dict[str, Any]):
+    """Возврат на предыдущий шаг"""
+    current_step = state.get('step')
+    user_type = data.get('type')
+    
+    # Маппинг шагов для отправителей
+    sender_back_steps = {
+        'choose_marketplace': ('choose_service', show_main_menu),
+        'sender_warehouse': ('choose_marketplace', lambda cid: send_marketplace_keyboard(cid, 'sender')),
+        'sender_loading_city': ('sender_warehouse', lambda cid: send_message(cid, "📍 <b>Укажите склад назначения</b>\n\nНапример: Электросталь", {
+            'keyboard': [[{'text': '⬅️ Назад'}]], 'resize_keyboard': True, 'one_time_keyboard': False
+        })),
         'sender_loading_address': ('sender_loading_city', lambda cid: send_message(cid, "🏙 <b>Укажите город или населенный пункт погрузки</b>\n\nНапример: Москва, Санкт-Петербург, Самара", {
             'keyboard': [[{'text': '⬅️ Назад'}]], 'resize_keyboard': True, 'one_time_keyboard': False
         })),
@@ -1279,191 +1307,34 @@ def send_date_keyboard(chat_id: int, message: str):
     )
 
 
-def process_message(chat_id: int, text: str, username: str = 'unknown'):
-    if text.startswith('/unblock '):
-        if str(chat_id) != ADMIN_CHAT_ID:
-            send_message(chat_id, "❌ У вас нет прав администратора")
-            return
-        
-        try:
-            target_chat_id = int(text.split()[1])
-            unblock_user(chat_id, target_chat_id)
-        except (ValueError, IndexError):
-            send_message(chat_id, "❌ Неверный формат. Используйте: /unblock CHAT_ID")
-        return
-    
-    if text == '/add_admin':
-        perms = get_admin_permissions(chat_id)
-        if not perms or not perms.get('can_manage_admins'):
-            send_message(chat_id, "❌ У вас нет прав для добавления администраторов")
-            return
-        
-        state = user_states.get(chat_id, {'step': 'choose_service', 'data': {}})
-        state['step'] = 'add_admin_chat_id'
-        state['last_activity'] = time.time()
-        user_states[chat_id] = state
-        
-        send_message(
-            chat_id,
-            "👤 <b>Добавление администратора</b>\n\n"
-            "Отправьте мне Chat ID пользователя, которого хотите добавить.\n\n"
-            "💡 <i>Подсказка:</i> Пользователь может узнать свой Chat ID командой /my_id"
-        )
-        return
-    
-    if text == '/admin':
-        perms = get_admin_permissions(chat_id)
-        if not perms:
-            send_message(chat_id, "❌ У вас нет прав администратора")
-            return
-        
-        admin_sessions[chat_id] = int(time.time())
-        
-        role_text = {
-            'owner': '👑 Владелец',
-            'admin': '⚡️ Администратор',
-            'moderator': '🛡 Модератор',
-            'viewer': '👁 Наблюдатель'
-        }.get(perms.get('role', 'viewer'), '👁 Наблюдатель')
-        
-        buttons = []
-        
-        if perms.get('can_view_stats'):
-            buttons.append([{'text': '📊 Статистика', 'callback_data': 'admin_stats'}])
-            buttons.append([{'text': '📈 Еженедельный отчёт', 'callback_data': 'admin_weekly'}])
-        
-        if perms.get('can_view_security_logs'):
-            buttons.append([{'text': '🔒 Логи безопасности', 'callback_data': 'admin_security_logs'}])
-        
-        if perms.get('can_block_users'):
-            buttons.append([{'text': '🚫 Заблокированные', 'callback_data': 'admin_blocked_users'}])
-        
-        if perms.get('can_manage_users'):
-            buttons.append([{'text': '⚙️ Установить лимит', 'callback_data': 'admin_set_limit'}])
-        
-        if perms.get('can_remove_orders'):
-            buttons.append([{'text': '🗑️ Удалить заявку', 'callback_data': 'admin_delete'}])
-            buttons.append([{'text': '🧹 Очистить старые заявки', 'callback_data': 'admin_cleanup'}])
-        
-        if perms.get('can_manage_admins'):
-            buttons.append([{'text': '👥 Управление админами', 'callback_data': 'admin_manage_admins'}])
-        
-        buttons.append([{'text': '🏠 Выйти из админ-панели', 'callback_data': 'admin_exit'}])
-        
-        send_message(
-            chat_id,
-            f"🔧 <b>Админ-панель</b>\n\n"
-            f"Ваша роль: {role_text}\n\n"
-            f"Выберите действие:",
-            {'inline_keyboard': buttons}
-        )
-        return
-    
-    if text == '/add_admin':
-        if str(chat_id) != ADMIN_CHAT_ID:
-            send_message(chat_id, "❌ Только владелец бота может добавлять администраторов")
-            return
-        
-        user_states[chat_id] = {'step': 'add_admin_chat_id', 'data': {}, 'last_activity': time.time()}
-        send_message(
-            chat_id,
-            "👤 <b>Добавление нового администратора</b>\n\n"
-            "Отправьте Chat ID пользователя, которого хотите сделать администратором\n\n"
-            "💡 Пользователь может узнать свой Chat ID командой /my_id"
-        )
-        return
-    
-    if text == '/list_admins':
-        if str(chat_id) != ADMIN_CHAT_ID:
-            send_message(chat_id, "❌ Доступно только владельцу бота")
-            return
-        
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(
-                    "SELECT chat_id, username, is_active, added_at FROM t_p52349012_telegram_bot_creatio.bot_admins ORDER BY added_at DESC"
-                )
-                admins = cur.fetchall()
-                
-                if not admins:
-                    send_message(chat_id, "📭 Список администраторов пуст")
-                    return
-                
-                message_parts = ["👥 <b>Список администраторов:</b>\n"]
-                for admin in admins:
-                    status = "✅" if admin['is_active'] else "❌"
-                    message_parts.append(
-                        f"\n{status} @{admin.get('username', 'нет username')}\n"
-                        f"   Chat ID: <code>{admin['chat_id']}</code>\n"
-                        f"   Добавлен: {admin['added_at'].strftime('%d.%m.%Y %H:%M') if admin['added_at'] else 'неизвестно'}"
-                    )
-                
-                send_message(chat_id, ''.join(message_parts))
-        finally:
-            conn.close()
-        return
-    
-    if text.startswith('/remove_admin '):
-        if str(chat_id) != ADMIN_CHAT_ID:
-            send_message(chat_id, "❌ Только владелец бота может удалять администраторов")
-            return
-        
-        parts = text.split(' ', 1)
-        if len(parts) < 2 or not parts[1].strip().isdigit():
-            send_message(chat_id, "❌ Неверный формат.\n\nИспользование: /remove_admin CHAT_ID")
-            return
-        
-        target_chat_id = int(parts[1].strip())
-        
-        if target_chat_id == int(ADMIN_CHAT_ID):
-            send_message(chat_id, "❌ Нельзя удалить владельца бота")
-            return
-        
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "UPDATE t_p52349012_telegram_bot_creatio.bot_admins SET is_active = false WHERE chat_id = %s",
-                    (target_chat_id,)
-                )
-                conn.commit()
-                
-                if cur.rowcount > 0:
-                    send_message(chat_id, f"✅ Администратор {target_chat_id} деактивирован")
-                    log_security_event(chat_id, 'admin_removed', f'Админ {target_chat_id} деактивирован', 'high')
-                else:
-                    send_message(chat_id, f"❌ Администратор с Chat ID {target_chat_id} не найден")
-        finally:
-            conn.close()
-        return
-    
-    if text == '/my_id':
-        send_message(
-            chat_id,
-            f"🆔 <b>Ваш Chat ID:</b> <code>{chat_id}</code>\n\n"
-            f"Скопируйте это значение и отправьте владельцу бота для получения прав администратора"
-        )
-        return
-    
-    if text == '/delete_my_data':
-        send_message(
-            chat_id,
-            "⚠️ <b>Удаление персональных данных</b>\n\n"
-            "Вы уверены, что хотите удалить все свои персональные данные?\n\n"
-            "❗️ Это действие:\n"
-            "• Удалит все ваши заявки (отправителя и перевозчика)\n"
-            "• Удалит все ваши шаблоны\n"
-            "• Удалит подписки на уведомления\n"
-            "• Невозможно отменить\n\n"
-            "Для подтверждения отправьте: <b>УДАЛИТЬ МОИ ДАННЫЕ</b>",
-            {'remove_keyboard': True}
-        )
-        user_states[chat_id] = {'step': 'confirm_data_deletion', 'data': {}, 'last_activity': time.time()}
-        return
-    
-    if text == '/privacy':
-        privacy_text = """
+def popular_warehouse_rows(marketplace: str, defaults: Optional[Dict[str, Any]]) -> List[List[Dict[str, str]]]:
+    """Кнопки популярных складов маркетплейса (по два в ряд), без дубля последнего склада"""
+    last = normalize_warehouse(defaults.get('last_warehouse', '')) if defaults else ''
+    names = [w for w in get_popular_warehouses(marketplace, 6) if normalize_warehouse(w) != last]
+    return [[{'text': name} for name in names[i:i + 2]] for i in range(0, len(names), 2)]
+
+
+def offer_warehouse_suggestions(chat_id: int, marketplace: str, warehouse: str, extra_rows: List[List[Dict[str, str]]]) -> bool:
+    """Если склад незнаком, предложить похожие варианты. True — подсказки отправлены, шаг не меняется"""
+    if not warehouse or is_known_warehouse(marketplace, warehouse):
+        return False
+    normalized = normalize_warehouse(warehouse)
+    suggestions = suggest_warehouses(marketplace, warehouse, 4)
+    if not suggestions or any(normalize_warehouse(w) == normalized for w in suggestions):
+        return False
+    keyboard = [[{'text': name}] for name in suggestions]
+    keyboard.append([{'text': f"✅ {warehouse}"}])
+    keyboard.extend(extra_rows)
+    send_message(
+        chat_id,
+        f"🔎 Склад «{sanitize_html(warehouse)}» не найден среди известных.\n\nВозможно, вы имели в виду один из вариантов ниже? "
+        f"Чтобы оставить как есть, нажмите «✅ {sanitize_html(warehouse)}».",
+        {'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': False}
+    )
+    return True
+
+
+PRIVACY_TEXT = """
 🔒 <b>Политика конфиденциальности</b>
 
 <b>1. Обработка данных</b>
@@ -1490,11 +1361,9 @@ def process_message(chat_id: int, text: str, username: str = 'unknown'):
 
 📋 Пользовательское соглашение: /terms
 """
-        send_message(chat_id, privacy_text)
-        return
-    
-    if text == '/terms':
-        terms_text = """
+
+
+TERMS_TEXT = """
 📋 <b>Пользовательское соглашение</b>
 
 <b>1. Предмет соглашения</b>
@@ -1530,89 +1399,170 @@ def process_message(chat_id: int, text: str, username: str = 'unknown'):
 
 🔒 Политика конфиденциальности: /privacy
 """
-        send_message(chat_id, terms_text)
+
+
+@command_router.route('/start')
+def command_start(chat_id: int, text: str, username: str):
+    show_main_menu(chat_id)
+
+
+@command_router.route('/my_id')
+def command_my_id(chat_id: int, text: str, username: str):
+    send_message(chat_id, f"🆔 Ваш Chat ID: <code>{chat_id}</code>\n\n@{username}")
+
+
+@command_router.route('/admin')
+def command_admin(chat_id: int, text: str, username: str):
+    perms = get_admin_permissions(chat_id)
+    if not perms:
+        send_message(chat_id, "❌ У вас нет прав администратора")
         return
     
-    if text == '/start':
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT chat_id FROM t_p52349012_telegram_bot_creatio.sender_orders WHERE chat_id = %s UNION SELECT chat_id FROM t_p52349012_telegram_bot_creatio.carrier_orders WHERE chat_id = %s LIMIT 1", (chat_id, chat_id))
-                is_first_time = cur.fetchone() is None
-        finally:
-            conn.close()
-        
-        user_states[chat_id] = {'step': 'choose_service', 'data': {}, 'last_activity': time.time()}
-        
-        # Получаем шаблоны пользователя
-        templates = get_user_templates(chat_id)
-        
-        keyboard_buttons = []
-        
-        # Добавляем первые 3 шаблона на главный экран для быстрого доступа
-        if templates:
-            for template in templates[:3]:
-                template_name = template['template_name']
-                order_type = template.get('order_type', 'sender')
-                emoji = '📦' if order_type == 'sender' else '🚚'
-                keyboard_buttons.append([{'text': f"⚡️ {emoji} {template_name}"}])
-        
-        # Основные кнопки
-        keyboard_buttons.extend([
-            [{'text': '📦 Отправитель'}],
-            [{'text': '🚚 Перевозчик'}],
-            [{'text': '📋 Мои заявки'}]
-        ])
-        
-        # Показываем кнопку "Мои шаблоны" только если есть больше 3 шаблонов
-        if templates and len(templates) > 3:
-            keyboard_buttons.append([{'text': '💾 Мои шаблоны'}])
-        
-        reply_markup = {
-            'keyboard': keyboard_buttons,
-            'resize_keyboard': True,
-            'one_time_keyboard': False
-        }
-        
-        if is_first_time:
-            welcome_text = (
-                "👋 <b>Добро пожаловать!</b>\n\n"
-                "⚠️ <b>Используя бота, вы соглашаетесь с:</b>\n"
-                "📋 Пользовательским соглашением\n"
-                "🔒 Политикой конфиденциальности\n\n"
-                "<b>Важно:</b>\n"
-                "• Сохраняйте скрины переписок\n"
-                "• Сверяйте данные авто с заявкой\n"
-                "• Будьте внимательны к деталям\n\n"
-                "<b>Выберите услугу:</b>"
+    show_admin_panel(chat_id, perms)
+
+
+@command_router.route('/add_admin')
+def command_add_admin(chat_id: int, text: str, username: str):
+    perms = get_admin_permissions(chat_id)
+    if not perms or not perms.get('can_manage_admins'):
+        send_message(chat_id, "❌ У вас нет прав для добавления администраторов")
+        return
+    
+    state = user_states.get(chat_id, {'step': 'choose_service', 'data': {}})
+    state['step'] = 'add_admin_chat_id'
+    state['last_activity'] = time.time()
+    user_states[chat_id] = state
+    
+    send_message(
+        chat_id,
+        "👤 <b>Добавление администратора</b>\n\n"
+        "Отправьте мне Chat ID пользователя, которого хотите добавить.\n\n"
+        "💡 <i>Подсказка:</i> Пользователь может узнать свой Chat ID командой /my_id"
+    )
+
+
+@command_router.route('/list_admins')
+def command_list_admins(chat_id: int, text: str, username: str):
+    if str(chat_id) != ADMIN_CHAT_ID:
+        send_message(chat_id, "❌ Доступно только владельцу бота")
+        return
+    
+    conn = db.open_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                "SELECT chat_id, username, is_active, added_at FROM t_p52349012_telegram_bot_creatio.bot_admins ORDER BY added_at DESC"
             )
-            # Добавляем inline кнопки для первого входа
-            reply_markup['inline_keyboard'] = [
-                [
-                    {'text': '📋 Пользовательское соглашение', 'url': 'https://t.me/iv?url=https%3A%2F%2Ftelegra.ph%2FPolzovatelskoe-soglashenie-12-21&rhash=b8c0f0e0f0e0f0'},
-                    {'text': '🔒 Политика конфиденциальности', 'url': 'https://t.me/iv?url=https%3A%2F%2Ftelegra.ph%2FPolitika-konfidencialnosti-12-21&rhash=c9d0f0e0f0e0f0'}
-                ]
-            ]
-        else:
-            welcome_text = (
-                "👋 <b>Добро пожаловать!</b>\n\n"
-                "⚠️ <b>Важно:</b>\n"
-                "• Сохраняйте скрины переписок\n"
-                "• Сверяйте данные авто с заявкой\n"
-                "• Будьте внимательны к деталям\n\n"
-                "<b>Выберите услугу:</b>"
+            admins = cur.fetchall()
+            
+            if not admins:
+                send_message(chat_id, "📭 Список администраторов пуст")
+                return
+            
+            message_parts = ["👥 <b>Список администраторов:</b>\n"]
+            for admin in admins:
+                status = "✅" if admin['is_active'] else "❌"
+                message_parts.append(
+                    f"\n{status} @{admin.get('username', 'нет username')}\n"
+                    f"   Chat ID: <code>{admin['chat_id']}</code>\n"
+                    f"   Добавлен: {admin['added_at'].strftime('%d.%m.%Y %H:%M') if admin['added_at'] else 'неизвестно'}"
+                )
+            
+            send_message(chat_id, ''.join(message_parts))
+    finally:
+        conn.close()
+
+
+@command_router.route('/remove_admin {args:rest}')
+def command_remove_admin(chat_id: int, text: str, username: str, args: str):
+    if str(chat_id) != ADMIN_CHAT_ID:
+        send_message(chat_id, "❌ Только владелец бота может удалять администраторов")
+        return
+    
+    if not args.strip().isdigit():
+        send_message(chat_id, "❌ Неверный формат.\n\nИспользование: /remove_admin CHAT_ID")
+        return
+    
+    target_chat_id = int(args.strip())
+    
+    if target_chat_id == int(ADMIN_CHAT_ID):
+        send_message(chat_id, "❌ Нельзя удалить владельца бота")
+        return
+    
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE t_p52349012_telegram_bot_creatio.bot_admins SET is_active = false WHERE chat_id = %s",
+                (target_chat_id,)
             )
-            # Добавляем inline кнопки для всех пользователей
-            reply_markup['inline_keyboard'] = [
-                [
-                    {'text': '📋 Условия', 'callback_data': 'show_terms'},
-                    {'text': '🔒 Конфиденциальность', 'callback_data': 'show_privacy'}
-                ]
-            ]
-        
-        send_message(chat_id, welcome_text, reply_markup)
+            conn.commit()
+            invalidate_admin_permissions(target_chat_id)
+            
+            if cur.rowcount > 0:
+                send_message(chat_id, f"✅ Администратор {target_chat_id} деактивирован")
+                log_security_event(chat_id, 'admin_removed', f'Админ {target_chat_id} деактивирован', 'high')
+            else:
+                send_message(chat_id, f"❌ Администратор с Chat ID {target_chat_id} не найден")
+    finally:
+        conn.close()
+
+
+@command_router.route('/unblock {args:rest}')
+def command_unblock(chat_id: int, text: str, username: str, args: str):
+    if str(chat_id) != ADMIN_CHAT_ID:
+        send_message(chat_id, "❌ У вас нет прав администратора")
         return
     
+    try:
+        target_chat_id = int(args.split()[0])
+        unblock_user(chat_id, target_chat_id)
+    except (ValueError, IndexError):
+        send_message(chat_id, "❌ Неверный формат. Используйте: /unblock CHAT_ID")
+
+
+@command_router.route('/delete_my_data')
+def command_delete_my_data(chat_id: int, text: str, username: str):
+    send_message(
+        chat_id,
+        "⚠️ <b>Удаление персональных данных</b>\n\n"
+        "Вы уверены, что хотите удалить все свои персональные данные?\n\n"
+        "❗️ Это действие:\n"
+        "• Удалит все ваши заявки (отправителя и перевозчика)\n"
+        "• Удалит все ваши шаблоны\n"
+        "• Удалит подписки на уведомления\n"
+        "• Невозможно отменить\n\n"
+        "Для подтверждения отправьте: <b>УДАЛИТЬ МОИ ДАННЫЕ</b>",
+        {'remove_keyboard': True}
+    )
+    user_states[chat_id] = {'step': 'confirm_data_deletion', 'data': {}, 'last_activity': time.time()}
+
+
+@command_router.route('/digest')
+def command_digest(chat_id: int, text: str, username: str):
+    keyboard = {'inline_keyboard': [
+        [{'text': label, 'callback_data': f'digest_mode_{minutes}'}] for minutes, label in digest.DIGEST_MODES.items()
+    ]}
+    send_message(
+        chat_id,
+        "🔔 <b>Как присылать новые заявки по подписке?</b>\n\n"
+        "• <b>Сразу</b> — отдельным сообщением о каждой заявке\n"
+        "• <b>Сводкой</b> — одним сообщением со всеми заявками за период",
+        keyboard
+    )
+
+
+@command_router.route('/privacy')
+def command_privacy(chat_id: int, text: str, username: str):
+    send_message(chat_id, PRIVACY_TEXT)
+
+
+@command_router.route('/terms')
+def command_terms(chat_id: int, text: str, username: str):
+    send_message(chat_id, TERMS_TEXT)
+
+
+def process_message(chat_id: int, text: str, username: str = 'unknown'):
     if chat_id not in user_states:
         user_states[chat_id] = {'step': 'choose_service', 'data': {}, 'last_activity': time.time()}
         send_message(
@@ -1660,7 +1610,7 @@ def process_message(chat_id: int, text: str, username: str = 'unknown'):
         
         target_chat_id = int(text)
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = db.open_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute(
@@ -1823,632 +1773,677 @@ def process_message(chat_id: int, text: str, username: str = 'unknown'):
         go_back_step(chat_id, state, data)
         return
     
-    if step == 'choose_service':
-        # Проверяем, не нажал ли пользователь на быстрый шаблон
-        if text.startswith('⚡️'):
-            # Извлекаем имя шаблона
-            template_name = text.replace('⚡️', '').replace('📦', '').replace('🚚', '').strip()
-            templates = get_user_templates(chat_id)
-            
-            # Ищем шаблон
-            template = next((t for t in templates if t['template_name'] == template_name), None)
-            
-            if template:
-                # Загружаем данные из шаблона
-                template_data = template.get('template_data', {})
-                if isinstance(template_data, str):
-                    template_data = json.loads(template_data)
-                
-                data.update(template_data)
-                data['type'] = template.get('order_type', 'sender')
-                
-                # Сразу переходим к предпросмотру
-                state['step'] = 'show_preview'
-                send_message(chat_id, "⚡️ <b>Загружен шаблон!</b>\n\nПроверьте данные и при необходимости измените:", {'remove_keyboard': True})
-                show_preview(chat_id, data)
-                return
-            
-        if '📦' in text or 'отправитель' in text.lower():
-            data['type'] = 'sender'
-            state['step'] = 'choose_marketplace'
-            
-            # Умный дефолт: предложить последний маркетплейс
-            defaults = get_user_defaults(chat_id)
-            keyboard = []
-            
-            if defaults and defaults.get('last_marketplace') and defaults.get('last_order_type') == 'sender':
-                last_mp = defaults['last_marketplace']
-                keyboard.append([{'text': f"✅ {last_mp}"}])
-            
-            keyboard.extend([[{'text': mp}] for mp in MARKETPLACES])
-            keyboard.append([{'text': '⬅️ Назад'}])
-            send_message(
-                chat_id,
-                "🏪 <b>Выберите маркетплейс:</b>",
-                {'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': True}
-            )
-        elif '🚚' in text or 'перевозчик' in text.lower():
-            data['type'] = 'carrier'
-            state['step'] = 'choose_marketplace'
-            
-            # Умный дефолт: предложить последний маркетплейс
-            defaults = get_user_defaults(chat_id)
-            keyboard = []
-            
-            if defaults and defaults.get('last_marketplace') and defaults.get('last_order_type') == 'carrier':
-                last_mp = defaults['last_marketplace']
-                keyboard.append([{'text': f"✅ {last_mp}"}])
-            
-            keyboard.extend([[{'text': mp}] for mp in MARKETPLACES])
-            keyboard.append([{'text': '⬅️ Назад'}])
-            send_message(
-                chat_id,
-                "🏪 <b>Выберите маркетплейс:</b>",
-                {'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': True}
-            )
-        elif 'мои заявки' in text.lower() or '📋' in text:
-            show_my_orders(chat_id)
-            return
-        elif 'мои шаблоны' in text.lower() or '💾' in text:
-            show_templates_management(chat_id)
-            return
-        else:
-            send_message(chat_id, "Пожалуйста, выберите услугу из меню")
-    
-    elif step == 'choose_marketplace':
-        # Если пользователь нажал на кнопку с последним маркетплейсом
-        if text.startswith('✅'):
-            marketplace = text.replace('✅', '').strip()
-        else:
-            marketplace = text.strip()
-        
-        data['marketplace'] = marketplace
-        
-        # Получаем последние значения пользователя
-        defaults = get_user_defaults(chat_id)
+    step_router.dispatch(step, chat_id, text, state, data)
+
+
+@step_router.route('choose_service')
+def step_choose_service(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    if 'отправитель' in text.lower():
+        state['step'] = 'choose_marketplace'
+        data['type'] = 'sender'
         
-        if data['type'] == 'sender':
-            state['step'] = 'sender_warehouse'
-            keyboard = []
-            
-            # Добавляем кнопку с последним значением, если оно есть
-            if defaults and defaults.get('last_warehouse'):
-                keyboard.append([{'text': f"✅ {defaults['last_warehouse']}"}])
-            
-            keyboard.append([{'text': '⬅️ Назад'}])
-            
-            send_message(chat_id, "📍 <b>Укажите склад назначения</b>\n\nНапример: Электросталь", {
-                'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': False
-            })
-        else:
-            state['step'] = 'carrier_warehouse'
-            keyboard = [[{'text': '📦 Любой склад'}]]
-            
-            # Добавляем кнопку с последним значением, если оно есть
-            if defaults and defaults.get('last_warehouse'):
-                keyboard.insert(0, [{'text': f"✅ {defaults['last_warehouse']}"}])
-            
-            send_message(
-                chat_id,
-                "📍 <b>Укажите склад назначения</b>\n\nНапример: Электросталь",
-                {
-                    'keyboard': keyboard,
-                    'resize_keyboard': True,
-                    'one_time_keyboard': False
-                }
-            )
+        keyboard_buttons = [[{'text': mp}] for mp in MARKETPLACES]
+        keyboard_buttons.append([{'text': '⬅️ Назад'}])
+        send_message(chat_id, "🏪 <b>Выберите маркетплейс</b>", {
+            'keyboard': keyboard_buttons,
+            'resize_keyboard': True,
+            'one_time_keyboard': True
+        })
     
-    elif step == 'sender_warehouse':
-        if '⬅️' in text or text.strip() == 'Назад':
-            go_back_step(chat_id, state, data)
-            return
+    elif 'перевозчик' in text.lower():
+        state['step'] = 'choose_marketplace'
+        data['type'] = 'carrier'
         
-        # Если пользователь нажал на кнопку с последним складом
-        if text.startswith('✅'):
-            warehouse = text.replace('✅', '').strip()
-        else:
-            warehouse = text.strip()
-        
-        data['warehouse'] = warehouse
-        state['step'] = 'sender_loading_city'
-        send_message(chat_id, "🏙 <b>Укажите город или населенный пункт погрузки</b>\n\nНапример: Москва, Санкт-Петербург, Самара", {
-            'keyboard': [[{'text': '⬅️ Назад'}]], 'resize_keyboard': True, 'one_time_keyboard': False
+        keyboard_buttons = [[{'text': mp}] for mp in MARKETPLACES]
+        keyboard_buttons.append([{'text': '⬅️ Назад'}])
+        send_message(chat_id, "🏪 <b>Выберите маркетплейс</b>", {
+            'keyboard': keyboard_buttons,
+            'resize_keyboard': True,
+            'one_time_keyboard': True
         })
     
-    elif step == 'sender_loading_city':
-        # Очищаем текст от галочки если есть
-        if text.startswith('✅'):
-            loading_city = text.replace('✅', '').strip()
-        else:
-            loading_city = text.strip()
-        
-        data['loading_city'] = loading_city
-        state['step'] = 'sender_loading_address'
+    elif 'мои заявки' in text.lower():
+        show_my_orders(chat_id)
+    
+    elif 'мои шаблоны' in text.lower() or '💾' in text:
+        show_templates_management(chat_id)
+
+
+@step_router.route('choose_marketplace')
+def step_choose_marketplace(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    # Если пользователь нажал на кнопку с последним маркетплейсом
+    if text.startswith('✅'):
+        marketplace = text.replace('✅', '').strip()
+    else:
+        marketplace = text.strip()
+    
+    data['marketplace'] = marketplace
+    
+    # Получаем последние значения пользователя
+    defaults = get_user_defaults(chat_id)
+    
+    if data['type'] == 'sender':
+        state['step'] = 'sender_warehouse'
+        keyboard = []
         
-        # Умный дефолт: предложить последний адрес
-        defaults = get_user_defaults(chat_id)
-        keyboard = [[{'text': '⬅️ Назад'}]]
-        message = "🏠 <b>Укажите адрес ПОГРУЗКИ</b>\n\nНапример: ул. Ленина, д. 10"
+        # Добавляем кнопку с последним значением, если оно есть
+        if defaults and defaults.get('last_warehouse'):
+            keyboard.append([{'text': f"✅ {defaults['last_warehouse']}"}])
         
-        if defaults and defaults.get('last_loading_address'):
-            last_address = defaults['last_loading_address']
-            if len(last_address) <= 60:
-                keyboard.insert(0, [{'text': f"✅ {last_address}"}])
-                message += f"\n\n💡 Или используйте последний адрес"
+        keyboard.extend(popular_warehouse_rows(marketplace, defaults))
+        keyboard.append([{'text': '⬅️ Назад'}])
         
-        send_message(chat_id, message, {
+        send_message(chat_id, "📍 <b>Укажите склад назначения</b>\n\nНапример: Электросталь", {
             'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': False
         })
-    
-    elif step == 'sender_loading_address':
-        # Если пользователь нажал на кнопку с последним адресом
-        if text.startswith('✅'):
-            loading_address = text.replace('✅', '').strip()
-        else:
-            loading_address = text.strip()
+    else:
+        state['step'] = 'carrier_warehouse'
+        keyboard = [[{'text': '📦 Любой склад'}]]
         
-        data['loading_address'] = loading_address
-        state['step'] = 'sender_loading_date'
+        # Добавляем кнопку с последним значением, если оно есть
+        if defaults and defaults.get('last_warehouse'):
+            keyboard.insert(0, [{'text': f"✅ {defaults['last_warehouse']}"}])
+        
+        keyboard[-1:-1] = popular_warehouse_rows(marketplace, defaults)
         
-        today = datetime.now()
-        tomorrow = today + timedelta(days=1)
         send_message(
             chat_id,
-            "📅 <b>Укажите дату ПОГРУЗКИ</b>",
+            "📍 <b>Укажите склад назначения</b>\n\nНапример: Электросталь",
             {
-                'keyboard': [
-                    [{'text': f"🔴 Сегодня ({today.strftime('%d.%m.%Y')})"}],
-                    [{'text': f"🟢 Завтра ({tomorrow.strftime('%d.%m.%Y')})"}],
-                    [{'text': 'Ввести дату'}],
-                    [{'text': '⬅️ Назад'}]
-                ],
+                'keyboard': keyboard,
                 'resize_keyboard': True,
-                'one_time_keyboard': True
+                'one_time_keyboard': False
             }
         )
+
+
+@step_router.route('sender_warehouse')
+def step_sender_warehouse(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    if '⬅️' in text or text.strip() == 'Назад':
+        go_back_step(chat_id, state, data)
+        return
     
-    elif step == 'sender_loading_date':
-        try:
-            if 'сегодня' in text.lower() or '🔴' in text:
-                loading_date = datetime.now()
-            elif 'завтра' in text.lower() or '🟢' in text:
-                loading_date = datetime.now() + timedelta(days=1)
-            elif 'ввести' in text.lower():
-                send_message(chat_id, "📅 <b>Введите дату ПОГРУЗКИ</b>\n\nФормат: ДД.ММ.ГГГГ\nНапример: 25.12.2025", {'remove_keyboard': True})
-                return
-            else:
-                loading_date = datetime.strptime(text, '%d.%m.%Y')
-            
-            is_valid, error_msg = validate_date_not_past(loading_date.strftime('%Y-%m-%d'))
-            if not is_valid:
-                send_message(chat_id, error_msg)
-                log_security_event(chat_id, 'past_date_attempt', f'Attempted past date: {text}', 'low')
-                return
-            
-            data['loading_date'] = loading_date.strftime('%Y-%m-%d')
-            
-            days_until = (loading_date - datetime.now()).days
-            if days_until > 1:
-                send_message(
-                    chat_id,
-                    f"⚠️ <b>Внимание!</b> Заявка будет автоматически удалена через 24 часа после указанной даты ПОГРУЗКИ.\n\n" +
-                    f"Дата ПОГРУЗКИ: {loading_date.strftime('%d.%m.%Y')}\n" +
-                    f"Заявка будет удалена: {(loading_date + timedelta(days=1)).strftime('%d.%m.%Y')}"
-                )
-            
-            state['step'] = 'sender_loading_time'
-            send_message(chat_id, "🕐 <b>Укажите время ПОГРУЗКИ</b>\n\nФормат: ЧЧ:ММ\nНапример: 14:30", {
-                'keyboard': [
-                    [{'text': '🕒 Любое время'}],
-                    [{'text': '⬅️ Назад'}]
-                ], 'resize_keyboard': True, 'one_time_keyboard': False
-            })
-        except ValueError:
-            send_message(chat_id, "❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+    # Если пользователь нажал на кнопку с последним складом
+    if text.startswith('✅'):
+        warehouse = text.replace('✅', '').strip()
+    else:
+        warehouse = text.strip()
+        if offer_warehouse_suggestions(chat_id, data.get('marketplace'), warehouse, [[{'text': '⬅️ Назад'}]]):
+            return
     
-    elif step == 'sender_loading_time':
-        import re
-        if 'любое' in text.lower() or '🕒' in text:
-            data['loading_time'] = '00:00'
-        else:
-            time_pattern = r'^([0-1]?[0-9]|2[0-3]):([0-5][0-9])$'
-            if not re.match(time_pattern, text):
-                send_message(chat_id, "❌ Неверный формат времени. Используйте ЧЧ:ММ (например: 14:30)")
-                return
-            data['loading_time'] = text
-        state['step'] = 'sender_delivery_date'
-        
-        today = datetime.now()
-        tomorrow = today + timedelta(days=1)
-        send_message(
-            chat_id,
-            "📅 <b>Укажите дату ПОСТАВКИ на склад</b>",
-            {
-                'keyboard': [
-                    [{'text': f"🔴 Сегодня ({today.strftime('%d.%m.%Y')})"}],
-                    [{'text': f"🟢 Завтра ({tomorrow.strftime('%d.%m.%Y')})"}],
-                    [{'text': 'Ввести дату'}],
-                    [{'text': '⬅️ Назад'}]
-                ],
-                'resize_keyboard': True,
-                'one_time_keyboard': True
-            }
-        )
+    data['warehouse'] = warehouse
+    state['step'] = 'sender_loading_city'
+    send_message(chat_id, "🏙 <b>Укажите город или населенный пункт погрузки</b>\n\nНапример: Москва, Санкт-Петербург, Самара", {
+        'keyboard': [[{'text': '⬅️ Назад'}]], 'resize_keyboard': True, 'one_time_keyboard': False
+    })
+
+
+@step_router.route('sender_loading_city')
+def step_sender_loading_city(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    # Очищаем текст от галочки если есть
+    if text.startswith('✅'):
+        loading_city = text.replace('✅', '').strip()
+    else:
+        loading_city = text.strip()
     
-    elif step == 'sender_pallet_quantity':
-        data['pallet_quantity'] = int(text) if text.isdigit() else 0
-        state['step'] = 'sender_box_quantity'
-        send_message(chat_id, "📦 <b>Укажите количество коробок</b>\n\nНапример: 10\nИли 0, если нет коробок")
+    data['loading_city'] = loading_city
+    state['step'] = 'sender_loading_address'
     
-    elif step == 'sender_delivery_date':
-        try:
-            if 'сегодня' in text.lower() or '🔴' in text:
-                delivery_date = datetime.now()
-            elif 'завтра' in text.lower() or '🟢' in text:
-                delivery_date = datetime.now() + timedelta(days=1)
-            elif 'ввести' in text.lower():
-                send_message(chat_id, "📅 <b>Введите дату ПОСТАВКИ на склад</b>\n\nФормат: ДД.ММ.ГГГГ\nНапример: 25.12.2025", {'remove_keyboard': True})
-                return
-            else:
-                delivery_date = datetime.strptime(text, '%d.%m.%Y')
-            
-            is_valid, error_msg = validate_date_not_past(delivery_date.strftime('%Y-%m-%d'))
-            if not is_valid:
-                send_message(chat_id, error_msg)
-                log_security_event(chat_id, 'past_date_attempt', f'Attempted past date: {text}', 'low')
-                return
-            
-            data['delivery_date'] = delivery_date.strftime('%Y-%m-%d')
-            state['step'] = 'sender_pallet_quantity'
-            send_message(chat_id, "📦 <b>Укажите количество паллет</b>\n\nНапример: 5\nИли 0, если нет паллет", {
-                'keyboard': [[{'text': '⬅️ Назад'}]], 'resize_keyboard': True, 'one_time_keyboard': False
-            })
-        except ValueError:
-            send_message(chat_id, "❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+    # Умный дефолт: предложить последний адрес
+    defaults = get_user_defaults(chat_id)
+    keyboard = [[{'text': '⬅️ Назад'}]]
+    message = "🏠 <b>Укажите адрес ПОГРУЗКИ</b>\n\nНапример: ул. Ленина, д. 10"
     
-    elif step == 'sender_pallet_quantity':
-        if not text.isdigit():
-            send_message(chat_id, "❌ Введите целое число")
-            return
-        
-        value = int(text)
-        is_valid, error_msg = validate_number_range(value, 0, 33, "Количество паллет")
-        if not is_valid:
-            send_message(chat_id, error_msg)
-            return
-        
-        data['pallet_quantity'] = value
-        state['step'] = 'sender_box_quantity'
-        send_message(chat_id, "📦 <b>Укажите количество коробок</b>\n\nНапример: 10\nИли 0, если нет коробок", {
-            'keyboard': [[{'text': '⬅️ Назад'}]], 'resize_keyboard': True, 'one_time_keyboard': False
-        })
+    if defaults and defaults.get('last_loading_address'):
+        last_address = defaults['last_loading_address']
+        if len(last_address) <= 60:
+            keyboard.insert(0, [{'text': f"✅ {last_address}"}])
+            message += f"\n\n💡 Или используйте последний адрес"
     
-    elif step == 'sender_box_quantity':
-        if not text.isdigit():
-            send_message(chat_id, "❌ Введите целое число")
+    send_message(chat_id, message, {
+        'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': False
+    })
+
+
+@step_router.route('sender_loading_address')
+def step_sender_loading_address(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    # Если пользователь нажал на кнопку с последним адресом
+    if text.startswith('✅'):
+        loading_address = text.replace('✅', '').strip()
+    else:
+        loading_address = text.strip()
+    
+    data['loading_address'] = loading_address
+    state['step'] = 'sender_loading_date'
+    
+    today = datetime.now()
+    tomorrow = today + timedelta(days=1)
+    send_message(
+        chat_id,
+        "📅 <b>Укажите дату ПОГРУЗКИ</b>",
+        {
+            'keyboard': [
+                [{'text': f"🔴 Сегодня ({today.strftime('%d.%m.%Y')})"}],
+                [{'text': f"🟢 Завтра ({tomorrow.strftime('%d.%m.%Y')})"}],
+                [{'text': 'Ввести дату'}],
+                [{'text': '⬅️ Назад'}]
+            ],
+            'resize_keyboard': True,
+            'one_time_keyboard': True
+        }
+    )
+
+
+@step_router.route('sender_loading_date')
+def step_sender_loading_date(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    try:
+        if 'сегодня' in text.lower() or '🔴' in text:
+            loading_date = datetime.now()
+        elif 'завтра' in text.lower() or '🟢' in text:
+            loading_date = datetime.now() + timedelta(days=1)
+        elif 'ввести' in text.lower():
+            send_message(chat_id, "📅 <b>Введите дату ПОГРУЗКИ</b>\n\nФормат: ДД.ММ.ГГГГ\nНапример: 25.12.2025", {'remove_keyboard': True})
             return
+        else:
+            loading_date = datetime.strptime(text, '%d.%m.%Y')
         
-        value = int(text)
-        is_valid, error_msg = validate_number_range(value, 0, 1000, "Количество коробок")
+        is_valid, error_msg = validate_date_not_past(loading_date.strftime('%Y-%m-%d'))
         if not is_valid:
             send_message(chat_id, error_msg)
+            log_security_event(chat_id, 'past_date_attempt', f'Attempted past date: {text}', 'low')
             return
         
-        data['box_quantity'] = value
-        state['step'] = 'sender_name'
-        
-        # Умный дефолт: предложить последнее ФИО
-        defaults = get_user_defaults(chat_id)
-        keyboard = [[{'text': '⬅️ Назад'}]]
-        message = "👤 <b>Укажите ФИО отправителя</b>\n\nНапример: Иванов Иван Иванович"
+        data['loading_date'] = loading_date.strftime('%Y-%m-%d')
         
-        if defaults and defaults.get('last_sender_name'):
-            last_name = defaults['last_sender_name']
-            keyboard.insert(0, [{'text': f"✅ {last_name}"}])
-            message += f"\n\n💡 Или используйте последнее ФИО"
+        days_until = (loading_date - datetime.now()).days
+        if days_until > 1:
+            send_message(
+                chat_id,
+                f"⚠️ <b>Внимание!</b> Заявка будет автоматически удалена через 24 часа после указанной даты ПОГРУЗКИ.\n\n" +
+                f"Дата ПОГРУЗКИ: {loading_date.strftime('%d.%m.%Y')}\n" +
+                f"Заявка будет удалена: {(loading_date + timedelta(days=1)).strftime('%d.%m.%Y')}"
+            )
         
-        send_message(chat_id, message, {
-            'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': False
+        state['step'] = 'sender_loading_time'
+        send_message(chat_id, "🕐 <b>Укажите время ПОГРУЗКИ</b>\n\nФормат: ЧЧ:ММ\nНапример: 14:30", {
+            'keyboard': [
+                [{'text': '🕒 Любое время'}],
+                [{'text': '⬅️ Назад'}]
+            ], 'resize_keyboard': True, 'one_time_keyboard': False
         })
-    
-    elif step == 'sender_name':
-        # Если пользователь нажал на кнопку с последним ФИО
-        if text.startswith('✅'):
-            sender_name = text.replace('✅', '').strip()
-        else:
-            sender_name = text.strip()
-        
-        if len(sender_name) < 3:
-            send_message(chat_id, "❌ ФИО должно содержать минимум 3 символа")
+    except ValueError:
+        send_message(chat_id, "❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+
+
+@step_router.route('sender_loading_time')
+def step_sender_loading_time(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    import re
+    if 'любое' in text.lower() or '🕒' in text:
+        data['loading_time'] = '00:00'
+    else:
+        time_pattern = r'^([0-1]?[0-9]|2[0-3]):([0-5][0-9])$'
+        if not re.match(time_pattern, text):
+            send_message(chat_id, "❌ Неверный формат времени. Используйте ЧЧ:ММ (например: 14:30)")
             return
-        
-        data['sender_name'] = sender_name
-        state['step'] = 'sender_phone'
-        
-        # Умный дефолт: предложить последний телефон
-        defaults = get_user_defaults(chat_id)
-        keyboard = [[{'text': '⬅️ Назад'}]]
-        message = "📱 <b>Укажите номер телефона</b>\n\nФормат: +79991234567"
-        
-        if defaults and defaults.get('last_phone'):
-            last_phone = defaults['last_phone']
-            keyboard.insert(0, [{'text': f"✅ {last_phone}"}])
-            message += f"\n\n💡 Или используйте последний номер"
-        
-        send_message(chat_id, message, {
-            'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': False
-        })
+        data['loading_time'] = text
+    state['step'] = 'sender_delivery_date'
     
-    elif step == 'sender_phone':
-        # Если пользователь нажал на кнопку с последним телефоном
-        if text.startswith('✅'):
-            phone = text.replace('✅', '').strip()
+    today = datetime.now()
+    tomorrow = today + timedelta(days=1)
+    send_message(
+        chat_id,
+        "📅 <b>Укажите дату ПОСТАВКИ на склад</b>",
+        {
+            'keyboard': [
+                [{'text': f"🔴 Сегодня ({today.strftime('%d.%m.%Y')})"}],
+                [{'text': f"🟢 Завтра ({tomorrow.strftime('%d.%m.%Y')})"}],
+                [{'text': 'Ввести дату'}],
+                [{'text': '⬅️ Назад'}]
+            ],
+            'resize_keyboard': True,
+            'one_time_keyboard': True
+        }
+    )
+
+
+@step_router.route('sender_delivery_date')
+def step_sender_delivery_date(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    try:
+        if 'сегодня' in text.lower() or '🔴' in text:
+            delivery_date = datetime.now()
+        elif 'завтра' in text.lower() or '🟢' in text:
+            delivery_date = datetime.now() + timedelta(days=1)
+        elif 'ввести' in text.lower():
+            send_message(chat_id, "📅 <b>Введите дату ПОСТАВКИ на склад</b>\n\nФормат: ДД.ММ.ГГГГ\nНапример: 25.12.2025", {'remove_keyboard': True})
+            return
         else:
-            phone = text.strip()
-            if phone.startswith('8'):
-                phone = '+7' + phone[1:]
-            elif not phone.startswith('+'):
-                phone = '+7' + phone
+            delivery_date = datetime.strptime(text, '%d.%m.%Y')
         
-        if not validate_phone(phone):
-            send_message(chat_id, "❌ Неверный формат телефона\n\n📞 Введите номер в формате:\n+79991234567 или 89991234567")
-            log_security_event(chat_id, 'invalid_phone', f'Invalid phone format: {text}', 'low')
+        is_valid, error_msg = validate_date_not_past(delivery_date.strftime('%Y-%m-%d'))
+        if not is_valid:
+            send_message(chat_id, error_msg)
+            log_security_event(chat_id, 'past_date_attempt', f'Attempted past date: {text}', 'low')
             return
         
-        data['phone'] = phone
-        state['step'] = 'sender_rate'
-        send_message(chat_id, "💵 <b>Укажите желаемую ставку в рублях</b>\n\nНапример: 5000", {
+        data['delivery_date'] = delivery_date.strftime('%Y-%m-%d')
+        state['step'] = 'sender_pallet_quantity'
+        send_message(chat_id, "📦 <b>Укажите количество паллет</b>\n\nНапример: 5\nИли 0, если нет паллет", {
             'keyboard': [[{'text': '⬅️ Назад'}]], 'resize_keyboard': True, 'one_time_keyboard': False
         })
+    except ValueError:
+        send_message(chat_id, "❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+
+
+@step_router.route('sender_pallet_quantity')
+def step_sender_pallet_quantity(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    if not text.isdigit():
+        send_message(chat_id, "❌ Введите целое число")
+        return
     
-    elif step == 'sender_rate':
-        if not text.isdigit():
-            send_message(chat_id, "❌ Введите целое число. Например: 5000")
-            return
-        
-        value = int(text)
-        is_valid, error_msg = validate_number_range(value, 100, 900000, "Ставка")
-        if not is_valid:
-            send_message(chat_id, error_msg)
-            return
-        
-        data['rate'] = value
-        data['label_size'] = '120x75'
-        state['step'] = 'show_preview'
-        show_preview(chat_id, data)
+    value = int(text)
+    is_valid, error_msg = validate_number_range(value, 0, 33, "Количество паллет")
+    if not is_valid:
+        send_message(chat_id, error_msg)
+        return
     
+    data['pallet_quantity'] = value
+    state['step'] = 'sender_box_quantity'
+    send_message(chat_id, "📦 <b>Укажите количество коробок</b>\n\nНапример: 10\nИли 0, если нет коробок", {
+        'keyboard': [[{'text': '⬅️ Назад'}]], 'resize_keyboard': True, 'one_time_keyboard': False
+    })
 
+
+@step_router.route('sender_box_quantity')
+def step_sender_box_quantity(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    if not text.isdigit():
+        send_message(chat_id, "❌ Введите целое число")
+        return
     
-    elif step == 'carrier_warehouse':
-        if text.startswith('✅'):
-            warehouse = text.replace('✅', '').strip()
-        elif 'любой' in text.lower():
-            warehouse = 'Любой склад'
-        else:
-            warehouse = text
-        
-        data['warehouse'] = warehouse
-        state['step'] = 'carrier_car_brand'
-        
-        # Умный дефолт: предложить последнюю марку авто
-        defaults = get_user_defaults(chat_id)
-        keyboard = []
-        message = "🚗 <b>Укажите марку автомобиля</b>\n\nНапример: Mercedes"
-        
-        if defaults and defaults.get('last_car_model'):
-            # last_car_model хранит полную модель, извлечём марку (первое слово)
-            last_model = defaults['last_car_model']
-            keyboard.append([{'text': f"✅ {last_model}"}])
-            message += f"\n\n💡 В прошлый раз: {last_model}"
-        
-        send_message(chat_id, message, {
-            'keyboard': keyboard if keyboard else None, 'resize_keyboard': True
-        })
+    value = int(text)
+    is_valid, error_msg = validate_number_range(value, 0, 1000, "Количество коробок")
+    if not is_valid:
+        send_message(chat_id, error_msg)
+        return
     
-    elif step == 'carrier_car_brand':
-        # Если пользователь нажал на кнопку с последней моделью
-        if text.startswith('✅'):
-            car_info = text.replace('✅', '').strip()
-            # Если это полная модель (напр. "Mercedes Sprinter"), разделим
-            parts = car_info.split(maxsplit=1)
-            data['car_brand'] = parts[0] if parts else car_info
-            # Сразу переходим к номеру, пропуская модель
-            if len(parts) > 1:
-                data['car_model'] = parts[1]
-                state['step'] = 'carrier_license_plate'
-                
-                # Умный дефолт: предложить последний гос. номер
-                defaults = get_user_defaults(chat_id)
-                keyboard = []
-                message = "🔢 <b>Укажите гос. номер автомобиля</b>\n\nНапример: А000АА777"
-                
-                if defaults and defaults.get('last_license_plate'):
-                    last_plate = defaults['last_license_plate']
-                    keyboard.append([{'text': f"✅ {last_plate}"}])
-                    message += f"\n\n💡 В прошлый раз: {last_plate}"
-                
-                send_message(chat_id, message, {
-                    'keyboard': keyboard if keyboard else None, 'resize_keyboard': True
-                })
-                return
-        else:
-            data['car_brand'] = text
-        
-        state['step'] = 'carrier_car_model'
-        send_message(chat_id, "🚗 <b>Укажите модель автомобиля</b>\n\nНапример: Sprinter")
+    data['box_quantity'] = value
+    state['step'] = 'sender_name'
     
-    elif step == 'carrier_car_model':
-        data['car_model'] = text
-        state['step'] = 'carrier_license_plate'
-        
-        # Умный дефолт: предложить последний госномер
-        defaults = get_user_defaults(chat_id)
-        keyboard = []
-        message = "🔢 <b>Укажите гос. номер автомобиля</b>\n\nНапример: А000АА777"
-        
-        if defaults and defaults.get('last_license_plate'):
-            last_plate = defaults['last_license_plate']
-            keyboard.append([{'text': f"✅ {last_plate}"}])
-            message += f"\n\n💡 Или используйте последний номер"
-        
-        send_message(chat_id, message, {'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': False} if keyboard else None)
+    # Умный дефолт: предложить последнее ФИО
+    defaults = get_user_defaults(chat_id)
+    keyboard = [[{'text': '⬅️ Назад'}]]
+    message = "👤 <b>Укажите ФИО отправителя</b>\n\nНапример: Иванов Иван Иванович"
     
-    elif step == 'carrier_license_plate':
-        # Если пользователь нажал на кнопку с последним номером
-        if text.startswith('✅'):
-            license_plate = text.replace('✅', '').strip()
-        else:
-            license_plate = text.strip()
-        
-        data['license_plate'] = license_plate
-        state['step'] = 'carrier_pallet_capacity'
-        send_message(chat_id, "📦 <b>Укажите вместимость паллет</b>\n\nНапример: 10\nИли 0, если не перевозите паллеты")
+    if defaults and defaults.get('last_sender_name'):
+        last_name = defaults['last_sender_name']
+        keyboard.insert(0, [{'text': f"✅ {last_name}"}])
+        message += f"\n\n💡 Или используйте последнее ФИО"
     
-    elif step == 'carrier_pallet_capacity':
-        if not text.isdigit():
-            send_message(chat_id, "❌ Введите целое число")
-            return
-        
-        value = int(text)
-        is_valid, error_msg = validate_number_range(value, 0, 33, "Вместимость паллет")
-        if not is_valid:
-            send_message(chat_id, error_msg)
-            return
-        
-        data['pallet_capacity'] = value
-        state['step'] = 'carrier_box_capacity'
-        send_message(chat_id, "📦 <b>Укажите вместимость коробок</b>\n\nНапример: 50\nИли 0, если не перевозите коробки")
+    send_message(chat_id, message, {
+        'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': False
+    })
+
+
+@step_router.route('sender_name')
+def step_sender_name(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    # Если пользователь нажал на кнопку с последним ФИО
+    if text.startswith('✅'):
+        sender_name = text.replace('✅', '').strip()
+    else:
+        sender_name = text.strip()
     
-    elif step == 'carrier_box_capacity':
-        if not text.isdigit():
-            send_message(chat_id, "❌ Введите целое число")
+    if len(sender_name) < 3:
+        send_message(chat_id, "❌ ФИО должно содержать минимум 3 символа")
+        return
+    
+    data['sender_name'] = sender_name
+    state['step'] = 'sender_phone'
+    
+    # Умный дефолт: предложить последний телефон
+    defaults = get_user_defaults(chat_id)
+    keyboard = [[{'text': '⬅️ Назад'}]]
+    message = "📱 <b>Укажите номер телефона</b>\n\nФормат: +79991234567"
+    
+    if defaults and defaults.get('last_phone'):
+        last_phone = defaults['last_phone']
+        keyboard.insert(0, [{'text': f"✅ {last_phone}"}])
+        message += f"\n\n💡 Или используйте последний номер"
+    
+    send_message(chat_id, message, {
+        'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': False
+    })
+
+
+@step_router.route('sender_phone')
+def step_sender_phone(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    # Если пользователь нажал на кнопку с последним телефоном
+    if text.startswith('✅'):
+        phone = text.replace('✅', '').strip()
+    else:
+        phone = text.strip()
+        if phone.startswith('8'):
+            phone = '+7' + phone[1:]
+        elif not phone.startswith('+'):
+            phone = '+7' + phone
+    
+    if not validate_phone(phone):
+        send_message(chat_id, "❌ Неверный формат телефона\n\n📞 Введите номер в формате:\n+79991234567 или 89991234567")
+        log_security_event(chat_id, 'invalid_phone', f'Invalid phone format: {text}', 'low')
+        return
+    
+    data['phone'] = phone
+    state['step'] = 'sender_rate'
+    send_message(chat_id, "💵 <b>Укажите желаемую ставку в рублях</b>\n\nНапример: 5000", {
+        'keyboard': [[{'text': '⬅️ Назад'}]], 'resize_keyboard': True, 'one_time_keyboard': False
+    })
+
+
+@step_router.route('sender_rate')
+def step_sender_rate(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    if not text.isdigit():
+        send_message(chat_id, "❌ Введите целое число. Например: 5000")
+        return
+    
+    value = int(text)
+    is_valid, error_msg = validate_number_range(value, 100, 900000, "Ставка")
+    if not is_valid:
+        send_message(chat_id, error_msg)
+        return
+    
+    data['rate'] = value
+    data['label_size'] = '120x75'
+    state['step'] = 'show_preview'
+    show_preview(chat_id, data)
+
+
+@step_router.route('carrier_warehouse')
+def step_carrier_warehouse(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    if text.startswith('✅'):
+        warehouse = text.replace('✅', '').strip()
+    elif 'любой' in text.lower():
+        warehouse = 'Любой склад'
+    else:
+        warehouse = text
+        if offer_warehouse_suggestions(chat_id, data.get('marketplace'), warehouse.strip(), [[{'text': '📦 Любой склад'}]]):
             return
-        
-        value = int(text)
-        is_valid, error_msg = validate_number_range(value, 0, 2000, "Вместимость коробок")
-        if not is_valid:
-            send_message(chat_id, error_msg)
+    
+    data['warehouse'] = warehouse
+    state['step'] = 'carrier_car_brand'
+    
+    # Умный дефолт: предложить последнюю марку авто
+    defaults = get_user_defaults(chat_id)
+    keyboard = []
+    message = "🚗 <b>Укажите марку автомобиля</b>\n\nНапример: Mercedes"
+    
+    if defaults and defaults.get('last_car_model'):
+        # last_car_model хранит полную модель, извлечём марку (первое слово)
+        last_model = defaults['last_car_model']
+        keyboard.append([{'text': f"✅ {last_model}"}])
+        message += f"\n\n💡 В прошлый раз: {last_model}"
+    
+    send_message(chat_id, message, {
+        'keyboard': keyboard if keyboard else None, 'resize_keyboard': True
+    })
+
+
+@step_router.route('carrier_car_brand')
+def step_carrier_car_brand(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    # Если пользователь нажал на кнопку с последней моделью
+    if text.startswith('✅'):
+        car_info = text.replace('✅', '').strip()
+        # Если это полная модель (напр. "Mercedes Sprinter"), разделим
+        parts = car_info.split(maxsplit=1)
+        data['car_brand'] = parts[0] if parts else car_info
+        # Сразу переходим к номеру, пропуская модель
+        if len(parts) > 1:
+            data['car_model'] = parts[1]
+            state['step'] = 'carrier_license_plate'
+            
+            # Умный дефолт: предложить последний гос. номер
+            defaults = get_user_defaults(chat_id)
+            keyboard = []
+            message = "🔢 <b>Укажите гос. номер автомобиля</b>\n\nНапример: А000АА777"
+            
+            if defaults and defaults.get('last_license_plate'):
+                last_plate = defaults['last_license_plate']
+                keyboard.append([{'text': f"✅ {last_plate}"}])
+                message += f"\n\n💡 В прошлый раз: {last_plate}"
+            
+            send_message(chat_id, message, {
+                'keyboard': keyboard if keyboard else None, 'resize_keyboard': True
+            })
             return
-        
-        data['box_capacity'] = value
-        state['step'] = 'carrier_driver_name'
-        
-        # Умный дефолт: предложить последнее ФИО водителя
-        defaults = get_user_defaults(chat_id)
-        keyboard = []
-        message = "👤 <b>Укажите ФИО водителя</b>\n\nНапример: Петров Петр Петрович"
-        
-        if defaults and defaults.get('last_driver_name'):
-            last_driver = defaults['last_driver_name']
-            keyboard.append([{'text': f"✅ {last_driver}"}])
-            message += f"\n\n💡 Или используйте последнее ФИО"
-        
-        send_message(chat_id, message, {
-            'keyboard': keyboard if keyboard else None, 'resize_keyboard': True
-        })
+    else:
+        data['car_brand'] = text
     
-    elif step == 'carrier_driver_name':
-        # Если пользователь нажал на кнопку с последним ФИО
-        if text.startswith('✅'):
-            driver_name = text.replace('✅', '').strip()
-        else:
-            driver_name = text.strip()
-        
-        data['driver_name'] = driver_name
-        state['step'] = 'carrier_phone'
-        
-        # Умный дефолт: предложить последний телефон
-        defaults = get_user_defaults(chat_id)
-        keyboard = []
-        message = "📱 <b>Укажите номер телефона</b>\n\nФормат: +79991234567"
-        
-        if defaults and defaults.get('last_phone'):
-            last_phone = defaults['last_phone']
-            keyboard.append([{'text': f"✅ {last_phone}"}])
-            message += f"\n\n💡 Или используйте последний номер"
-        
-        send_message(chat_id, message, {
-            'keyboard': keyboard if keyboard else None, 'resize_keyboard': True
-        })
+    state['step'] = 'carrier_car_model'
+    send_message(chat_id, "🚗 <b>Укажите модель автомобиля</b>\n\nНапример: Sprinter")
+
+
+@step_router.route('carrier_car_model')
+def step_carrier_car_model(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    data['car_model'] = text
+    state['step'] = 'carrier_license_plate'
     
-    elif step == 'carrier_phone':
-        # Если пользователь нажал на кнопку с последним телефоном
-        if text.startswith('✅'):
-            phone = text.replace('✅', '').strip()
-        else:
-            phone = text.strip()
-            if phone.startswith('8'):
-                phone = '+7' + phone[1:]
-            elif not phone.startswith('+'):
-                phone = '+7' + phone
-        
-        if not validate_phone(phone):
-            send_message(chat_id, "❌ Неверный формат телефона\n\n📞 Введите номер в формате:\n+79991234567 или 89991234567")
-            log_security_event(chat_id, 'invalid_phone', f'Invalid phone format: {text}', 'low')
-            return
-        
-        data['phone'] = phone
-        state['step'] = 'carrier_hydroboard'
-        
-        # Умный дефолт: предложить последнее значение гидроборта
-        defaults = get_user_defaults(chat_id)
-        keyboard = [
-            [{'text': 'Есть'}],
-            [{'text': 'Нету'}]
-        ]
-        
-        message = "🚚 <b>Гидроборт</b>"
-        if defaults and defaults.get('last_hydroboard'):
-            last_hydroboard = defaults['last_hydroboard']
-            keyboard.insert(0, [{'text': f"✅ {last_hydroboard}"}])
-            message += f"\n\n💡 В прошлый раз: {last_hydroboard}"
-        
-        send_message(
-            chat_id,
-            message,
-            {
-                'keyboard': keyboard,
-                'resize_keyboard': True,
-                'one_time_keyboard': True
-            }
-        )
+    # Умный дефолт: предложить последний госномер
+    defaults = get_user_defaults(chat_id)
+    keyboard = []
+    message = "🔢 <b>Укажите гос. номер автомобиля</b>\n\nНапример: А000АА777"
     
-    elif step == 'carrier_hydroboard':
-        # Если пользователь нажал на кнопку с последним значением
-        if text.startswith('✅'):
-            hydroboard_value = text.replace('✅', '').strip()
-        else:
-            hydroboard_value = 'Есть' if 'есть' in text.lower() else 'Нету'
-        
-        data['hydroboard'] = hydroboard_value
-        state['step'] = 'carrier_loading_city'
-        
-        send_message(
-            chat_id,
-            "🏙 <b>Укажите город или населенный пункт погрузки</b>",
-            {
-                'keyboard': [
-                    [{'text': '🌐 Любой город'}]
-                ],
-                'resize_keyboard': True,
-                'one_time_keyboard': True
-            }
-        )
+    if defaults and defaults.get('last_license_plate'):
+        last_plate = defaults['last_license_plate']
+        keyboard.append([{'text': f"✅ {last_plate}"}])
+        message += f"\n\n💡 Или используйте последний номер"
+    
+    send_message(chat_id, message, {'keyboard': keyboard, 'resize_keyboard': True, 'one_time_keyboard': False} if keyboard else None)
+
+
+@step_router.route('carrier_license_plate')
+def step_carrier_license_plate(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    # Если пользователь нажал на кнопку с последним номером
+    if text.startswith('✅'):
+        license_plate = text.replace('✅', '').strip()
+    else:
+        license_plate = text.strip()
+    
+    data['license_plate'] = license_plate
+    state['step'] = 'carrier_pallet_capacity'
+    send_message(chat_id, "📦 <b>Укажите вместимость паллет</b>\n\nНапример: 10\nИли 0, если не перевозите паллеты")
+
+
+@step_router.route('carrier_pallet_capacity')
+def step_carrier_pallet_capacity(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    if not text.isdigit():
+        send_message(chat_id, "❌ Введите целое число")
+        return
+    
+    value = int(text)
+    is_valid, error_msg = validate_number_range(value, 0, 33, "Вместимость паллет")
+    if not is_valid:
+        send_message(chat_id, error_msg)
+        return
+    
+    data['pallet_capacity'] = value
+    state['step'] = 'carrier_box_capacity'
+    send_message(chat_id, "📦 <b>Укажите вместимость коробок</b>\n\nНапример: 50\nИли 0, если не перевозите коробки")
+
+
+@step_router.route('carrier_box_capacity')
+def step_carrier_box_capacity(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    if not text.isdigit():
+        send_message(chat_id, "❌ Введите целое число")
+        return
+    
+    value = int(text)
+    is_valid, error_msg = validate_number_range(value, 0, 2000, "Вместимость коробок")
+    if not is_valid:
+        send_message(chat_id, error_msg)
+        return
+    
+    data['box_capacity'] = value
+    state['step'] = 'carrier_driver_name'
+    
+    # Умный дефолт: предложить последнее ФИО водителя
+    defaults = get_user_defaults(chat_id)
+    keyboard = []
+    message = "👤 <b>Укажите ФИО водителя</b>\n\nНапример: Петров Петр Петрович"
+    
+    if defaults and defaults.get('last_driver_name'):
+        last_driver = defaults['last_driver_name']
+        keyboard.append([{'text': f"✅ {last_driver}"}])
+        message += f"\n\n💡 Или используйте последнее ФИО"
+    
+    send_message(chat_id, message, {
+        'keyboard': keyboard if keyboard else None, 'resize_keyboard': True
+    })
+
+
+@step_router.route('carrier_driver_name')
+def step_carrier_driver_name(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    # Если пользователь нажал на кнопку с последним ФИО
+    if text.startswith('✅'):
+        driver_name = text.replace('✅', '').strip()
+    else:
+        driver_name = text.strip()
+    
+    data['driver_name'] = driver_name
+    state['step'] = 'carrier_phone'
+    
+    # Умный дефолт: предложить последний телефон
+    defaults = get_user_defaults(chat_id)
+    keyboard = []
+    message = "📱 <b>Укажите номер телефона</b>\n\nФормат: +79991234567"
+    
+    if defaults and defaults.get('last_phone'):
+        last_phone = defaults['last_phone']
+        keyboard.append([{'text': f"✅ {last_phone}"}])
+        message += f"\n\n💡 Или используйте последний номер"
+    
+    send_message(chat_id, message, {
+        'keyboard': keyboard if keyboard else None, 'resize_keyboard': True
+    })
+
+
+@step_router.route('carrier_phone')
+def step_carrier_phone(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    # Если пользователь нажал на кнопку с последним телефоном
+    if text.startswith('✅'):
+        phone = text.replace('✅', '').strip()
+    else:
+        phone = text.strip()
+        if phone.startswith('8'):
+            phone = '+7' + phone[1:]
+        elif not phone.startswith('+'):
+            phone = '+7' + phone
+    
+    if not validate_phone(phone):
+        send_message(chat_id, "❌ Неверный формат телефона\n\n📞 Введите номер в формате:\n+79991234567 или 89991234567")
+        log_security_event(chat_id, 'invalid_phone', f'Invalid phone format: {text}', 'low')
+        return
+    
+    data['phone'] = phone
+    state['step'] = 'carrier_hydroboard'
+    
+    # Умный дефолт: предложить последнее значение гидроборта
+    defaults = get_user_defaults(chat_id)
+    keyboard = [
+        [{'text': 'Есть'}],
+        [{'text': 'Нету'}]
+    ]
+    
+    message = "🚚 <b>Гидроборт</b>"
+    if defaults and defaults.get('last_hydroboard'):
+        last_hydroboard = defaults['last_hydroboard']
+        keyboard.insert(0, [{'text': f"✅ {last_hydroboard}"}])
+        message += f"\n\n💡 В прошлый раз: {last_hydroboard}"
+    
+    send_message(
+        chat_id,
+        message,
+        {
+            'keyboard': keyboard,
+            'resize_keyboard': True,
+            'one_time_keyboard': True
+        }
+    )
+
+
+@step_router.route('carrier_hydroboard')
+def step_carrier_hydroboard(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    # Если пользователь нажал на кнопку с последним значением
+    if text.startswith('✅'):
+        hydroboard_value = text.replace('✅', '').strip()
+    else:
+        hydroboard_value = 'Есть' if 'есть' in text.lower() else 'Нету'
+    
+    data['hydroboard'] = hydroboard_value
+    state['step'] = 'carrier_loading_city'
+    
+    send_message(
+        chat_id,
+        "🏙 <b>Укажите город или населенный пункт погрузки</b>",
+        {
+            'keyboard': [
+                [{'text': '🌐 Любой город'}]
+            ],
+            'resize_keyboard': True,
+            'one_time_keyboard': True
+        }
+    )
+
+
+@step_router.route('carrier_loading_city')
+def step_carrier_loading_city(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    if '🌐' in text or 'любой' in text.lower():
+        data['loading_city'] = 'Любой город'
+    else:
+        data['loading_city'] = text
+    
+    state['step'] = 'carrier_loading_date'
+    
+    today = datetime.now()
+    tomorrow = today + timedelta(days=1)
     
-    elif step == 'carrier_loading_city':
-        if '🌐' in text or 'любой' in text.lower():
-            data['loading_city'] = 'Любой город'
+    send_message(
+        chat_id,
+        "📅 <b>Укажите желаемую дату ПОГРУЗКИ</b>\n\nВыберите из вариантов или введите дату вручную\nФормат: ДД.ММ.ГГГГ",
+        {
+            'keyboard': [
+                [{'text': f'🔴 Сегодня ({today.strftime("%d.%m.%Y")})'}],
+                [{'text': f'🟢 Завтра ({tomorrow.strftime("%d.%m.%Y")})'}]
+            ],
+            'resize_keyboard': True,
+            'one_time_keyboard': True
+        }
+    )
+
+
+@step_router.route('carrier_loading_date')
+def step_carrier_loading_date(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    try:
+        if 'сегодня' in text.lower() or '🔴' in text:
+            loading_date = datetime.now()
+        elif 'завтра' in text.lower() or '🟢' in text:
+            loading_date = datetime.now() + timedelta(days=1)
         else:
-            data['loading_city'] = text
+            text_cleaned = text.replace('🔴', '').replace('🟢', '').strip()
+            text_cleaned = text_cleaned.split('(')[-1].replace(')', '').strip() if '(' in text_cleaned else text_cleaned
+            loading_date = datetime.strptime(text_cleaned, '%d.%m.%Y')
         
-        state['step'] = 'carrier_loading_date'
+        is_valid, error_msg = validate_date_not_past(loading_date.strftime('%Y-%m-%d'))
+        if not is_valid:
+            send_message(chat_id, error_msg)
+            log_security_event(chat_id, 'past_date_attempt', f'Attempted past date: {text}', 'low')
+            return
+        
+        data['loading_date'] = loading_date.strftime('%Y-%m-%d')
+        state['step'] = 'carrier_arrival_date'
         
         today = datetime.now()
         tomorrow = today + timedelta(days=1)
         
         send_message(
             chat_id,
-            "📅 <b>Укажите желаемую дату ПОГРУЗКИ</b>\n\nВыберите из вариантов или введите дату вручную\nФормат: ДД.ММ.ГГГГ",
+            "📅 <b>Укажите дату прибытия на склад</b>\n\nВыберите из вариантов или введите дату вручную\nФормат: ДД.ММ.ГГГГ",
             {
                 'keyboard': [
                     [{'text': f'🔴 Сегодня ({today.strftime("%d.%m.%Y")})'}],
@@ -2458,67 +2453,33 @@ def process_message(chat_id: int, text: str, username: str = 'unknown'):
                 'one_time_keyboard': True
             }
         )
-    
-    elif step == 'carrier_loading_date':
-        try:
-            if 'сегодня' in text.lower() or '🔴' in text:
-                loading_date = datetime.now()
-            elif 'завтра' in text.lower() or '🟢' in text:
-                loading_date = datetime.now() + timedelta(days=1)
-            else:
-                text_cleaned = text.replace('🔴', '').replace('🟢', '').strip()
-                text_cleaned = text_cleaned.split('(')[-1].replace(')', '').strip() if '(' in text_cleaned else text_cleaned
-                loading_date = datetime.strptime(text_cleaned, '%d.%m.%Y')
-            
-            is_valid, error_msg = validate_date_not_past(loading_date.strftime('%Y-%m-%d'))
-            if not is_valid:
-                send_message(chat_id, error_msg)
-                log_security_event(chat_id, 'past_date_attempt', f'Attempted past date: {text}', 'low')
-                return
-            
-            data['loading_date'] = loading_date.strftime('%Y-%m-%d')
-            state['step'] = 'carrier_arrival_date'
-            
-            today = datetime.now()
-            tomorrow = today + timedelta(days=1)
-            
-            send_message(
-                chat_id,
-                "📅 <b>Укажите дату прибытия на склад</b>\n\nВыберите из вариантов или введите дату вручную\nФормат: ДД.ММ.ГГГГ",
-                {
-                    'keyboard': [
-                        [{'text': f'🔴 Сегодня ({today.strftime("%d.%m.%Y")})'}],
-                        [{'text': f'🟢 Завтра ({tomorrow.strftime("%d.%m.%Y")})'}]
-                    ],
-                    'resize_keyboard': True,
-                    'one_time_keyboard': True
-                }
-            )
-        except ValueError:
-            send_message(chat_id, "❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
-    
-    elif step == 'carrier_arrival_date':
-        try:
-            if 'сегодня' in text.lower() or '🔴' in text:
-                arrival_date = datetime.now()
-            elif 'завтра' in text.lower() or '🟢' in text:
-                arrival_date = datetime.now() + timedelta(days=1)
-            else:
-                text_cleaned = text.replace('🔴', '').replace('🟢', '').strip()
-                text_cleaned = text_cleaned.split('(')[-1].replace(')', '').strip() if '(' in text_cleaned else text_cleaned
-                arrival_date = datetime.strptime(text_cleaned, '%d.%m.%Y')
-            
-            is_valid, error_msg = validate_date_not_past(arrival_date.strftime('%Y-%m-%d'))
-            if not is_valid:
-                send_message(chat_id, error_msg)
-                log_security_event(chat_id, 'past_date_attempt', f'Attempted past date: {text}', 'low')
-                return
-            
-            data['arrival_date'] = arrival_date.strftime('%Y-%m-%d')
-            state['step'] = 'show_preview'
-            show_preview(chat_id, data)
-        except ValueError:
-            send_message(chat_id, "❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+    except ValueError:
+        send_message(chat_id, "❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+
+
+@step_router.route('carrier_arrival_date')
+def step_carrier_arrival_date(chat_id: int, text: str, state: Dict[str, Any], data: Dict[str, Any]):
+    try:
+        if 'сегодня' in text.lower() or '🔴' in text:
+            arrival_date = datetime.now()
+        elif 'завтра' in text.lower() or '🟢' in text:
+            arrival_date = datetime.now() + timedelta(days=1)
+        else:
+            text_cleaned = text.replace('🔴', '').replace('🟢', '').strip()
+            text_cleaned = text_cleaned.split('(')[-1].replace(')', '').strip() if '(' in text_cleaned else text_cleaned
+            arrival_date = datetime.strptime(text_cleaned, '%d.%m.%Y')
+        
+        is_valid, error_msg = validate_date_not_past(arrival_date.strftime('%Y-%m-%d'))
+        if not is_valid:
+            send_message(chat_id, error_msg)
+            log_security_event(chat_id, 'past_date_attempt', f'Attempted past date: {text}', 'low')
+            return
+        
+        data['arrival_date'] = arrival_date.strftime('%Y-%m-%d')
+        state['step'] = 'show_preview'
+        show_preview(chat_id, data)
+    except ValueError:
+        send_message(chat_id, "❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
 
 
 def generate_and_send_label(chat_id: int, data: Dict[str, Any]):
@@ -2530,7 +2491,7 @@ def send_label_to_user(chat_id: int, order_id: int, order_type: str, label_size:
     try:
         import base64
         
-        response = requests.post(
+        response = telegram_client.post(
             PDF_FUNCTION_URL,
             json={
                 'order_id': order_id,
@@ -2557,7 +2518,8 @@ def send_label_to_user(chat_id: int, order_id: int, order_type: str, label_size:
         send_message(chat_id, f"❌ Ошибка отправки термоэтикетки: {str(e)}")
 
 
-def show_preview(chat_id: int, data: Dict[str, Any]):
+def build_preview(data: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Текст и клавиатура превью заявки"""
     if data['type'] == 'sender':
         preview_text = (
             "📋 <b>ПРЕВЬЮ ЗАЯВКИ ОТПРАВИТЕЛЯ</b>\n\n"
@@ -2672,6 +2634,11 @@ def show_preview(chat_id: int, data: Dict[str, Any]):
             ]
         }
     
+    return preview_text, keyboard
+
+
+def show_preview(chat_id: int, data: Dict[str, Any]):
+    preview_text, keyboard = build_preview(data)
     send_message(chat_id, preview_text, keyboard)
 
 
@@ -2698,109 +2665,83 @@ def save_sender_order(chat_id: int, data: Dict[str, Any]):
                 )
                 return
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        warehouse_norm = normalize_warehouse(data.get('warehouse', ''))
+        loading_city = data.get('loading_city', '')
+        loading_city_norm = normalize_city(loading_city)
+        
+        # Определяем тип груза на основе количества (только 'pallet' или 'box')
+        pallet_qty = data.get('pallet_quantity', 0)
+        box_qty = data.get('box_quantity', 0)
+        if pallet_qty > 0:
+            cargo_type = 'pallet'
+        else:
+            cargo_type = 'box'
+        
+        if edit_mode and original_order_id:
+            db.execute('update_sender_order', (
+                data.get('loading_address'), data.get('warehouse'), cargo_type, data.get('sender_name'), data.get('phone'),
+                data.get('loading_date'), data.get('loading_time'), data.get('delivery_date'),
+                data.get('pallet_quantity', 0), data.get('box_quantity', 0), data.get('marketplace'), data.get('rate'),
+                warehouse_norm, loading_city, loading_city_norm, original_order_id, chat_id
+            ), fetch='one')
+            order_id = original_order_id
+        else:
+            result = db.execute('insert_sender_order', (
+                data.get('loading_address'), data.get('warehouse'), cargo_type, data.get('sender_name'), data.get('phone'),
+                data.get('loading_date'), data.get('loading_time'), data.get('delivery_date'),
+                data.get('pallet_quantity', 0), data.get('box_quantity', 0), data.get('marketplace'), chat_id, data.get('rate'),
+                warehouse_norm, loading_city, loading_city_norm
+            ), fetch='one')
+            if result is None:
+                raise Exception("INSERT query returned no result")
+            order_id = result[0]
+        
+        if edit_mode:
+            send_message(
+                chat_id,
+                f"✅ <b>Заявка #{order_id} обновлена!</b>\n\nИзменения сохранены."
+            )
+        else:
+            delivery_date_str = data.get('delivery_date', '')
+            try:
+                from datetime import datetime, timedelta
+                delivery_date_obj = datetime.strptime(delivery_date_str, '%Y-%m-%d')
+                delete_date = delivery_date_obj + timedelta(hours=48)
+                delete_date_str = delete_date.strftime('%d.%m.%Y %H:%M')
+                auto_delete_warning = f"\n\n⏰ <b>Важно:</b> Заявка будет автоматически удалена {delete_date_str} (через 48 часов после даты поставки)"
+            except:
+                auto_delete_warning = "\n\n⏰ <b>Важно:</b> Заявка будет автоматически удалена через 48 часов после даты поставки на склад"
+            
+            send_message(
+                chat_id,
+                f"✅ <b>Заявка #{order_id} создана!</b>\n\nВаш груз добавлен в систему.{auto_delete_warning}"
+            )
+            
+            data['chat_id'] = chat_id
+        
+        # Этикетка, уведомления и подбор независимы — выполняются одновременно
+        label_size = data.get('label_size', '120x75')
+        tasks = [
+            ('send_notifications_to_subscribers', lambda: send_notifications_to_subscribers(order_id, 'sender', data)),
+            ('find_matching_orders_by_date', lambda: find_matching_orders_by_date(order_id, 'sender', data)),
+        ]
+        if not edit_mode:
+            tasks = [
+                ('send_label_to_user', lambda: send_label_to_user(chat_id, order_id, 'sender', label_size)),
+                ('notify_about_new_order', lambda: notify_about_new_order(order_id, 'sender', data)),
+            ] + tasks
+        fanout.run_all(tasks)
+        
+        if not edit_mode:
+            record_warehouse_usage(data.get('marketplace'), data.get('warehouse', ''))
         
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                warehouse_norm = normalize_warehouse(data.get('warehouse', ''))
-                loading_city = data.get('loading_city', '')
-                loading_city_norm = normalize_city(loading_city)
-                
-                # Определяем тип груза на основе количества (только 'pallet' или 'box')
-                pallet_qty = data.get('pallet_quantity', 0)
-                box_qty = data.get('box_quantity', 0)
-                if pallet_qty > 0:
-                    cargo_type = 'pallet'
-                else:
-                    cargo_type = 'box'
-                
-                # Экранируем строки для SQL
-                def escape_sql(value):
-                    if value is None:
-                        return 'NULL'
-                    if isinstance(value, (int, float)):
-                        return str(value)
-                    return "'" + str(value).replace("'", "''") + "'"
-                
-                if edit_mode and original_order_id:
-                    query = f"""
-                        UPDATE t_p52349012_telegram_bot_creatio.sender_orders
-                        SET loading_address = {escape_sql(data.get('loading_address'))},
-                            warehouse = {escape_sql(data.get('warehouse'))},
-                            cargo_type = {escape_sql(cargo_type)},
-                            sender_name = {escape_sql(data.get('sender_name'))},
-                            phone = {escape_sql(data.get('phone'))},
-                            loading_date = {escape_sql(data.get('loading_date'))},
-                            loading_time = {escape_sql(data.get('loading_time'))},
-                            delivery_date = {escape_sql(data.get('delivery_date'))},
-                            pallet_quantity = {data.get('pallet_quantity', 0)},
-                            box_quantity = {data.get('box_quantity', 0)},
-                            marketplace = {escape_sql(data.get('marketplace'))},
-                            rate = {escape_sql(data.get('rate'))},
-                            warehouse_normalized = {escape_sql(warehouse_norm)},
-                            loading_city = {escape_sql(loading_city)},
-                            loading_city_normalized = {escape_sql(loading_city_norm)}
-                        WHERE id = {original_order_id} AND chat_id = {chat_id}
-                        RETURNING id
-                    """
-                    order_id = original_order_id
-                else:
-                    query = f"""
-                        INSERT INTO t_p52349012_telegram_bot_creatio.sender_orders
-                        (loading_address, warehouse, cargo_type, sender_name, phone, loading_date, loading_time, delivery_date, pallet_quantity, box_quantity, label_size, marketplace, chat_id, rate, warehouse_normalized, loading_city, loading_city_normalized)
-                        VALUES ({escape_sql(data.get('loading_address'))}, {escape_sql(data.get('warehouse'))}, {escape_sql(cargo_type)}, {escape_sql(data.get('sender_name'))}, {escape_sql(data.get('phone'))}, {escape_sql(data.get('loading_date'))}, {escape_sql(data.get('loading_time'))}, {escape_sql(data.get('delivery_date'))}, {data.get('pallet_quantity', 0)}, {data.get('box_quantity', 0)}, '120x75', {escape_sql(data.get('marketplace'))}, {chat_id}, {escape_sql(data.get('rate'))}, {escape_sql(warehouse_norm)}, {escape_sql(loading_city)}, {escape_sql(loading_city_norm)})
-                        RETURNING id
-                    """
-                
-                cur.execute(query)
-                
-                if not edit_mode:
-                    result = cur.fetchone()
-                    
-                    if result is None:
-                        raise Exception("INSERT query returned no result")
-                    
-                    order_id = result['id'] if isinstance(result, dict) else result[0]
-                conn.commit()
-                
-                if edit_mode:
-                    send_message(
-                        chat_id,
-                        f"✅ <b>Заявка #{order_id} обновлена!</b>\n\nИзменения сохранены."
-                    )
-                else:
-                    delivery_date_str = data.get('delivery_date', '')
-                    try:
-                        from datetime import datetime, timedelta
-                        delivery_date_obj = datetime.strptime(delivery_date_str, '%Y-%m-%d')
-                        delete_date = delivery_date_obj + timedelta(hours=48)
-                        delete_date_str = delete_date.strftime('%d.%m.%Y %H:%M')
-                        auto_delete_warning = f"\n\n⏰ <b>Важно:</b> Заявка будет автоматически удалена {delete_date_str} (через 48 часов после даты поставки)"
-                    except:
-                        auto_delete_warning = "\n\n⏰ <b>Важно:</b> Заявка будет автоматически удалена через 48 часов после даты поставки на склад"
-                    
-                    send_message(
-                        chat_id,
-                        f"✅ <b>Заявка #{order_id} создана!</b>\n\nВаш груз добавлен в систему.{auto_delete_warning}"
-                    )
-                    
-                    label_size = data.get('label_size', '120x75')
-                    send_label_to_user(chat_id, order_id, 'sender', label_size)
-                    data['chat_id'] = chat_id
-                    notify_about_new_order(order_id, 'sender', data)
-                send_notifications_to_subscribers(order_id, 'sender', data)
-                find_matching_orders_by_date(order_id, 'sender', data)
-                
-                # Сохраняем дефолтные значения для будущих заявок
-                save_user_defaults(chat_id, data, 'sender')
-                
-                if chat_id in user_states:
-                    del user_states[chat_id]
-                
-                show_main_menu(chat_id)
+        # Сохраняем дефолтные значения для будущих заявок
+        save_user_defaults(chat_id, data, 'sender')
         
-        finally:
-            conn.close()
+        if chat_id in user_states:
+            del user_states[chat_id]
+        
+        show_main_menu(chat_id)
     
     except Exception as e:
         print(f"[ERROR] save_sender_order failed: {str(e)}")
@@ -2831,94 +2772,65 @@ def save_carrier_order(chat_id: int, data: Dict[str, Any]):
                 )
                 return
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        warehouse_norm = normalize_warehouse(data.get('warehouse', ''))
+        loading_city = data.get('loading_city', '')
+        loading_city_norm = normalize_city(loading_city)
+        
+        # Определяем capacity_type на основе количества
+        pallet_cap = data.get('pallet_capacity', 0)
+        box_cap = data.get('box_capacity', 0)
+        capacity_type = 'pallet' if pallet_cap > 0 else 'box'
+        
+        if edit_mode and original_order_id:
+            db.execute('update_carrier_order', (
+                data.get('car_brand'), data.get('license_plate'), capacity_type, data.get('driver_name'), data.get('phone'),
+                data.get('warehouse'), data.get('car_model'), pallet_cap, box_cap, data.get('marketplace'),
+                data.get('loading_date'), data.get('arrival_date'), data.get('hydroboard'),
+                warehouse_norm, loading_city, loading_city_norm, original_order_id, chat_id
+            ), fetch='one')
+            order_id = original_order_id
+        else:
+            result = db.execute('insert_carrier_order', (
+                data.get('car_brand'), data.get('license_plate'), capacity_type, data.get('driver_name'), data.get('phone'),
+                data.get('warehouse'), data.get('car_model'), pallet_cap, box_cap, data.get('marketplace'),
+                data.get('loading_date'), data.get('arrival_date'), data.get('hydroboard'), chat_id,
+                warehouse_norm, loading_city, loading_city_norm
+            ), fetch='one')
+            if result is None:
+                raise Exception("INSERT query returned no result")
+            order_id = result[0]
         
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                warehouse_norm = normalize_warehouse(data.get('warehouse', ''))
-                loading_city = data.get('loading_city', '')
-                loading_city_norm = normalize_city(loading_city)
-                
-                # Определяем capacity_type на основе количества
-                pallet_cap = data.get('pallet_capacity', 0)
-                box_cap = data.get('box_capacity', 0)
-                capacity_type = 'pallet' if pallet_cap > 0 else 'box'
-                
-                # Экранируем строки для SQL
-                def escape_sql(value):
-                    if value is None:
-                        return 'NULL'
-                    if isinstance(value, (int, float)):
-                        return str(value)
-                    return "'" + str(value).replace("'", "''") + "'"
-                
-                if edit_mode and original_order_id:
-                    query = f"""
-                        UPDATE t_p52349012_telegram_bot_creatio.carrier_orders
-                        SET car_brand = {escape_sql(data.get('car_brand'))},
-                            license_plate = {escape_sql(data.get('license_plate'))},
-                            capacity_type = {escape_sql(capacity_type)},
-                            driver_name = {escape_sql(data.get('driver_name'))},
-                            phone = {escape_sql(data.get('phone'))},
-                            warehouse = {escape_sql(data.get('warehouse'))},
-                            car_model = {escape_sql(data.get('car_model'))},
-                            pallet_capacity = {pallet_cap},
-                            box_capacity = {box_cap},
-                            marketplace = {escape_sql(data.get('marketplace'))},
-                            loading_date = {escape_sql(data.get('loading_date'))},
-                            arrival_date = {escape_sql(data.get('arrival_date'))},
-                            hydroboard = {escape_sql(data.get('hydroboard'))},
-                            warehouse_normalized = {escape_sql(warehouse_norm)},
-                            loading_city = {escape_sql(loading_city)},
-                            loading_city_normalized = {escape_sql(loading_city_norm)}
-                        WHERE id = {original_order_id} AND chat_id = {chat_id}
-                        RETURNING id
-                    """
-                    order_id = original_order_id
-                else:
-                    query = f"""
-                        INSERT INTO t_p52349012_telegram_bot_creatio.carrier_orders
-                        (car_brand, license_plate, capacity_type, driver_name, phone, warehouse, car_model, pallet_capacity, box_capacity, marketplace, loading_date, arrival_date, hydroboard, chat_id, warehouse_normalized, loading_city, loading_city_normalized)
-                        VALUES ({escape_sql(data.get('car_brand'))}, {escape_sql(data.get('license_plate'))}, {escape_sql(capacity_type)}, {escape_sql(data.get('driver_name'))}, {escape_sql(data.get('phone'))}, {escape_sql(data.get('warehouse'))}, {escape_sql(data.get('car_model'))}, {pallet_cap}, {box_cap}, {escape_sql(data.get('marketplace'))}, {escape_sql(data.get('loading_date'))}, {escape_sql(data.get('arrival_date'))}, {escape_sql(data.get('hydroboard'))}, {chat_id}, {escape_sql(warehouse_norm)}, {escape_sql(loading_city)}, {escape_sql(loading_city_norm)})
-                        RETURNING id
-                    """
-                
-                cur.execute(query)
-                
-                if not edit_mode:
-                    result = cur.fetchone()
-                    
-                    if result is None:
-                        raise Exception("INSERT query returned no result")
-                    
-                    order_id = result['id'] if isinstance(result, dict) else result[0]
-                conn.commit()
-                
-                if edit_mode:
-                    send_message(
-                        chat_id,
-                        f"✅ <b>Заявка #{order_id} обновлена!</b>\n\nИзменения сохранены."
-                    )
-                else:
-                    send_message(
-                        chat_id,
-                        f"✅ <b>Заявка #{order_id} создана!</b>\n\nОтправители получили уведомление о вашем предложении."
-                    )
-                    data['chat_id'] = chat_id
-                    notify_about_new_order(order_id, 'carrier', data)
-                send_notifications_to_subscribers(order_id, 'carrier', data)
-                find_matching_orders_by_date(order_id, 'carrier', data)
-                
-                # Сохраняем дефолтные значения для будущих заявок
-                save_user_defaults(chat_id, data, 'carrier')
-                
-                if chat_id in user_states:
-                    del user_states[chat_id]
-                
-                show_main_menu(chat_id)
+        if edit_mode:
+            send_message(
+                chat_id,
+                f"✅ <b>Заявка #{order_id} обновлена!</b>\n\nИзменения сохранены."
+            )
+        else:
+            send_message(
+                chat_id,
+                f"✅ <b>Заявка #{order_id} создана!</b>\n\nОтправители получили уведомление о вашем предложении."
+            )
+            data['chat_id'] = chat_id
         
-        finally:
-            conn.close()
+        # Уведомления и подбор независимы — выполняются одновременно
+        tasks = [
+            ('send_notifications_to_subscribers', lambda: send_notifications_to_subscribers(order_id, 'carrier', data)),
+            ('find_matching_orders_by_date', lambda: find_matching_orders_by_date(order_id, 'carrier', data)),
+        ]
+        if not edit_mode:
+            tasks.insert(0, ('notify_about_new_order', lambda: notify_about_new_order(order_id, 'carrier', data)))
+        fanout.run_all(tasks)
+        
+        if not edit_mode and data.get('warehouse') != 'Любой склад':
+            record_warehouse_usage(data.get('marketplace'), data.get('warehouse', ''))
+        
+        # Сохраняем дефолтные значения для будущих заявок
+        save_user_defaults(chat_id, data, 'carrier')
+        
+        if chat_id in user_states:
+            del user_states[chat_id]
+        
+        show_main_menu(chat_id)
     
     except Exception as e:
         print(f"[ERROR] save_carrier_order failed: {str(e)}")
@@ -2926,7 +2838,7 @@ def save_carrier_order(chat_id: int, data: Dict[str, Any]):
 
 
 def get_blocked_users() -> list:
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
             cur.execute("SELECT chat_id FROM t_p52349012_telegram_bot_creatio.blocked_users")
@@ -2938,46 +2850,18 @@ def get_blocked_users() -> list:
 
 
 def show_admin_stats(chat_id: int):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.sender_orders")
-            sender_count = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.carrier_orders")
-            carrier_count = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.blocked_users")
-            blocked_count = cur.fetchone()[0]
-            
-            # Подсчёт уникальных пользователей
-            cur.execute("""
-                SELECT COUNT(DISTINCT chat_id) FROM (
-                    SELECT chat_id FROM t_p52349012_telegram_bot_creatio.sender_orders
-                    UNION
-                    SELECT chat_id FROM t_p52349012_telegram_bot_creatio.carrier_orders
-                ) AS users
-            """)
-            total_users = cur.fetchone()[0]
-            
-            cur.execute("""
-                SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.sender_orders 
-                WHERE loading_date < CURRENT_DATE - INTERVAL '1 day'
-            """)
-            old_sender = cur.fetchone()[0]
-            
-            stats_text = (
-                f"📊 <b>Статистика бота</b>\n\n"
-                f"👥 <b>Всего пользователей: {total_users}</b>\n\n"
-                f"📦 Заявок отправителей: {sender_count}\n"
-                f"🚚 Заявок перевозчиков: {carrier_count}\n"
-                f"🚫 Заблокировано пользователей: {blocked_count}\n"
-                f"⏰ Устаревших заявок: {old_sender}"
-            )
-            
-            send_message(chat_id, stats_text)
-    finally:
-        conn.close()
+    stats = get_admin_stats()
+    
+    stats_text = (
+        f"📊 <b>Статистика бота</b>\n\n"
+        f"👥 <b>Всего пользователей: {stats['total_users']}</b>\n\n"
+        f"📦 Заявок отправителей: {stats['sender_count']}\n"
+        f"🚚 Заявок перевозчиков: {stats['carrier_count']}\n"
+        f"🚫 Заблокировано пользователей: {stats['blocked_count']}\n"
+        f"⏰ Устаревших заявок: {stats['old_sender']}"
+    )
+    
+    send_message(chat_id, stats_text)
 
 
 def handle_admin_input(chat_id: int, text: str, action: str):
@@ -2989,7 +2873,7 @@ def handle_admin_input(chat_id: int, text: str, action: str):
             return
         
         order_id = int(text)
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = db.open_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute(
@@ -3019,7 +2903,7 @@ def handle_admin_input(chat_id: int, text: str, action: str):
             return
         
         user_chat_id = int(text)
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = db.open_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute(
@@ -3039,7 +2923,7 @@ def handle_admin_input(chat_id: int, text: str, action: str):
             return
         
         user_chat_id = int(text)
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = db.open_connection()
         try:
             with conn.cursor() as cur:
                 cur.execute(
@@ -3055,149 +2939,111 @@ def handle_admin_input(chat_id: int, text: str, action: str):
 
 
 def cleanup_old_orders(chat_id: int):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                DELETE FROM t_p52349012_telegram_bot_creatio.sender_orders 
-                WHERE delivery_date < CURRENT_DATE - INTERVAL '5 days'
-            """)
-            deleted_count = cur.rowcount
-            conn.commit()
-            
-            send_message(chat_id, f"🧹 Удалено старых заявок отправителей: {deleted_count}")
-    finally:
-        conn.close()
+    moved = maintenance.run_order_expiry()
+    send_message(
+        chat_id,
+        f"🧹 Перенесено в архив истёкших заявок:\n"
+        f"📦 Отправителей: {moved.get('sender', 0)}\n"
+        f"🚚 Перевозчиков: {moved.get('carrier', 0)}"
+    )
 
 
 def show_weekly_stats(chat_id: int):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor() as cur:
-            week_ago = datetime.now() - timedelta(days=7)
-            week_ago_str = week_ago.strftime('%Y-%m-%d')
-            
-            cur.execute("""
-                SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.sender_orders 
-                WHERE created_at >= %s
-            """, (week_ago_str,))
-            new_sender = cur.fetchone()[0]
-            
-            cur.execute("""
-                SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.carrier_orders 
-                WHERE created_at >= %s
-            """, (week_ago_str,))
-            new_carrier = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.sender_orders")
-            total_sender = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM t_p52349012_telegram_bot_creatio.carrier_orders")
-            total_carrier = cur.fetchone()[0]
-            
-            cur.execute("""
-                SELECT marketplace, COUNT(*) as cnt 
-                FROM t_p52349012_telegram_bot_creatio.sender_orders 
-                WHERE created_at >= %s AND marketplace IS NOT NULL
-                GROUP BY marketplace 
-                ORDER BY cnt DESC 
-                LIMIT 3
-            """, (week_ago_str,))
-            top_marketplaces = cur.fetchall()
-            
-            cur.execute("""
-                SELECT warehouse, COUNT(*) as cnt 
-                FROM t_p52349012_telegram_bot_creatio.sender_orders 
-                WHERE created_at >= %s AND warehouse IS NOT NULL
-                GROUP BY warehouse 
-                ORDER BY cnt DESC 
-                LIMIT 3
-            """, (week_ago_str,))
-            top_warehouses = cur.fetchall()
-            
-            stats_text = (
-                f"📈 <b>ЕЖЕНЕДЕЛЬНЫЙ ОТЧЁТ</b>\n"
-                f"📅 {week_ago.strftime('%d.%m.%Y')} - {datetime.now().strftime('%d.%m.%Y')}\n\n"
-                f"📊 <b>Новые заявки за неделю:</b>\n"
-                f"📦 Отправителей: {new_sender}\n"
-                f"🚚 Перевозчиков: {new_carrier}\n"
-                f"📊 Всего: {new_sender + new_carrier}\n\n"
-                f"📊 <b>Общая статистика:</b>\n"
-                f"📦 Всего отправителей: {total_sender}\n"
-                f"🚚 Всего перевозчиков: {total_carrier}\n"
-            )
-            
-            if top_marketplaces:
-                stats_text += "\n🏪 <b>Топ маркетплейсов недели:</b>\n"
-                for mp, cnt in top_marketplaces:
-                    stats_text += f"• {mp}: {cnt} заявок\n"
-            
-            if top_warehouses:
-                stats_text += "\n📍 <b>Топ складов недели:</b>\n"
-                for wh, cnt in top_warehouses:
-                    stats_text += f"• {wh}: {cnt} заявок\n"
-            
-            send_message(chat_id, stats_text)
-    finally:
-        conn.close()
+    week_ago = datetime.now() - timedelta(days=7)
+    stats = get_weekly_stats(week_ago.date())
+    
+    new_sender = stats['new_sender']
+    new_carrier = stats['new_carrier']
+    top_marketplaces = stats['top_marketplaces']
+    top_warehouses = stats['top_warehouses']
+    
+    stats_text = (
+        f"📈 <b>ЕЖЕНЕДЕЛЬНЫЙ ОТЧЁТ</b>\n"
+        f"📅 {week_ago.strftime('%d.%m.%Y')} - {datetime.now().strftime('%d.%m.%Y')}\n\n"
+        f"📊 <b>Новые заявки за неделю:</b>\n"
+        f"📦 Отправителей: {new_sender}\n"
+        f"🚚 Перевозчиков: {new_carrier}\n"
+        f"📊 Всего: {new_sender + new_carrier}\n\n"
+        f"📊 <b>Общая статистика:</b>\n"
+        f"📦 Всего отправителей: {stats['total_sender']}\n"
+        f"🚚 Всего перевозчиков: {stats['total_carrier']}\n"
+    )
+    
+    if top_marketplaces:
+        stats_text += "\n🏪 <b>Топ маркетплейсов недели:</b>\n"
+        for item in top_marketplaces:
+            stats_text += f"• {sanitize_html(item['name'])}: {item['cnt']} заявок\n"
+    
+    if top_warehouses:
+        stats_text += "\n📍 <b>Топ складов недели:</b>\n"
+        for item in top_warehouses:
+            stats_text += f"• {sanitize_html(item['name'])}: {item['cnt']} заявок\n"
+    
+    send_message(chat_id, stats_text)
 
 
-def show_my_orders(chat_id: int):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                "SELECT id, marketplace, warehouse, loading_date FROM t_p52349012_telegram_bot_creatio.sender_orders WHERE chat_id = %s ORDER BY id DESC LIMIT 10",
-                (chat_id,)
-            )
-            sender_orders = cur.fetchall()
-            
-            cur.execute(
-                "SELECT id, marketplace, warehouse, loading_date, arrival_date FROM t_p52349012_telegram_bot_creatio.carrier_orders WHERE chat_id = %s ORDER BY id DESC LIMIT 10",
-                (chat_id,)
+def send_or_edit(chat_id: int, message_id: Optional[int], text: str, reply_markup: Optional[Dict] = None):
+    """Отрисовать экран: новым сообщением или на месте сообщения с нажатой кнопкой"""
+    if message_id:
+        edit_message(chat_id, message_id, text, reply_markup)
+    else:
+        send_message(chat_id, text, reply_markup)
+
+
+def format_order_line(order: Dict[str, Any], order_type: str) -> str:
+    """Строка заявки в списке «Мои заявки»"""
+    route = f"#{order['id']} - {sanitize_html(order.get('marketplace') or '-')} → {sanitize_html(order.get('warehouse') or '-')}"
+    if order_type == 'sender':
+        return f"{route} ({order.get('loading_date') or '-'})"
+    return f"{route} ({order.get('loading_date') or '-'} - {order.get('target_date') or '-'})"
+
+
+def show_my_orders(chat_id: int, order_type: Optional[str] = None, direction: str = 'first', anchor: int = 0,
+                   message_id: Optional[int] = None):
+    """Заявки пользователя одной страницей; переключение типа и страниц редактирует то же сообщение"""
+    if order_type is None:
+        page = order_pages.fetch_page('sender', owner_chat_id=chat_id)
+        if not page.orders:
+            page = order_pages.fetch_page('carrier', owner_chat_id=chat_id)
+    else:
+        page = order_pages.fetch_page(order_type, direction, anchor, owner_chat_id=chat_id)
+    order_type = page.order_type
+    other_type = 'carrier' if order_type == 'sender' else 'sender'
+    switch_row = [{
+        'text': '🚚 Заявки перевозчика' if other_type == 'carrier' else '📦 Заявки отправителя',
+        'callback_data': order_pages.page_callback('my_orders', other_type)
+    }]
+    
+    if not page.orders:
+        if direction == 'first' and message_id is None:
+            send_message(
+                chat_id,
+                "📭 <b>У вас пока нет заявок</b>\n\nСоздайте заявку через главное меню, выбрав роль отправителя или перевозчика."
             )
-            carrier_orders = cur.fetchall()
-            
-            if not sender_orders and not carrier_orders:
-                send_message(
-                    chat_id,
-                    "📭 <b>У вас пока нет заявок</b>\n\nСоздайте заявку через главное меню, выбрав роль отправителя или перевозчика."
-                )
-                return
-            
-            if sender_orders:
-                send_message(chat_id, "📦 <b>Ваши заявки отправителя:</b>")
-                for order in sender_orders:
-                    order_text = f"#{order['id']} - {order.get('marketplace', '-')} → {order.get('warehouse', '-')} ({order.get('loading_date', '-')})"
-                    keyboard = {
-                        'inline_keyboard': [
-                            [
-                                {'text': '🗑️ Удалить', 'callback_data': f"delete_order_sender_{order['id']}"}
-                            ]
-                        ]
-                    }
-                    send_message(chat_id, order_text, keyboard)
-            
-            if carrier_orders:
-                send_message(chat_id, "🚚 <b>Ваши заявки перевозчика:</b>")
-                for order in carrier_orders:
-                    loading = order.get('loading_date', '-')
-                    arrival = order.get('arrival_date', '-')
-                    order_text = f"#{order['id']} - {order.get('marketplace', '-')} → {order.get('warehouse', '-')} ({loading} - {arrival})"
-                    keyboard = {
-                        'inline_keyboard': [
-                            [
-                                {'text': '🗑️ Удалить', 'callback_data': f"delete_order_carrier_{order['id']}"}
-                            ]
-                        ]
-                    }
-                    send_message(chat_id, order_text, keyboard)
-    finally:
-        conn.close()
+        else:
+            title = 'отправителя' if order_type == 'sender' else 'перевозчика'
+            send_or_edit(chat_id, message_id, f"📭 <b>Заявок {title} нет</b>", {'inline_keyboard': [switch_row]})
+        return
+    
+    title = "📦 <b>Ваши заявки отправителя:</b>" if order_type == 'sender' else "🚚 <b>Ваши заявки перевозчика:</b>"
+    lines = [format_order_line(order, order_type) for order in page.orders]
+    buttons = [
+        [
+            {'text': f"✏️ #{order['id']}", 'callback_data': f"edit_order_{order_type}_{order['id']}"},
+            {'text': f"🗑️ #{order['id']}", 'callback_data': f"delete_order_{order_type}_{order['id']}"}
+        ]
+        for order in page.orders
+    ]
+    nav = order_pages.nav_row(page, 'my_orders')
+    if nav:
+        buttons.append(nav)
+    buttons.append(switch_row)
+    
+    send_or_edit(chat_id, message_id, title + "\n\n" + "\n".join(lines), {'inline_keyboard': buttons})
 
 
 def delete_user_order(chat_id: int, order_id: int, order_type: str, message_id: int):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
             table = 'sender_orders' if order_type == 'sender' else 'carrier_orders'
@@ -3206,14 +3052,15 @@ def delete_user_order(chat_id: int, order_id: int, order_type: str, message_id:
                 (order_id, chat_id)
             )
             conn.commit()
-        
-        delete_message(chat_id, message_id)
     finally:
         conn.close()
+    
+    # Сообщение со списком перерисовывается без удалённой заявки
+    show_my_orders(chat_id, order_type if order_type in order_pages.ORDER_TYPES else None, message_id=message_id)
 
 
 def load_order_for_edit(chat_id: int, order_id: int, order_type: str):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             if order_type == 'sender':
@@ -3248,9 +3095,37 @@ def load_order_for_edit(chat_id: int, order_id: int, order_type: str):
         conn.close()
 
 
+def build_new_order_notification(order_id: int, order_type: str, data: Dict[str, Any]) -> str:
+    """Текст уведомления админам о новой заявке"""
+    if order_type == 'sender':
+        return (
+            f"🆕 <b>Новая заявка отправителя #{order_id}</b>\n\n"
+            f"🏪 Маркетплейс: {sanitize_html(data.get('marketplace', '-'))}\n"
+            f"📍 Склад: {sanitize_html(data.get('warehouse'))}\n"
+            f"🏠 Адрес: {sanitize_html(data.get('loading_address'))}\n"
+            f"📅 Дата: {data.get('loading_date')} {data.get('loading_time')}\n"
+            f"📦 Паллеты: {data.get('pallet_quantity', 0)}\n"
+            f"📦 Коробки: {data.get('box_quantity', 0)}\n"
+            f"👤 Отправитель: {sanitize_html(data.get('sender_name'))}\n"
+            f"📱 Телефон: {sanitize_html(data.get('phone'))}"
+        )
+    return (
+        f"🆕 <b>Новая заявка перевозчика #{order_id}</b>\n\n"
+        f"🏪 Маркетплейс: {sanitize_html(data.get('marketplace', '-'))}\n"
+        f"📍 Склад: {sanitize_html(data.get('warehouse'))}\n"
+        f"🚗 Авто: {sanitize_html(data.get('car_brand'))} {sanitize_html(data.get('car_model'))}\n"
+        f"🔢 Номер: {sanitize_html(data.get('license_plate'))}\n"
+        f"📦 Вместимость: {data.get('pallet_capacity', 0)} паллет, {data.get('box_capacity', 0)} коробок\n"
+        f"👤 Водитель: {sanitize_html(data.get('driver_name'))}\n"
+        f"📱 Телефон: {sanitize_html(data.get('phone'))}\n"
+        f"📅 Погрузка: {data.get('loading_date', '-')}\n"
+        f"📅 Прибытие: {data.get('arrival_date', '-')}"
+    )
+
+
 def notify_about_new_order(order_id: int, order_type: str, data: Dict[str, Any]):
     """Отправляет уведомления о новой заявке всем активным админам"""
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -3270,38 +3145,10 @@ def notify_about_new_order(order_id: int, order_type: str, data: Dict[str, Any])
                 # Фоллбек на старый способ через переменную окружения
                 admins = [{'chat_id': int(ADMIN_CHAT_ID)}]
             
-            if order_type == 'sender':
-                message = (
-                    f"🆕 <b>Новая заявка отправителя #{order_id}</b>\n\n"
-                    f"🏪 Маркетплейс: {sanitize_html(data.get('marketplace', '-'))}\n"
-                    f"📍 Склад: {sanitize_html(data.get('warehouse'))}\n"
-                    f"🏠 Адрес: {sanitize_html(data.get('loading_address'))}\n"
-                    f"📅 Дата: {data.get('loading_date')} {data.get('loading_time')}\n"
-                    f"📦 Паллеты: {data.get('pallet_quantity', 0)}\n"
-                    f"📦 Коробки: {data.get('box_quantity', 0)}\n"
-                    f"👤 Отправитель: {sanitize_html(data.get('sender_name'))}\n"
-                    f"📱 Телефон: {sanitize_html(data.get('phone'))}"
-                )
-            else:
-                message = (
-                    f"🆕 <b>Новая заявка перевозчика #{order_id}</b>\n\n"
-                    f"🏪 Маркетплейс: {sanitize_html(data.get('marketplace', '-'))}\n"
-                    f"📍 Склад: {sanitize_html(data.get('warehouse'))}\n"
-                    f"🚗 Авто: {sanitize_html(data.get('car_brand'))} {sanitize_html(data.get('car_model'))}\n"
-                    f"🔢 Номер: {sanitize_html(data.get('license_plate'))}\n"
-                    f"📦 Вместимость: {data.get('pallet_capacity', 0)} паллет, {data.get('box_capacity', 0)} коробок\n"
-                    f"👤 Водитель: {sanitize_html(data.get('driver_name'))}\n"
-                    f"📱 Телефон: {sanitize_html(data.get('phone'))}\n"
-                    f"📅 Погрузка: {data.get('loading_date', '-')}\n"
-                    f"📅 Прибытие: {data.get('arrival_date', '-')}"
-                )
+            message = build_new_order_notification(order_id, order_type, data)
             
             # Отправляем всем админам
-            for admin in admins:
-                try:
-                    send_message(admin['chat_id'], message)
-                except Exception as e:
-                    print(f"[ERROR] Failed to notify admin {admin['chat_id']}: {str(e)}")
+            fanout.send_all(send_message, [(admin['chat_id'], message) for admin in admins], 'notify admin')
     
     finally:
         conn.close()
@@ -3335,7 +3182,7 @@ def ask_notification_settings(chat_id: int, user_type: str, data: Dict[str, Any]
     
     user_states[chat_id] = {
         'step': 'setup_notifications',
-        'data': {'user_type': user_type, 'warehouse': data.get('warehouse')},
+        'data': {'user_type': user_type, 'warehouse': data.get('warehouse'), 'marketplace': data.get('marketplace')},
         'last_activity': time.time()
     }
     
@@ -3346,109 +3193,116 @@ def handle_notification_setup(chat_id: int, text: str, data: Dict[str, Any]):
     user_type = data.get('user_type')
     warehouse = data.get('warehouse')
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    
-    try:
-        with conn.cursor() as cur:
-            if 'да' in text.lower() and 'всех' in text.lower():
-                cur.execute(
-                    """
-                    INSERT INTO t_p52349012_telegram_bot_creatio.user_subscriptions
-                    (chat_id, user_type, subscription_type, warehouse_filter)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT DO NOTHING
-                    """,
-                    (chat_id, user_type, 'all', None)
-                )
-                send_message(
-                    chat_id,
-                    f"✅ Вы подписаны на все новые заявки!\n\nВведите /start для создания новой заявки",
-                    {'remove_keyboard': True}
-                )
-            elif 'только' in text.lower() or warehouse:
-                target_warehouse = warehouse if 'только' in text.lower() else text
-                cur.execute(
-                    """
-                    INSERT INTO t_p52349012_telegram_bot_creatio.user_subscriptions
-                    (chat_id, user_type, subscription_type, warehouse_filter)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT DO NOTHING
-                    """,
-                    (chat_id, user_type, 'warehouse', target_warehouse)
-                )
-                send_message(
-                    chat_id,
-                    f"✅ Вы подписаны на заявки по складу: {target_warehouse}\n\nВведите /start для создания новой заявки",
-                    {'remove_keyboard': True}
-                )
-            else:
-                send_message(
-                    chat_id,
-                    "❌ Подписка на уведомления отключена\n\nВведите /start для создания новой заявки",
-                    {'remove_keyboard': True}
-                )
-            
-            conn.commit()
-            
-            del user_states[chat_id]
+    if 'да' in text.lower() and 'всех' in text.lower():
+        subscriptions.subscribe(chat_id, user_type, 'all')
+        send_message(
+            chat_id,
+            f"✅ Вы подписаны на все новые заявки!\n\n"
+            f"Получать их сводкой, а не по одной: /digest\n\nВведите /start для создания новой заявки",
+            {'remove_keyboard': True}
+        )
+    elif 'только' in text.lower() or warehouse:
+        target_warehouse = warehouse if 'только' in text.lower() else text
+        # Подписка на склад ограничена маркетплейсом заявки, из которой её оформили
+        subscriptions.subscribe(chat_id, user_type, 'warehouse', target_warehouse, data.get('marketplace'))
+        send_message(
+            chat_id,
+            f"✅ Вы подписаны на заявки по складу: {target_warehouse}\n\n"
+            f"Получать их сводкой, а не по одной: /digest\n\nВведите /start для создания новой заявки",
+            {'remove_keyboard': True}
+        )
+    else:
+        send_message(
+            chat_id,
+            "❌ Подписка на уведомления отключена\n\nВведите /start для создания новой заявки",
+            {'remove_keyboard': True}
+        )
     
-    finally:
-        conn.close()
+    del user_states[chat_id]
+
+
+def build_subscriber_notification(order_id: int, order_type: str, data: Dict[str, Any]) -> str:
+    """Текст уведомления подписчикам о новой заявке"""
+    if order_type == 'sender':
+        return (
+            f"🆕 <b>Новая заявка отправителя #{order_id}</b>\n\n"
+            f"🏪 Маркетплейс: {sanitize_html(data.get('marketplace', '-'))}\n"
+            f"📍 Склад: {sanitize_html(data.get('warehouse'))}\n"
+            f"📅 Дата: {data.get('loading_date')} {data.get('loading_time')}\n"
+            f"📦 Груз: {data.get('pallet_quantity', 0)} паллет, {data.get('box_quantity', 0)} коробок\n"
+            f"💵 Ставка: {data.get('rate', '-')} руб.\n"
+            f"👤 Отправитель: {sanitize_html(data.get('sender_name'))}\n"
+            f"📱 Телефон: {sanitize_html(data.get('phone'))}"
+        )
+    return (
+        f"🆕 <b>Новая заявка перевозчика #{order_id}</b>\n\n"
+        f"🏪 Маркетплейс: {sanitize_html(data.get('marketplace', '-'))}\n"
+        f"📍 Склад: {sanitize_html(data.get('warehouse'))}\n"
+        f"🚗 Авто: {sanitize_html(data.get('car_brand'))} {sanitize_html(data.get('car_model'))}\n"
+        f"📦 Вместимость: {data.get('pallet_capacity', 0)} паллет, {data.get('box_capacity', 0)} коробок\n"
+        f"🚚 Гидроборт: {sanitize_html(data.get('hydroboard', '-'))}\n"
+        f"👤 Водитель: {sanitize_html(data.get('driver_name'))}\n"
+        f"📱 Телефон: {sanitize_html(data.get('phone'))}"
+    )
 
 
 def send_notifications_to_subscribers(order_id: int, order_type: str, data: Dict[str, Any]):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            target_user_type = 'carrier' if order_type == 'sender' else 'sender'
-            warehouse = data.get('warehouse', '')
-            
-            cur.execute(
-                """
-                SELECT DISTINCT us.chat_id, us.warehouse_filter 
-                FROM t_p52349012_telegram_bot_creatio.user_subscriptions us
-                WHERE us.user_type = %s
-                AND (us.subscription_type = 'all' 
-                     OR (us.subscription_type = 'warehouse' 
-                         AND us.warehouse_filter = %s))
-                """,
-                (target_user_type, warehouse)
-            )
-            
-            subscribers = cur.fetchall()
-            
-            if order_type == 'sender':
-                message = (
-                    f"🆕 <b>Новая заявка отправителя #{order_id}</b>\n\n"
-                    f"🏪 Маркетплейс: {sanitize_html(data.get('marketplace', '-'))}\n"
-                    f"📍 Склад: {sanitize_html(data.get('warehouse'))}\n"
-                    f"📅 Дата: {data.get('loading_date')} {data.get('loading_time')}\n"
-                    f"📦 Груз: {data.get('pallet_quantity', 0)} паллет, {data.get('box_quantity', 0)} коробок\n"
-                    f"💵 Ставка: {data.get('rate', '-')} руб.\n"
-                    f"👤 Отправитель: {sanitize_html(data.get('sender_name'))}\n"
-                    f"📱 Телефон: {sanitize_html(data.get('phone'))}"
-                )
-            else:
-                message = (
-                    f"🆕 <b>Новая заявка перевозчика #{order_id}</b>\n\n"
-                    f"🏪 Маркетплейс: {sanitize_html(data.get('marketplace', '-'))}\n"
-                    f"📍 Склад: {sanitize_html(data.get('warehouse'))}\n"
-                    f"🚗 Авто: {sanitize_html(data.get('car_brand'))} {sanitize_html(data.get('car_model'))}\n"
-                    f"📦 Вместимость: {data.get('pallet_capacity', 0)} паллет, {data.get('box_capacity', 0)} коробок\n"
-                    f"🚚 Гидроборт: {sanitize_html(data.get('hydroboard', '-'))}\n"
-                    f"👤 Водитель: {sanitize_html(data.get('driver_name'))}\n"
-                    f"📱 Телефон: {sanitize_html(data.get('phone'))}"
-                )
-            
-            for subscriber in subscribers:
-                try:
-                    send_message(subscriber['chat_id'], message)
-                except:
-                    pass
-    
-    finally:
-        conn.close()
+    """Уведомить подписчиков: в режиме «сразу» — сообщением, остальных — строкой в сводке"""
+    target_user_type = 'carrier' if order_type == 'sender' else 'sender'
+    # Получатели считаются по карте подписок в памяти, без запроса на каждую заявку
+    targets = subscriptions.find_targets(target_user_type, data.get('warehouse', ''), data.get('marketplace', ''))
+    # При редактировании заявки подписчики, которым о ней уже сообщили, пропускаются
+    kind = sent_notifications.subscriber_kind(order_type)
+    claimed = sent_notifications.claim([(chat_id, order_id, kind) for chat_id in targets])
+    targets = {chat_id: minutes for chat_id, minutes in targets.items() if (chat_id, order_id, kind) in claimed}
+    
+    immediate = [chat_id for chat_id, digest_minutes in targets.items() if not digest_minutes]
+    deferred = [chat_id for chat_id, digest_minutes in targets.items() if digest_minutes]
+    
+    if immediate:
+        message = build_subscriber_notification(order_id, order_type, data)
+        sent_notifications.send_claimed(
+            send_message, [(chat_id, message, [(chat_id, order_id, kind)]) for chat_id in immediate], 'notify subscriber')
+    if deferred:
+        digest.enqueue(order_id, order_type, data, deferred)
+
+
+def build_carrier_matches_message(order_id: int, delivery_date: Any, warehouse: str,
+                                  matches: List[Dict[str, Any]]) -> str:
+    """Список подходящих перевозчиков для отправителя"""
+    message = f"🎯 <b>Найдены подходящие перевозчики для вашей заявки #{order_id}!</b>\n\n"
+    message += f"📅 Дата поставки: {delivery_date}\n"
+    message += f"📍 Склад: {warehouse}\n\n"
+    
+    for i, match in enumerate(matches, 1):
+        message += (
+            f"<b>{i}. {match['driver_name']}</b>\n"
+            f"🚗 {match['car_brand']} {match['car_model']}\n"
+            f"📦 Вместимость: {match['pallet_capacity']} паллет, {match['box_capacity']} коробок\n"
+            f"🚚 Гидроборт: {match.get('hydroboard', '-')}\n"
+            f"📱 Телефон: {match['phone']}\n"
+            f"📅 Прибытие на склад: {match.get('arrival_date', '-')}\n\n"
+        )
+    return message
+
+
+def build_sender_matches_message(order_id: int, arrival_date: Any, warehouse: str,
+                                 matches: List[Dict[str, Any]]) -> str:
+    """Список подходящих отправителей для перевозчика"""
+    message = f"🎯 <b>Найдены подходящие отправители для вашей заявки #{order_id}!</b>\n\n"
+    message += f"📅 Дата прибытия: {arrival_date}\n"
+    message += f"📍 Склад: {warehouse}\n\n"
+    
+    for i, match in enumerate(matches, 1):
+        message += (
+            f"<b>{i}. {match['sender_name']}</b>\n"
+            f"📦 Груз: {match['pallet_quantity']} паллет, {match['box_quantity']} коробок\n"
+            f"💵 Ставка: {match.get('rate', '-')} руб.\n"
+            f"🏠 Адрес: {match['loading_address']}\n"
+            f"📱 Телефон: {match['phone']}\n"
+            f"🕐 Время погрузки: {match.get('loading_time', '-')}\n\n"
+        )
+    return message
 
 
 def find_matching_orders_by_date(order_id: int, order_type: str, data: Dict[str, Any]):
@@ -3457,228 +3311,161 @@ def find_matching_orders_by_date(order_id: int, order_type: str, data: Dict[str,
     - Отправитель видит только перевозчиков (по дате поставки, складу, вместимости)
     - Перевозчик видит только отправителей (по дате поставки, складу, вместимости)
     """
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            if order_type == 'sender':
-                # Отправитель создал заявку - ищем перевозчиков с подходящей вместимостью
-                delivery_date = data.get('delivery_date')
-                warehouse = data.get('warehouse')
-                marketplace = data.get('marketplace')
-                sender_chat_id = data.get('chat_id')
-                sender_pallet_qty = data.get('pallet_quantity', 0)
-                sender_box_qty = data.get('box_quantity', 0)
-                loading_city = data.get('loading_city', '')
-                
-                if not delivery_date:
-                    return
+    if order_type == 'sender':
+        # Отправитель создал заявку - ищем перевозчиков с подходящей вместимостью
+        delivery_date = data.get('delivery_date')
+        warehouse = data.get('warehouse')
+        marketplace = data.get('marketplace')
+        sender_chat_id = data.get('chat_id')
+        sender_pallet_qty = data.get('pallet_quantity', 0)
+        sender_box_qty = data.get('box_quantity', 0)
+        loading_city = data.get('loading_city', '')
+        
+        if not delivery_date:
+            return
+        
+        warehouse_norm = normalize_warehouse(warehouse)
+        loading_city_norm = normalize_city(loading_city)
+        
+        statement, warehouse_params = backfill.match_statement('match_carriers_for_sender', warehouse_norm, warehouse)
+        matches = db.execute(
+            statement,
+            (delivery_date, *warehouse_params, marketplace, loading_city_norm,
+             sender_pallet_qty, sender_box_qty),
+            fetch='all', dict_rows=True
+        )
+        
+        if matches:
+            # Отправителю — список перевозчиков, о которых ему ещё не сообщали
+            owner_kind = sent_notifications.match_kind('carrier', order_id)
+            owner_keys = [(sender_chat_id, match['id'], owner_kind) for match in matches] if sender_chat_id else []
+            counterparts = []
+            
+            # Отправляем перевозчикам уведомление о новом подходящем отправителе
+            for match in matches:
+                carrier_chat_id = match.get('chat_id')
+                carrier_pallet_cap = match.get('pallet_capacity', 0)
+                carrier_box_cap = match.get('box_capacity', 0)
                 
-                warehouse_norm = normalize_warehouse(warehouse)
-                loading_city_norm = normalize_city(loading_city)
+                # Проверка: груз должен помещаться в машину
+                is_match = False
+                if sender_pallet_qty > 0:
+                    # Есть паллеты - нужна вместимость по паллетам
+                    if carrier_pallet_cap >= sender_pallet_qty:
+                        is_match = True
+                else:
+                    # Только коробки - подойдет любая машина с достаточной вместимостью коробок
+                    if carrier_pallet_cap > 0 or carrier_box_cap >= sender_box_qty:
+                        is_match = True
                 
-                cur.execute(
-                    """
-                    SELECT id, phone, driver_name, car_brand, car_model, 
-                           pallet_capacity, box_capacity, loading_date, arrival_date, hydroboard, warehouse, chat_id, loading_city
-                    FROM t_p52349012_telegram_bot_creatio.carrier_orders
-                    WHERE arrival_date = %s
-                    AND (warehouse_normalized = %s OR warehouse = %s)
-                    AND marketplace = %s
-                    AND (loading_city_normalized = %s OR loading_city = 'Любой город')
-                    AND (
-                        (pallet_capacity >= %s) OR
-                        (pallet_capacity = 0 AND box_capacity >= %s)
+                if carrier_chat_id and is_match:
+                    carrier_message = (
+                        f"🎯 <b>Найдена подходящая заявка отправителя #{order_id}!</b>\n\n"
+                        f"📅 Дата поставки: {delivery_date}\n"
+                        f"📍 Склад: {warehouse}\n"
+                        f"🏪 Маркетплейс: {marketplace}\n"
+                        f"📦 Груз: {sender_pallet_qty} паллет, {sender_box_qty} коробок\n"
+                        f"💵 Ставка: {data.get('rate', '-')} руб.\n"
+                        f"👤 Отправитель: {data.get('sender_name')}\n"
+                        f"📱 Телефон: {data.get('phone')}\n"
+                        f"🏠 Адрес: {data.get('loading_address')}"
                     )
-                    ORDER BY id DESC
-                    LIMIT 5
-                    """,
-                    (delivery_date, warehouse_norm, warehouse, marketplace, loading_city_norm,
-                     sender_pallet_qty, sender_box_qty)
-                )
-                
-                matches = cur.fetchall()
-                
-                if matches:
-                    # Отправляем отправителю список подходящих перевозчиков
-                    if sender_chat_id:
-                        message = f"🎯 <b>Найдены подходящие перевозчики для вашей заявки #{order_id}!</b>\n\n"
-                        message += f"📅 Дата поставки: {delivery_date}\n"
-                        message += f"📍 Склад: {warehouse}\n\n"
-                        
-                        for i, match in enumerate(matches, 1):
-                            message += (
-                                f"<b>{i}. {match['driver_name']}</b>\n"
-                                f"🚗 {match['car_brand']} {match['car_model']}\n"
-                                f"📦 Вместимость: {match['pallet_capacity']} паллет, {match['box_capacity']} коробок\n"
-                                f"🚚 Гидроборт: {match.get('hydroboard', '-')}\n"
-                                f"📱 Телефон: {match['phone']}\n"
-                                f"📅 Прибытие на склад: {match.get('arrival_date', '-')}\n\n"
-                            )
-                        
-                        try:
-                            send_message(sender_chat_id, message)
-                        except Exception as e:
-                            print(f"[ERROR] Failed to send match notification to sender {sender_chat_id}: {str(e)}")
-                    
-                    # Отправляем перевозчикам уведомление о новом подходящем отправителе
-                    for match in matches:
-                        carrier_chat_id = match.get('chat_id')
-                        carrier_pallet_cap = match.get('pallet_capacity', 0)
-                        carrier_box_cap = match.get('box_capacity', 0)
-                        
-                        # Проверка: груз должен помещаться в машину
-                        is_match = False
-                        if sender_pallet_qty > 0:
-                            # Есть паллеты - нужна вместимость по паллетам
-                            if carrier_pallet_cap >= sender_pallet_qty:
-                                is_match = True
-                        else:
-                            # Только коробки - подойдет любая машина с достаточной вместимостью коробок
-                            if carrier_pallet_cap > 0 or carrier_box_cap >= sender_box_qty:
-                                is_match = True
-                        
-                        if carrier_chat_id and is_match:
-                            carrier_message = (
-                                f"🎯 <b>Найдена подходящая заявка отправителя #{order_id}!</b>\n\n"
-                                f"📅 Дата поставки: {delivery_date}\n"
-                                f"📍 Склад: {warehouse}\n"
-                                f"🏪 Маркетплейс: {marketplace}\n"
-                                f"📦 Груз: {sender_pallet_qty} паллет, {sender_box_qty} коробок\n"
-                                f"💵 Ставка: {data.get('rate', '-')} руб.\n"
-                                f"👤 Отправитель: {data.get('sender_name')}\n"
-                                f"📱 Телефон: {data.get('phone')}\n"
-                                f"🏠 Адрес: {data.get('loading_address')}"
-                            )
-                            
-                            try:
-                                send_message(carrier_chat_id, carrier_message)
-                            except Exception as e:
-                                print(f"[ERROR] Failed to send match notification to carrier {carrier_chat_id}: {str(e)}")
+                    counterparts.append(((carrier_chat_id, order_id, sent_notifications.match_kind('sender')), carrier_message))
             
-            else:
-                # Перевозчик создал заявку - ищем отправителей с подходящим грузом
-                arrival_date = data.get('arrival_date')
-                warehouse = data.get('warehouse')
-                marketplace = data.get('marketplace')
-                carrier_chat_id = data.get('chat_id')
-                carrier_pallet_cap = data.get('pallet_capacity', 0)
-                carrier_box_cap = data.get('box_capacity', 0)
-                loading_city = data.get('loading_city', '')
-                
-                if not arrival_date:
-                    return
-                
-                warehouse_norm = normalize_warehouse(warehouse)
-                loading_city_norm = normalize_city(loading_city)
+            # Одна отметка в журнале на все сообщения; уже отправленные пропускаются
+            claimed = sent_notifications.claim(owner_keys + [key for key, _ in counterparts])
+            outgoing = []
+            new_matches = [(match, key) for match, key in zip(matches, owner_keys) if key in claimed]
+            if new_matches:
+                outgoing.append((sender_chat_id, build_carrier_matches_message(
+                    order_id, delivery_date, warehouse, [match for match, _ in new_matches]), [key for _, key in new_matches]))
+            outgoing += [(key[0], text, [key]) for key, text in counterparts if key in claimed]
+            sent_notifications.send_claimed(send_message, outgoing, 'match notification')
+    
+    else:
+        # Перевозчик создал заявку - ищем отправителей с подходящим грузом
+        arrival_date = data.get('arrival_date')
+        warehouse = data.get('warehouse')
+        marketplace = data.get('marketplace')
+        carrier_chat_id = data.get('chat_id')
+        carrier_pallet_cap = data.get('pallet_capacity', 0)
+        carrier_box_cap = data.get('box_capacity', 0)
+        loading_city = data.get('loading_city', '')
+        
+        if not arrival_date:
+            return
+        
+        warehouse_norm = normalize_warehouse(warehouse)
+        loading_city_norm = normalize_city(loading_city)
+        
+        # Если перевозчик указал "Любой город", ищем всех отправителей
+        if loading_city == 'Любой город':
+            statement, warehouse_params = backfill.match_statement('match_senders_any_city', warehouse_norm, warehouse)
+            matches = db.execute(
+                statement,
+                (arrival_date, *warehouse_params, marketplace,
+                 carrier_pallet_cap, carrier_pallet_cap, carrier_box_cap),
+                fetch='all', dict_rows=True
+            )
+        else:
+            statement, warehouse_params = backfill.match_statement('match_senders_for_carrier', warehouse_norm, warehouse)
+            matches = db.execute(
+                statement,
+                (arrival_date, *warehouse_params, marketplace, loading_city_norm,
+                 carrier_pallet_cap, carrier_pallet_cap, carrier_box_cap),
+                fetch='all', dict_rows=True
+            )
+        
+        if matches:
+            # Перевозчику — список отправителей, о которых ему ещё не сообщали
+            owner_kind = sent_notifications.match_kind('sender', order_id)
+            owner_keys = [(carrier_chat_id, match['id'], owner_kind) for match in matches] if carrier_chat_id else []
+            counterparts = []
+            
+            # Отправляем отправителям уведомление о новом подходящем перевозчике
+            for match in matches:
+                sender_chat_id = match.get('chat_id')
+                sender_pallet_qty = match.get('pallet_quantity', 0)
+                sender_box_qty = match.get('box_quantity', 0)
                 
-                # Если перевозчик указал "Любой город", ищем всех отправителей
-                if loading_city == 'Любой город':
-                    cur.execute(
-                        """
-                        SELECT id, phone, sender_name, loading_address, loading_city,
-                               pallet_quantity, box_quantity, loading_date, loading_time, delivery_date, rate, warehouse, chat_id
-                        FROM t_p52349012_telegram_bot_creatio.sender_orders
-                        WHERE delivery_date = %s
-                        AND (warehouse_normalized = %s OR warehouse = %s)
-                        AND marketplace = %s
-                        AND (
-                            (%s >= pallet_quantity) OR
-                            (%s = 0 AND %s >= box_quantity)
-                        )
-                        ORDER BY id DESC
-                        LIMIT 5
-                        """,
-                        (arrival_date, warehouse_norm, warehouse, marketplace,
-                         carrier_pallet_cap, carrier_pallet_cap, carrier_box_cap)
-                    )
+                # Проверка: груз должен помещаться в машину
+                is_match = False
+                if sender_pallet_qty > 0:
+                    # Есть паллеты - нужна вместимость по паллетам
+                    if carrier_pallet_cap >= sender_pallet_qty:
+                        is_match = True
                 else:
-                    cur.execute(
-                        """
-                        SELECT id, phone, sender_name, loading_address, loading_city,
-                               pallet_quantity, box_quantity, loading_date, loading_time, delivery_date, rate, warehouse, chat_id
-                        FROM t_p52349012_telegram_bot_creatio.sender_orders
-                        WHERE delivery_date = %s
-                        AND (warehouse_normalized = %s OR warehouse = %s)
-                        AND marketplace = %s
-                        AND loading_city_normalized = %s
-                        AND (
-                            (%s >= pallet_quantity) OR
-                            (%s = 0 AND %s >= box_quantity)
-                        )
-                        ORDER BY id DESC
-                        LIMIT 5
-                        """,
-                        (arrival_date, warehouse_norm, warehouse, marketplace, loading_city_norm,
-                         carrier_pallet_cap, carrier_pallet_cap, carrier_box_cap)
-                    )
-                
-                matches = cur.fetchall()
+                    # Только коробки - подойдет любая машина с достаточной вместимостью
+                    if carrier_pallet_cap > 0 or carrier_box_cap >= sender_box_qty:
+                        is_match = True
                 
-                if matches:
-                    # Отправляем перевозчику список подходящих отправителей
-                    if carrier_chat_id:
-                        message = f"🎯 <b>Найдены подходящие отправители для вашей заявки #{order_id}!</b>\n\n"
-                        message += f"📅 Дата прибытия: {arrival_date}\n"
-                        message += f"📍 Склад: {warehouse}\n\n"
-                        
-                        for i, match in enumerate(matches, 1):
-                            message += (
-                                f"<b>{i}. {match['sender_name']}</b>\n"
-                                f"📦 Груз: {match['pallet_quantity']} паллет, {match['box_quantity']} коробок\n"
-                                f"💵 Ставка: {match.get('rate', '-')} руб.\n"
-                                f"🏠 Адрес: {match['loading_address']}\n"
-                                f"📱 Телефон: {match['phone']}\n"
-                                f"🕐 Время погрузки: {match.get('loading_time', '-')}\n\n"
-                            )
-                        
-                        try:
-                            send_message(carrier_chat_id, message)
-                        except Exception as e:
-                            print(f"[ERROR] Failed to send match notification to carrier {carrier_chat_id}: {str(e)}")
-                    
-                    # Отправляем отправителям уведомление о новом подходящем перевозчике
-                    for match in matches:
-                        sender_chat_id = match.get('chat_id')
-                        sender_pallet_qty = match.get('pallet_quantity', 0)
-                        sender_box_qty = match.get('box_quantity', 0)
-                        
-                        # Проверка: груз должен помещаться в машину
-                        is_match = False
-                        if sender_pallet_qty > 0:
-                            # Есть паллеты - нужна вместимость по паллетам
-                            if carrier_pallet_cap >= sender_pallet_qty:
-                                is_match = True
-                        else:
-                            # Только коробки - подойдет любая машина с достаточной вместимостью
-                            if carrier_pallet_cap > 0 or carrier_box_cap >= sender_box_qty:
-                                is_match = True
-                        
-                        if sender_chat_id and is_match:
-                            sender_message = (
-                                f"🎯 <b>Найдена подходящая заявка перевозчика #{order_id}!</b>\n\n"
-                                f"📅 Дата прибытия: {arrival_date}\n"
-                                f"📍 Склад: {warehouse}\n"
-                                f"🏪 Маркетплейс: {marketplace}\n"
-                                f"🚗 Авто: {data.get('car_brand')} {data.get('car_model')}\n"
-                                f"📦 Вместимость: {carrier_pallet_cap} паллет, {carrier_box_cap} коробок\n"
-                                f"🚚 Гидроборт: {data.get('hydroboard', '-')}\n"
-                                f"👤 Водитель: {data.get('driver_name')}\n"
-                                f"📱 Телефон: {data.get('phone')}\n"
-                                f"📅 Погрузка: {data.get('loading_date', '-')}"
-                            )
-                            
-                            try:
-                                send_message(sender_chat_id, sender_message)
-                            except Exception as e:
-                                print(f"[ERROR] Failed to send match notification to sender {sender_chat_id}: {str(e)}")
-    
-    finally:
-        conn.close()
+                if sender_chat_id and is_match:
+                    sender_message = (
+                        f"🎯 <b>Найдена подходящая заявка перевозчика #{order_id}!</b>\n\n"
+                        f"📅 Дата прибытия: {arrival_date}\n"
+                        f"📍 Склад: {warehouse}\n"
+                        f"🏪 Маркетплейс: {marketplace}\n"
+                        f"🚗 Авто: {data.get('car_brand')} {data.get('car_model')}\n"
+                        f"📦 Вместимость: {carrier_pallet_cap} паллет, {carrier_box_cap} коробок\n"
+                        f"🚚 Гидроборт: {data.get('hydroboard', '-')}\n"
+                        f"👤 Водитель: {data.get('driver_name')}\n"
+                        f"📱 Телефон: {data.get('phone')}\n"
+                        f"📅 Погрузка: {data.get('loading_date', '-')}"
+                    )
+                    counterparts.append(((sender_chat_id, order_id, sent_notifications.match_kind('carrier')), sender_message))
+            
+            claimed = sent_notifications.claim(owner_keys + [key for key, _ in counterparts])
+            outgoing = []
+            new_matches = [(match, key) for match, key in zip(matches, owner_keys) if key in claimed]
+            if new_matches:
+                outgoing.append((carrier_chat_id, build_sender_matches_message(
+                    order_id, arrival_date, warehouse, [match for match, _ in new_matches]), [key for _, key in new_matches]))
+            outgoing += [(key[0], text, [key]) for key, text in counterparts if key in claimed]
+            sent_notifications.send_claimed(send_message, outgoing, 'match notification')
 
 
 def set_user_limit(chat_id: int, limit: int):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
@@ -3696,12 +3483,14 @@ def set_user_limit(chat_id: int, limit: int):
 
 
 def show_security_logs(chat_id: int):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    security_log.flush()
+    conn = db.open_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
-                SELECT chat_id, event_type, details, severity, created_at
+                SELECT chat_id, event_type, details, severity, event_count, created_at
                 FROM t_p52349012_telegram_bot_creatio.security_logs
+                WHERE created_at > NOW() - INTERVAL '30 days'
                 ORDER BY created_at DESC
                 LIMIT 20
             """)
@@ -3722,14 +3511,15 @@ def show_security_logs(chat_id: int):
                 }.get(log['severity'], '⚪')
                 
                 time_str = log['created_at'].strftime('%d.%m %H:%M')
+                repeats = f" ×{log['event_count']}" if log['event_count'] > 1 else ''
                 message += (
-                    f"{severity_emoji} <code>{log['chat_id']}</code> - {log['event_type']}\n"
+                    f"{severity_emoji} <code>{log['chat_id']}</code> - {log['event_type']}{repeats}\n"
                     f"   {log['details']}\n"
                     f"   ⏰ {time_str}\n\n"
                 )
             
             cur.execute("""
-                SELECT event_type, COUNT(*) as cnt
+                SELECT event_type, SUM(event_count) as cnt
                 FROM t_p52349012_telegram_bot_creatio.security_logs
                 WHERE created_at > NOW() - INTERVAL '24 hours'
                 GROUP BY event_type
@@ -3750,7 +3540,7 @@ def show_security_logs(chat_id: int):
 
 
 def show_blocked_users(chat_id: int):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
@@ -3787,110 +3577,59 @@ def show_blocked_users(chat_id: int):
         conn.close()
 
 
-def show_all_orders_for_admin(chat_id: int, filter_type: str = 'all'):
-    """Показать все заявки для удаления администратором"""
+def format_admin_order(order: Dict[str, Any]) -> str:
+    """Заявка в списках админ-панели"""
+    return (
+        f"<b>#{order['id']}</b> | {sanitize_html(order.get('marketplace') or 'None')} → {sanitize_html(order.get('warehouse') or '-')}\n"
+        f"📅 {order.get('loading_date') or '-'} | 👤 {sanitize_html(order.get('contact_name') or '-')}\n"
+        f"📱 {sanitize_html(order.get('phone') or '-')} | Chat ID: <code>{order['chat_id']}</code>"
+    )
+
+
+def show_all_orders_for_admin(chat_id: int, filter_type: str = 'all', direction: str = 'first', anchor: int = 0,
+                              message_id: Optional[int] = None):
+    """Показать все заявки для удаления администратором (одно сообщение на страницу)"""
+    # Заявки двух таблиц листаются раздельно; «все» открывает заявки отправителей
+    order_type = filter_type if filter_type in order_pages.ORDER_TYPES else 'sender'
+    page = order_pages.fetch_page(order_type, direction, anchor)
     
-    # Отправляем меню фильтров
     filter_buttons = [
         [
-            {'text': '📦 Только отправители', 'callback_data': 'admin_filter_sender'},
-            {'text': '🚚 Только перевозчики', 'callback_data': 'admin_filter_carrier'}
-        ],
-        [
-            {'text': '📅 Все заявки', 'callback_data': 'admin_filter_all'},
-            {'text': '🔍 Поиск по Chat ID', 'callback_data': 'admin_search_chatid'}
+            {'text': ('• ' if order_type == 'sender' else '') + '📦 Отправители', 'callback_data': 'admin_filter_sender'},
+            {'text': ('• ' if order_type == 'carrier' else '') + '🚚 Перевозчики', 'callback_data': 'admin_filter_carrier'}
         ],
+        [{'text': '🔍 Поиск по Chat ID', 'callback_data': 'admin_search_chatid'}],
         [{'text': '🏠 Вернуться в админ-панель', 'callback_data': 'admin_exit_to_main'}]
     ]
     
-    send_message(
-        chat_id,
-        "🗑️ <b>Управление заявками</b>\n\nВыберите фильтр или поиск:",
-        {'inline_keyboard': filter_buttons}
-    )
+    title = "📦 <b>Заявки отправителей</b>" if order_type == 'sender' else "🚚 <b>Заявки перевозчиков</b>"
+    if not page.orders:
+        send_or_edit(
+            chat_id, message_id,
+            f"🗑️ <b>Управление заявками</b>\n\n{title}\n\n📭 Нет заявок в системе",
+            {'inline_keyboard': filter_buttons}
+        )
+        return
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            sender_orders = []
-            carrier_orders = []
-            
-            if filter_type in ['all', 'sender']:
-                cur.execute("""
-                    SELECT 'sender' as type, id, chat_id, marketplace, warehouse, loading_date, 
-                           created_at, phone, sender_name as contact_name
-                    FROM t_p52349012_telegram_bot_creatio.sender_orders
-                    WHERE id IS NOT NULL AND chat_id IS NOT NULL
-                    ORDER BY created_at DESC
-                    LIMIT 20
-                """)
-                sender_orders = cur.fetchall()
-            
-            if filter_type in ['all', 'carrier']:
-                cur.execute("""
-                    SELECT 'carrier' as type, id, chat_id, marketplace, warehouse, loading_date, 
-                           created_at, phone, driver_name as contact_name
-                    FROM t_p52349012_telegram_bot_creatio.carrier_orders
-                    WHERE id IS NOT NULL AND chat_id IS NOT NULL
-                    ORDER BY created_at DESC
-                    LIMIT 20
-                """)
-                carrier_orders = cur.fetchall()
-            
-            if not sender_orders and not carrier_orders:
-                send_message(chat_id, "📭 Нет заявок в системе")
-                return
-            
-            # Отправляем каждую заявку отдельным сообщением с двумя кнопками под ней
-            if sender_orders:
-                send_message(chat_id, f"📦 <b>Заявки отправителей (последние {len(sender_orders)}):</b>")
-                for order in sender_orders:
-                    message = (
-                        f"#{order['id']} | {order['marketplace']} → {order['warehouse']}\n"
-                        f"📅 {order['loading_date']} | 👤 {order['contact_name']}\n"
-                        f"📱 {order['phone']} | Chat ID: <code>{order['chat_id']}</code>"
-                    )
-                    
-                    buttons = [
-                        [{
-                            'text': f"🗑 Удалить #{order['id']}",
-                            'callback_data': f"admin_del_s_{order['id']}_{order['chat_id']}"
-                        }],
-                        [{
-                            'text': f"🗑🗑 Удалить все от Chat ID: {order['chat_id']}",
-                            'callback_data': f"admin_del_all_{order['chat_id']}"
-                        }]
-                    ]
-                    
-                    send_message(chat_id, message, {'inline_keyboard': buttons})
-            
-            if carrier_orders:
-                send_message(chat_id, f"🚚 <b>Заявки перевозчиков (последние {len(carrier_orders)}):</b>")
-                for order in carrier_orders:
-                    marketplace = order.get('marketplace') or 'None'
-                    message = (
-                        f"#{order['id']} | {marketplace} → {order['warehouse']}\n"
-                        f"📅 {order['loading_date']} | 👤 {order['contact_name']}\n"
-                        f"📱 {order['phone']} | Chat ID: <code>{order['chat_id']}</code>"
-                    )
-                    
-                    buttons = [
-                        [{
-                            'text': f"🗑 Удалить #{order['id']}",
-                            'callback_data': f"admin_del_c_{order['id']}_{order['chat_id']}"
-                        }],
-                        [{
-                            'text': f"🗑🗑 Удалить все от Chat ID: {order['chat_id']}",
-                            'callback_data': f"admin_del_all_{order['chat_id']}"
-                        }]
-                    ]
-                    
-                    send_message(chat_id, message, {'inline_keyboard': buttons})
-    finally:
-        conn.close()
+    type_code = 's' if order_type == 'sender' else 'c'
+    buttons = [
+        [
+            {'text': f"🗑 Удалить #{order['id']}", 'callback_data': f"admin_del_{type_code}_{order['id']}_{order['chat_id']}"},
+            {'text': f"👤 Все от {order['chat_id']}",
+             'callback_data': order_pages.page_callback(f"admin_user_orders_{order['chat_id']}", order_type)}
+        ]
+        for order in page.orders
+    ]
+    nav = order_pages.nav_row(page, 'admin_orders')
+    if nav:
+        buttons.append(nav)
+    
+    message = f"🗑️ <b>Управление заявками</b>\n\n{title}\n\n" + "\n\n".join(format_admin_order(o) for o in page.orders)
+    send_or_edit(chat_id, message_id, message, {'inline_keyboard': buttons + filter_buttons})
 
 
-def confirm_delete_order(admin_chat_id: int, order_id: int, order_type: str, user_chat_id: int):
+def confirm_delete_order(admin_chat_id: int, order_id: int, order_type: str, user_chat_id: int,
+                         message_id: Optional[int] = None):
     """Спросить у админа: удалить одну заявку или все заявки пользователя"""
     print(f"[DEBUG] confirm_delete_order: admin_chat_id={admin_chat_id}, order_id={order_id}, order_type={order_type}, user_chat_id={user_chat_id}")
     
@@ -3902,8 +3641,10 @@ def confirm_delete_order(admin_chat_id: int, order_id: int, order_type: str, use
     
     print(f"[DEBUG] Sending confirmation message with buttons: {buttons}")
     
-    result = send_message(
+    # Подтверждение появляется на месте списка; «Отмена» возвращает список
+    send_or_edit(
         admin_chat_id,
+        message_id,
         f"⚠️ <b>Подтвердите удаление:</b>\n\n"
         f"Заявка: #{order_id} ({order_type})\n"
         f"Пользователь: <code>{user_chat_id}</code>\n\n"
@@ -3911,13 +3652,13 @@ def confirm_delete_order(admin_chat_id: int, order_id: int, order_type: str, use
         {'inline_keyboard': buttons}
     )
     
-    print(f"[DEBUG] Confirmation message sent, result: {result}")
+    print("[DEBUG] Confirmation message sent")
 
 
 def delete_order_admin(admin_chat_id: int, order_id: int, order_type: str):
     """Удалить одну заявку"""
     print(f"[DEBUG] delete_order_admin called: order_id={order_id}, order_type={order_type}, admin_chat_id={admin_chat_id}")
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             if order_type == 's':
@@ -3961,73 +3702,53 @@ def delete_order_admin(admin_chat_id: int, order_id: int, order_type: str):
         conn.close()
 
 
-def search_orders_by_chatid(admin_chat_id: int, search_chat_id: int):
-    """Поиск всех заявок конкретного пользователя"""
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT 'sender' as type, id, chat_id, marketplace, warehouse, loading_date, 
-                       created_at, phone, sender_name as contact_name
-                FROM t_p52349012_telegram_bot_creatio.sender_orders
-                WHERE chat_id = %s
-                ORDER BY created_at DESC
-            """, (search_chat_id,))
-            sender_orders = cur.fetchall()
-            
-            cur.execute("""
-                SELECT 'carrier' as type, id, chat_id, marketplace, warehouse, loading_date, 
-                       created_at, phone, driver_name as contact_name
-                FROM t_p52349012_telegram_bot_creatio.carrier_orders
-                WHERE chat_id = %s
-                ORDER BY created_at DESC
-            """, (search_chat_id,))
-            carrier_orders = cur.fetchall()
-            
-            if not sender_orders and not carrier_orders:
-                send_message(admin_chat_id, f"📭 У пользователя <code>{search_chat_id}</code> нет заявок")
-                return
-            
-            total_orders = len(sender_orders) + len(carrier_orders)
-            message = f"🔍 <b>Найдено {total_orders} заявок пользователя <code>{search_chat_id}</code>:</b>\n\n"
-            
-            buttons = []
-            
-            if sender_orders:
-                message += f"📦 <b>Отправитель ({len(sender_orders)}):</b>\n"
-                for order in sender_orders:
-                    message += (
-                        f"#{order['id']} | {order['marketplace']} → {order['warehouse']}\n"
-                        f"📅 {order['loading_date']} | 👤 {order['contact_name']}\n\n"
-                    )
-                    buttons.append([{
-                        'text': f"🗑 #{order['id']} - {order['marketplace']}",
-                        'callback_data': f"admin_del_s_{order['id']}_{order['chat_id']}"
-                    }])
-            
-            if carrier_orders:
-                message += f"\n🚚 <b>Перевозчик ({len(carrier_orders)}):</b>\n"
-                for order in carrier_orders:
-                    message += (
-                        f"#{order['id']} | {order['marketplace']} → {order['warehouse']}\n"
-                        f"📅 {order['loading_date']} | 👤 {order['contact_name']}\n\n"
-                    )
-                    buttons.append([{
-                        'text': f"🗑 #{order['id']} - {order['marketplace']}",
-                        'callback_data': f"admin_del_c_{order['id']}_{order['chat_id']}"
-                    }])
-            
-            buttons.append([{'text': '🗑🗑 Удалить ВСЕ заявки этого пользователя', 'callback_data': f'admin_del_all_{search_chat_id}'}])
-            buttons.append([{'text': '◀️ Назад к списку', 'callback_data': 'admin_delete'}])
-            
-            send_message(admin_chat_id, message, {'inline_keyboard': buttons})
-    finally:
-        conn.close()
+def search_orders_by_chatid(admin_chat_id: int, search_chat_id: int, order_type: Optional[str] = None,
+                            direction: str = 'first', anchor: int = 0, message_id: Optional[int] = None):
+    """Поиск всех заявок конкретного пользователя (одно сообщение на страницу)"""
+    user = get_bot_user(search_chat_id)
+    if order_type is None:
+        if not user or not (user['sender_orders_count'] or user['carrier_orders_count']):
+            send_or_edit(admin_chat_id, message_id, f"📭 У пользователя <code>{search_chat_id}</code> нет заявок")
+            return
+        order_type = 'sender' if user['sender_orders_count'] else 'carrier'
+    
+    page = order_pages.fetch_page(order_type, direction, anchor, owner_chat_id=search_chat_id)
+    prefix = f"admin_user_orders_{search_chat_id}"
+    
+    message = f"🔍 <b>Заявки пользователя <code>{search_chat_id}</code></b>\n"
+    if user:
+        message += f"📦 Отправитель: {user['sender_orders_count']} | 🚚 Перевозчик: {user['carrier_orders_count']}\n"
+    message += "\n📦 <b>Отправитель:</b>\n\n" if order_type == 'sender' else "\n🚚 <b>Перевозчик:</b>\n\n"
+    if page.orders:
+        message += "\n\n".join(format_admin_order(o) for o in page.orders)
+    else:
+        message += "📭 Заявок нет"
+    
+    type_code = 's' if order_type == 'sender' else 'c'
+    buttons = [
+        [{
+            'text': f"🗑 #{order['id']} - {order.get('marketplace') or '-'}",
+            'callback_data': f"admin_del_{type_code}_{order['id']}_{order['chat_id']}"
+        }]
+        for order in page.orders
+    ]
+    nav = order_pages.nav_row(page, prefix)
+    if nav:
+        buttons.append(nav)
+    other_type = 'carrier' if order_type == 'sender' else 'sender'
+    buttons.append([{
+        'text': '🚚 Заявки перевозчика' if other_type == 'carrier' else '📦 Заявки отправителя',
+        'callback_data': order_pages.page_callback(prefix, other_type)
+    }])
+    buttons.append([{'text': '🗑🗑 Удалить ВСЕ заявки этого пользователя', 'callback_data': f'admin_del_all_{search_chat_id}'}])
+    buttons.append([{'text': '◀️ Назад к списку', 'callback_data': 'admin_delete'}])
+    
+    send_or_edit(admin_chat_id, message_id, message, {'inline_keyboard': buttons})
 
 
 def delete_all_user_orders(admin_chat_id: int, user_chat_id: int):
     """Удалить все заявки пользователя"""
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
@@ -4065,7 +3786,7 @@ def delete_all_user_orders(admin_chat_id: int, user_chat_id: int):
 
 
 def unblock_user(admin_chat_id: int, target_chat_id: int):
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.open_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
@@ -4164,10 +3885,6 @@ def show_main_menu(chat_id: int):
 
 
 def handle_message(chat_id: int, text: str, username: str):
-    state = user_states.get(chat_id, {})
-    step = state.get('step', '')
-    data = state.get('data', {})
-    
     now = time.time()
     if chat_id in user_states:
         last_activity = user_states[chat_id].get('last_activity', now)
@@ -4177,190 +3894,139 @@ def handle_message(chat_id: int, text: str, username: str):
             return
         user_states[chat_id]['last_activity'] = now
     
-    if text == '/start':
-        show_main_menu(chat_id)
-        return
-    
-    if text == '/my_id':
-        send_message(chat_id, f"🆔 Ваш Chat ID: <code>{chat_id}</code>\n\n@{username}")
-        return
-    
-    if text == '/admin':
-        perms = get_admin_permissions(chat_id)
-        if not perms:
-            send_message(chat_id, "❌ У вас нет прав администратора")
-            return
-        
-        show_admin_panel(chat_id, perms)
-        return
-    
-    if step == 'choose_service':
-        if 'отправитель' in text.lower():
-            state['step'] = 'choose_marketplace'
-            data['type'] = 'sender'
-            
-            keyboard_buttons = [[{'text': mp}] for mp in MARKETPLACES]
-            keyboard_buttons.append([{'text': '⬅️ Назад'}])
-            send_message(chat_id, "🏪 <b>Выберите маркетплейс</b>", {
-                'keyboard': keyboard_buttons,
-                'resize_keyboard': True,
-                'one_time_keyboard': True
-            })
-        
-        elif 'перевозчик' in text.lower():
-            state['step'] = 'choose_marketplace'
-            data['type'] = 'carrier'
-            
-            keyboard_buttons = [[{'text': mp}] for mp in MARKETPLACES]
-            keyboard_buttons.append([{'text': '⬅️ Назад'}])
-            send_message(chat_id, "🏪 <b>Выберите маркетплейс</b>", {
-                'keyboard': keyboard_buttons,
-                'resize_keyboard': True,
-                'one_time_keyboard': True
-            })
-        
-        elif 'мои заявки' in text.lower():
-            show_my_orders(chat_id)
-        
-        elif 'мои шаблоны' in text.lower() or '💾' in text:
-            show_templates_management(chat_id)
-        
+    if command_router.dispatch(text, chat_id, text, username):
         return
     
     process_message(chat_id, text, username)
 
 
-def handle_callback(chat_id: int, callback_data: str, message_id: int, callback_query_id: str):
-    answer_callback_query(callback_query_id)
-    
-    if callback_data == 'show_terms':
-        terms_text = """
-📋 <b>Пользовательское соглашение</b>
-
-<b>1. Предмет соглашения</b>
-Данный бот предоставляет платформу для размещения заявок отправителей и перевозчиков. Бот не является посредником и не несёт ответственности за сделки между пользователями.
-
-<b>2. Обязанности пользователя</b>
-• Предоставлять достоверную информацию
-• Сохранять скриншоты переписок с другими пользователями
-• Самостоятельно проверять контрагентов
-• Сверять данные авто с заявкой перед сделкой
-
-<b>3. Ограничение ответственности</b>
-⚠️ Владелец бота НЕ НЕСЁТ ОТВЕТСТВЕННОСТЬ за:
-• Действия пользователей и их взаимоотношения
-• Мошеннические действия третьих лиц
-• Убытки от использования сервиса
-• Утерю данных при технических сбоях
-• Недостоверность информации в заявках
-• Неисполнение обязательств между пользователями
-
-<b>4. Безопасность данных</b>
-Мы применяем меры защиты, но не гарантируем абсолютную безопасность от:
-• Хакерских атак
-• DDoS-атак
-• Взлома инфраструктуры
-• Действий злоумышленников
-
-<b>5. Использование на свой риск</b>
-⚠️ ВЫ ИСПОЛЬЗУЕТЕ БОТА НА СВОЙ СТРАХ И РИСК
-
-<b>6. Изменения соглашения</b>
-Владелец оставляет за собой право изменять условия без уведомления.
-"""
-        send_message(chat_id, terms_text)
-        return
-    
-    elif callback_data == 'show_privacy':
-        privacy_text = """
-🔒 <b>Политика конфиденциальности</b>
-
-<b>1. Обработка данных</b>
-Мы собираем и храним только необходимые данные для работы сервиса: Chat ID, контактную информацию из заявок (ФИО, телефон), данные о грузах и транспорте.
-
-<b>2. Цель обработки</b>
-Данные используются исключительно для связи отправителей и перевозчиков, создания заявок и термоэтикеток.
-
-<b>3. Безопасность</b>
-Мы применяем технические меры защиты данных, но не можем гарантировать 100% безопасность от хакерских атак и несанкционированного доступа третьих лиц.
-
-<b>4. Ограничение ответственности</b>
-⚠️ Владелец бота НЕ НЕСЁТ ОТВЕТСТВЕННОСТЬ за:
-• Утечку данных в результате хакерских атак
-• Несанкционированный доступ к базе данных
-• Действия третьих лиц
-• Технические сбои инфраструктуры
-
-<b>5. Ваши права</b>
-Вы можете удалить все свои данные командой /delete_my_data
-
-<b>6. Согласие</b>
-Используя бота, вы соглашаетесь с данной политикой конфиденциальности и принимаете связанные риски.
-"""
-        send_message(chat_id, privacy_text)
-        return
-    
-    if callback_data == 'admin_stats':
-        show_admin_stats(chat_id)
-    
-    elif callback_data == 'admin_weekly':
-        show_weekly_stats(chat_id)
-    
-    elif callback_data == 'admin_security_logs':
-        show_security_logs(chat_id)
-    
-    elif callback_data == 'admin_blocked_users':
-        show_blocked_users(chat_id)
-    
-    elif callback_data == 'admin_cleanup':
-        cleanup_old_orders(chat_id)
-    
-    elif callback_data == 'admin_delete':
-        show_all_orders_for_admin(chat_id)
-    
-    elif callback_data.startswith('admin_del_s_') or callback_data.startswith('admin_del_c_'):
-        parts = callback_data.split('_')
-        order_type = parts[2]
-        order_id = int(parts[3])
-        user_chat_id = int(parts[4])
-        confirm_delete_order(chat_id, order_id, order_type, user_chat_id)
-    
-    elif callback_data.startswith('admin_del_one_'):
-        parts = callback_data.split('_')
-        order_type = parts[3]
-        order_id = int(parts[4])
-        delete_order_admin(chat_id, order_id, order_type)
-        show_all_orders_for_admin(chat_id)
-    
-    elif callback_data.startswith('admin_del_all_'):
-        user_chat_id = int(callback_data.split('_')[3])
-        delete_all_user_orders(chat_id, user_chat_id)
-    
-    elif callback_data == 'admin_filter_sender':
-        show_all_orders_for_admin(chat_id, 'sender')
-    
-    elif callback_data == 'admin_filter_carrier':
-        show_all_orders_for_admin(chat_id, 'carrier')
-    
-    elif callback_data == 'admin_filter_all':
-        show_all_orders_for_admin(chat_id, 'all')
-    
-    elif callback_data == 'admin_search_chatid':
-        state = user_states.get(chat_id, {})
-        state['admin_action'] = 'search_chatid'
-        user_states[chat_id] = state
-        send_message(chat_id, "🔍 Введите Chat ID пользователя для поиска его заявок:")
-    
-    elif callback_data == 'admin_exit_to_main':
-        perms = get_admin_permissions(chat_id)
-        if perms:
-            show_admin_panel(chat_id, perms)
+def process_update(update: Any) -> Dict[str, Any]:
+    """Обработать одно обновление Telegram: тело вебхука (строка JSON) или элемент getUpdates (dict)"""
+    tracing.start_trace('telegram_update')
+    update_type = 'other'
+    update_id = None
+    claimed = False
+    started = time.perf_counter()
+    try:
+        if isinstance(update, str):
+            update = json.loads(update)
+        update_id = update.get('update_id')
+        tracing.set_attribute('update_id', update_id)
+        
+        # Повторная доставка того же обновления: подтверждаем, ничего не делая
+        if not dedup.claim(update_id):
+            update_type = 'duplicate'
+            tracing.set_attribute('update_type', update_type)
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json'},
+                'isBase64Encoded': False,
+                'body': json.dumps({'ok': True})
+            }
+        claimed = True
+        
+        if 'message' in update:
+            message = update['message']
+            chat_id = message['chat'].get('id')
+            text = message.get('text', '')
+            username = message['from'].get('username', 'unknown')
+            update_type = 'message'
+            tracing.set_attribute('update_type', update_type)
+            
+            if not chat_id:
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'ok': True})
+                }
+            
+            touch_user_from_update(message.get('from'))
+            
+            if is_user_blocked(chat_id):
+                send_message(chat_id, "❌ Ваш аккаунт заблокирован. Обратитесь к администратору.")
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'ok': True})
+                }
+            
+            if is_rate_limited(chat_id):
+                send_message(chat_id, "⏳ Слишком много запросов. Подождите немного.")
+                log_security_event(chat_id, 'rate_limit_exceeded', f'User exceeded rate limit', 'medium')
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'ok': True})
+                }
+            
+            if not validate_text_length(text):
+                send_message(chat_id, f"❌ Сообщение слишком длинное (макс {MAX_TEXT_LENGTH} символов)")
+                log_security_event(chat_id, 'text_too_long', f'Message length: {len(text)}', 'low')
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'ok': True})
+                }
+            
+            tracing.set_attribute('step', user_states.get(chat_id, {}).get('step'))
+            handle_message(chat_id, text, username)
+        
+        elif 'callback_query' in update:
+            callback_query = update['callback_query']
+            chat_id = callback_query['from']['id']
+            callback_data = callback_query['data']
+            message_id = callback_query['message']['message_id']
+            update_type = 'callback_query'
+            tracing.set_attribute('update_type', update_type)
+            
+            touch_user_from_update(callback_query.get('from'))
+            
+            if is_user_blocked(chat_id):
+                answer_callback_query(callback_query['id'], "❌ Ваш аккаунт заблокирован", True)
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'ok': True})
+                }
+            
+            answer_callback_query(callback_query['id'])
+            process_callback(chat_id, callback_data, message_id)
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'ok': True})
+        }
     
-    elif callback_data == 'admin_exit':
-        if chat_id in admin_sessions:
-            del admin_sessions[chat_id]
-        send_message(chat_id, "👋 Вы вышли из админ-панели")
-        show_main_menu(chat_id)
+    except Exception as e:
+        print(f"[ERROR] handler failed: {str(e)}")
+        tracing.set_attribute('error', str(e))
+        dedup.release(update_id)
+        claimed = False
+        import traceback
+        traceback.print_exc()
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
+    finally:
+        if claimed:
+            dedup.complete(update_id)
+        if security_log.buffered_count():
+            with tracing.span('db', 'security_log.flush'):
+                security_log.flush()
+        tracing.finish_trace()
+        UPDATES.inc(type=update_type)
+        UPDATE_DURATION.observe(time.perf_counter() - started, type=update_type)
+        metrics.maybe_push('telegram-bot')
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -4380,6 +4046,53 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     if method == 'GET':
+        query_params = event.get('queryStringParameters') or {}
+        
+        action = query_params.get('action')
+        if action == 'metrics':
+            if not metrics.is_authorized(query_params):
+                return {
+                    'statusCode': 403,
+                    'headers': {'Content-Type': 'application/json'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': 'Forbidden'})
+                }
+            return metrics.metrics_response()
+        
+        if action in ('maintenance', 'backfill', 'routes', 'queries', 'digest'):
+            if not maintenance.is_authorized(query_params.get('token', '')):
+                return {
+                    'statusCode': 403,
+                    'headers': {'Content-Type': 'application/json'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': 'Forbidden'})
+                }
+            try:
+                if action == 'maintenance':
+                    result = maintenance.run_maintenance()
+                elif action == 'backfill':
+                    result = backfill.run_backfill()
+                elif action == 'digest':
+                    result = digest.flush_due(send_message)
+                elif action == 'routes':
+                    result = [r.stats() for r in (callback_router, admin_router, command_router, step_router)]
+                else:
+                    result = db.statement_stats()
+            except Exception as e:
+                print(f"[ERROR] {action} failed: {str(e)}")
+                return {
+                    'statusCode': 500,
+                    'headers': {'Content-Type': 'application/json'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': str(e)})
+                }
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json'},
+                'isBase64Encoded': False,
+                'body': json.dumps({'ok': True, 'result': result}, ensure_ascii=False)
+            }
+        
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'text/plain'},
@@ -4388,103 +4101,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     if method == 'POST':
-        try:
-            # IP проверка отключена для Cloud Functions (всегда показывает IP облака, а не Telegram)
-            # source_ip = event.get('requestContext', {}).get('identity', {}).get('sourceIp', '')
-            # if not is_telegram_request(source_ip):
-            #     log_security_event(0, 'invalid_source_ip', f'Request from non-Telegram IP: {source_ip}', 'high')
-            #     return {
-            #         'statusCode': 403,
-            #         'headers': {'Content-Type': 'application/json'},
-            #         'isBase64Encoded': False,
-            #         'body': json.dumps({'error': 'Forbidden'})
-            #     }
-            
-            body_str = event.get('body', '{}')
-            update = json.loads(body_str)
-            
-            if 'message' in update:
-                message = update['message']
-                chat_id = message['chat'].get('id')
-                text = message.get('text', '')
-                username = message['from'].get('username', 'unknown')
-                
-                if not chat_id:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'ok': True})
-                    }
-                
-                blocked = get_blocked_users()
-                if str(chat_id) in blocked:
-                    send_message(chat_id, "❌ Ваш аккаунт заблокирован. Обратитесь к администратору.")
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'ok': True})
-                    }
-                
-                if is_rate_limited(chat_id):
-                    send_message(chat_id, "⏳ Слишком много запросов. Подождите немного.")
-                    log_security_event(chat_id, 'rate_limit_exceeded', f'User exceeded rate limit', 'medium')
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'ok': True})
-                    }
-                
-                if not validate_text_length(text):
-                    send_message(chat_id, f"❌ Сообщение слишком длинное (макс {MAX_TEXT_LENGTH} символов)")
-                    log_security_event(chat_id, 'text_too_long', f'Message length: {len(text)}', 'low')
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'ok': True})
-                    }
-                
-                handle_message(chat_id, text, username)
-            
-            elif 'callback_query' in update:
-                callback_query = update['callback_query']
-                chat_id = callback_query['from']['id']
-                callback_data = callback_query['data']
-                message_id = callback_query['message']['message_id']
-                
-                blocked = get_blocked_users()
-                if str(chat_id) in blocked:
-                    answer_callback_query(callback_query['id'], "❌ Ваш аккаунт заблокирован", True)
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'ok': True})
-                    }
-                
-                answer_callback_query(callback_query['id'])
-                process_callback(chat_id, callback_data, message_id)
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'ok': True})
-            }
-        
-        except Exception as e:
-            print(f"[ERROR] handler failed: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': str(e)})
-            }
+        # IP проверка отключена для Cloud Functions (всегда показывает IP облака, а не Telegram)
+        # source_ip = event.get('requestContext', {}).get('identity', {}).get('sourceIp', '')
+        # if not is_telegram_request(source_ip):
+        #     log_security_event(0, 'invalid_source_ip', f'Request from non-Telegram IP: {source_ip}', 'high')
+        #     return {
+        #         'statusCode': 403,
+        #         'headers': {'Content-Type': 'application/json'},
+        #         'isBase64Encoded': False,
+        #         'body': json.dumps({'error': 'Forbidden'})
+        #     }
+        
+        return process_update(event.get('body', '{}'))
     
     return {
         'statusCode': 405,
@@ -0,0 +1,151 @@
+"""
+Плановое обслуживание БД бота
+Вызывается по расписанию через GET ?action=maintenance&token=MAINTENANCE_TOKEN
+"""
+
+import os
+import hmac
+from typing import Dict, Any, List
+import db
+from rate_limit import purge_rate_limits
+from dedup import purge_processed_updates
+from sent_notifications import purge_sent_notifications
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# Сколько полных месяцев хранить логи безопасности (плюс текущий)
+SECURITY_LOG_RETENTION_MONTHS = int(os.environ.get('SECURITY_LOG_RETENTION_MONTHS', '3'))
+# На сколько месяцев вперёд заранее создавать партиции
+SECURITY_LOG_PREMAKE_MONTHS = 2
+
+# Заявки истекают через столько дней после даты поставки/прибытия (или погрузки)
+ORDER_EXPIRY_DAYS = 2
+# Размер одной пачки переноса в архив и предел пачек за один запуск
+ORDER_EXPIRY_BATCH_SIZE = 500
+ORDER_EXPIRY_MAX_BATCHES = 40
+# Сколько дней хранить архив заявок
+ORDER_ARCHIVE_RETENTION_DAYS = 180
+
+# Дата, от которой отсчитывается истечение заявки
+ORDER_EXPIRY_DATES = {
+    'sender': 'COALESCE(delivery_date, loading_date)',
+    'carrier': 'COALESCE(arrival_date, loading_date)',
+}
+
+
+def _expire_orders_query(order_type: str) -> str:
+    """Перенести пачку истёкших заявок в архив; заблокированные другими транзакциями строки пропускаются"""
+    table = f"{order_type}_orders"
+    expires_on = ORDER_EXPIRY_DATES[order_type]
+    return f"""
+        WITH batch AS (
+            SELECT id, {expires_on} AS expires_on FROM {SCHEMA}.{table}
+            WHERE {expires_on} <= CURRENT_DATE - %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), moved AS (
+            DELETE FROM {SCHEMA}.{table} o
+            USING batch
+            WHERE o.id = batch.id
+            RETURNING o.*
+        ), archived AS (
+            INSERT INTO {SCHEMA}.{table}_archive (id, chat_id, expired_on, order_data, created_at)
+            SELECT m.id, m.chat_id, b.expires_on, to_jsonb(m), m.created_at
+            FROM moved m
+            JOIN batch b ON b.id = m.id
+            ON CONFLICT (id) DO NOTHING
+        )
+        SELECT COUNT(*) FROM moved
+    """
+
+
+EXPIRE_ORDERS_QUERIES = {order_type: _expire_orders_query(order_type) for order_type in ORDER_EXPIRY_DATES}
+
+
+def is_authorized(token: str) -> bool:
+    """Обслуживание доступно только с токеном из секретов"""
+    expected = os.environ.get('MAINTENANCE_TOKEN', '')
+    return bool(expected) and hmac.compare_digest(token.encode(), expected.encode())
+
+
+def maintain_security_log_partitions(conn) -> Dict[str, List[str]]:
+    """Создать партиции security_logs наперёд и удалить вышедшие за срок хранения"""
+    result = {'ensured': [], 'dropped': []}
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT action, partition_name FROM {SCHEMA}.security_logs_maintain(%s, %s)",
+            (SECURITY_LOG_RETENTION_MONTHS, SECURITY_LOG_PREMAKE_MONTHS)
+        )
+        for action, partition_name in cur.fetchall():
+            result['ensured' if action == 'ensure' else 'dropped'].append(partition_name)
+    conn.commit()
+    return result
+
+
+def expire_orders(conn) -> Dict[str, int]:
+    """Перенести истёкшие заявки в архив небольшими пачками, каждая пачка — отдельная транзакция"""
+    result = {}
+    for order_type, query in EXPIRE_ORDERS_QUERIES.items():
+        moved_total = 0
+        for _ in range(ORDER_EXPIRY_MAX_BATCHES):
+            with conn.cursor() as cur:
+                cur.execute(query, (ORDER_EXPIRY_DAYS, ORDER_EXPIRY_BATCH_SIZE))
+                moved = cur.fetchone()[0]
+            conn.commit()
+            moved_total += moved
+            if moved < ORDER_EXPIRY_BATCH_SIZE:
+                break
+        result[order_type] = moved_total
+    return result
+
+
+def purge_orders_archive(conn) -> Dict[str, int]:
+    """Удалить из архива заявки старше срока хранения (тоже пачками)"""
+    result = {}
+    for order_type in ORDER_EXPIRY_DATES:
+        table = f"{SCHEMA}.{order_type}_orders_archive"
+        purged_total = 0
+        for _ in range(ORDER_EXPIRY_MAX_BATCHES):
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    DELETE FROM {table}
+                    WHERE id IN (
+                        SELECT id FROM {table}
+                        WHERE archived_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                """, (ORDER_ARCHIVE_RETENTION_DAYS, ORDER_EXPIRY_BATCH_SIZE))
+                purged = cur.rowcount
+            conn.commit()
+            purged_total += purged
+            if purged < ORDER_EXPIRY_BATCH_SIZE:
+                break
+        result[order_type] = purged_total
+    return result
+
+
+def run_order_expiry() -> Dict[str, int]:
+    """Отдельный запуск переноса истёкших заявок (для админской кнопки очистки)"""
+    conn = db.open_connection()
+    try:
+        return expire_orders(conn)
+    finally:
+        conn.close()
+
+
+def run_maintenance() -> Dict[str, Any]:
+    """Выполнить все задачи обслуживания, вернуть сводку"""
+    conn = db.open_connection()
+    try:
+        return {
+            'security_logs': maintain_security_log_partitions(conn),
+            'expired_orders': expire_orders(conn),
+            'purged_archive': purge_orders_archive(conn),
+            'purged_rate_limits': purge_rate_limits(conn),
+            'purged_processed_updates': purge_processed_updates(conn),
+            'purged_sent_notifications': purge_sent_notifications(conn)
+        }
+    finally:
+        conn.close()
@@ -6,7 +6,7 @@
 import json
 import os
 from typing import Dict, Optional
-import requests
+import telegram_client
 from datetime import datetime
 
 BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
@@ -25,7 +25,7 @@ def send_message(chat_id: int, text: str, reply_markup: Optional[Dict] = None):
         data['reply_markup'] = json.dumps(reply_markup)
     
     try:
-        response = requests.post(url, json=data, timeout=10)
+        response = telegram_client.post(url, json=data, timeout=10)
         return response.json()
     except Exception as e:
         print(f"[ERROR] send_message failed: {str(e)}")
@@ -43,7 +43,7 @@ def edit_message(chat_id: int, message_id: int, text: str, reply_markup: Optiona
         data['reply_markup'] = json.dumps(reply_markup)
     
     try:
-        response = requests.post(url, json=data, timeout=10)
+        response = telegram_client.post(url, json=data, timeout=10)
         return response.json()
     except Exception as e:
         print(f"[ERROR] edit_message failed: {str(e)}")
@@ -57,7 +57,7 @@ def delete_message(chat_id: int, message_id: int):
     }
     
     try:
-        response = requests.post(url, json=data, timeout=10)
+        response = telegram_client.post(url, json=data, timeout=10)
         return response.json()
     except Exception as e:
         print(f"[ERROR] delete_message failed: {str(e)}")
@@ -73,7 +73,7 @@ def answer_callback_query(callback_query_id: str, text: Optional[str] = None, sh
         data['text'] = text
     
     try:
-        response = requests.post(url, json=data, timeout=10)
+        response = telegram_client.post(url, json=data, timeout=10)
         return response.json()
     except Exception as e:
         print(f"[ERROR] answer_callback_query failed: {str(e)}")
@@ -105,7 +105,7 @@ def send_document(chat_id: int, document_bytes: bytes, filename: str, caption: s
         'parse_mode': 'HTML'
     }
     try:
-        requests.post(url, data=data, files=files, timeout=10)
+        telegram_client.post(url, data=data, files=files, timeout=10)
     except Exception as e:
         print(f"[ERROR] send_document failed: {str(e)}")
 
@@ -113,7 +113,7 @@ def send_label_to_user(chat_id: int, order_id: int, order_type: str, label_size:
     try:
         import base64
         
-        response = requests.post(
+        response = telegram_client.post(
             PDF_FUNCTION_URL,
             json={
                 'order_id': order_id,
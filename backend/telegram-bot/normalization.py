@@ -0,0 +1,113 @@
+"""
+Нормализация названий складов и городов для fuzzy matching
+Таблицы и регулярные выражения компилируются один раз при импорте,
+результаты запоминаются в ограниченном LRU-кэше
+"""
+
+import re
+from functools import lru_cache
+from typing import Iterable, List
+
+NORMALIZE_CACHE_SIZE = 4096
+
+# Увеличивать при любом изменении правил ниже: фоновый пересчёт (backfill.py) начнётся заново
+NORMALIZATION_VERSION = 2
+
+# Частые варианты написания складов -> каноническое написание (замена подстрок)
+WAREHOUSE_REPLACEMENTS = {
+    'коледино': 'каледино',
+    'электросталь': 'електросталь',
+    'подольск': 'падольск',
+    'щелково': 'щолково',
+    'чехов': 'чихов',
+}
+
+# Варианты названий городов -> канонический ключ (совпадение целиком или префиксом до пробела)
+CITY_ALIASES = {
+    'москва': 'москва',
+    'санкт-петербург': 'санктпетербург',
+    'санкт петербург': 'санктпетербург',
+    'спб': 'санктпетербург',
+    'питер': 'санктпетербург',
+    'петербург': 'санктпетербург',
+    'нижний новгород': 'нижнийновгород',
+    'н новгород': 'нижнийновгород',
+    'екатеринбург': 'екатеринбург',
+    'самара': 'самара',
+    'казань': 'казань',
+    'ростов-на-дону': 'ростовнадону',
+    'ростов': 'ростовнадону',
+}
+
+# Варианты названий маркетплейсов -> канонический ключ (в backfill.py не участвуют)
+MARKETPLACE_ALIASES = {
+    'wildberries': 'wildberries',
+    'wb': 'wildberries',
+    'вб': 'wildberries',
+    'вайлдберриз': 'wildberries',
+    'ozon': 'ozon',
+    'озон': 'ozon',
+    'яндексмаркет': 'yandexmarket',
+    'yandexmarket': 'yandexmarket',
+    'ям': 'yandexmarket',
+    'aliexpress': 'aliexpress',
+    'алиэкспресс': 'aliexpress',
+}
+
+_YO_TABLE = str.maketrans({'ё': 'е'})
+_PUNCTUATION_RE = re.compile(r'[^\w\s]|_')
+_NON_ALNUM_RE = re.compile(r'[\W_]+')
+_CITY_PREFIX_RE = re.compile(r'\bг\.|\bгород\b')
+
+
+def _alternation(keys: Iterable[str]) -> str:
+    """Альтернатива с длинными вариантами первыми, чтобы выигрывало самое длинное совпадение"""
+    return '|'.join(re.escape(k) for k in sorted(keys, key=len, reverse=True))
+
+
+_WAREHOUSE_RE = re.compile(_alternation(WAREHOUSE_REPLACEMENTS))
+_CITY_RE = re.compile(rf'^(?:{_alternation(CITY_ALIASES)})(?= |$)')
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_warehouse(warehouse: str) -> str:
+    """Нормализует название склада: регистр, ё, пунктуация, пробелы, частые опечатки"""
+    if not warehouse:
+        return ''
+    normalized = warehouse.lower().translate(_YO_TABLE)
+    normalized = _PUNCTUATION_RE.sub('', normalized)
+    normalized = ' '.join(normalized.split())
+    return _WAREHOUSE_RE.sub(lambda m: WAREHOUSE_REPLACEMENTS[m.group(0)], normalized)
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_city(city: str) -> str:
+    """Нормализует название города в ключ без пробелов и знаков (спб, питер -> санктпетербург)"""
+    if not city:
+        return ''
+    normalized = city.lower().translate(_YO_TABLE)
+    normalized = _CITY_PREFIX_RE.sub('', normalized)
+    normalized = ' '.join(normalized.split())
+    match = _CITY_RE.match(normalized)
+    if match:
+        return CITY_ALIASES[match.group(0)]
+    return _NON_ALNUM_RE.sub('', normalized)
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_marketplace(marketplace: str) -> str:
+    """Ключ маркетплейса без регистра и знаков (WB, вб -> wildberries)"""
+    if not marketplace:
+        return ''
+    key = _NON_ALNUM_RE.sub('', marketplace.lower().translate(_YO_TABLE))
+    return MARKETPLACE_ALIASES.get(key, key)
+
+
+def normalize_warehouse_batch(values: Iterable[str]) -> List[str]:
+    """Нормализация целой колонки складов (для бэкфиллов)"""
+    return [normalize_warehouse(v) for v in values]
+
+
+def normalize_city_batch(values: Iterable[str]) -> List[str]:
+    """Нормализация целой колонки городов (для бэкфиллов)"""
+    return [normalize_city(v) for v in values]
@@ -0,0 +1,115 @@
+"""
+Постраничные списки заявок («Мои заявки», заявки в админ-панели, поиск по Chat ID)
+Страница — одно сообщение: заявки списком, под ними кнопки заявок и навигация.
+Кнопки «Новее» / «Старее» редактируют то же сообщение (editMessageText).
+Страницы выбираются по ключу (id < последнего показанного / id > первого показанного),
+а не через OFFSET: запрос читает PAGE_SIZE + 1 строк по первичному ключу на любой странице.
+Курсор целиком лежит в callback_data, поэтому состояние между нажатиями не хранится.
+"""
+
+from typing import Dict, Any, List, Optional
+
+import db
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# Заявок на странице (сообщение Telegram — до 4096 символов, клавиатура — до 100 кнопок)
+PAGE_SIZE = 8
+# Якорь первой страницы: больше любого id (колонки id — SERIAL)
+FIRST_PAGE_ANCHOR = 2147483647
+
+ORDER_TYPES = ('sender', 'carrier')
+DIRECTIONS = ('first', 'older', 'newer')
+
+TABLES = {
+    'sender': 'sender_orders',
+    'carrier': 'carrier_orders',
+}
+COLUMNS = {
+    'sender': "id, chat_id, marketplace, warehouse, loading_date, delivery_date AS target_date, "
+              "phone, sender_name AS contact_name",
+    'carrier': "id, chat_id, marketplace, warehouse, loading_date, arrival_date AS target_date, "
+               "phone, driver_name AS contact_name",
+}
+# Область списка: заявки одного пользователя или все
+SCOPES = {
+    'user': 'chat_id = %s',
+    'all': 'chat_id IS NOT NULL',
+}
+# Направление: условие на id и порядок чтения
+KEYSETS = {
+    'older': ('id < %s', 'DESC'),
+    'newer': ('id > %s', 'ASC'),
+}
+
+
+def _statement_name(order_type: str, scope: str, direction: str) -> str:
+    return f"order_page_{order_type}_{scope}_{direction}"
+
+
+for _order_type in ORDER_TYPES:
+    for _scope, _scope_sql in SCOPES.items():
+        for _direction, (_keyset_sql, _order) in KEYSETS.items():
+            db.register_statement(_statement_name(_order_type, _scope, _direction), f"""
+                SELECT {COLUMNS[_order_type]}
+                FROM {SCHEMA}.{TABLES[_order_type]}
+                WHERE {_scope_sql} AND {_keyset_sql}
+                ORDER BY id {_order}
+                LIMIT %s
+            """)
+
+
+class Page:
+    """Заявки одной страницы (от новых к старым) и наличие соседних страниц"""
+
+    def __init__(self, order_type: str, orders: List[Dict[str, Any]], has_newer: bool, has_older: bool):
+        self.order_type = order_type
+        self.orders = orders
+        self.has_newer = has_newer
+        self.has_older = has_older
+
+    @property
+    def newest_id(self) -> int:
+        return self.orders[0]['id']
+
+    @property
+    def oldest_id(self) -> int:
+        return self.orders[-1]['id']
+
+
+def fetch_page(order_type: str, direction: str = 'first', anchor: int = 0,
+               owner_chat_id: Optional[int] = None) -> Page:
+    """Страница заявок типа order_type; owner_chat_id=None — заявки всех пользователей"""
+    if direction not in KEYSETS:
+        direction, anchor = 'older', FIRST_PAGE_ANCHOR
+    scope = 'all' if owner_chat_id is None else 'user'
+    params = ([] if owner_chat_id is None else [owner_chat_id]) + [anchor, PAGE_SIZE + 1]
+    rows = db.execute(_statement_name(order_type, scope, direction), params, fetch='all', dict_rows=True)
+
+    has_more = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    if direction == 'newer':
+        rows.reverse()
+        page = Page(order_type, rows, has_newer=has_more, has_older=True)
+    else:
+        page = Page(order_type, rows, has_newer=anchor != FIRST_PAGE_ANCHOR, has_older=has_more)
+
+    if not page.orders and anchor != FIRST_PAGE_ANCHOR:
+        # Заявки страницы удалили, пока сообщение висело в чате, — показываем начало списка
+        return fetch_page(order_type, owner_chat_id=owner_chat_id)
+    return page
+
+
+def page_callback(prefix: str, order_type: str, direction: str = 'first', anchor: int = 0) -> str:
+    """callback_data страницы: {prefix}_{order_type}_{direction}_{anchor}"""
+    return f"{prefix}_{order_type}_{direction}_{anchor}"
+
+
+def nav_row(page: Page, prefix: str) -> List[Dict[str, str]]:
+    """Кнопки «Новее» / «Старее» (пустой список, если страница единственная)"""
+    row = []
+    if page.orders and page.has_newer:
+        row.append({'text': '◀️ Новее', 'callback_data': page_callback(prefix, page.order_type, 'newer', page.newest_id)})
+    if page.orders and page.has_older:
+        row.append({'text': 'Старее ▶️', 'callback_data': page_callback(prefix, page.order_type, 'older', page.oldest_id)})
+    return row
@@ -0,0 +1,128 @@
+"""
+Права администраторов с кэшем в памяти процесса
+Результат запроса (в том числе «не администратор») хранится по chat_id ограниченное время.
+Изменения ролей в этом процессе сбрасывают запись сразу через invalidate_admin_permissions,
+другие экземпляры функции увидят их не позже чем через TTL.
+Запрос к БД идёт без блокировки; если за время запроса кэш сбросили (поколение сменилось),
+прочитанные права не сохраняются — иначе старые права вернулись бы в кэш до конца TTL.
+"""
+
+import time
+import threading
+from typing import Dict, Any, Optional, Tuple
+from psycopg2.extras import RealDictCursor
+
+import db
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# Сколько секунд доверять найденным правам администратора
+ADMIN_CACHE_TTL = 60
+# Сколько секунд помнить, что пользователь не администратор (таких подавляющее большинство)
+ADMIN_NEGATIVE_CACHE_TTL = 120
+# Сколько записей держать, прежде чем вычистить устаревшие
+ADMIN_CACHE_SIZE = 10000
+
+OWNER_PERMISSIONS = {
+    'role': 'owner',
+    'can_view_stats': True,
+    'can_view_orders': True,
+    'can_remove_orders': True,
+    'can_manage_users': True,
+    'can_block_users': True,
+    'can_manage_admins': True,
+    'can_view_security_logs': True
+}
+
+ADMIN_PERMISSIONS_QUERY = f"""
+    SELECT ba.role, ap.*
+    FROM {SCHEMA}.bot_admins ba
+    LEFT JOIN {SCHEMA}.admin_permissions ap ON ba.id = ap.admin_id
+    WHERE ba.chat_id = %s AND ba.is_active = true
+"""
+
+# chat_id -> (момент истечения, права или None)
+_permissions_cache: Dict[int, Tuple[float, Optional[Dict[str, Any]]]] = {}
+_cache_stats = {'hits': 0, 'misses': 0}
+# Поколение кэша: растёт при каждом сбросе (сбросы редки, поэтому одно на весь кэш)
+_generation = 0
+_lock = threading.Lock()
+
+
+def load_admin_permissions(chat_id: int) -> Optional[Dict[str, Any]]:
+    """Прочитать права из БД (без кэша). None — не администратор"""
+    conn = db.open_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(ADMIN_PERMISSIONS_QUERY, (chat_id,))
+            result = cur.fetchone()
+    finally:
+        conn.close()
+
+    if not result:
+        return None
+
+    role = result.get('role', 'viewer')
+    if role == 'owner':
+        return dict(OWNER_PERMISSIONS)
+
+    return {
+        'role': role,
+        'can_view_stats': result.get('can_view_stats', True),
+        'can_view_orders': result.get('can_view_orders', True),
+        'can_remove_orders': result.get('can_remove_orders', False),
+        'can_manage_users': result.get('can_manage_users', False),
+        'can_block_users': result.get('can_block_users', False),
+        'can_manage_admins': result.get('can_manage_admins', False),
+        'can_view_security_logs': result.get('can_view_security_logs', False)
+    }
+
+
+def _prune_cache(now: float) -> None:
+    expired = [cid for cid, (expires_at, _perms) in list(_permissions_cache.items()) if expires_at <= now]
+    for cid in expired:
+        _permissions_cache.pop(cid, None)
+    if len(_permissions_cache) >= ADMIN_CACHE_SIZE:
+        _permissions_cache.clear()
+
+
+def get_admin_permissions(chat_id: int) -> Optional[Dict[str, Any]]:
+    """Права администратора из кэша или БД. При ошибке БД возвращает None и ничего не кэширует"""
+    now = time.time()
+    with _lock:
+        cached = _permissions_cache.get(chat_id)
+        if cached and cached[0] > now:
+            _cache_stats['hits'] += 1
+            return cached[1]
+        _cache_stats['misses'] += 1
+        generation = _generation
+
+    try:
+        perms = load_admin_permissions(chat_id)
+    except Exception as e:
+        print(f"[ERROR] get_admin_permissions: {str(e)}")
+        return None
+
+    with _lock:
+        if generation == _generation:
+            if len(_permissions_cache) >= ADMIN_CACHE_SIZE:
+                _prune_cache(now)
+            ttl = ADMIN_CACHE_TTL if perms else ADMIN_NEGATIVE_CACHE_TTL
+            _permissions_cache[chat_id] = (now + ttl, perms)
+    return perms
+
+
+def invalidate_admin_permissions(chat_id: Optional[int] = None) -> None:
+    """Сбросить кэш прав одного пользователя (или всех, если chat_id не указан)"""
+    global _generation
+    with _lock:
+        _generation += 1
+        if chat_id is None:
+            _permissions_cache.clear()
+        else:
+            _permissions_cache.pop(chat_id, None)
+
+
+def cache_stats() -> Dict[str, int]:
+    with _lock:
+        return {'entries': len(_permissions_cache), **_cache_stats}
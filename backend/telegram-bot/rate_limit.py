@@ -0,0 +1,119 @@
+"""
+Ограничение частоты запросов (GCRA)
+На ключ хранится одно число — теоретическое время следующего запроса (TAT), поэтому проверка O(1)
+и не требует списка отметок. Память ограничена: простаивающие ключи вычищаются периодически,
+число ключей не превышает RATE_LIMIT_MAX_KEYS.
+Бэкенд 'postgres' хранит TAT в таблице rate_limits, и лимит действует сразу для всех экземпляров функции.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Hashable
+
+import db
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# memory — в памяти процесса, postgres — общий для всех экземпляров
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+# Максимум отслеживаемых ключей в памяти (при превышении вытесняются самые давние)
+RATE_LIMIT_MAX_KEYS = 10000
+# Как часто вычищать ключи, у которых лимит уже полностью восстановился (секунды)
+RATE_LIMIT_SWEEP_INTERVAL = 60
+# Сколько хранить строки в rate_limits после восстановления лимита (секунды)
+RATE_LIMIT_DB_RETENTION = 3600
+
+
+class MemoryRateLimiter:
+    """limit запросов за window секунд на ключ, состояние в памяти процесса"""
+
+    def __init__(self, name: str, limit: int, window: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        # Интервал между запросами при равномерной нагрузке и допустимый «всплеск»
+        self.interval = window / limit
+        self.tolerance = window - self.interval
+        self.max_keys = max_keys
+        self.tats: 'OrderedDict[Hashable, float]' = OrderedDict()
+        self.last_sweep = time.monotonic()
+        self.lock = threading.Lock()
+
+    def is_limited(self, key: Hashable) -> bool:
+        """True — запрос нужно отклонить; разрешённый запрос сразу учитывается"""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_sweep >= RATE_LIMIT_SWEEP_INTERVAL:
+                self.sweep(now)
+
+            tat = max(self.tats.get(key, now), now)
+            if tat - now > self.tolerance:
+                return True
+
+            self.tats[key] = tat + self.interval
+            self.tats.move_to_end(key)
+            if len(self.tats) > self.max_keys:
+                self.tats.popitem(last=False)
+            return False
+
+    def sweep(self, now: float) -> int:
+        """Удалить ключи, у которых TAT уже в прошлом: для них состояние не отличается от нового ключа"""
+        self.last_sweep = now
+        stale = [key for key, tat in self.tats.items() if tat <= now]
+        for key in stale:
+            del self.tats[key]
+        return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'name': self.name, 'backend': 'memory', 'keys': len(self.tats)}
+
+
+class PostgresRateLimiter:
+    """Тот же алгоритм, TAT хранится в rate_limits и обновляется одним атомарным запросом"""
+
+    def __init__(self, name: str, limit: int, window: float):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.interval = window / limit
+        self.tolerance = window - self.interval
+        # Если БД недоступна, лимит продолжает работать в пределах процесса
+        self.fallback = MemoryRateLimiter(name, limit, window)
+
+    def is_limited(self, key: Hashable) -> bool:
+        try:
+            # Общее соединение потока из db.py: без подключения к БД на каждое сообщение
+            row = db.execute('rate_limit_hit', (
+                f"{self.name}:{key}",
+                self.interval,
+                self.interval, self.interval,
+                self.interval, self.interval, self.tolerance,
+            ), fetch='one')
+            return row is None
+        except Exception as e:
+            print(f"[ERROR] rate_limit {self.name}: {str(e)}")
+            return self.fallback.is_limited(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'name': self.name, 'backend': 'postgres', 'fallback_keys': len(self.fallback.tats)}
+
+
+def create_limiter(name: str, limit: int, window: float):
+    """Лимитер с бэкендом из RATE_LIMIT_BACKEND"""
+    if RATE_LIMIT_BACKEND == 'postgres':
+        return PostgresRateLimiter(name, limit, window)
+    return MemoryRateLimiter(name, limit, window)
+
+
+def purge_rate_limits(conn) -> int:
+    """Удалить из rate_limits давно восстановившиеся ключи (вызывается из maintenance)"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            DELETE FROM {SCHEMA}.rate_limits
+            WHERE tat < EXTRACT(EPOCH FROM clock_timestamp()) - %s
+        """, (RATE_LIMIT_DB_RETENTION,))
+        deleted = cur.rowcount
+    conn.commit()
+    return deleted
@@ -0,0 +1,187 @@
+"""
+Табличный роутер для callback_data, команд и шагов мастера
+Точные ключи ищутся в словаре, ключи с параметрами (delete_order_{order_type}_{order_id:int}) —
+по префиксному дереву с самым длинным совпадением; для каждого маршрута считаются вызовы и время
+"""
+
+import re
+import time
+from typing import Dict, Any, Optional, List, Callable, Tuple
+
+import tracing
+import metrics
+
+ROUTE_DURATION = metrics.histogram(
+    'bot_route_duration_seconds', 'Время обработчика маршрута', ('router', 'route'))
+ROUTE_ERRORS = metrics.counter(
+    'bot_route_errors_total', 'Исключения в обработчиках маршрутов', ('router', 'route'))
+
+PARAM_RE = re.compile(r'\{(\w+)(?::(int|str|rest))?\}')
+
+# Как разбирается значение параметра каждого типа
+PARAM_PATTERNS = {
+    'int': r'-?\d+',
+    'str': r'[^_]+',
+    'rest': r'.+',
+}
+PARAM_CASTS = {
+    'int': int,
+    'str': str,
+    'rest': str,
+}
+
+
+class Route:
+    """Маршрут с обработчиком и счётчиками вызовов"""
+
+    def __init__(self, pattern: str, handler: Callable, literal: str, regex: Optional[re.Pattern] = None,
+                 casts: Optional[Dict[str, Callable]] = None):
+        self.pattern = pattern
+        self.handler = handler
+        self.literal = literal
+        self.regex = regex
+        self.casts = casts or {}
+        self.hits = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def parse(self, key: str) -> Optional[Dict[str, Any]]:
+        """Разобрать параметры из хвоста ключа после литерального префикса"""
+        if self.regex is None:
+            return {}
+        match = self.regex.fullmatch(key, len(self.literal))
+        if not match:
+            return None
+        return {name: self.casts[name](value) for name, value in match.groupdict().items()}
+
+
+def compile_pattern(pattern: str) -> Tuple[str, Optional[re.Pattern], Dict[str, Callable]]:
+    """'delete_order_{order_type}_{order_id:int}' -> литеральный префикс, регулярка хвоста, приведение типов"""
+    first = PARAM_RE.search(pattern)
+    if not first:
+        return pattern, None, {}
+
+    literal = pattern[:first.start()]
+    regex_parts = []
+    casts = {}
+    pos = first.start()
+    for match in PARAM_RE.finditer(pattern, first.start()):
+        regex_parts.append(re.escape(pattern[pos:match.start()]))
+        name, kind = match.group(1), match.group(2) or 'str'
+        regex_parts.append(f'(?P<{name}>{PARAM_PATTERNS[kind]})')
+        casts[name] = PARAM_CASTS[kind]
+        pos = match.end()
+    regex_parts.append(re.escape(pattern[pos:]))
+    # Регулярка применяется к полному ключу начиная с позиции после префикса
+    return literal, re.compile(''.join(regex_parts)), casts
+
+
+class Router:
+    """Точные маршруты — словарь, параметризованные — префиксное дерево"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.exact_routes: Dict[str, Route] = {}
+        self.trie: Dict[str, Any] = {'children': {}, 'routes': []}
+        self.misses = 0
+
+    def add(self, pattern: str, handler: Callable) -> Route:
+        literal, regex, casts = compile_pattern(pattern)
+        route = Route(pattern, handler, literal, regex, casts)
+        if regex is None:
+            if pattern in self.exact_routes:
+                raise ValueError(f"Duplicate route '{pattern}' in router '{self.name}'")
+            self.exact_routes[pattern] = route
+            return route
+
+        node = self.trie
+        for ch in literal:
+            node = node['children'].setdefault(ch, {'children': {}, 'routes': []})
+        if any(r.pattern == pattern for r in node['routes']):
+            raise ValueError(f"Duplicate route '{pattern}' in router '{self.name}'")
+        node['routes'].append(route)
+        return route
+
+    def route(self, *patterns: str) -> Callable:
+        """Декоратор регистрации обработчика на один или несколько ключей"""
+        def decorator(handler: Callable) -> Callable:
+            for pattern in patterns:
+                self.add(pattern, handler)
+            return handler
+        return decorator
+
+    def resolve(self, key: str) -> Tuple[Optional[Route], Dict[str, Any]]:
+        """Найти маршрут: сначала точный ключ, затем самый длинный подходящий префикс"""
+        route = self.exact_routes.get(key)
+        if route is not None:
+            return route, {}
+
+        candidates: List[List[Route]] = []
+        node = self.trie
+        if node['routes']:
+            candidates.append(node['routes'])
+        for ch in key:
+            node = node['children'].get(ch)
+            if node is None:
+                break
+            if node['routes']:
+                candidates.append(node['routes'])
+
+        for routes in reversed(candidates):
+            for route in routes:
+                params = route.parse(key)
+                if params is not None:
+                    return route, params
+        return None, {}
+
+    def dispatch(self, key: str, *args, **kwargs) -> bool:
+        """Вызвать обработчик маршрута. False — маршрут не найден"""
+        route, params = self.resolve(key)
+        if route is None:
+            self.misses += 1
+            return False
+
+        tracing.set_attribute(f"{self.name}_route", route.pattern)
+        started = time.perf_counter()
+        try:
+            route.handler(*args, **kwargs, **params)
+        except Exception:
+            route.errors += 1
+            ROUTE_ERRORS.inc(router=self.name, route=route.pattern)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            route.hits += 1
+            route.total_time += elapsed
+            route.max_time = max(route.max_time, elapsed)
+            ROUTE_DURATION.observe(elapsed, router=self.name, route=route.pattern)
+        return True
+
+    def routes(self) -> List[Route]:
+        result = list(self.exact_routes.values())
+        stack = [self.trie]
+        while stack:
+            node = stack.pop()
+            result.extend(node['routes'])
+            stack.extend(node['children'].values())
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики по маршрутам (для диагностики)"""
+        routes = sorted(self.routes(), key=lambda r: r.total_time, reverse=True)
+        return {
+            'router': self.name,
+            'misses': self.misses,
+            'routes': [
+                {
+                    'pattern': r.pattern,
+                    'hits': r.hits,
+                    'errors': r.errors,
+                    'total_ms': round(r.total_time * 1000, 2),
+                    'avg_ms': round(r.total_time * 1000 / r.hits, 2) if r.hits else 0,
+                    'max_ms': round(r.max_time * 1000, 2),
+                }
+                for r in routes if r.hits
+            ]
+        }
@@ -0,0 +1,110 @@
+"""
+Буферизованный журнал событий безопасности
+События копятся в памяти и записываются одним многострочным INSERT:
+в конце обработки запроса, при переполнении буфера или по таймауту.
+Повторяющиеся одинаковые события одного чата схлопываются в одну строку со счётчиком.
+"""
+
+import time
+import threading
+from datetime import datetime
+from typing import Dict, Any, Tuple
+from psycopg2.extras import execute_values
+
+import db
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# Сбросить буфер, когда в нём столько различных событий
+FLUSH_MAX_EVENTS = 50
+# Сбросить буфер, если самое старое событие ждёт дольше (секунд)
+FLUSH_MAX_AGE = 5.0
+# Схлопывать одинаковые события (chat_id, event_type, details, severity) в одну строку
+AGGREGATE_EVENTS = True
+# События этих уровней записываются сразу, без ожидания порогов
+IMMEDIATE_SEVERITIES = {'high'}
+
+_buffer: Dict[Tuple, Dict[str, Any]] = {}
+_buffer_started_at = 0.0
+_sequence = 0
+# Буфер общий для потоков воркера long polling
+_lock = threading.Lock()
+
+INSERT_EVENTS_QUERY = f"""
+    INSERT INTO {SCHEMA}.security_logs (chat_id, event_type, details, severity, event_count, created_at)
+    VALUES %s
+"""
+
+
+def log_event(chat_id: int, event_type: str, details: str, severity: str = 'medium') -> None:
+    """Добавить событие в буфер; при достижении порогов буфер сбрасывается в БД"""
+    global _buffer_started_at, _sequence
+
+    with _lock:
+        if AGGREGATE_EVENTS:
+            key = (chat_id, event_type, details, severity)
+        else:
+            _sequence += 1
+            key = (_sequence,)
+
+        if not _buffer:
+            _buffer_started_at = time.time()
+
+        event = _buffer.get(key)
+        if event:
+            event['event_count'] += 1
+        else:
+            _buffer[key] = {
+                'chat_id': chat_id,
+                'event_type': event_type,
+                'details': details,
+                'severity': severity,
+                'event_count': 1,
+                'created_at': datetime.now()
+            }
+
+        should_flush = (severity in IMMEDIATE_SEVERITIES
+                        or len(_buffer) >= FLUSH_MAX_EVENTS
+                        or time.time() - _buffer_started_at >= FLUSH_MAX_AGE)
+    if should_flush:
+        flush()
+
+
+def pending_count(chat_id: int) -> int:
+    """Сколько событий чата ещё не записано в БД"""
+    with _lock:
+        return sum(e['event_count'] for e in _buffer.values() if e['chat_id'] == chat_id)
+
+
+def buffered_count() -> int:
+    """Сколько агрегированных событий ждёт записи (глубина очереди)"""
+    return len(_buffer)
+
+
+def flush() -> int:
+    """Записать накопленные события одним запросом. Возвращает число записанных строк"""
+    global _buffer
+
+    with _lock:
+        if not _buffer:
+            return 0
+        events = list(_buffer.values())
+        _buffer = {}
+
+    rows = [
+        (e['chat_id'], e['event_type'], e['details'], e['severity'], e['event_count'], e['created_at'])
+        for e in events
+    ]
+
+    try:
+        conn = db.open_connection()
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, INSERT_EVENTS_QUERY, rows, page_size=FLUSH_MAX_EVENTS)
+            conn.commit()
+        finally:
+            conn.close()
+        return len(rows)
+    except Exception as e:
+        print(f"[ERROR] security_log.flush: {str(e)} (lost {len(rows)} events)")
+        return 0
@@ -0,0 +1,113 @@
+"""
+Журнал отправленных уведомлений (sent_notifications)
+Заявка сохраняется повторно при каждом редактировании, и подбор совпадений с рассылкой
+подписчикам запускаются снова. Перед отправкой пары (получатель, заявка) отмечаются в журнале
+одним INSERT ... ON CONFLICT DO NOTHING RETURNING: уходят только сообщения, отметка которых
+вставилась. Одновременные сохранения одной заявки не отправят одно уведомление дважды.
+Отметки сообщений, которые не ушли из-за временной ошибки (сеть, 429, 5xx), снимаются —
+уведомление отправится при следующем сохранении заявки.
+
+Вид уведомления говорит, о заявке какого типа сообщили получателю:
+    new_sender / new_carrier     — подписчику о новой заявке
+    match_sender / match_carrier — контрагенту о подходящей заявке
+    match_carrier:<id> / match_sender:<id> — владельцу заявки <id> в списке совпадений
+"""
+
+from typing import Any, Callable, List, Optional, Set, Tuple
+from psycopg2.extras import execute_values
+
+import db
+import fanout
+import metrics
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# Сколько дней хранить журнал (заявки истекают через 2 дня после даты поставки)
+SENT_NOTIFICATIONS_RETENTION_DAYS = 30
+
+SKIPPED = metrics.counter(
+    'bot_notifications_skipped_total', 'Уведомления, не отправленные повторно', ('kind',))
+RELEASED = metrics.counter(
+    'bot_notifications_released_total', 'Отметки, снятые после ошибки отправки')
+
+# (chat_id, order_id, notification_type)
+Key = Tuple[int, int, str]
+
+CLAIM_QUERY = f"""
+    INSERT INTO {SCHEMA}.sent_notifications (chat_id, order_id, notification_type)
+    VALUES %s
+    ON CONFLICT (chat_id, order_id, notification_type) DO NOTHING
+    RETURNING chat_id, order_id, notification_type
+"""
+
+RELEASE_QUERY = f"""
+    DELETE FROM {SCHEMA}.sent_notifications
+    WHERE (chat_id, order_id, notification_type) IN (VALUES %s)
+"""
+
+
+def subscriber_kind(order_type: str) -> str:
+    return f'new_{order_type}'
+
+
+def match_kind(order_type: str, owner_order_id: Optional[int] = None) -> str:
+    """owner_order_id — для списка совпадений владельцу: одна и та же заявка контрагента
+    подходит к разным заявкам владельца, и о каждой паре сообщается отдельно"""
+    if owner_order_id is None:
+        return f'match_{order_type}'
+    return f'match_{order_type}:{owner_order_id}'
+
+
+def claim(keys: List[Key]) -> Set[Key]:
+    """Отметить уведомления как отправленные; вернуть те, что ещё не были отмечены"""
+    keys = list(dict.fromkeys(k for k in keys if k[0]))
+    if not keys:
+        return set()
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            rows = execute_values(cur, CLAIM_QUERY, keys, page_size=len(keys), fetch=True)
+        conn.commit()
+    finally:
+        conn.close()
+    claimed = {tuple(row) for row in rows}
+    for key in keys:
+        if key not in claimed:
+            SKIPPED.inc(kind=key[2])
+    return claimed
+
+
+def release(keys: List[Key]) -> None:
+    """Снять отметки уведомлений, которые не удалось отправить"""
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, RELEASE_QUERY, keys, page_size=len(keys))
+        conn.commit()
+    finally:
+        conn.close()
+    RELEASED.inc(len(keys))
+
+
+def send_claimed(send: Callable[[int, str], Any], outgoing: List[Tuple[int, str, List[Key]]], what: str) -> int:
+    """Отправить сообщения (chat_id, текст, отметки сообщения) и снять отметки тех, что не ушли
+    из-за временной ошибки; возвращает число доставленных сообщений"""
+    outcomes = fanout.send_each(send, [(chat_id, text) for chat_id, text, _ in outgoing], what)
+    failed = [key for (_, _, keys), outcome in zip(outgoing, outcomes) if outcome == fanout.FAILED for key in keys]
+    release(failed)
+    return sum(1 for outcome in outcomes if outcome == fanout.SENT)
+
+
+def purge_sent_notifications(conn) -> int:
+    """Удалить старые строки журнала (вызывается из maintenance)"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            DELETE FROM {SCHEMA}.sent_notifications
+            WHERE sent_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+        """, (SENT_NOTIFICATIONS_RETENTION_DAYS,))
+        deleted = cur.rowcount
+    conn.commit()
+    return deleted
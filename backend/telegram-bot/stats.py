@@ -0,0 +1,79 @@
+"""
+Модуль статистики бота
+Дневная сводка существующих заявок (order_stats_daily) поддерживается триггерами при вставке,
+изменении и удалении заявки (V0030), админские экраны читают её одним запросом.
+Пользователи с заявками считаются по счётчикам bot_users (V0019)
+"""
+
+from datetime import date
+from typing import Dict, Any
+from psycopg2.extras import RealDictCursor
+
+import db
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+ADMIN_STATS_QUERY = f"""
+    SELECT
+        (SELECT COALESCE(SUM(orders_count), 0) FROM {SCHEMA}.order_stats_daily WHERE order_type = 'sender') AS sender_count,
+        (SELECT COALESCE(SUM(orders_count), 0) FROM {SCHEMA}.order_stats_daily WHERE order_type = 'carrier') AS carrier_count,
+        u.blocked_count, u.total_users, u.sender_users, u.carrier_users,
+        (SELECT COUNT(*) FROM {SCHEMA}.sender_orders
+         WHERE loading_date < CURRENT_DATE - INTERVAL '1 day') AS old_sender
+    FROM (
+        SELECT COUNT(*) AS total_users,
+               COUNT(*) FILTER (WHERE sender_orders_count > 0) AS sender_users,
+               COUNT(*) FILTER (WHERE carrier_orders_count > 0) AS carrier_users,
+               COUNT(*) FILTER (WHERE is_blocked) AS blocked_count
+        FROM {SCHEMA}.bot_users
+    ) u
+"""
+
+WEEKLY_STATS_QUERY = f"""
+    WITH week AS (
+        SELECT * FROM {SCHEMA}.order_stats_daily WHERE stat_date >= %s
+    )
+    SELECT
+        (SELECT COALESCE(SUM(orders_count), 0) FROM week WHERE order_type = 'sender') AS new_sender,
+        (SELECT COALESCE(SUM(orders_count), 0) FROM week WHERE order_type = 'carrier') AS new_carrier,
+        (SELECT COALESCE(SUM(orders_count), 0) FROM {SCHEMA}.order_stats_daily WHERE order_type = 'sender') AS total_sender,
+        (SELECT COALESCE(SUM(orders_count), 0) FROM {SCHEMA}.order_stats_daily WHERE order_type = 'carrier') AS total_carrier,
+        (SELECT COALESCE(json_agg(t), '[]'::json) FROM (
+            SELECT marketplace AS name, SUM(orders_count) AS cnt
+            FROM week
+            WHERE order_type = 'sender' AND marketplace <> ''
+            GROUP BY marketplace
+            ORDER BY cnt DESC
+            LIMIT 3
+        ) t) AS top_marketplaces,
+        (SELECT COALESCE(json_agg(t), '[]'::json) FROM (
+            SELECT MIN(warehouse) AS name, SUM(orders_count) AS cnt
+            FROM week
+            WHERE order_type = 'sender' AND warehouse_normalized <> ''
+            GROUP BY warehouse_normalized
+            ORDER BY cnt DESC
+            LIMIT 3
+        ) t) AS top_warehouses
+"""
+
+
+def get_admin_stats() -> Dict[str, Any]:
+    """Общая статистика для экрана «Статистика»"""
+    conn = db.open_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(ADMIN_STATS_QUERY)
+            return dict(cur.fetchone())
+    finally:
+        conn.close()
+
+
+def get_weekly_stats(week_ago: date) -> Dict[str, Any]:
+    """Статистика за неделю: новые заявки, итоги, топ маркетплейсов и складов"""
+    conn = db.open_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(WEEKLY_STATS_QUERY, (week_ago,))
+            return dict(cur.fetchone())
+    finally:
+        conn.close()
@@ -0,0 +1,131 @@
+"""
+Подписки на новые заявки (user_subscriptions) и карта получателей в памяти процесса
+Подписки хранятся с нормализованными ключами склада и маркетплейса, поэтому «Коледино»,
+«коледино » и «Каледино» попадают в одну подписку. Для рассылки по новой заявке карта
+подписок держится в памяти: список получателей считается без запроса к БД. Карта
+перечитывается после изменения подписок в этом экземпляре и не реже раза в SUBSCRIPTION_MAP_TTL
+секунд (подписки могли изменить другие экземпляры функции).
+"""
+
+import time
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import db
+import metrics
+from normalization import normalize_warehouse, normalize_marketplace
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# Сколько секунд карта подписок считается актуальной
+SUBSCRIPTION_MAP_TTL = 60
+
+INSERT_SUBSCRIPTION_QUERY = f"""
+    INSERT INTO {SCHEMA}.user_subscriptions
+    (chat_id, user_type, subscription_type, warehouse_filter, warehouse_filter_normalized, marketplace_normalized)
+    SELECT %(chat_id)s, %(user_type)s, %(subscription_type)s, %(warehouse_filter)s,
+           %(warehouse_filter_normalized)s, %(marketplace_normalized)s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {SCHEMA}.user_subscriptions
+        WHERE chat_id = %(chat_id)s AND user_type = %(user_type)s AND subscription_type = %(subscription_type)s
+        AND warehouse_filter_normalized IS NOT DISTINCT FROM %(warehouse_filter_normalized)s
+        AND marketplace_normalized IS NOT DISTINCT FROM %(marketplace_normalized)s
+    )
+"""
+
+MAP_SIZE = metrics.gauge('bot_subscription_map_size', 'Подписок в карте получателей')
+MAP_LOADS = metrics.counter('bot_subscription_map_loads_total', 'Загрузки карты подписок из БД')
+
+# (chat_id, marketplace_normalized или None, digest_minutes)
+Subscriber = Tuple[int, Optional[str], int]
+
+
+class SubscriptionMap:
+    """Подписки, разложенные по типу пользователя и ключу склада"""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.loaded_at = time.monotonic()
+        self.size = len(rows)
+        # user_type -> подписки «на все»
+        self.all: Dict[str, List[Subscriber]] = {}
+        # (user_type, ключ склада) -> подписки на склад
+        self.by_warehouse: Dict[Tuple[str, str], List[Subscriber]] = {}
+        for row in rows:
+            subscriber = (row['chat_id'], row['marketplace_normalized'] or None, row['digest_minutes'] or 0)
+            if row['subscription_type'] == 'all':
+                self.all.setdefault(row['user_type'], []).append(subscriber)
+            elif row['subscription_type'] == 'warehouse':
+                key = row['warehouse_filter_normalized'] or normalize_warehouse(row['warehouse_filter'] or '')
+                if key:
+                    self.by_warehouse.setdefault((row['user_type'], key), []).append(subscriber)
+
+    def targets(self, user_type: str, warehouse: str, marketplace: str) -> Dict[int, int]:
+        """Получатели уведомления о заявке: chat_id -> digest_minutes (одна запись на чат)"""
+        marketplace_key = normalize_marketplace(marketplace or '')
+        candidates = self.all.get(user_type, []) + self.by_warehouse.get(
+            (user_type, normalize_warehouse(warehouse or '')), [])
+        result: Dict[int, int] = {}
+        for chat_id, subscription_marketplace, digest_minutes in candidates:
+            if subscription_marketplace and subscription_marketplace != marketplace_key:
+                continue
+            # Если у чата несколько подходящих подписок, побеждает самый частый режим доставки
+            result[chat_id] = min(result.get(chat_id, digest_minutes), digest_minutes)
+        return result
+
+
+_map: Optional[SubscriptionMap] = None
+_lock = threading.Lock()
+
+
+def _load() -> SubscriptionMap:
+    subscription_map = SubscriptionMap(db.execute('load_subscriptions', fetch='all', dict_rows=True))
+    MAP_LOADS.inc()
+    MAP_SIZE.set(subscription_map.size)
+    return subscription_map
+
+
+def get_map() -> SubscriptionMap:
+    """Карта подписок; перечитывается, если устарела или была сброшена"""
+    global _map
+    current = _map
+    if current is not None and time.monotonic() - current.loaded_at < SUBSCRIPTION_MAP_TTL:
+        return current
+    with _lock:
+        if _map is None or time.monotonic() - _map.loaded_at >= SUBSCRIPTION_MAP_TTL:
+            _map = _load()
+        return _map
+
+
+def invalidate() -> None:
+    """Сбросить карту после изменения подписок"""
+    global _map
+    _map = None
+
+
+def find_targets(user_type: str, warehouse: str, marketplace: str) -> Dict[int, int]:
+    return get_map().targets(user_type, warehouse, marketplace)
+
+
+def subscribe(chat_id: int, user_type: str, subscription_type: str,
+              warehouse: Optional[str] = None, marketplace: Optional[str] = None) -> bool:
+    """Добавить подписку (повтор той же подписки не создаёт вторую строку)"""
+    warehouse_key = normalize_warehouse(warehouse) if warehouse else None
+    marketplace_key = normalize_marketplace(marketplace) if marketplace else None
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(INSERT_SUBSCRIPTION_QUERY, {
+                'chat_id': chat_id,
+                'user_type': user_type,
+                'subscription_type': subscription_type,
+                'warehouse_filter': warehouse,
+                'warehouse_filter_normalized': warehouse_key,
+                'marketplace_normalized': marketplace_key,
+            })
+            created = cur.rowcount > 0
+        conn.commit()
+    finally:
+        conn.close()
+    invalidate()
+    return created
+
@@ -0,0 +1,54 @@
+"""
+HTTP-клиент для Telegram Bot API и соседних функций
+Одна requests.Session на процесс: TCP/TLS-соединение с api.telegram.org переиспользуется
+между запросами и вызовами функции. Каждый запрос записывается в текущую трассу и метрики.
+"""
+
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+import tracing
+import metrics
+
+TELEGRAM_API_HOST = 'https://api.telegram.org/'
+
+API_DURATION = metrics.histogram(
+    'bot_telegram_api_duration_seconds', 'Время запросов к Telegram Bot API и соседним функциям', ('method',))
+API_REQUESTS = metrics.counter(
+    'bot_telegram_api_requests_total', 'Запросы к Telegram Bot API по методу и HTTP-статусу', ('method', 'status'))
+API_RATE_LIMITED = metrics.counter(
+    'bot_telegram_api_rate_limited_total', 'Ответы 429 Too Many Requests от Telegram', ('method',))
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+
+def configure_pool(maxsize: int) -> None:
+    """Размер пула соединений под число потоков (воркер long polling); меньше 8 не опускается"""
+    session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=max(8, maxsize)))
+
+
+def _span_name(url: str):
+    """('tg', 'sendMessage') для Bot API, ('http', хост/путь) для остальных адресов"""
+    if url.startswith(TELEGRAM_API_HOST):
+        return 'tg', url.rsplit('/', 1)[-1]
+    return 'http', url.split('://', 1)[-1].split('?', 1)[0]
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """requests.post через общую сессию с замером времени"""
+    kind, name = _span_name(url)
+    method = name if kind == 'tg' else 'http'
+    status = 'error'
+    started = time.perf_counter()
+    try:
+        with tracing.span(kind, name):
+            response = session.post(url, **kwargs)
+        status = str(response.status_code)
+        if response.status_code == 429:
+            API_RATE_LIMITED.inc(method=method)
+        return response
+    finally:
+        API_DURATION.observe(time.perf_counter() - started, method=method)
+        API_REQUESTS.inc(method=method, status=status)
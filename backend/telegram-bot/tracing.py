@@ -0,0 +1,159 @@
+"""
+Трассировка обработки одного обновления Telegram
+handler() открывает трассу на обновление, запросы реестра db и вызовы Telegram API
+записываются как вложенные отрезки (spans). В конце печатается одна строка JSON
+с итогами (db_ms, tg_ms, n_queries, n_tg_calls) и самыми затратными операциями —
+по ней видны медленные вебхуки и N+1 (например, по сообщению на каждую заявку).
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Callable
+
+# Трассировку можно выключить: TRACING_ENABLED=0
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', '1') != '0'
+# Сколько отдельных отрезков хранить в трассе (итоги считаются по всем)
+TRACE_MAX_SPANS = 100
+# Сколько самых затратных операций выводить в агрегате по имени
+TRACE_TOP_OPERATIONS = 10
+
+
+class Trace:
+    """Трасса одного обновления"""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped_spans = 0
+        self.totals: Dict[str, Dict[str, float]] = {}
+        self.operations: Dict[str, Dict[str, float]] = {}
+        # Отрезки могут приходить из потоков fanout параллельно
+        self.lock = threading.Lock()
+
+    def add_span(self, kind: str, name: str, started: float, duration: float, error: Optional[str]) -> None:
+        with self.lock:
+            self._add_span(kind, name, started, duration, error)
+
+    def _add_span(self, kind: str, name: str, started: float, duration: float, error: Optional[str]) -> None:
+        total = self.totals.setdefault(kind, {'count': 0, 'ms': 0.0})
+        total['count'] += 1
+        total['ms'] += duration * 1000
+
+        operation = self.operations.setdefault(f"{kind}:{name}", {'count': 0, 'ms': 0.0})
+        operation['count'] += 1
+        operation['ms'] += duration * 1000
+
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped_spans += 1
+            return
+        span = {
+            'kind': kind,
+            'name': name,
+            'start_ms': round((started - self.started) * 1000, 2),
+            'ms': round(duration * 1000, 2),
+        }
+        if error:
+            span['error'] = error
+        self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        db = self.totals.get('db', {'count': 0, 'ms': 0.0})
+        tg = self.totals.get('tg', {'count': 0, 'ms': 0.0})
+        top = sorted(self.operations.items(), key=lambda item: item[1]['ms'], reverse=True)[:TRACE_TOP_OPERATIONS]
+        return {
+            'trace': self.name,
+            'attributes': self.attributes,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'db_ms': round(db['ms'], 2),
+            'tg_ms': round(tg['ms'], 2),
+            'n_queries': int(db['count']),
+            'n_tg_calls': int(tg['count']),
+            'totals': {kind: {'count': int(t['count']), 'ms': round(t['ms'], 2)} for kind, t in self.totals.items()},
+            'top_operations': [
+                {'operation': op, 'count': int(t['count']), 'ms': round(t['ms'], 2)} for op, t in top
+            ],
+            'spans': self.spans,
+            'dropped_spans': self.dropped_spans,
+        }
+
+
+# Текущая трасса своя у каждого потока: воркер long polling обрабатывает чаты параллельно
+_local = threading.local()
+
+
+def _current() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+def _print_trace(result: Dict[str, Any]) -> None:
+    print(json.dumps(result, ensure_ascii=False, default=str))
+
+
+_sink: Callable[[Dict[str, Any]], None] = _print_trace
+
+
+def set_sink(sink: Optional[Callable[[Dict[str, Any]], None]]) -> None:
+    """Куда отдавать итоги трасс (None — печать в лог). Нагрузочный тест собирает их сам"""
+    global _sink
+    _sink = sink or _print_trace
+
+
+def start_trace(name: str, **attributes) -> Optional[Trace]:
+    """Начать трассу обновления (предыдущая незавершённая отбрасывается)"""
+    _local.trace = Trace(name, attributes) if TRACING_ENABLED else None
+    return _local.trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current()
+
+
+@contextmanager
+def attach(trace: Optional[Trace]):
+    """Записывать отрезки этого потока в чужую трассу (задачи fanout пишут в трассу обновления)"""
+    previous = _current()
+    _local.trace = trace
+    try:
+        yield
+    finally:
+        _local.trace = previous
+
+
+def set_attribute(key: str, value: Any) -> None:
+    trace = _current()
+    if trace is not None:
+        trace.attributes[key] = value
+
+
+@contextmanager
+def span(kind: str, name: str):
+    """Замерить операцию внутри текущей трассы; без трассы ничего не делает"""
+    trace = _current()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.add_span(kind, name, started, time.perf_counter() - started, error)
+
+
+def finish_trace() -> Optional[Dict[str, Any]]:
+    """Завершить трассу и вывести её одной строкой JSON"""
+    trace = _current()
+    _local.trace = None
+    if trace is None:
+        return None
+    result = trace.to_dict()
+    _sink(result)
+    return result
@@ -0,0 +1,91 @@
+"""
+Кэш пользовательских данных (шаблоны, умные дефолты) в памяти процесса
+Заполняется при первом чтении, при записи обновляется сразу (write-through).
+Объём ограничен USER_CACHE_MAX_BYTES: при превышении вытесняются давно не использованные записи.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+# Примерный бюджет памяти под кэш (байты сериализованных значений)
+USER_CACHE_MAX_BYTES = int(os.environ.get('USER_CACHE_MAX_BYTES', str(2 * 1024 * 1024)))
+# Сколько секунд запись считается актуальной (другие экземпляры функции могли изменить данные)
+USER_CACHE_TTL = 600
+
+_MISSING = object()
+
+
+def _estimate_size(value: Any) -> int:
+    return len(json.dumps(value, default=str, ensure_ascii=False)) + 64
+
+
+class UserDataCache:
+    """LRU по ключу (вид данных, chat_id) с ограничением суммарного размера"""
+
+    def __init__(self, max_bytes: int = USER_CACHE_MAX_BYTES, ttl: float = USER_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: 'OrderedDict[Tuple[str, int], Tuple[float, int, Any]]' = OrderedDict()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def get(self, kind: str, chat_id: int, default: Any = _MISSING) -> Any:
+        """Значение из кэша или default (по умолчанию — маркер промаха, см. is_miss)"""
+        key = (kind, chat_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[0] >= self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, kind: str, chat_id: int, value: Any) -> None:
+        key = (kind, chat_id)
+        size = _estimate_size(value)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (time.time(), size, value)
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+
+    def invalidate(self, chat_id: int, kind: Optional[str] = None) -> None:
+        """Сбросить данные пользователя (один вид или все)"""
+        with self.lock:
+            keys = [key for key in self.entries if key[1] == chat_id and (kind is None or key[0] == kind)]
+            for key in keys:
+                self._remove(key)
+
+    def _remove(self, key: Tuple[str, int]) -> None:
+        _created, size, _value = self.entries.pop(key)
+        self.used_bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self.entries),
+            'used_bytes': self.used_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def is_miss(value: Any) -> bool:
+    return value is _MISSING
+
+
+user_cache = UserDataCache()
@@ -0,0 +1,109 @@
+"""
+Реестр пользователей бота (bot_users)
+Активность обновляется не чаще раза в USER_TOUCH_INTERVAL секунд на пользователя,
+счётчики заявок и флаги ролей поддерживают триггеры в БД
+"""
+
+import time
+from typing import Dict, Any, Optional, List
+from psycopg2.extras import RealDictCursor
+
+import db
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# Как часто обновлять last_seen/профиль одного пользователя
+USER_TOUCH_INTERVAL = 300
+# Сколько отметок держать в памяти, прежде чем вычистить устаревшие
+USER_TOUCH_CACHE_SIZE = 10000
+
+_last_touch: Dict[int, float] = {}
+
+TOUCH_USER_QUERY = f"""
+    INSERT INTO {SCHEMA}.bot_users (chat_id, username, first_name, last_name, first_seen, last_seen)
+    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT (chat_id) DO UPDATE
+    SET username = EXCLUDED.username,
+        first_name = EXCLUDED.first_name,
+        last_name = EXCLUDED.last_name,
+        last_seen = CURRENT_TIMESTAMP
+"""
+
+
+def _prune_touches(now: float) -> None:
+    """Убрать отметки старше интервала, чтобы кэш не рос бесконечно"""
+    stale = [cid for cid, ts in list(_last_touch.items()) if now - ts >= USER_TOUCH_INTERVAL]
+    for cid in stale:
+        _last_touch.pop(cid, None)
+
+
+def touch_user(chat_id: int, username: Optional[str] = None,
+               first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
+    """Отметить активность пользователя. Возвращает True, если запись в БД была выполнена"""
+    if not chat_id:
+        return False
+
+    now = time.time()
+    last = _last_touch.get(chat_id)
+    if last is not None and now - last < USER_TOUCH_INTERVAL:
+        return False
+
+    if len(_last_touch) >= USER_TOUCH_CACHE_SIZE:
+        _prune_touches(now)
+    _last_touch[chat_id] = now
+
+    try:
+        conn = db.open_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(TOUCH_USER_QUERY, (chat_id, username, first_name, last_name))
+            conn.commit()
+        finally:
+            conn.close()
+        return True
+    except Exception as e:
+        print(f"[ERROR] touch_user: {str(e)}")
+        _last_touch.pop(chat_id, None)
+        return False
+
+
+def touch_user_from_update(user: Dict[str, Any]) -> bool:
+    """Отметить активность по полю from из апдейта Telegram"""
+    if not user:
+        return False
+    return touch_user(user.get('id'), user.get('username'), user.get('first_name'), user.get('last_name'))
+
+
+def get_bot_user(chat_id: int) -> Optional[Dict[str, Any]]:
+    """Карточка пользователя: профиль, счётчики заявок и флаги"""
+    conn = db.open_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"""
+                SELECT chat_id, username, first_name, last_name, first_seen, last_seen,
+                       sender_orders_count, carrier_orders_count, is_admin, is_blocked
+                FROM {SCHEMA}.bot_users
+                WHERE chat_id = %s
+            """, (chat_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def get_top_users(limit: int = 30) -> List[Dict[str, Any]]:
+    """Пользователи с наибольшим числом заявок"""
+    conn = db.open_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"""
+                SELECT chat_id, username, last_seen,
+                       sender_orders_count + carrier_orders_count AS order_count
+                FROM {SCHEMA}.bot_users
+                WHERE sender_orders_count + carrier_orders_count > 0
+                ORDER BY sender_orders_count + carrier_orders_count DESC
+                LIMIT %s
+            """, (limit,))
+            return [dict(row) for row in cur.fetchall()]
+    finally:
+        conn.close()
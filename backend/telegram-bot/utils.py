@@ -5,16 +5,16 @@
 import time
 import ipaddress
 from typing import Dict
-from collections import defaultdict
 
 from constants import (
     TELEGRAM_IPS, MAX_REQUESTS_PER_MINUTE, MAX_TEXT_LENGTH,
     SESSION_TIMEOUT, ADMIN_SESSION_TIMEOUT
 )
+from rate_limit import create_limiter
 
 user_states: Dict[int, Dict[str, any]] = {}
 admin_sessions: Dict[int, int] = {}
-request_counts: Dict[int, list] = defaultdict(list)
+message_limiter = create_limiter('messages', MAX_REQUESTS_PER_MINUTE, 60)
 
 def is_telegram_request(ip: str) -> bool:
     """
@@ -36,17 +36,7 @@ def is_telegram_request(ip: str) -> bool:
     #     return True
 
 def is_rate_limited(chat_id: int) -> bool:
-    now = time.time()
-    requests_list = request_counts[chat_id]
-    
-    requests_list = [req for req in requests_list if now - req < 60]
-    request_counts[chat_id] = requests_list
-    
-    if len(requests_list) >= MAX_REQUESTS_PER_MINUTE:
-        return True
-    
-    requests_list.append(now)
-    return False
+    return message_limiter.is_limited(chat_id)
 
 def validate_text_length(text: str, max_length: int = MAX_TEXT_LENGTH) -> bool:
     return len(text) <= max_length
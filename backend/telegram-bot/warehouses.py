@@ -0,0 +1,167 @@
+"""
+Автодополнение складов
+Популярные склады каждого маркетплейса держатся в префиксном дереве в памяти процесса,
+остальное ищется нечётко через pg_trgm-индекс warehouse_mappings
+"""
+
+import time
+from typing import Dict, Any, Optional, List, Tuple
+import db
+from normalization import normalize_warehouse
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+
+# Сколько самых популярных складов маркетплейса кэшировать
+TRIE_TOP_N = 200
+# Сколько подсказок хранить в каждом узле дерева
+TRIE_SUGGESTIONS_PER_NODE = 8
+# Время жизни кэша маркетплейса (секунды)
+TRIE_TTL = 600
+# Минимальное сходство для нечёткого поиска
+SIMILARITY_THRESHOLD = 0.3
+
+
+class WarehouseTrie:
+    """Префиксное дерево по нормализованным названиям; в узле — лучшие варианты по usage_count"""
+
+    def __init__(self, items: List[Tuple[str, str, int]]):
+        self.root: Dict[str, Any] = {'children': {}, 'top': []}
+        self.names = set()
+        # items уже отсортированы по usage_count DESC, поэтому списки в узлах тоже упорядочены
+        for normalized, original, _usage in items:
+            self.names.add(normalized)
+            self._insert(normalized, original)
+
+    def _insert(self, normalized: str, original: str) -> None:
+        node = self.root
+        self._remember(node, original)
+        for ch in normalized:
+            node = node['children'].setdefault(ch, {'children': {}, 'top': []})
+            self._remember(node, original)
+
+    @staticmethod
+    def _remember(node: Dict[str, Any], original: str) -> None:
+        if len(node['top']) < TRIE_SUGGESTIONS_PER_NODE and original not in node['top']:
+            node['top'].append(original)
+
+    def lookup(self, prefix: str, limit: int) -> List[str]:
+        node = self.root
+        for ch in prefix:
+            node = node['children'].get(ch)
+            if node is None:
+                return []
+        return node['top'][:limit]
+
+    def contains(self, normalized: str) -> bool:
+        return normalized in self.names
+
+
+_tries: Dict[str, Tuple[float, WarehouseTrie]] = {}
+
+
+def _load_trie(marketplace: str) -> WarehouseTrie:
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT normalized_name, original_name, usage_count
+                FROM {SCHEMA}.warehouse_mappings
+                WHERE marketplace = %s
+                ORDER BY usage_count DESC, original_name
+                LIMIT %s
+            """, (marketplace, TRIE_TOP_N))
+            return WarehouseTrie(cur.fetchall())
+    finally:
+        conn.close()
+
+
+def get_trie(marketplace: Optional[str]) -> WarehouseTrie:
+    """Дерево популярных складов маркетплейса (перечитывается раз в TRIE_TTL)"""
+    key = marketplace or ''
+    cached = _tries.get(key)
+    if cached and time.time() - cached[0] < TRIE_TTL:
+        return cached[1]
+    trie = _load_trie(key)
+    _tries[key] = (time.time(), trie)
+    return trie
+
+
+def get_popular_warehouses(marketplace: Optional[str], limit: int = 6) -> List[str]:
+    """Самые частые склады маркетплейса (для клавиатуры)"""
+    try:
+        return get_trie(marketplace).lookup('', limit)
+    except Exception as e:
+        print(f"[ERROR] get_popular_warehouses: {str(e)}")
+        return []
+
+
+def is_known_warehouse(marketplace: Optional[str], warehouse: str) -> bool:
+    """Склад уже встречался среди популярных у этого маркетплейса"""
+    try:
+        return get_trie(marketplace).contains(normalize_warehouse(warehouse))
+    except Exception as e:
+        print(f"[ERROR] is_known_warehouse: {str(e)}")
+        return True
+
+
+def search_warehouses_fuzzy(marketplace: Optional[str], normalized: str, limit: int) -> List[str]:
+    """Нечёткий поиск по триграммам, сходство взвешено популярностью"""
+    conn = db.open_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT set_limit(%s)", (SIMILARITY_THRESHOLD,))
+            cur.execute(f"""
+                SELECT original_name
+                FROM (
+                    SELECT DISTINCT ON (normalized_name)
+                           original_name,
+                           similarity(normalized_name, %s) * ln(2 + usage_count) AS score
+                    FROM {SCHEMA}.warehouse_mappings
+                    WHERE normalized_name %% %s
+                    AND (%s IS NULL OR marketplace = %s)
+                    ORDER BY normalized_name, usage_count DESC
+                ) t
+                ORDER BY score DESC
+                LIMIT %s
+            """, (normalized, normalized, marketplace, marketplace, limit))
+            return [row[0] for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def suggest_warehouses(marketplace: Optional[str], term: str, limit: int = 5) -> List[str]:
+    """Подсказки складов: сначала префикс из кэша, при промахе — нечёткий поиск в БД"""
+    normalized = normalize_warehouse(term)
+    if not normalized:
+        return []
+    try:
+        hits = get_trie(marketplace).lookup(normalized, limit)
+        if hits:
+            return hits
+        return search_warehouses_fuzzy(marketplace, normalized, limit)
+    except Exception as e:
+        print(f"[ERROR] suggest_warehouses: {str(e)}")
+        return []
+
+
+def record_warehouse_usage(marketplace: Optional[str], warehouse: str) -> None:
+    """Учесть использование написания склада (после сохранения заявки)"""
+    normalized = normalize_warehouse(warehouse)
+    if not normalized:
+        return
+    try:
+        conn = db.open_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    INSERT INTO {SCHEMA}.warehouse_mappings (marketplace, normalized_name, original_name)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (marketplace, normalized_name, original_name) DO UPDATE
+                    SET usage_count = {SCHEMA}.warehouse_mappings.usage_count + 1,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (marketplace or '', normalized, warehouse.strip()))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"[ERROR] record_warehouse_usage: {str(e)}")
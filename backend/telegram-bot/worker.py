@@ -0,0 +1,237 @@
+"""
+Воркер long polling: тот же бот без вебхука (собственный сервер, стенд)
+Обновления забираются через getUpdates пакетами. Пакет обрабатывается параллельно по чатам:
+обновления одного чата идут строго по порядку в одном потоке, разные чаты — в пуле потоков.
+offset подтверждается после обработки всего пакета, поэтому при падении воркера
+необработанные обновления придут повторно. Если обработка обновления упала (process_update
+вернул 500 — в режиме вебхука Telegram повторил бы доставку), offset останавливается на нём
+и следующий getUpdates заберёт его снова; уже обработанные обновления пакета при этом
+отсекает dedup.py. Обновление, упавшее WORKER_MAX_ATTEMPTS раз подряд, пропускается. Соединения с БД (по одному на поток), кэши
+и HTTP-сессия живут весь срок процесса. Между пакетами воркер отправляет созревшие сводки
+подписчикам (digest.py) — в режиме вебхука это делает вызов по расписанию.
+
+Запуск:
+    TELEGRAM_BOT_TOKEN=... DATABASE_URL=... python worker.py --workers 8
+
+Пока у бота установлен вебхук, getUpdates отвечает 409; --delete-webhook снимает его.
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Hashable
+
+import index
+import digest
+import metrics
+import security_log
+import telegram_client
+
+# Сколько секунд Telegram держит запрос getUpdates, если обновлений нет
+WORKER_POLL_TIMEOUT = int(os.environ.get('WORKER_POLL_TIMEOUT', '30'))
+# Максимум обновлений в одном пакете (ограничение Bot API — 100)
+WORKER_BATCH_LIMIT = 100
+# Число потоков обработки
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', '8'))
+# Пауза после ошибки getUpdates растёт до этого значения (секунды)
+WORKER_MAX_BACKOFF = 30
+ALLOWED_UPDATES = ['message', 'callback_query']
+# Как часто проверять созревшие сводки подписчиков (секунды)
+WORKER_DIGEST_INTERVAL = 60
+# Сколько раз обрабатывать упавшее обновление, прежде чем пропустить его
+WORKER_MAX_ATTEMPTS = int(os.environ.get('WORKER_MAX_ATTEMPTS', '3'))
+
+BATCH_SIZE = metrics.histogram(
+    'bot_worker_batch_size', 'Обновлений в пакете getUpdates', buckets=(1, 2, 5, 10, 25, 50, 100))
+BATCH_DURATION = metrics.histogram('bot_worker_batch_duration_seconds', 'Время обработки пакета getUpdates')
+POLL_ERRORS = metrics.counter('bot_worker_poll_errors_total', 'Ошибки getUpdates по HTTP-статусу', ('status',))
+RETRIED = metrics.counter('bot_worker_updates_retried_total', 'Обновления, возвращённые на повторную обработку')
+DROPPED = metrics.counter('bot_worker_updates_dropped_total', 'Обновления, пропущенные после WORKER_MAX_ATTEMPTS ошибок')
+
+
+def chat_key(update: Dict[str, Any]) -> Hashable:
+    """Ключ очереди: обновления с одинаковым ключом обрабатываются последовательно"""
+    if 'message' in update:
+        return update['message'].get('chat', {}).get('id')
+    if 'callback_query' in update:
+        return update['callback_query'].get('from', {}).get('id')
+    return ('update', update.get('update_id'))
+
+
+def group_by_chat(updates: List[Dict[str, Any]]) -> Dict[Hashable, List[Dict[str, Any]]]:
+    """Разложить пакет по чатам, сохраняя порядок обновлений внутри чата"""
+    groups: Dict[Hashable, List[Dict[str, Any]]] = {}
+    for update in updates:
+        groups.setdefault(chat_key(update), []).append(update)
+    return groups
+
+
+class PollError(Exception):
+    """Ответ getUpdates с ошибкой (409 — установлен вебхук, 429 — слишком часто)"""
+
+    def __init__(self, status: int, description: str, retry_after: Optional[int] = None):
+        super().__init__(f"{status} {description}")
+        self.status = status
+        self.description = description
+        self.retry_after = retry_after
+
+
+class PollingWorker:
+    """Цикл getUpdates → обработка пакета → подтверждение offset"""
+
+    def __init__(self, threads: int = WORKER_THREADS, poll_timeout: int = WORKER_POLL_TIMEOUT,
+                 batch_limit: int = WORKER_BATCH_LIMIT):
+        self.threads = threads
+        self.poll_timeout = poll_timeout
+        self.batch_limit = batch_limit
+        self.offset = 0
+        self.processed = 0
+        self.stopping = False
+        self.last_digest_flush = 0.0
+        # update_id -> число неудачных попыток обработки
+        self.attempts: Dict[int, int] = {}
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='update')
+        telegram_client.configure_pool(threads + 1)
+
+    def stop(self, *_args) -> None:
+        self.stopping = True
+
+    def delete_webhook(self) -> None:
+        response = telegram_client.post(f"{index.BASE_URL}/deleteWebhook", json={}, timeout=10)
+        print(f"deleteWebhook: {response.status_code} {response.text[:200]}")
+
+    def fetch(self) -> List[Dict[str, Any]]:
+        """Один запрос getUpdates; ошибки поднимаются наверх"""
+        response = telegram_client.post(
+            f"{index.BASE_URL}/getUpdates",
+            json={
+                'offset': self.offset,
+                'limit': self.batch_limit,
+                'timeout': self.poll_timeout,
+                'allowed_updates': ALLOWED_UPDATES,
+            },
+            timeout=self.poll_timeout + 10,
+        )
+        if response.status_code != 200:
+            POLL_ERRORS.inc(status=str(response.status_code))
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+            retry_after = (data.get('parameters') or {}).get('retry_after')
+            raise PollError(response.status_code, data.get('description', ''), retry_after)
+        return response.json().get('result', [])
+
+    def _process_chat(self, updates: List[Dict[str, Any]]) -> Optional[int]:
+        """Обработать обновления чата по порядку; update_id первого упавшего (остальные не трогаются)"""
+        for update in updates:
+            try:
+                failed = index.process_update(update).get('statusCode', 200) >= 500
+            except Exception as e:
+                print(f"[ERROR] worker.process_update: {str(e)}")
+                failed = True
+            if failed and self._should_retry(update['update_id']):
+                return update['update_id']
+        return None
+
+    def _should_retry(self, update_id: int) -> bool:
+        attempts = self.attempts[update_id] = self.attempts.get(update_id, 0) + 1
+        if attempts < WORKER_MAX_ATTEMPTS:
+            RETRIED.inc()
+            return True
+        print(f"[ERROR] worker: обновление {update_id} пропущено после {attempts} ошибок")
+        DROPPED.inc()
+        del self.attempts[update_id]
+        return False
+
+    def process_batch(self, updates: List[Dict[str, Any]]) -> None:
+        """Обработать пакет: чаты параллельно, внутри чата — по порядку"""
+        if not updates:
+            return
+        started = time.perf_counter()
+        futures = [self.pool.submit(self._process_chat, chat_updates)
+                   for chat_updates in group_by_chat(updates).values()]
+        failed = [update_id for update_id in (future.result() for future in futures) if update_id is not None]
+        if failed:
+            # Упавшее обновление и всё после него придут в следующем getUpdates
+            self.offset = min(failed)
+        else:
+            self.offset = max(u['update_id'] for u in updates) + 1
+        for update in updates:
+            if update['update_id'] < self.offset:
+                self.attempts.pop(update['update_id'], None)
+        self.processed += sum(1 for u in updates if u['update_id'] < self.offset)
+        BATCH_SIZE.observe(len(updates))
+        BATCH_DURATION.observe(time.perf_counter() - started)
+
+    def run(self) -> None:
+        backoff = 1.0
+        print(f"Long polling: потоков {self.threads}, timeout {self.poll_timeout} с")
+        while not self.stopping:
+            try:
+                updates = self.fetch()
+            except PollError as e:
+                if e.status == 409:
+                    print(f"[ERROR] getUpdates: {e.description} — запустите с --delete-webhook")
+                    break
+                delay = e.retry_after or backoff
+                print(f"[ERROR] getUpdates: {e.status} {e.description}, повтор через {delay} с")
+                time.sleep(delay)
+                backoff = min(backoff * 2, WORKER_MAX_BACKOFF)
+                continue
+            except Exception as e:
+                POLL_ERRORS.inc(status='error')
+                print(f"[ERROR] getUpdates: {str(e)}, повтор через {backoff} с")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, WORKER_MAX_BACKOFF)
+                continue
+            backoff = 1.0
+            self.process_batch(updates)
+            self.maybe_flush_digests()
+        self.shutdown()
+
+    def maybe_flush_digests(self) -> None:
+        if time.time() - self.last_digest_flush < WORKER_DIGEST_INTERVAL:
+            return
+        self.last_digest_flush = time.time()
+        try:
+            result = digest.flush_due(index.send_message)
+            if result['sent']:
+                print(f"Сводки подписчикам: {result}")
+        except Exception as e:
+            print(f"[ERROR] worker.flush_digests: {str(e)}")
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=True)
+        security_log.flush()
+        if metrics.METRICS_PUSH_URL:
+            metrics.push('telegram-bot')
+        print(f"Воркер остановлен, обработано обновлений: {self.processed}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Бот в режиме long polling (getUpdates)')
+    parser.add_argument('--workers', type=int, default=WORKER_THREADS, help='потоков обработки')
+    parser.add_argument('--poll-timeout', type=int, default=WORKER_POLL_TIMEOUT)
+    parser.add_argument('--batch-limit', type=int, default=WORKER_BATCH_LIMIT)
+    parser.add_argument('--delete-webhook', action='store_true', help='снять вебхук перед запуском')
+    args = parser.parse_args(argv)
+
+    if not index.BOT_TOKEN:
+        print('[ERROR] TELEGRAM_BOT_TOKEN не задан')
+        return 1
+
+    worker = PollingWorker(args.workers, args.poll_timeout, min(args.batch_limit, WORKER_BATCH_LIMIT))
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    if args.delete_webhook:
+        worker.delete_webhook()
+    worker.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Локальная заглушка Telegram Bot API для нагрузочных тестов
+Принимает вызовы /bot<token>/<method>, записывает их и отвечает как Telegram.
+Умеет добавлять задержку и отвечать 429 Too Many Requests с заданной вероятностью.
+Остальные пути отвечают как функция pdf-label (маленький PDF в base64).
+"""
+
+import json
+import time
+import base64
+import random
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+FAKE_PDF = base64.b64encode(b'%PDF-1.4\n%bench\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF\n').decode('ascii')
+
+
+class FakeTelegramServer:
+    """HTTP-сервер в отдельном потоке; calls — журнал принятых вызовов"""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, rate_429: float = 0.0,
+                 retry_after: int = 1, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls: List[Dict[str, Any]] = []
+        self.updates: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.message_id = 0
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeTelegramServer':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.calls.clear()
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(Counter(call['method'] for call in self.calls))
+
+    def push_update(self, update: Dict[str, Any]) -> None:
+        """Положить обновление в очередь getUpdates (для long polling)"""
+        with self.lock:
+            self.updates.append(update)
+
+    def _respond(self, method: str, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        delay = self.latency_ms + (self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+
+        with self.lock:
+            limited = self.rate_429 and self.random.random() < self.rate_429
+            self.calls.append({
+                'method': method,
+                'chat_id': payload.get('chat_id'),
+                'status': 429 if limited else 200,
+                'at': time.time(),
+            })
+            if limited:
+                return 429, {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after},
+                }
+            if method == 'getUpdates':
+                # Как в Telegram: offset подтверждает всё, что меньше него
+                offset = int(payload.get('offset') or 0)
+                self.updates = [u for u in self.updates if u['update_id'] >= offset]
+                return 200, {'ok': True, 'result': self.updates[:int(payload.get('limit') or 100)]}
+            self.message_id += 1
+            message_id = self.message_id
+
+        if method in ('sendMessage', 'sendDocument', 'editMessageText'):
+            return 200, {'ok': True, 'result': {'message_id': message_id, 'chat': {'id': payload.get('chat_id')}}}
+        return 200, {'ok': True, 'result': True}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _payload(self) -> Dict[str, Any]:
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                if self.headers.get('Content-Type', '').startswith('application/json') and raw:
+                    return json.loads(raw)
+                # multipart (sendDocument) и form-data разбирать не нужно — достаточно факта вызова
+                return {}
+
+            def do_POST(self):
+                path = urlsplit(self.path).path
+                payload = self._payload()
+                if path.startswith('/bot'):
+                    status, body = server._respond(path.rsplit('/', 1)[-1], payload)
+                else:
+                    status, body = server._respond('pdf-label', payload)
+                    if status == 200:
+                        body = {'pdf': FAKE_PDF, 'filename': f"label_{payload.get('order_id')}.pdf"}
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class RedirectAdapter(HTTPAdapter):
+    """Адаптер requests, отправляющий запросы на заглушку вместо настоящего хоста"""
+
+    def __init__(self, target: str, **kwargs):
+        super().__init__(**kwargs)
+        self.target = target.rstrip('/')
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = self.target + parts.path + (f"?{parts.query}" if parts.query else '')
+        return super().send(request, **kwargs)
+
+
+def redirect_session(session: requests.Session, server: FakeTelegramServer,
+                     prefixes=('https://api.telegram.org/', 'https://functions.poehali.dev/')) -> None:
+    """Направить запросы сессии к Telegram и соседним функциям на заглушку"""
+    adapter = RedirectAdapter(server.base_url)
+    for prefix in prefixes:
+        session.mount(prefix, adapter)
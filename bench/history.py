@@ -0,0 +1,92 @@
+"""
+Хранение результатов бенчмарков и сравнение с прошлыми прогонами
+Каждый прогон — JSON-файл в bench/results/ с полями bench, started_at, git_rev, config, result.
+Сравнение идёт с последним прогоном того же бенчмарка с теми же параметрами (config).
+"""
+
+import os
+import json
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+# Насколько может ухудшиться метрика (в процентах), прежде чем прогон считается регрессией
+DEFAULT_REGRESSION_THRESHOLD = 10.0
+
+# Путь к метрике в result и направление: True — больше лучше
+MetricSpec = Tuple[Tuple[str, ...], bool]
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def make_record(bench: str, config: Dict[str, Any], result: Dict[str, Any], **extra) -> Dict[str, Any]:
+    return {
+        'bench': bench,
+        'started_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'git_rev': git_revision(),
+        'config': config,
+        'result': result,
+        **extra,
+    }
+
+
+def save_record(record: Dict[str, Any], results_dir: str = RESULTS_DIR) -> str:
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{record['started_at'].replace(':', '')}-{record['bench']}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def find_previous(bench: str, config: Dict[str, Any], results_dir: str = RESULTS_DIR) -> Optional[Dict[str, Any]]:
+    """Последний сохранённый прогон бенчмарка с теми же параметрами"""
+    if not os.path.isdir(results_dir):
+        return None
+    for name in sorted(os.listdir(results_dir), reverse=True):
+        if not name.endswith(f"-{bench}.json"):
+            continue
+        with open(os.path.join(results_dir, name), encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('bench') == bench and previous.get('config') == config:
+            return previous
+    return None
+
+
+def _get(result: Dict[str, Any], path: Sequence[str]) -> Optional[float]:
+    value: Any = result
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any], metrics: Sequence[MetricSpec],
+            threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> List[str]:
+    """Напечатать изменения относительно прошлого прогона; вернуть список регрессий"""
+    regressions = []
+    print(f"\nСравнение с прогоном {previous['started_at']} ({previous.get('git_rev') or '?'}):")
+    for path, higher_is_better in metrics:
+        old = _get(previous['result'], path)
+        new = _get(current['result'], path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        worse = -change if higher_is_better else change
+        mark = ''
+        if worse > threshold:
+            mark = '  <-- регрессия'
+            regressions.append('.'.join(path))
+        print(f"  {'.'.join(path):40} {old:>12} -> {new:>12}  ({change:+.1f}%){mark}")
+    return regressions
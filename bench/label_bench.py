@@ -0,0 +1,208 @@
+"""
+Бенчмарк генерации PDF-этикеток (функция pdf-label)
+Рендерит N этикеток каждого размера по синтетическим заявкам отправителей и перевозчиков
+и показывает этикеток в секунду, байт на этикетку, пиковый RSS и разбивку времени
+по фазам generate_label_pdf: шрифт, QR-код, раскладка текста, сохранение PDF.
+
+Пример:
+    python bench/label_bench.py --count 200
+    python bench/label_bench.py --count 500 --parallel 4
+
+Шрифт берётся из --font (или системного DejaVuSans) и кладётся туда, где его ищет
+download_font, — сеть не нужна. БД не нужна: заявки передаются напрямую.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+sys.path.insert(0, BENCH_DIR)
+
+import history  # noqa: E402
+from scenarios import sender_order_data, carrier_order_data  # noqa: E402
+
+# Куда download_font в pdf-label сохраняет шрифт
+FONT_PATH = '/tmp/DejaVuSans.ttf'
+SYSTEM_FONTS = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/TTF/DejaVuSans.ttf',
+]
+PHASES = ('font', 'qr', 'text', 'save')
+
+# Модуль pdf-label в текущем процессе (в воркерах пула загружается инициализатором)
+_pdf_label = None
+
+
+def ensure_font(font: Optional[str]) -> None:
+    """Положить шрифт в FONT_PATH, чтобы download_font не ходил в сеть"""
+    if os.path.exists(FONT_PATH) and not font:
+        return
+    candidates = [font] if font else SYSTEM_FONTS
+    for path in candidates:
+        if path and os.path.exists(path):
+            shutil.copyfile(path, FONT_PATH)
+            return
+    raise SystemExit(f"Шрифт не найден: укажите --font путь/к/DejaVuSans.ttf (искали {', '.join(candidates)})")
+
+
+def _load_pdf_label():
+    global _pdf_label
+    if _pdf_label is None:
+        # Без токена модуль не запрашивает getMe при импорте
+        os.environ.pop('TELEGRAM_BOT_TOKEN', None)
+        os.environ.pop('METRICS_PUSH_URL', None)
+        from microbench import load_pdf_label
+        _pdf_label = load_pdf_label()
+        if _pdf_label is None:
+            raise SystemExit('Не удалось импортировать pdf-label (нужны reportlab, psycopg2, requests)')
+    return _pdf_label
+
+
+def build_orders(count: int, seed: int) -> List[Tuple[Dict[str, Any], str]]:
+    """count заявок вперемешку: две трети отправителей, треть перевозчиков"""
+    rnd = random.Random(seed)
+    orders = []
+    for i in range(count):
+        data = sender_order_data(rnd) if i % 3 else carrier_order_data(rnd)
+        orders.append((dict(data, id=100000 + i), data['type']))
+    return orders
+
+
+def render_batch(label_size: str, orders: List[Tuple[Dict[str, Any], str]]) -> Dict[str, Any]:
+    """Отрендерить пакет этикеток одного размера; вернуть число, байты и время по фазам"""
+    pdf_label = _load_pdf_label()
+    timings: Dict[str, float] = {}
+    total_bytes = 0
+    started = time.perf_counter()
+    for order, order_type in orders:
+        total_bytes += len(pdf_label.generate_label_pdf(order, order_type, label_size, timings))
+    return {
+        'labels': len(orders),
+        'bytes': total_bytes,
+        'elapsed': time.perf_counter() - started,
+        'timings': timings,
+    }
+
+
+def _chunks(items: List[Any], n: int) -> List[List[Any]]:
+    size = max(1, -(-len(items) // n))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def run_size(label_size: str, orders: List[Tuple[Dict[str, Any], str]],
+             pool: Optional[ProcessPoolExecutor], workers: int) -> Dict[str, Any]:
+    started = time.perf_counter()
+    if pool is None:
+        parts = [render_batch(label_size, orders)]
+    else:
+        futures = [pool.submit(render_batch, label_size, chunk) for chunk in _chunks(orders, workers)]
+        parts = [f.result() for f in futures]
+    wall = time.perf_counter() - started
+
+    labels = sum(p['labels'] for p in parts)
+    total_bytes = sum(p['bytes'] for p in parts)
+    busy = sum(p['elapsed'] for p in parts)
+    phases = {name: sum(p['timings'].get(name, 0.0) for p in parts) for name in PHASES}
+    other = max(0.0, busy - sum(phases.values()))
+    return {
+        'labels': labels,
+        'labels_per_s': round(labels / wall, 1),
+        'ms_per_label': round(busy / labels * 1000, 3),
+        'bytes_per_label': round(total_bytes / labels),
+        'phase_ms_per_label': {name: round(value / labels * 1000, 3) for name, value in phases.items()},
+        'phase_share_pct': {
+            name: round(value / busy * 100, 1) if busy else 0.0
+            for name, value in list(phases.items()) + [('other', other)]
+        },
+    }
+
+
+def peak_rss_kib() -> Dict[str, int]:
+    """Пиковый RSS процесса и самого тяжёлого воркера (ru_maxrss в Linux — КиБ)"""
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"\n{'размер':8} {'этикеток':>9} {'эт./с':>9} {'мс/эт.':>9} {'байт/эт.':>9}   "
+          + '  '.join(f"{name:>6}" for name in PHASES + ('other',)))
+    for label_size, r in result['sizes'].items():
+        shares = '  '.join(f"{r['phase_share_pct'][name]:>5}%" for name in PHASES + ('other',))
+        print(f"{label_size:8} {r['labels']:>9} {r['labels_per_s']:>9} {r['ms_per_label']:>9} "
+              f"{r['bytes_per_label']:>9}   {shares}")
+    rss = result['peak_rss_kib']
+    print(f"\nПиковый RSS: процесс {rss['self'] / 1024:.1f} МиБ"
+          + (f", воркер {rss['children'] / 1024:.1f} МиБ" if rss['children'] else ''))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Бенчмарк генерации PDF-этикеток')
+    parser.add_argument('--count', type=int, default=200, help='этикеток каждого размера')
+    parser.add_argument('--sizes', default='120x75,58x40')
+    parser.add_argument('--parallel', type=int, default=0, help='число процессов (0 — в текущем процессе)')
+    parser.add_argument('--font', help='путь к DejaVuSans.ttf')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--results-dir', default=history.RESULTS_DIR)
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--threshold', type=float, default=history.DEFAULT_REGRESSION_THRESHOLD,
+                        help='допустимое ухудшение, %%')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    ensure_font(args.font)
+    sizes = [s.strip() for s in args.sizes.split(',') if s.strip()]
+    orders = build_orders(args.count, args.seed)
+
+    pool = None
+    if args.parallel:
+        pool = ProcessPoolExecutor(max_workers=args.parallel, initializer=_load_pdf_label)
+    else:
+        _load_pdf_label()
+    try:
+        # Прогрев: импорт reportlab, разбор шрифта, первые выделения памяти
+        if pool is None:
+            render_batch(sizes[0], orders[:3])
+        else:
+            for f in [pool.submit(render_batch, sizes[0], orders[:1]) for _ in range(args.parallel)]:
+                f.result()
+        result: Dict[str, Any] = {'sizes': {size: run_size(size, orders, pool, args.parallel) for size in sizes}}
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    result['peak_rss_kib'] = peak_rss_kib()
+    print_report(result)
+
+    config = {'count': args.count, 'sizes': sizes, 'parallel': args.parallel, 'seed': args.seed,
+              'python': sys.version.split()[0]}
+    record = history.make_record('label_bench', config, result)
+
+    regressions = []
+    previous = history.find_previous('label_bench', config, args.results_dir)
+    if previous:
+        metrics = []
+        for size in sizes:
+            metrics += [(('sizes', size, 'labels_per_s'), True), (('sizes', size, 'ms_per_label'), False)]
+        metrics.append((('peak_rss_kib', 'self'), False))
+        regressions = history.compare(previous, record, metrics, args.threshold)
+
+    if not args.no_save:
+        path = history.save_record(record, args.results_dir)
+        print(f"\nРезультат сохранён: {os.path.relpath(path, ROOT_DIR)}")
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
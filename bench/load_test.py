@@ -0,0 +1,312 @@
+"""
+Нагрузочный тест вебхука: прогоняет синтетический поток обновлений через
+backend/telegram-bot/index.py:handler на локальном Postgres и заглушке Bot API.
+
+Отчёт: updates/s, p50/p95/p99 задержки, запросы к БД, новые соединения и вызовы
+Telegram на одно обновление, самые затратные операции. Результат сохраняется
+в bench/results/ и сравнивается с прошлым прогоном с теми же параметрами.
+
+Пример:
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench \\
+    python bench/load_test.py --migrate --users 200 --tg-latency-ms 40 --tg-429-rate 0.01
+
+Обработчик вызывается последовательно, как в одном экземпляре облачной функции:
+updates/s — пропускная способность одного экземпляра.
+"""
+
+import io
+import os
+import math
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+BOT_DIR = os.path.join(ROOT_DIR, 'backend', 'telegram-bot')
+MIGRATIONS_DIR = os.path.join(ROOT_DIR, 'db_migrations')
+
+SCHEMA = 't_p52349012_telegram_bot_creatio'
+FIRST_CHAT_ID = 900000000
+
+sys.path.insert(0, BENCH_DIR)
+
+import history  # noqa: E402
+from fake_telegram import FakeTelegramServer, redirect_session  # noqa: E402
+from scenarios import build_stream, OWNER_CHAT_ID  # noqa: E402
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def apply_migrations(database_url: str) -> List[str]:
+    """Применить db_migrations по порядку; применённые версии хранятся в bench_migrations"""
+    import psycopg2
+
+    applied = []
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}")
+            cur.execute(f"SET search_path TO {SCHEMA}, public")
+            cur.execute("CREATE TABLE IF NOT EXISTS bench_migrations (version INTEGER PRIMARY KEY)")
+            cur.execute("SELECT version FROM bench_migrations")
+            done = {row[0] for row in cur.fetchall()}
+
+            files = []
+            for name in os.listdir(MIGRATIONS_DIR):
+                match = re.match(r'V(\d+)__.+\.sql$', name)
+                if match:
+                    files.append((int(match.group(1)), name))
+
+            for version, name in sorted(files):
+                if version in done:
+                    continue
+                with open(os.path.join(MIGRATIONS_DIR, name), encoding='utf-8') as f:
+                    cur.execute(f.read())
+                cur.execute("INSERT INTO bench_migrations (version) VALUES (%s)", (version,))
+                applied.append(name)
+    finally:
+        conn.close()
+    return applied
+
+
+def reset_bench_data(database_url: str, first_chat_id: int, last_chat_id: int) -> int:
+    """Удалить данные синтетических пользователей прошлых прогонов (все таблицы с chat_id)"""
+    import psycopg2
+
+    deleted = 0
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.table_name
+                FROM information_schema.columns c
+                JOIN information_schema.tables t
+                  ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+                WHERE c.table_schema = %s AND c.column_name = 'chat_id' AND t.table_type = 'BASE TABLE'
+            """, (SCHEMA,))
+            for (table,) in cur.fetchall():
+                cur.execute(
+                    f"DELETE FROM {SCHEMA}.{table} WHERE chat_id BETWEEN %s AND %s",
+                    (first_chat_id, last_chat_id)
+                )
+                deleted += cur.rowcount
+    finally:
+        conn.close()
+    return deleted
+
+
+def load_bot(database_url: str, server: FakeTelegramServer):
+    """Импортировать функцию бота с окружением бенчмарка и направить HTTP на заглушку"""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '100000:bench')
+    os.environ['TRACING_ENABLED'] = '1'
+    os.environ.pop('METRICS_PUSH_URL', None)
+    sys.path.insert(0, BOT_DIR)
+
+    import index
+    import tracing
+    import telegram_client
+
+    redirect_session(telegram_client.session, server)
+    return index, tracing
+
+
+def run(stream: List[Dict[str, Any]], index, tracing, warmup: int = 0) -> Dict[str, Any]:
+    traces: List[Dict[str, Any]] = []
+    tracing.set_sink(traces.append)
+
+    latencies: List[float] = []
+    by_type: Dict[str, List[float]] = defaultdict(list)
+    errors = 0
+    log = io.StringIO()
+
+    started = None
+    for i, update in enumerate(stream):
+        if i == warmup:
+            traces.clear()
+            log.seek(0)
+            log.truncate()
+            started = time.perf_counter()
+        event = {'httpMethod': 'POST', 'headers': {}, 'body': json.dumps(update, ensure_ascii=False)}
+        update_type = 'callback_query' if 'callback_query' in update else 'message'
+
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            response = index.handler(event, None)
+        elapsed = time.perf_counter() - t0
+
+        if i >= warmup:
+            latencies.append(elapsed)
+            by_type[update_type].append(elapsed)
+            if response.get('statusCode') != 200:
+                errors += 1
+    wall = time.perf_counter() - started if started is not None else 0.0
+    tracing.set_sink(None)
+
+    error_lines = [line for line in log.getvalue().splitlines() if line.startswith('[ERROR]')]
+    return summarize(latencies, by_type, traces, wall, errors, error_lines)
+
+
+def summarize(latencies: List[float], by_type: Dict[str, List[float]], traces: List[Dict[str, Any]],
+              wall: float, errors: int, error_lines: List[str]) -> Dict[str, Any]:
+    n = len(latencies)
+    ordered = sorted(latencies)
+
+    def mean(values) -> float:
+        values = list(values)
+        return round(sum(values) / len(values), 3) if values else 0.0
+
+    operations: Dict[str, Dict[str, float]] = defaultdict(lambda: {'count': 0, 'ms': 0.0})
+    for trace in traces:
+        for op in trace['top_operations']:
+            operations[op['operation']]['count'] += op['count']
+            operations[op['operation']]['ms'] += op['ms']
+    top = sorted(operations.items(), key=lambda item: item[1]['ms'], reverse=True)[:15]
+
+    error_kinds: Dict[str, int] = defaultdict(int)
+    for line in error_lines:
+        error_kinds[line.split(':', 1)[0]] += 1
+
+    return {
+        'updates': n,
+        'wall_s': round(wall, 3),
+        'updates_per_s': round(n / wall, 2) if wall else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(ordered, 50) * 1000, 2),
+            'p95': round(percentile(ordered, 95) * 1000, 2),
+            'p99': round(percentile(ordered, 99) * 1000, 2),
+            'max': round(ordered[-1] * 1000, 2) if ordered else 0.0,
+            'mean': round(sum(ordered) / n * 1000, 2) if n else 0.0,
+        },
+        'latency_ms_by_type': {
+            kind: {
+                'count': len(values),
+                'p50': round(percentile(sorted(values), 50) * 1000, 2),
+                'p95': round(percentile(sorted(values), 95) * 1000, 2),
+            }
+            for kind, values in sorted(by_type.items())
+        },
+        'queries_per_update': mean(t['n_queries'] for t in traces),
+        'connections_per_update': mean(t['totals'].get('db_connect', {}).get('count', 0) for t in traces),
+        'tg_calls_per_update': mean(t['n_tg_calls'] for t in traces),
+        'db_ms_per_update': mean(t['db_ms'] for t in traces),
+        'tg_ms_per_update': mean(t['tg_ms'] for t in traces),
+        'top_operations': [
+            {'operation': name, 'count': int(v['count']), 'ms': round(v['ms'], 2)} for name, v in top
+        ],
+        'failed_responses': errors,
+        'logged_errors': dict(error_kinds),
+    }
+
+
+# Метрики для сравнения прогонов: путь в результате и направление (True — больше лучше)
+COMPARED_METRICS = [
+    (('updates_per_s',), True),
+    (('latency_ms', 'p50'), False),
+    (('latency_ms', 'p95'), False),
+    (('latency_ms', 'p99'), False),
+    (('queries_per_update',), False),
+    (('connections_per_update',), False),
+    (('tg_calls_per_update',), False),
+]
+
+
+def print_report(result: Dict[str, Any], tg_counts: Dict[str, int], tg_429: int) -> None:
+    latency = result['latency_ms']
+    print(f"Обновлений: {result['updates']} за {result['wall_s']} с — {result['updates_per_s']} updates/s")
+    print(f"Задержка, мс: p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    for kind, values in result['latency_ms_by_type'].items():
+        print(f"  {kind:16} n={values['count']:<6} p50 {values['p50']}  p95 {values['p95']}")
+    print(f"На обновление: запросов к БД {result['queries_per_update']}, "
+          f"новых соединений {result['connections_per_update']}, "
+          f"вызовов Telegram {result['tg_calls_per_update']}")
+    print(f"Время на обновление, мс: БД {result['db_ms_per_update']}, Telegram {result['tg_ms_per_update']}")
+    print(f"Вызовы заглушки Bot API: {json.dumps(tg_counts, ensure_ascii=False)}; ответов 429: {tg_429}")
+    print("Самые затратные операции:")
+    for op in result['top_operations']:
+        print(f"  {op['operation']:40} {op['count']:>7}  {op['ms']:>10} мс")
+    if result['failed_responses'] or result['logged_errors']:
+        print(f"Ошибки: ответов не 200 — {result['failed_responses']}, "
+              f"в логе — {json.dumps(result['logged_errors'], ensure_ascii=False)}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест вебхука telegram-bot')
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL', ''),
+                        help='локальная БД (по умолчанию BENCH_DATABASE_URL)')
+    parser.add_argument('--migrate', action='store_true', help='применить db_migrations перед прогоном')
+    parser.add_argument('--no-reset', action='store_true', help='не удалять данные прошлых прогонов')
+    parser.add_argument('--users', type=int, default=100, help='число синтетических пользователей')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=50, help='первые N обновлений не учитываются')
+    parser.add_argument('--tg-latency-ms', type=float, default=30.0, help='задержка ответа Bot API')
+    parser.add_argument('--tg-jitter-ms', type=float, default=20.0, help='случайная добавка к задержке')
+    parser.add_argument('--tg-429-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--results-dir', default=history.RESULTS_DIR)
+    parser.add_argument('--no-save', action='store_true', help='не сохранять результат')
+    parser.add_argument('--threshold', type=float, default=history.DEFAULT_REGRESSION_THRESHOLD,
+                        help='допустимое ухудшение метрики, %%')
+    parser.add_argument('--fail-on-regression', action='store_true', help='код выхода 1 при регрессии')
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        parser.error('укажите --database-url или BENCH_DATABASE_URL')
+
+    if args.migrate:
+        applied = apply_migrations(args.database_url)
+        print(f"Применено миграций: {len(applied)}")
+    if not args.no_reset:
+        reset_bench_data(args.database_url, FIRST_CHAT_ID, FIRST_CHAT_ID + args.users)
+        reset_bench_data(args.database_url, OWNER_CHAT_ID, OWNER_CHAT_ID)
+
+    # update_id уникальны между прогонами, иначе processed_updates отбросит их как повторы
+    stream = build_stream(args.users, seed=args.seed, first_chat_id=FIRST_CHAT_ID,
+                          first_update_id=int(time.time() * 1000))
+    server = FakeTelegramServer(args.tg_latency_ms, args.tg_jitter_ms, args.tg_429_rate, seed=args.seed).start()
+    try:
+        index, tracing = load_bot(args.database_url, server)
+        result = run(stream, index, tracing, warmup=min(args.warmup, len(stream) // 10))
+    finally:
+        server.stop()
+
+    tg_counts = server.counts()
+    tg_429 = sum(1 for call in server.calls if call['status'] == 429)
+    print_report(result, tg_counts, tg_429)
+
+    config = {
+        'users': args.users,
+        'seed': args.seed,
+        'tg_latency_ms': args.tg_latency_ms,
+        'tg_jitter_ms': args.tg_jitter_ms,
+        'tg_429_rate': args.tg_429_rate,
+    }
+    record = history.make_record('load_test', config, result, telegram_calls=tg_counts)
+
+    regressions = []
+    previous = history.find_previous('load_test', config, args.results_dir)
+    if previous:
+        regressions = history.compare(previous, record, COMPARED_METRICS, args.threshold)
+
+    if not args.no_save:
+        path = history.save_record(record, args.results_dir)
+        print(f"\nРезультат сохранён: {os.path.relpath(path, ROOT_DIR)}")
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+Микробенчмарки горячих чистых функций бота
+Нормализация складов и городов, экранирование HTML, валидация телефона и даты,
+ограничитель частоты, тексты превью и уведомлений, текст этикетки (pdf-label).
+Каждая функция прогоняется по большому пакету типичных кириллических входов;
+отдельный прогон под tracemalloc показывает выделения памяти.
+
+Пример:
+    python bench/microbench.py --batch 20000 --filter normalize
+
+Результат сохраняется в bench/results/ и сравнивается с прошлым прогоном
+с теми же параметрами (см. history.py). БД и сеть не нужны.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import tracemalloc
+import importlib.util
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Callable, Sequence, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+BOT_DIR = os.path.join(ROOT_DIR, 'backend', 'telegram-bot')
+PDF_LABEL_DIR = os.path.join(ROOT_DIR, 'backend', 'pdf-label')
+
+sys.path.insert(0, BENCH_DIR)
+
+import history  # noqa: E402
+from scenarios import WAREHOUSES, CITIES, sender_order_data, carrier_order_data  # noqa: E402
+
+# Варианты написания, которые реально приходят от пользователей
+WAREHOUSE_VARIANTS = [
+    '{w}', '{w} ', '  {w}', '{lower}', '{upper}', 'СЦ {w}', 'склад {w}', '{w} WB', '{w} (Wildberries)',
+    'г. {w}', '{w}-2', 'Склад  {w}  ', 'WB {w}', '{w} РЦ',
+]
+CITY_VARIANTS = [
+    '{c}', '{lower}', '{upper}', 'г. {c}', 'г {c}', '{c} ', 'город {c}', '{c}, Россия', 'пос. {c}',
+]
+EXTRA_CITIES = ['спб', 'мск', 'Санкт Петербург', 'С-Петербург', 'Ростов на Дону', 'Нижний Новгород']
+PHONES = [
+    '+79991234567', '89991234567', '8 (999) 123-45-67', '+7 999 123 45 67', '9991234567',
+    '+7-999-123-45-67', 'не скажу', '12345', '+7999123456789012', '',
+]
+HTML_FRAGMENTS = [
+    'ул. Ленина, д. 10', 'ООО «Ромашка» & партнёры', '<b>жирный</b>', 'Иванов "Ваня" Иван',
+    'Склад <Коледино>', "д'Артаньян", 'Просто текст без спецсимволов', 'Ъ' * 120,
+]
+
+
+class Case:
+    """Одна функция и пакет аргументов к ней; setup вызывается перед каждым пакетом вне замера"""
+
+    def __init__(self, name: str, fn: Callable, inputs: Sequence[Tuple], setup: Optional[Callable] = None):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.setup = setup
+
+    def run_batch(self) -> float:
+        fn = self.fn
+        if self.setup is not None:
+            self.setup()
+        started = time.perf_counter()
+        for args in self.inputs:
+            fn(*args)
+        return time.perf_counter() - started
+
+
+def _warehouse_inputs(rnd: random.Random, n: int) -> List[Tuple]:
+    result = []
+    for _ in range(n):
+        w = rnd.choice(WAREHOUSES)
+        template = rnd.choice(WAREHOUSE_VARIANTS)
+        result.append((template.format(w=w, lower=w.lower(), upper=w.upper()),))
+    return result
+
+
+def _city_inputs(rnd: random.Random, n: int) -> List[Tuple]:
+    result = []
+    for _ in range(n):
+        if rnd.random() < 0.2:
+            result.append((rnd.choice(EXTRA_CITIES),))
+            continue
+        c = rnd.choice(CITIES)
+        template = rnd.choice(CITY_VARIANTS)
+        result.append((template.format(c=c, lower=c.lower(), upper=c.upper()),))
+    return result
+
+
+def load_bot():
+    """Импорт функции бота без БД и сети: лимитер в памяти, трассировка выключена"""
+    os.environ['RATE_LIMIT_BACKEND'] = 'memory'
+    os.environ['TRACING_ENABLED'] = '0'
+    os.environ.setdefault('DATABASE_URL', 'postgresql://bench@localhost/bench')
+    os.environ.pop('METRICS_PUSH_URL', None)
+    sys.path.insert(0, BOT_DIR)
+    import index
+    import normalization
+    return index, normalization
+
+
+def load_pdf_label():
+    """Модуль pdf-label под отдельным именем (у обеих функций файл называется index.py)"""
+    sys.path.insert(0, PDF_LABEL_DIR)
+    try:
+        spec = importlib.util.spec_from_file_location('pdf_label_index', os.path.join(PDF_LABEL_DIR, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except ImportError as e:
+        print(f"pdf-label пропущен: {e}")
+        return None
+    finally:
+        sys.path.remove(PDF_LABEL_DIR)
+
+
+def build_cases(batch: int, seed: int) -> List[Case]:
+    rnd = random.Random(seed)
+    index, normalization = load_bot()
+
+    today = datetime.now()
+    dates = [((today + timedelta(days=rnd.randint(-3, 30))).strftime('%Y-%m-%d'),) for _ in range(batch)]
+    dates[::50] = [('31.12.2025',)] * len(dates[::50])
+
+    senders = [sender_order_data(rnd) for _ in range(batch)]
+    carriers = [carrier_order_data(rnd) for _ in range(batch)]
+    matches = [
+        dict(c, id=i, chat_id=1000 + i) for i, c in enumerate(carriers[:5])
+    ]
+
+    warehouse_inputs = _warehouse_inputs(rnd, batch)
+    city_inputs = _city_inputs(rnd, batch)
+    cases = [
+        # Нормализация закэширована (lru_cache): кэш очищается перед каждым пакетом, иначе повторы
+        # замеряли бы одни попадания в кэш. [uncached] — сами правила, без кэша
+        Case('normalize_warehouse', normalization.normalize_warehouse, warehouse_inputs,
+             setup=normalization.normalize_warehouse.cache_clear),
+        Case('normalize_warehouse[uncached]', normalization.normalize_warehouse.__wrapped__, warehouse_inputs),
+        Case('normalize_city', normalization.normalize_city, city_inputs,
+             setup=normalization.normalize_city.cache_clear),
+        Case('normalize_city[uncached]', normalization.normalize_city.__wrapped__, city_inputs),
+        Case('sanitize_html', index.sanitize_html,
+             [(rnd.choice(HTML_FRAGMENTS) * rnd.randint(1, 4),) for _ in range(batch)]),
+        Case('validate_phone', index.validate_phone, [(rnd.choice(PHONES),) for _ in range(batch)]),
+        Case('validate_date_not_past', index.validate_date_not_past, dates),
+        Case('is_rate_limited', index.is_rate_limited,
+             [(rnd.randint(1, 5000) + 800000000,) for _ in range(batch)]),
+        Case('build_preview[sender]', index.build_preview, [(d,) for d in senders]),
+        Case('build_preview[carrier]', index.build_preview, [(d,) for d in carriers]),
+        Case('build_new_order_notification', index.build_new_order_notification,
+             [(i, d['type'], d) for i, d in enumerate(senders[:batch // 2] + carriers[:batch // 2])]),
+        Case('build_subscriber_notification', index.build_subscriber_notification,
+             [(i, d['type'], d) for i, d in enumerate(senders[:batch // 2] + carriers[:batch // 2])]),
+        Case('build_carrier_matches_message', index.build_carrier_matches_message,
+             [(i, d['delivery_date'], d['warehouse'], matches) for i, d in enumerate(senders)]),
+    ]
+
+    pdf_label = load_pdf_label()
+    if pdf_label is not None:
+        orders = [dict(d, id=i) for i, d in enumerate(senders[:batch // 2] + carriers[:batch // 2])]
+        cases.append(Case('format_order_text', pdf_label.format_order_text, [(o, o['type']) for o in orders]))
+    return cases
+
+
+def measure(case: Case, repeat: int, track_memory: bool) -> Dict[str, Any]:
+    case.run_batch()  # прогрев: кэши регулярных выражений, ленивые импорты
+    timings = [case.run_batch() for _ in range(repeat)]
+    calls = len(case.inputs)
+    best = min(timings)
+    result = {
+        'calls': calls,
+        'ns_per_call': round(best / calls * 1e9, 1),
+        'ns_per_call_median': round(statistics.median(timings) / calls * 1e9, 1),
+        'calls_per_s': round(calls / best),
+    }
+    if track_memory:
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        case.run_batch()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['alloc_peak_kib'] = round((peak - before) / 1024, 1)
+        result['retained_bytes_per_call'] = round((current - before) / calls, 1)
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Микробенчмарки горячих функций бота')
+    parser.add_argument('--batch', type=int, default=10000, help='входов на функцию')
+    parser.add_argument('--repeat', type=int, default=5, help='повторов пакета (берётся лучший)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--filter', default='', help='только функции, в имени которых есть подстрока')
+    parser.add_argument('--no-memory', action='store_true', help='не запускать tracemalloc')
+    parser.add_argument('--results-dir', default=history.RESULTS_DIR)
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--threshold', type=float, default=history.DEFAULT_REGRESSION_THRESHOLD,
+                        help='допустимое ухудшение, %%')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    cases = [c for c in build_cases(args.batch, args.seed) if args.filter in c.name]
+
+    results: Dict[str, Dict[str, Any]] = {}
+    print(f"{'функция':32} {'нс/вызов':>10} {'медиана':>10} {'вызовов/с':>12} {'пик, КиБ':>10} {'байт/вызов':>11}")
+    for case in cases:
+        r = measure(case, args.repeat, not args.no_memory)
+        results[case.name] = r
+        print(f"{case.name:32} {r['ns_per_call']:>10} {r['ns_per_call_median']:>10} {r['calls_per_s']:>12} "
+              f"{r.get('alloc_peak_kib', '-'):>10} {r.get('retained_bytes_per_call', '-'):>11}")
+
+    config = {'batch': args.batch, 'repeat': args.repeat, 'seed': args.seed, 'filter': args.filter,
+              'python': sys.version.split()[0]}
+    record = history.make_record('microbench', config, {'cases': results})
+
+    regressions = []
+    previous = history.find_previous('microbench', config, args.results_dir)
+    if previous:
+        metrics = [(('cases', name, 'ns_per_call'), False) for name in results]
+        regressions = history.compare(previous, record, metrics, args.threshold)
+
+    if not args.no_save:
+        path = history.save_record(record, args.results_dir)
+        print(f"\nРезультат сохранён: {os.path.relpath(path, ROOT_DIR)}")
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
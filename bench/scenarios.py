@@ -0,0 +1,232 @@
+"""
+Синтетические потоки обновлений Telegram для нагрузочного теста
+Каждый сценарий — последовательность обновлений одного пользователя (мастер заявки
+отправителя или перевозчика, просмотр заявок, админ-панель, злоупотребления).
+build_stream перемешивает пользователей, сохраняя порядок шагов внутри каждого.
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Callable, Iterator
+
+# Владелец из V0016__add_bot_owner.sql — у него есть права администратора
+OWNER_CHAT_ID = 352891390
+
+WAREHOUSES = ['Коледино', 'Электросталь', 'Подольск', 'Тула', 'Казань', 'Краснодар', 'Невинномысск']
+CITIES = ['Москва', 'Санкт-Петербург', 'Самара', 'Казань', 'Екатеринбург', 'Ростов-на-Дону']
+MARKETPLACES = ['Wildberries', 'OZON', 'Яндекс.Маркет']
+NAMES = ['Иванов Иван Иванович', 'Петрова Анна Сергеевна', 'Сидоров Пётр', 'Кузнецова Мария']
+CARS = [('Газель', 'Next'), ('Mercedes', 'Sprinter'), ('Ford', 'Transit'), ('ГАЗ', 'Валдай')]
+
+# Доля пользователей каждого сценария в смешанном потоке
+DEFAULT_MIX = {
+    'sender': 0.35,
+    'carrier': 0.25,
+    'browse': 0.2,
+    'admin': 0.05,
+    'abuse': 0.15,
+}
+
+
+def sender_order_data(rnd: random.Random) -> Dict[str, Any]:
+    """Данные заявки отправителя, как их собирает мастер"""
+    date = (datetime.now() + timedelta(days=rnd.randint(0, 5))).strftime('%Y-%m-%d')
+    return {
+        'type': 'sender',
+        'marketplace': rnd.choice(MARKETPLACES),
+        'warehouse': rnd.choice(WAREHOUSES),
+        'loading_city': rnd.choice(CITIES),
+        'loading_address': f"ул. {rnd.choice(['Ленина', 'Мира', 'Садовая'])}, д. {rnd.randint(1, 99)} <корп. 2>",
+        'loading_date': date,
+        'loading_time': '10:00',
+        'delivery_date': date,
+        'pallet_quantity': rnd.randint(0, 33),
+        'box_quantity': rnd.randint(0, 500),
+        'sender_name': rnd.choice(NAMES),
+        'phone': '+79991234567',
+        'rate': rnd.randint(10, 900) * 100,
+        'label_size': '120x75',
+    }
+
+
+def carrier_order_data(rnd: random.Random) -> Dict[str, Any]:
+    """Данные заявки перевозчика, как их собирает мастер"""
+    brand, model = rnd.choice(CARS)
+    date = (datetime.now() + timedelta(days=rnd.randint(0, 5))).strftime('%Y-%m-%d')
+    return {
+        'type': 'carrier',
+        'marketplace': rnd.choice(MARKETPLACES),
+        'warehouse': rnd.choice(WAREHOUSES),
+        'loading_city': rnd.choice(CITIES),
+        'car_brand': brand,
+        'car_model': model,
+        'license_plate': f"А{rnd.randint(100, 999)}ВС77",
+        'pallet_capacity': rnd.randint(0, 33),
+        'box_capacity': rnd.randint(0, 500),
+        'hydroboard': rnd.choice(['Есть', 'Нету']),
+        'driver_name': rnd.choice(NAMES),
+        'phone': '+79991234567',
+        'loading_date': date,
+        'arrival_date': date,
+    }
+
+
+class UpdateFactory:
+    """Выдаёт обновления с возрастающими update_id и message_id"""
+
+    def __init__(self, start_update_id: int = 1):
+        self.update_id = start_update_id
+        self.message_id = 1000
+
+    def _next_ids(self):
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+
+    def message(self, chat_id: int, text: str) -> Dict[str, Any]:
+        update_id, message_id = self._next_ids()
+        user = {'id': chat_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench{chat_id}',
+                'language_code': 'ru'}
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': message_id,
+                'from': user,
+                'chat': {'id': chat_id, 'type': 'private'},
+                'date': 0,
+                'text': text,
+            },
+        }
+
+    def callback(self, chat_id: int, data: str) -> Dict[str, Any]:
+        update_id, message_id = self._next_ids()
+        user = {'id': chat_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench{chat_id}',
+                'language_code': 'ru'}
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': f'cb{update_id}',
+                'from': user,
+                'message': {'message_id': message_id, 'chat': {'id': chat_id, 'type': 'private'}, 'date': 0},
+                'data': data,
+            },
+        }
+
+
+def sender_flow(f: UpdateFactory, chat_id: int, rnd: random.Random) -> List[Dict[str, Any]]:
+    return [
+        f.message(chat_id, '/start'),
+        f.message(chat_id, '📦 Отправитель'),
+        f.message(chat_id, rnd.choice(MARKETPLACES)),
+        f.message(chat_id, f"✅ {rnd.choice(WAREHOUSES)}"),
+        f.message(chat_id, rnd.choice(CITIES)),
+        f.message(chat_id, f"ул. Ленина, д. {rnd.randint(1, 200)}"),
+        f.message(chat_id, '🟢 Завтра'),
+        f.message(chat_id, '🕒 Любое время'),
+        f.message(chat_id, '🟢 Завтра'),
+        f.message(chat_id, str(rnd.randint(1, 10))),
+        f.message(chat_id, str(rnd.randint(0, 50))),
+        f.message(chat_id, rnd.choice(NAMES)),
+        f.message(chat_id, f"+7999{rnd.randint(1000000, 9999999)}"),
+        f.message(chat_id, str(rnd.randint(10, 200) * 100)),
+        f.callback(chat_id, 'confirm_create'),
+    ]
+
+
+def carrier_flow(f: UpdateFactory, chat_id: int, rnd: random.Random) -> List[Dict[str, Any]]:
+    brand, model = rnd.choice(CARS)
+    return [
+        f.message(chat_id, '/start'),
+        f.message(chat_id, '🚚 Перевозчик'),
+        f.message(chat_id, rnd.choice(MARKETPLACES)),
+        f.message(chat_id, f"✅ {rnd.choice(WAREHOUSES)}"),
+        f.message(chat_id, brand),
+        f.message(chat_id, model),
+        f.message(chat_id, f"А{rnd.randint(100, 999)}ВС77"),
+        f.message(chat_id, str(rnd.randint(4, 33))),
+        f.message(chat_id, str(rnd.randint(0, 300))),
+        f.message(chat_id, rnd.choice(NAMES)),
+        f.message(chat_id, f"8999{rnd.randint(1000000, 9999999)}"),
+        f.message(chat_id, rnd.choice(['Есть', 'Нету'])),
+        f.message(chat_id, rnd.choice(CITIES)),
+        f.message(chat_id, '🟢 Завтра'),
+        f.message(chat_id, '🟢 Завтра'),
+        f.callback(chat_id, 'confirm_create'),
+    ]
+
+
+def browse_flow(f: UpdateFactory, chat_id: int, rnd: random.Random) -> List[Dict[str, Any]]:
+    return [
+        f.message(chat_id, '/start'),
+        f.message(chat_id, '📋 Мои заявки'),
+        f.callback(chat_id, 'my_orders'),
+        f.message(chat_id, '💾 Мои шаблоны'),
+        f.callback(chat_id, 'show_terms'),
+        f.message(chat_id, '/my_id'),
+        f.message(chat_id, '/privacy'),
+    ]
+
+
+def admin_flow(f: UpdateFactory, chat_id: int, rnd: random.Random) -> List[Dict[str, Any]]:
+    chat_id = OWNER_CHAT_ID
+    return [
+        f.message(chat_id, '/admin'),
+        f.callback(chat_id, 'admin_stats'),
+        f.callback(chat_id, 'admin_weekly'),
+        f.callback(chat_id, 'admin_filter_all'),
+        f.callback(chat_id, 'admin_filter_sender'),
+        f.callback(chat_id, 'admin_security_logs'),
+        f.callback(chat_id, 'admin_blocked_users'),
+        f.message(chat_id, '/list_admins'),
+        f.callback(chat_id, 'admin_exit'),
+    ]
+
+
+def abuse_flow(f: UpdateFactory, chat_id: int, rnd: random.Random) -> List[Dict[str, Any]]:
+    """Всплеск сообщений выше лимита частоты, слишком длинный текст и мусорные callback"""
+    burst = [f.message(chat_id, rnd.choice(['/start', 'спам', '📦 Отправитель', '?'])) for _ in range(30)]
+    return burst + [
+        f.message(chat_id, 'Я' * 2000),
+        f.message(chat_id, '<script>alert(1)</script>'),
+        f.callback(chat_id, 'delete_order_sender_999999999'),
+        f.callback(chat_id, 'admin_del_all_1'),
+        f.callback(chat_id, 'no_such_callback'),
+    ]
+
+
+SCENARIOS: Dict[str, Callable[[UpdateFactory, int, random.Random], List[Dict[str, Any]]]] = {
+    'sender': sender_flow,
+    'carrier': carrier_flow,
+    'browse': browse_flow,
+    'admin': admin_flow,
+    'abuse': abuse_flow,
+}
+
+
+def build_stream(users: int, seed: int = 1, mix: Dict[str, float] = None,
+                 first_chat_id: int = 900000000, first_update_id: int = 1) -> List[Dict[str, Any]]:
+    """Поток обновлений users пользователей; шаги одного пользователя идут по порядку"""
+    rnd = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    factory = UpdateFactory()
+
+    queues: List[Iterator[Dict[str, Any]]] = []
+    for i in range(users):
+        scenario = rnd.choices(names, weights)[0]
+        queues.append(iter(SCENARIOS[scenario](factory, first_chat_id + i, rnd)))
+
+    stream = []
+    while queues:
+        queue = rnd.choice(queues)
+        update = next(queue, None)
+        if update is None:
+            queues.remove(queue)
+        else:
+            stream.append(update)
+
+    # update_id выдавались по сценариям, а Telegram нумерует в порядке поступления
+    for update_id, update in enumerate(stream, start=first_update_id):
+        update['update_id'] = update_id
+    return stream
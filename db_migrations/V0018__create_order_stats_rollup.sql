@@ -0,0 +1,37 @@
+-- Дневная сводка заявок для админской статистики (заполняется инкрементально)
+CREATE TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.order_stats_daily (
+    stat_date DATE NOT NULL,
+    order_type VARCHAR(20) NOT NULL,
+    marketplace VARCHAR(100) NOT NULL DEFAULT '',
+    warehouse_normalized VARCHAR(255) NOT NULL DEFAULT '',
+    -- Исходное написание склада для отображения в отчётах
+    warehouse VARCHAR(255),
+    orders_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (stat_date, order_type, marketplace, warehouse_normalized)
+);
+
+CREATE INDEX IF NOT EXISTS idx_order_stats_daily_type_date
+ON t_p52349012_telegram_bot_creatio.order_stats_daily(order_type, stat_date);
+
+-- Водяные знаки: до какого id заявки уже учтены в сводке
+CREATE TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.order_stats_state (
+    order_type VARCHAR(20) PRIMARY KEY,
+    last_order_id INT NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p52349012_telegram_bot_creatio.order_stats_state (order_type, last_order_id)
+VALUES ('sender', 0), ('carrier', 0)
+ON CONFLICT (order_type) DO NOTHING;
+
+-- Реестр пользователей бота (для подсчёта уникальных пользователей без UNION по заявкам)
+CREATE TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.bot_users (
+    chat_id BIGINT PRIMARY KEY,
+    is_sender BOOLEAN DEFAULT false,
+    is_carrier BOOLEAN DEFAULT false,
+    first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индекс для подсчёта устаревших заявок отправителей
+CREATE INDEX IF NOT EXISTS idx_sender_orders_loading_date
+ON t_p52349012_telegram_bot_creatio.sender_orders(loading_date);
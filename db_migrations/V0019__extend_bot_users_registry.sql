@@ -0,0 +1,134 @@
+-- Реестр пользователей: активность, счётчики заявок и флаги ролей
+ALTER TABLE t_p52349012_telegram_bot_creatio.bot_users
+ADD COLUMN IF NOT EXISTS username VARCHAR(255),
+ADD COLUMN IF NOT EXISTS first_name VARCHAR(255),
+ADD COLUMN IF NOT EXISTS last_name VARCHAR(255),
+ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+ADD COLUMN IF NOT EXISTS sender_orders_count INT NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS carrier_orders_count INT NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS is_admin BOOLEAN DEFAULT false,
+ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN DEFAULT false;
+
+-- Заполнение из существующих данных
+INSERT INTO t_p52349012_telegram_bot_creatio.bot_users (chat_id, is_sender, sender_orders_count, first_seen)
+SELECT chat_id, true, COUNT(*), MIN(created_at)
+FROM t_p52349012_telegram_bot_creatio.sender_orders
+WHERE chat_id IS NOT NULL
+GROUP BY chat_id
+ON CONFLICT (chat_id) DO UPDATE
+SET is_sender = true,
+    sender_orders_count = EXCLUDED.sender_orders_count,
+    first_seen = LEAST(t_p52349012_telegram_bot_creatio.bot_users.first_seen, EXCLUDED.first_seen);
+
+INSERT INTO t_p52349012_telegram_bot_creatio.bot_users (chat_id, is_carrier, carrier_orders_count, first_seen)
+SELECT chat_id, true, COUNT(*), MIN(created_at)
+FROM t_p52349012_telegram_bot_creatio.carrier_orders
+WHERE chat_id IS NOT NULL
+GROUP BY chat_id
+ON CONFLICT (chat_id) DO UPDATE
+SET is_carrier = true,
+    carrier_orders_count = EXCLUDED.carrier_orders_count,
+    first_seen = LEAST(t_p52349012_telegram_bot_creatio.bot_users.first_seen, EXCLUDED.first_seen);
+
+INSERT INTO t_p52349012_telegram_bot_creatio.bot_users (chat_id, is_admin)
+SELECT chat_id, true FROM t_p52349012_telegram_bot_creatio.bot_admins WHERE is_active = true
+ON CONFLICT (chat_id) DO UPDATE SET is_admin = true;
+
+INSERT INTO t_p52349012_telegram_bot_creatio.bot_users (chat_id, is_blocked)
+SELECT chat_id, true FROM t_p52349012_telegram_bot_creatio.blocked_users
+ON CONFLICT (chat_id) DO UPDATE SET is_blocked = true;
+
+-- Счётчики заявок поддерживаются триггерами, чтобы учитывать все пути создания и удаления
+CREATE OR REPLACE FUNCTION t_p52349012_telegram_bot_creatio.bot_users_track_orders()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.chat_id IS NOT NULL THEN
+            IF TG_TABLE_NAME = 'sender_orders' THEN
+                INSERT INTO t_p52349012_telegram_bot_creatio.bot_users (chat_id, is_sender, sender_orders_count)
+                VALUES (NEW.chat_id, true, 1)
+                ON CONFLICT (chat_id) DO UPDATE
+                SET is_sender = true,
+                    sender_orders_count = t_p52349012_telegram_bot_creatio.bot_users.sender_orders_count + 1;
+            ELSE
+                INSERT INTO t_p52349012_telegram_bot_creatio.bot_users (chat_id, is_carrier, carrier_orders_count)
+                VALUES (NEW.chat_id, true, 1)
+                ON CONFLICT (chat_id) DO UPDATE
+                SET is_carrier = true,
+                    carrier_orders_count = t_p52349012_telegram_bot_creatio.bot_users.carrier_orders_count + 1;
+            END IF;
+        END IF;
+        RETURN NEW;
+    END IF;
+
+    IF OLD.chat_id IS NOT NULL THEN
+        IF TG_TABLE_NAME = 'sender_orders' THEN
+            UPDATE t_p52349012_telegram_bot_creatio.bot_users
+            SET sender_orders_count = GREATEST(sender_orders_count - 1, 0)
+            WHERE chat_id = OLD.chat_id;
+        ELSE
+            UPDATE t_p52349012_telegram_bot_creatio.bot_users
+            SET carrier_orders_count = GREATEST(carrier_orders_count - 1, 0)
+            WHERE chat_id = OLD.chat_id;
+        END IF;
+    END IF;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_sender_orders_bot_users ON t_p52349012_telegram_bot_creatio.sender_orders;
+CREATE TRIGGER trg_sender_orders_bot_users
+AFTER INSERT OR DELETE ON t_p52349012_telegram_bot_creatio.sender_orders
+FOR EACH ROW EXECUTE FUNCTION t_p52349012_telegram_bot_creatio.bot_users_track_orders();
+
+DROP TRIGGER IF EXISTS trg_carrier_orders_bot_users ON t_p52349012_telegram_bot_creatio.carrier_orders;
+CREATE TRIGGER trg_carrier_orders_bot_users
+AFTER INSERT OR DELETE ON t_p52349012_telegram_bot_creatio.carrier_orders
+FOR EACH ROW EXECUTE FUNCTION t_p52349012_telegram_bot_creatio.bot_users_track_orders();
+
+-- Флаг блокировки
+CREATE OR REPLACE FUNCTION t_p52349012_telegram_bot_creatio.bot_users_track_blocked()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO t_p52349012_telegram_bot_creatio.bot_users (chat_id, is_blocked)
+        VALUES (NEW.chat_id, true)
+        ON CONFLICT (chat_id) DO UPDATE SET is_blocked = true;
+        RETURN NEW;
+    END IF;
+    UPDATE t_p52349012_telegram_bot_creatio.bot_users SET is_blocked = false WHERE chat_id = OLD.chat_id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_blocked_users_bot_users ON t_p52349012_telegram_bot_creatio.blocked_users;
+CREATE TRIGGER trg_blocked_users_bot_users
+AFTER INSERT OR DELETE ON t_p52349012_telegram_bot_creatio.blocked_users
+FOR EACH ROW EXECUTE FUNCTION t_p52349012_telegram_bot_creatio.bot_users_track_blocked();
+
+-- Флаг администратора
+CREATE OR REPLACE FUNCTION t_p52349012_telegram_bot_creatio.bot_users_track_admins()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE t_p52349012_telegram_bot_creatio.bot_users SET is_admin = false WHERE chat_id = OLD.chat_id;
+        RETURN OLD;
+    END IF;
+    INSERT INTO t_p52349012_telegram_bot_creatio.bot_users (chat_id, is_admin)
+    VALUES (NEW.chat_id, COALESCE(NEW.is_active, false))
+    ON CONFLICT (chat_id) DO UPDATE SET is_admin = COALESCE(NEW.is_active, false);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bot_admins_bot_users ON t_p52349012_telegram_bot_creatio.bot_admins;
+CREATE TRIGGER trg_bot_admins_bot_users
+AFTER INSERT OR UPDATE OF is_active OR DELETE ON t_p52349012_telegram_bot_creatio.bot_admins
+FOR EACH ROW EXECUTE FUNCTION t_p52349012_telegram_bot_creatio.bot_users_track_admins();
+
+-- Индексы для админских списков
+CREATE INDEX IF NOT EXISTS idx_bot_users_order_count
+ON t_p52349012_telegram_bot_creatio.bot_users((sender_orders_count + carrier_orders_count) DESC);
+
+CREATE INDEX IF NOT EXISTS idx_bot_users_last_seen
+ON t_p52349012_telegram_bot_creatio.bot_users(last_seen DESC);
@@ -0,0 +1,3 @@
+-- Счётчик повторов: одинаковые события одного чата записываются одной строкой
+ALTER TABLE t_p52349012_telegram_bot_creatio.security_logs
+ADD COLUMN IF NOT EXISTS event_count INT NOT NULL DEFAULT 1;
@@ -0,0 +1,109 @@
+-- Перевод security_logs на помесячные партиции по created_at
+ALTER TABLE t_p52349012_telegram_bot_creatio.security_logs RENAME TO security_logs_legacy;
+ALTER INDEX IF EXISTS t_p52349012_telegram_bot_creatio.idx_security_logs_chat_id RENAME TO idx_security_logs_legacy_chat_id;
+ALTER INDEX IF EXISTS t_p52349012_telegram_bot_creatio.idx_security_logs_created_at RENAME TO idx_security_logs_legacy_created_at;
+ALTER INDEX IF EXISTS t_p52349012_telegram_bot_creatio.idx_security_logs_severity RENAME TO idx_security_logs_legacy_severity;
+
+CREATE TABLE t_p52349012_telegram_bot_creatio.security_logs (
+    id BIGSERIAL,
+    chat_id BIGINT NOT NULL,
+    event_type VARCHAR(50) NOT NULL,
+    details TEXT,
+    severity VARCHAR(20) DEFAULT 'medium',
+    event_count INT NOT NULL DEFAULT 1,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX IF NOT EXISTS idx_security_logs_chat_created
+ON t_p52349012_telegram_bot_creatio.security_logs(chat_id, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_security_logs_created_at
+ON t_p52349012_telegram_bot_creatio.security_logs(created_at);
+
+-- Запасная партиция для строк вне созданных диапазонов
+CREATE TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.security_logs_default
+PARTITION OF t_p52349012_telegram_bot_creatio.security_logs DEFAULT;
+
+-- Создание партиции на месяц, в который попадает указанная дата
+CREATE OR REPLACE FUNCTION t_p52349012_telegram_bot_creatio.security_logs_create_partition(p_month DATE)
+RETURNS TEXT AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_month)::date;
+    partition_name TEXT := 'security_logs_' || to_char(month_start, 'YYYYMM');
+BEGIN
+    IF to_regclass('t_p52349012_telegram_bot_creatio.' || partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE t_p52349012_telegram_bot_creatio.%I PARTITION OF t_p52349012_telegram_bot_creatio.security_logs
+             FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, (month_start + INTERVAL '1 month')::date
+        );
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Обслуживание: партиции на месяцы вперёд и удаление партиций старше срока хранения
+CREATE OR REPLACE FUNCTION t_p52349012_telegram_bot_creatio.security_logs_maintain(
+    p_retention_months INT DEFAULT 3,
+    p_premake_months INT DEFAULT 2
+)
+RETURNS TABLE (action TEXT, partition_name TEXT) AS $$
+DECLARE
+    current_month DATE := date_trunc('month', CURRENT_DATE)::date;
+    cutoff DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => p_retention_months))::date;
+    i INT;
+    part RECORD;
+BEGIN
+    FOR i IN 0..p_premake_months LOOP
+        action := 'ensure';
+        partition_name := t_p52349012_telegram_bot_creatio.security_logs_create_partition(
+            (current_month + make_interval(months => i))::date
+        );
+        RETURN NEXT;
+    END LOOP;
+
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits inh
+        JOIN pg_class c ON c.oid = inh.inhrelid
+        JOIN pg_class p ON p.oid = inh.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE n.nspname = 't_p52349012_telegram_bot_creatio'
+          AND p.relname = 'security_logs'
+          AND c.relname ~ '^security_logs_[0-9]{6}$'
+          AND to_date(substring(c.relname from '[0-9]{6}$'), 'YYYYMM') < cutoff
+    LOOP
+        EXECUTE format('DROP TABLE t_p52349012_telegram_bot_creatio.%I', part.relname);
+        action := 'drop';
+        partition_name := part.relname;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Партиции под уже накопленные логи и на ближайшие месяцы
+DO $$
+DECLARE
+    m DATE;
+BEGIN
+    SELECT date_trunc('month', COALESCE(MIN(created_at), CURRENT_TIMESTAMP))::date INTO m
+    FROM t_p52349012_telegram_bot_creatio.security_logs_legacy;
+    WHILE m <= (date_trunc('month', CURRENT_DATE) + INTERVAL '2 months')::date LOOP
+        PERFORM t_p52349012_telegram_bot_creatio.security_logs_create_partition(m);
+        m := (m + INTERVAL '1 month')::date;
+    END LOOP;
+END $$;
+
+INSERT INTO t_p52349012_telegram_bot_creatio.security_logs
+(id, chat_id, event_type, details, severity, event_count, created_at)
+SELECT id, chat_id, event_type, details, severity, event_count, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM t_p52349012_telegram_bot_creatio.security_logs_legacy;
+
+SELECT setval(
+    pg_get_serial_sequence('t_p52349012_telegram_bot_creatio.security_logs', 'id'),
+    COALESCE((SELECT MAX(id) FROM t_p52349012_telegram_bot_creatio.security_logs), 0) + 1,
+    false
+);
+
+DROP TABLE t_p52349012_telegram_bot_creatio.security_logs_legacy;
@@ -0,0 +1,37 @@
+-- Архив истёкших заявок (полная строка заявки хранится в order_data)
+CREATE TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.sender_orders_archive (
+    id INT PRIMARY KEY,
+    chat_id BIGINT,
+    expired_on DATE,
+    order_data JSONB NOT NULL,
+    created_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.carrier_orders_archive (
+    id INT PRIMARY KEY,
+    chat_id BIGINT,
+    expired_on DATE,
+    order_data JSONB NOT NULL,
+    created_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_sender_orders_archive_chat_id
+ON t_p52349012_telegram_bot_creatio.sender_orders_archive(chat_id);
+
+CREATE INDEX IF NOT EXISTS idx_carrier_orders_archive_chat_id
+ON t_p52349012_telegram_bot_creatio.carrier_orders_archive(chat_id);
+
+CREATE INDEX IF NOT EXISTS idx_sender_orders_archive_archived_at
+ON t_p52349012_telegram_bot_creatio.sender_orders_archive(archived_at);
+
+CREATE INDEX IF NOT EXISTS idx_carrier_orders_archive_archived_at
+ON t_p52349012_telegram_bot_creatio.carrier_orders_archive(archived_at);
+
+-- Индексы по дате истечения для пакетного отбора
+CREATE INDEX IF NOT EXISTS idx_sender_orders_expires_on
+ON t_p52349012_telegram_bot_creatio.sender_orders((COALESCE(delivery_date, loading_date)));
+
+CREATE INDEX IF NOT EXISTS idx_carrier_orders_expires_on
+ON t_p52349012_telegram_bot_creatio.carrier_orders((COALESCE(arrival_date, loading_date)));
@@ -0,0 +1,14 @@
+-- Состояние фонового пересчёта нормализованных полей заявок
+-- rules_version меняется вместе с правилами нормализации, тогда пересчёт начинается заново
+CREATE TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.normalization_backfill_state (
+    order_type VARCHAR(20) PRIMARY KEY,
+    rules_version INT NOT NULL DEFAULT 0,
+    last_order_id INT NOT NULL DEFAULT 0,
+    updated_rows INT NOT NULL DEFAULT 0,
+    finished_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p52349012_telegram_bot_creatio.normalization_backfill_state (order_type)
+VALUES ('sender'), ('carrier')
+ON CONFLICT (order_type) DO NOTHING;
@@ -0,0 +1,94 @@
+-- Справочник написаний складов для автодополнения (по маркетплейсам)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.warehouse_mappings (
+    id SERIAL PRIMARY KEY,
+    marketplace VARCHAR(100) NOT NULL DEFAULT '',
+    normalized_name VARCHAR(255) NOT NULL,
+    original_name VARCHAR(255) NOT NULL,
+    usage_count INT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (marketplace, normalized_name, original_name)
+);
+
+-- Таблица могла остаться от старого database.py: без marketplace/updated_at и с уникальностью
+-- по (normalized_name, original_name). Тогда CREATE выше ничего не делает — приводим к новой форме
+ALTER TABLE t_p52349012_telegram_bot_creatio.warehouse_mappings
+ADD COLUMN IF NOT EXISTS marketplace VARCHAR(100) NOT NULL DEFAULT '';
+
+ALTER TABLE t_p52349012_telegram_bot_creatio.warehouse_mappings
+ADD COLUMN IF NOT EXISTS usage_count INT NOT NULL DEFAULT 1;
+
+ALTER TABLE t_p52349012_telegram_bot_creatio.warehouse_mappings
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+DO $$
+DECLARE
+    old_key RECORD;
+BEGIN
+    -- Старая уникальность без маркетплейса: ограничение или уникальный индекс
+    FOR old_key IN
+        SELECT c.conname AS name, 'constraint' AS kind
+        FROM pg_constraint c
+        WHERE c.conrelid = 't_p52349012_telegram_bot_creatio.warehouse_mappings'::regclass
+          AND c.contype = 'u'
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_attribute a
+              WHERE a.attrelid = c.conrelid AND a.attnum = ANY (c.conkey) AND a.attname = 'marketplace'
+          )
+        UNION ALL
+        SELECT i.relname, 'index'
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = 't_p52349012_telegram_bot_creatio.warehouse_mappings'::regclass
+          AND x.indisunique AND NOT x.indisprimary
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_attribute a
+              WHERE a.attrelid = x.indrelid AND a.attnum = ANY (x.indkey) AND a.attname = 'marketplace'
+          )
+    LOOP
+        IF old_key.kind = 'constraint' THEN
+            EXECUTE format('ALTER TABLE t_p52349012_telegram_bot_creatio.warehouse_mappings DROP CONSTRAINT %I', old_key.name);
+        ELSE
+            EXECUTE format('DROP INDEX t_p52349012_telegram_bot_creatio.%I', old_key.name);
+        END IF;
+    END LOOP;
+
+    -- Ключ ON CONFLICT (marketplace, normalized_name, original_name), если его ещё нет
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint c
+        WHERE c.conrelid = 't_p52349012_telegram_bot_creatio.warehouse_mappings'::regclass
+          AND c.contype = 'u'
+          AND array_length(c.conkey, 1) = 3
+          AND EXISTS (
+              SELECT 1 FROM pg_attribute a
+              WHERE a.attrelid = c.conrelid AND a.attnum = ANY (c.conkey) AND a.attname = 'marketplace'
+          )
+    ) THEN
+        ALTER TABLE t_p52349012_telegram_bot_creatio.warehouse_mappings
+        ADD CONSTRAINT uq_warehouse_mappings_marketplace_name
+        UNIQUE (marketplace, normalized_name, original_name);
+    END IF;
+END $$;
+
+-- Нечёткий поиск по триграммам
+CREATE INDEX IF NOT EXISTS idx_warehouse_mappings_normalized_trgm
+ON t_p52349012_telegram_bot_creatio.warehouse_mappings USING GIN (normalized_name gin_trgm_ops);
+
+-- Топ складов маркетплейса для кэша автодополнения
+CREATE INDEX IF NOT EXISTS idx_warehouse_mappings_marketplace_usage
+ON t_p52349012_telegram_bot_creatio.warehouse_mappings(marketplace, usage_count DESC);
+
+-- Начальное заполнение из существующих заявок
+INSERT INTO t_p52349012_telegram_bot_creatio.warehouse_mappings (marketplace, normalized_name, original_name, usage_count)
+SELECT COALESCE(marketplace, ''), warehouse_normalized, MIN(warehouse), COUNT(*)
+FROM (
+    SELECT marketplace, warehouse, warehouse_normalized FROM t_p52349012_telegram_bot_creatio.sender_orders
+    UNION ALL
+    SELECT marketplace, warehouse, warehouse_normalized FROM t_p52349012_telegram_bot_creatio.carrier_orders
+    WHERE warehouse <> 'Любой склад'
+) o
+WHERE COALESCE(warehouse_normalized, '') <> '' AND COALESCE(warehouse, '') <> ''
+GROUP BY COALESCE(marketplace, ''), warehouse_normalized
+ON CONFLICT (marketplace, normalized_name, original_name) DO NOTHING;
@@ -0,0 +1,9 @@
+-- Общее состояние ограничения частоты запросов (GCRA) для всех экземпляров функции
+-- tat — теоретическое время следующего разрешённого запроса, секунды эпохи
+-- Таблица нежурналируемая: после сбоя БД лимиты просто начинаются заново
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.rate_limits (
+    key VARCHAR(100) PRIMARY KEY,
+    tat DOUBLE PRECISION NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limits_tat ON t_p52349012_telegram_bot_creatio.rate_limits (tat);
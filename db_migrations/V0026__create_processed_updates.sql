@@ -0,0 +1,10 @@
+-- Обработанные обновления Telegram (update_id) для защиты от повторной доставки вебхука
+-- Строка вставляется до обработки обновления и удаляется, если обработка упала
+-- Telegram повторяет доставку не дольше суток — старые строки удаляет maintenance
+CREATE TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.processed_updates (
+    update_id BIGINT PRIMARY KEY,
+    processed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_processed_updates_processed_at
+    ON t_p52349012_telegram_bot_creatio.processed_updates (processed_at);
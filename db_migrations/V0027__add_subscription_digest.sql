@@ -0,0 +1,20 @@
+-- Режим доставки уведомлений подписчикам: 0 — сразу, N — сводкой не чаще раза в N минут
+ALTER TABLE t_p52349012_telegram_bot_creatio.user_subscriptions
+ADD COLUMN IF NOT EXISTS digest_minutes INT NOT NULL DEFAULT 0;
+
+-- Заявки, ожидающие отправки подписчику одной сводкой
+CREATE TABLE IF NOT EXISTS t_p52349012_telegram_bot_creatio.subscription_digest_items (
+    id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    order_type VARCHAR(20) NOT NULL,
+    order_id INT NOT NULL,
+    summary TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (chat_id, order_type, order_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_subscription_digest_items_chat_created
+    ON t_p52349012_telegram_bot_creatio.subscription_digest_items (chat_id, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_user_subscriptions_chat_id
+    ON t_p52349012_telegram_bot_creatio.user_subscriptions (chat_id);
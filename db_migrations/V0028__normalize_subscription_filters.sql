@@ -0,0 +1,11 @@
+-- Нормализованные ключи подписок: склад (как warehouse_normalized у заявок) и маркетплейс
+-- NULL в marketplace_normalized — подписка на любой маркетплейс
+-- Ключи склада для существующих строк заполняет backfill (GET ?action=backfill)
+ALTER TABLE t_p52349012_telegram_bot_creatio.user_subscriptions
+ADD COLUMN IF NOT EXISTS warehouse_filter_normalized VARCHAR(255);
+
+ALTER TABLE t_p52349012_telegram_bot_creatio.user_subscriptions
+ADD COLUMN IF NOT EXISTS marketplace_normalized VARCHAR(100);
+
+CREATE INDEX IF NOT EXISTS idx_user_subscriptions_match
+    ON t_p52349012_telegram_bot_creatio.user_subscriptions (user_type, subscription_type, warehouse_filter_normalized);
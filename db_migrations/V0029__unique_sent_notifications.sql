@@ -0,0 +1,17 @@
+-- Журнал отправленных уведомлений: одна строка на (получатель, заявка, вид уведомления)
+-- Уникальный индекс позволяет отмечать отправку через INSERT ... ON CONFLICT DO NOTHING
+DELETE FROM t_p52349012_telegram_bot_creatio.sent_notifications a
+USING t_p52349012_telegram_bot_creatio.sent_notifications b
+WHERE a.chat_id = b.chat_id
+  AND a.order_id = b.order_id
+  AND a.notification_type = b.notification_type
+  AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_sent_notifications_key
+    ON t_p52349012_telegram_bot_creatio.sent_notifications (chat_id, order_id, notification_type);
+
+-- Уникальный индекс покрывает те же поиски
+DROP INDEX IF EXISTS t_p52349012_telegram_bot_creatio.idx_sent_notifications_lookup;
+
+CREATE INDEX IF NOT EXISTS idx_sent_notifications_sent_at
+    ON t_p52349012_telegram_bot_creatio.sent_notifications (sent_at);
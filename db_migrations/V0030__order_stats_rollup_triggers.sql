@@ -0,0 +1,102 @@
+-- Дневная сводка заявок поддерживается триггерами в транзакции изменения заявки.
+-- Водяной знак по id пропускал заявки, закоммиченные позже заявки с большим id
+-- (SERIAL выдаётся до коммита), и сводка навсегда недосчитывала их.
+-- Сводка считает существующие заявки: удаление (админом, пользователем, перенос в архив
+-- по сроку) уменьшает счётчик, редактирование и пересчёт warehouse_normalized (backfill.py)
+-- переносят заявку в новую группу. Ключ склада — warehouse_normalized, как в подборе;
+-- старые заявки без ключа попадают в группу '' до пересчёта
+CREATE OR REPLACE FUNCTION t_p52349012_telegram_bot_creatio.order_stats_track_orders()
+RETURNS TRIGGER AS $$
+DECLARE
+    kind VARCHAR(20) := CASE WHEN TG_TABLE_NAME = 'sender_orders' THEN 'sender' ELSE 'carrier' END;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.created_at IS NOT NULL THEN
+        UPDATE t_p52349012_telegram_bot_creatio.order_stats_daily
+        SET orders_count = orders_count - 1
+        WHERE stat_date = OLD.created_at::date
+          AND order_type = kind
+          AND marketplace = COALESCE(OLD.marketplace, '')
+          AND warehouse_normalized = COALESCE(OLD.warehouse_normalized, '');
+
+        DELETE FROM t_p52349012_telegram_bot_creatio.order_stats_daily
+        WHERE stat_date = OLD.created_at::date
+          AND order_type = kind
+          AND marketplace = COALESCE(OLD.marketplace, '')
+          AND warehouse_normalized = COALESCE(OLD.warehouse_normalized, '')
+          AND orders_count <= 0;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.created_at IS NOT NULL THEN
+        INSERT INTO t_p52349012_telegram_bot_creatio.order_stats_daily
+        (stat_date, order_type, marketplace, warehouse_normalized, warehouse, orders_count)
+        VALUES (
+            NEW.created_at::date,
+            kind,
+            COALESCE(NEW.marketplace, ''),
+            COALESCE(NEW.warehouse_normalized, ''),
+            NEW.warehouse,
+            1
+        )
+        ON CONFLICT (stat_date, order_type, marketplace, warehouse_normalized) DO UPDATE
+        SET orders_count = t_p52349012_telegram_bot_creatio.order_stats_daily.orders_count + 1;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Пока переключаемся, заявки не меняются: сводка пересобирается по живым таблицам
+LOCK TABLE t_p52349012_telegram_bot_creatio.sender_orders, t_p52349012_telegram_bot_creatio.carrier_orders
+IN SHARE ROW EXCLUSIVE MODE;
+
+DELETE FROM t_p52349012_telegram_bot_creatio.order_stats_daily;
+
+INSERT INTO t_p52349012_telegram_bot_creatio.order_stats_daily
+(stat_date, order_type, marketplace, warehouse_normalized, warehouse, orders_count)
+SELECT o.created_at::date, 'sender', COALESCE(o.marketplace, ''), COALESCE(o.warehouse_normalized, ''),
+       MIN(o.warehouse), COUNT(*)
+FROM t_p52349012_telegram_bot_creatio.sender_orders o
+WHERE o.created_at IS NOT NULL
+GROUP BY 1, 3, 4;
+
+INSERT INTO t_p52349012_telegram_bot_creatio.order_stats_daily
+(stat_date, order_type, marketplace, warehouse_normalized, warehouse, orders_count)
+SELECT o.created_at::date, 'carrier', COALESCE(o.marketplace, ''), COALESCE(o.warehouse_normalized, ''),
+       MIN(o.warehouse), COUNT(*)
+FROM t_p52349012_telegram_bot_creatio.carrier_orders o
+WHERE o.created_at IS NOT NULL
+GROUP BY 1, 3, 4;
+
+-- Водяные знаки больше не нужны
+DROP TABLE IF EXISTS t_p52349012_telegram_bot_creatio.order_stats_state;
+
+DROP TRIGGER IF EXISTS trg_sender_orders_stats ON t_p52349012_telegram_bot_creatio.sender_orders;
+CREATE TRIGGER trg_sender_orders_stats
+AFTER INSERT OR DELETE ON t_p52349012_telegram_bot_creatio.sender_orders
+FOR EACH ROW EXECUTE FUNCTION t_p52349012_telegram_bot_creatio.order_stats_track_orders();
+
+DROP TRIGGER IF EXISTS trg_sender_orders_stats_update ON t_p52349012_telegram_bot_creatio.sender_orders;
+CREATE TRIGGER trg_sender_orders_stats_update
+AFTER UPDATE OF created_at, marketplace, warehouse_normalized ON t_p52349012_telegram_bot_creatio.sender_orders
+FOR EACH ROW
+WHEN (OLD.created_at IS DISTINCT FROM NEW.created_at
+      OR OLD.marketplace IS DISTINCT FROM NEW.marketplace
+      OR OLD.warehouse_normalized IS DISTINCT FROM NEW.warehouse_normalized)
+EXECUTE FUNCTION t_p52349012_telegram_bot_creatio.order_stats_track_orders();
+
+DROP TRIGGER IF EXISTS trg_carrier_orders_stats ON t_p52349012_telegram_bot_creatio.carrier_orders;
+CREATE TRIGGER trg_carrier_orders_stats
+AFTER INSERT OR DELETE ON t_p52349012_telegram_bot_creatio.carrier_orders
+FOR EACH ROW EXECUTE FUNCTION t_p52349012_telegram_bot_creatio.order_stats_track_orders();
+
+DROP TRIGGER IF EXISTS trg_carrier_orders_stats_update ON t_p52349012_telegram_bot_creatio.carrier_orders;
+CREATE TRIGGER trg_carrier_orders_stats_update
+AFTER UPDATE OF created_at, marketplace, warehouse_normalized ON t_p52349012_telegram_bot_creatio.carrier_orders
+FOR EACH ROW
+WHEN (OLD.created_at IS DISTINCT FROM NEW.created_at
+      OR OLD.marketplace IS DISTINCT FROM NEW.marketplace
+      OR OLD.warehouse_normalized IS DISTINCT FROM NEW.warehouse_normalized)
+EXECUTE FUNCTION t_p52349012_telegram_bot_creatio.order_stats_track_orders();
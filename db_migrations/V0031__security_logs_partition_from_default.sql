@@ -0,0 +1,37 @@
+-- Создание месячной партиции, когда строки этого месяца уже попали в security_logs_default
+-- (обслуживание не успело создать месяц заранее). CREATE TABLE ... PARTITION OF в этом случае
+-- падает, а вместе с ним и всё обслуживание. Теперь партиция создаётся отдельной таблицей,
+-- строки её диапазона переносятся из DEFAULT, после чего таблица подключается как партиция.
+CREATE OR REPLACE FUNCTION t_p52349012_telegram_bot_creatio.security_logs_create_partition(p_month DATE)
+RETURNS TEXT AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_month)::date;
+    month_end DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::date;
+    partition_name TEXT := 'security_logs_' || to_char(month_start, 'YYYYMM');
+BEGIN
+    IF to_regclass('t_p52349012_telegram_bot_creatio.' || partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE t_p52349012_telegram_bot_creatio.%I
+             (LIKE t_p52349012_telegram_bot_creatio.security_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+            partition_name
+        );
+        EXECUTE format(
+            'WITH moved AS (
+                 DELETE FROM t_p52349012_telegram_bot_creatio.security_logs_default
+                 WHERE created_at >= %L AND created_at < %L
+                 RETURNING id, chat_id, event_type, details, severity, event_count, created_at
+             )
+             INSERT INTO t_p52349012_telegram_bot_creatio.%I
+             (id, chat_id, event_type, details, severity, event_count, created_at)
+             SELECT id, chat_id, event_type, details, severity, event_count, created_at FROM moved',
+            month_start, month_end, partition_name
+        );
+        EXECUTE format(
+            'ALTER TABLE t_p52349012_telegram_bot_creatio.security_logs
+             ATTACH PARTITION t_p52349012_telegram_bot_creatio.%I FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, month_end
+        );
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,8 @@
+-- Состояние отметки обновления: processing — обработка идёт, done — обработано
+-- Отметка processing, которую не перевели в done за UPDATE_DEDUP_CLAIM_TIMEOUT (экземпляр упал
+-- по таймауту или памяти), занимается повторной доставкой заново. Старые строки считаются обработанными
+ALTER TABLE t_p52349012_telegram_bot_creatio.processed_updates
+ADD COLUMN IF NOT EXISTS status VARCHAR(16) NOT NULL DEFAULT 'done';
+
+ALTER TABLE t_p52349012_telegram_bot_creatio.processed_updates
+ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
@@ -0,0 +1,12 @@
+-- Строки сводки, взятые сбросом на отправку: claimed_by — метка сброса, claimed_at — начало аренды
+-- Строки удаляются после успешной отправки; при ошибке аренда снимается, а если сброс
+-- не дожил до конца, строки снова берутся через DIGEST_CLAIM_LEASE секунд
+ALTER TABLE t_p52349012_telegram_bot_creatio.subscription_digest_items
+ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(64);
+
+ALTER TABLE t_p52349012_telegram_bot_creatio.subscription_digest_items
+ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_subscription_digest_items_claimed_by
+    ON t_p52349012_telegram_bot_creatio.subscription_digest_items (claimed_by)
+    WHERE claimed_by IS NOT NULL;
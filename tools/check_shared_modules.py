@@ -0,0 +1,65 @@
+"""
+Проверка общих модулей функций
+Функции деплоятся каждая из своей папки, поэтому общие модули (metrics.py, normalization.py)
+лежат копиями в нескольких папках backend/. Скрипт сравнивает копии побайтно и завершается
+с кодом 1, если какая-то копия отличается или пропала: запускать перед деплоем.
+
+Пример:
+    python tools/check_shared_modules.py
+"""
+
+import os
+import sys
+import hashlib
+from typing import Dict, List
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TOOLS_DIR)
+BACKEND_DIR = os.path.join(ROOT_DIR, 'backend')
+
+# Модуль -> папки функций, где лежат его копии
+SHARED_MODULES: Dict[str, List[str]] = {
+    'metrics.py': ['telegram-bot', 'orders', 'pdf-label'],
+    'normalization.py': ['telegram-bot', 'orders'],
+}
+
+
+def file_digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def check_module(module: str, functions: List[str]) -> List[str]:
+    """Ошибки по одному модулю: пропавшие копии и копии, отличающиеся от первой"""
+    errors = []
+    digests: Dict[str, str] = {}
+    for function in functions:
+        path = os.path.join(BACKEND_DIR, function, module)
+        if not os.path.isfile(path):
+            errors.append(f"{module}: нет копии в backend/{function}")
+            continue
+        digests[function] = file_digest(path)
+
+    if digests:
+        reference, reference_digest = next(iter(digests.items()))
+        for function, digest in digests.items():
+            if digest != reference_digest:
+                errors.append(f"{module}: backend/{function} отличается от backend/{reference}")
+    return errors
+
+
+def main() -> int:
+    errors = []
+    for module, functions in SHARED_MODULES.items():
+        errors.extend(check_module(module, functions))
+
+    for error in errors:
+        print(f"[ERROR] {error}")
+    if errors:
+        return 1
+    print(f"Общие модули совпадают: {', '.join(SHARED_MODULES)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())